@@ -0,0 +1,224 @@
+"""
+Endpoint benchmark harness
+Boots server:app in-process over httpx's ASGI transport against a local mongod, with one
+database per dataset scale loaded by seed_dataset.py. Each case reports p50/p90 latency and
+Mongo round trips (from the Server-Timing header) and is compared with baseline.json.
+
+    python -m pytest benchmarks -q --bench-scales 1,10,100
+    python -m pytest benchmarks -q --bench-scales 1,10,100 --bench-update-baseline
+"""
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+BENCH_MONGO_URL = os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017")
+BASELINE_PATH = Path(os.environ.get("BENCH_BASELINE", Path(__file__).parent / "baseline.json"))
+P50_TOLERANCE = float(os.environ.get("BENCH_P50_TOLERANCE", 0.25))
+P50_SLACK_MS = float(os.environ.get("BENCH_P50_SLACK_MS", 2.0))
+ROUND_TRIP_TOLERANCE = int(os.environ.get("BENCH_ROUND_TRIP_TOLERANCE", 0))
+
+# server.py reads these at import time; the benchmark database is selected per scale below
+os.environ.setdefault("MONGO_URL", BENCH_MONGO_URL)
+os.environ.setdefault("DB_NAME", "divine_cakery_bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("INVALIDATION_BUS_MODE", "off")  # single in-process worker, nothing to hear about
+
+RECORDER_KEY = pytest.StashKey()
+SERVER_TIMING_ROUND_TRIPS = re.compile(r'"(\d+) round trips"')
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-scales", default=os.environ.get("BENCH_SCALES", "1"),
+                    help="comma-separated dataset scale factors, e.g. 1,10,100")
+    group.addoption("--bench-iterations", type=int, default=int(os.environ.get("BENCH_ITERATIONS", 30)),
+                    help="timed requests per case (after 3 warm-up requests)")
+    group.addoption("--bench-seed", type=int, default=42)
+    group.addoption("--bench-update-baseline", action="store_true",
+                    help="write the measured results to the baseline instead of comparing against it")
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        scales = [float(s) for s in metafunc.config.getoption("--bench-scales").split(",")]
+        metafunc.parametrize("scale", scales, ids=[f"{s:g}x" for s in scales], scope="session")
+
+
+def scale_key(scale: float) -> str:
+    return f"{scale:g}x"
+
+
+class BenchmarkRecorder:
+    """Collects results for the run and compares them with (or writes them to) the baseline"""
+
+    def __init__(self, path: Path, update: bool):
+        self.path = path
+        self.update = update
+        self.baseline = json.loads(path.read_text()) if path.exists() else {}
+        self.results = {}
+
+    def record(self, scale: float, name: str, result: dict):
+        self.results.setdefault(scale_key(scale), {})[name] = result
+
+    def regressions(self, scale: float, name: str, result: dict):
+        if self.update:
+            return []
+        expected = self.baseline.get(scale_key(scale), {}).get(name)
+        if expected is None:
+            # A case without a baseline would otherwise pass whatever it measures
+            return [f"no {scale_key(scale)} baseline in {self.path}; record one with --bench-update-baseline"]
+        problems = []
+        allowed_p50 = expected["p50_ms"] * (1 + P50_TOLERANCE) + P50_SLACK_MS
+        if result["p50_ms"] > allowed_p50:
+            problems.append(f"p50 {result['p50_ms']:.1f}ms > {allowed_p50:.1f}ms (baseline {expected['p50_ms']:.1f}ms)")
+        if result["round_trips"] > expected["round_trips"] + ROUND_TRIP_TOLERANCE:
+            problems.append(f"round trips {result['round_trips']} > baseline {expected['round_trips']}")
+        return problems
+
+    def save(self):
+        if not self.update or not self.results:
+            return
+        for key, cases in self.results.items():
+            self.baseline.setdefault(key, {}).update(cases)
+        self.path.write_text(json.dumps(self.baseline, indent=2, sort_keys=True) + "\n")
+
+
+class EndpointBench:
+    """Times requests against the in-process app for one dataset scale"""
+
+    def __init__(self, runner: asyncio.Runner, client: httpx.AsyncClient, tokens: dict, report_date: str, iterations: int):
+        self.runner = runner
+        self.client = client
+        self.tokens = tokens
+        self.report_date = report_date
+        self.iterations = iterations
+
+    async def _measure(self, method: str, path: str, user: str, params: dict, warmup: int = 3) -> dict:
+        headers = {"Authorization": f"Bearer {self.tokens[user]}"} if user else {}
+        params = {key: (self.report_date if value == "{report_date}" else value) for key, value in params.items()}
+        timings, round_trips = [], []
+        for i in range(warmup + self.iterations):
+            started = time.perf_counter()
+            response = await self.client.request(method, path, params=params, headers=headers)
+            elapsed = (time.perf_counter() - started) * 1000
+            assert response.status_code == 200, f"{method} {path} -> {response.status_code}: {response.text[:300]}"
+            if i >= warmup:
+                timings.append(elapsed)
+                match = SERVER_TIMING_ROUND_TRIPS.search(response.headers.get("server-timing", ""))
+                round_trips.append(int(match.group(1)) if match else 0)
+        timings.sort()
+        return {
+            "p50_ms": round(statistics.median(timings), 2),
+            "p90_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.9))], 2),
+            "round_trips": int(statistics.median(round_trips)),
+            "response_bytes": len(response.content),
+        }
+
+    def measure(self, method: str, path: str, user: str = None, params: dict = None) -> dict:
+        return self.runner.run(self._measure(method, path, user, params or {}))
+
+
+@pytest.fixture(scope="session")
+def runner():
+    """One event loop for the whole session - the Motor client is bound to it"""
+    try:
+        MongoClient(BENCH_MONGO_URL, serverSelectionTimeoutMS=1500).admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"No mongod at {BENCH_MONGO_URL} ({e.__class__.__name__}) - set BENCH_MONGO_URL")
+    with asyncio.Runner() as loop_runner:
+        yield loop_runner
+
+
+@pytest.fixture(scope="session")
+def server_app(runner):
+    import server
+
+    async def start():
+        server.mongo.connect(BENCH_MONGO_URL, os.environ["DB_NAME"])
+        await server.app.router.startup()
+
+    runner.run(start())
+    yield server
+    runner.run(server.app.router.shutdown())
+
+
+@pytest.fixture(scope="session")
+def recorder(request):
+    bench_recorder = BenchmarkRecorder(BASELINE_PATH, request.config.getoption("--bench-update-baseline"))
+    request.config.stash[RECORDER_KEY] = bench_recorder
+    yield bench_recorder
+    bench_recorder.save()
+
+
+@pytest.fixture(scope="session")
+def bench(request, runner, server_app, scale):
+    """Seed (or reuse) the dataset for this scale and point the app at it"""
+    from seed_dataset import DatasetGenerator, hash_password, load_dataset
+
+    server = server_app
+    seed = request.config.getoption("--bench-seed")
+    anchor = (datetime.utcnow() + IST_OFFSET).date()
+    db_name = f"divine_cakery_bench_{scale_key(scale).replace('.', '_')}"
+    fingerprint = {"_id": "dataset", "seed": seed, "scale": scale, "anchor": anchor.isoformat()}
+
+    async def prepare():
+        server.mongo.use(db_name)
+        # Benchmarks write (standing-order regeneration), so a dataset is only reused on the same day
+        if await server.db.bench_meta.find_one({"_id": "dataset"}) != fingerprint:
+            generator = DatasetGenerator(scale, seed, weeks=4, anchor=anchor, password_hash=hash_password("Bench@123"))
+            await load_dataset(server.db, generator, drop=True)
+            await server.db.bench_meta.replace_one({"_id": "dataset"}, fingerprint, upsert=True)
+        # Index/collection startup hooks ran against the first database only
+        for handler in server.app.router.on_startup:
+            if handler.__name__.startswith("ensure_"):
+                await handler()
+        server.settings_registry.invalidate()
+        server.order_lines.clear()
+
+        whitelisted = await server.db.users.find_one({"allowed_product_ids.0": {"$exists": True}, "user_type": "owner"})
+        agent = await server.db.users.find_one({"user_type": "order_agent"})
+        owner = await server.db.users.find_one({"id": agent["linked_owner_id"]})
+        expires = timedelta(hours=1)
+        return {
+            "admin": server.create_access_token({"sub": "admin", "role": "admin"}, expires),
+            "whitelist": server.create_access_token({"sub": whitelisted["username"], "role": "customer"}, expires),
+            "owner": server.create_access_token({"sub": owner["username"], "role": "customer"}, expires),
+        }
+
+    tokens = runner.run(prepare())
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench")
+    yield EndpointBench(runner, client, tokens, (anchor + timedelta(days=1)).isoformat(),
+                        request.config.getoption("--bench-iterations"))
+    runner.run(client.aclose())
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    bench_recorder = config.stash.get(RECORDER_KEY, None)
+    if not bench_recorder or not bench_recorder.results:
+        return
+    terminalreporter.section("endpoint benchmarks")
+    for key, cases in bench_recorder.results.items():
+        for name, result in cases.items():
+            expected = bench_recorder.baseline.get(key, {}).get(name) if not bench_recorder.update else None
+            vs = f"  (baseline p50 {expected['p50_ms']:.1f}ms, {expected['round_trips']} trips)" if expected else ""
+            terminalreporter.write_line(
+                f"{key:>5} {name:<28} p50 {result['p50_ms']:8.1f}ms  p90 {result['p90_ms']:8.1f}ms  "
+                f"{result['round_trips']:4d} trips{vs}"
+            )
+    if bench_recorder.update:
+        terminalreporter.write_line(f"baseline written to {bench_recorder.path}")
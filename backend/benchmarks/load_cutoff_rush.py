@@ -0,0 +1,315 @@
+"""
+Load scenario: the 4 AM IST cutoff rush
+
+Replays the peak-hour mix against a running instance loaded with seed_dataset.py:
+- customers (owners and order agents) log in, browse the catalog and categories, check their
+  wallet and recent orders, then place an order with pay-later, wallet or (short on balance)
+  online payment
+- admins poll the preparation list, route summary, daily items and shortage reports
+- Razorpay delivers payment_link.paid webhooks, some of them duplicates
+
+Customer sessions arrive as an open model: the arrival rate climbs from --start-rate to
+--peak-rate over --duration, the way orders pile up towards the cutoff. Per endpoint it reports
+throughput, p50/p90/p99 latency, rejections (4xx) and errors (5xx or transport failures).
+
+    uvicorn server:app --port 8001 --workers 2        (DB_NAME=divine_cakery_bench)
+    python benchmarks/load_cutoff_rush.py --base-url http://localhost:8001 --db divine_cakery_bench \\
+        --duration 300 --peak-rate 8 --json-out rush.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from seed_dataset import DEFAULT_PASSWORD
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+REPORT_PATHS = [
+    ("report_preparation_list", "/api/admin/reports/preparation-list", {}),
+    ("report_route_summary", "/api/admin/reports/route-summary", {"route_type": "lulu"}),
+    ("report_route_summary", "/api/admin/reports/route-summary", {"route_type": "short"}),
+    ("report_route_summary", "/api/admin/reports/route-summary", {"route_type": "long"}),
+    ("report_daily_items", "/api/admin/reports/daily-items", {}),
+    ("report_shortage_check", "/api/admin/reports/shortage-check", {}),
+    ("admin_orders", "/api/orders", {}),
+]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class EndpointStats:
+    """Latencies and outcomes per endpoint name"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.rejected: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.started = time.perf_counter()
+
+    def record(self, name: str, seconds: float, status: str):
+        self.latencies[name].append(seconds * 1000)
+        self.statuses[name][status] += 1
+        if status.startswith("4"):
+            self.rejected[name] += 1
+        elif not status.startswith("2"):
+            self.errors[name] += 1
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        endpoints = {}
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            endpoints[name] = {
+                "requests": len(values),
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 0.5), 1),
+                "p90_ms": round(percentile(values, 0.9), 1),
+                "p99_ms": round(percentile(values, 0.99), 1),
+                "max_ms": round(values[-1], 1),
+                "rejected": self.rejected[name],
+                "errors": self.errors[name],
+                "error_rate": round(self.errors[name] / len(values), 4),
+                "statuses": dict(self.statuses[name]),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "duration_s": round(elapsed, 1),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2),
+            "errors": sum(self.errors.values()),
+            "endpoints": endpoints,
+        }
+
+
+class CutoffRush:
+    """Drives the scenario over one httpx client (a real server, or an ASGI transport in tests)"""
+
+    def __init__(self, client: httpx.AsyncClient, customers: List[dict], products: List[dict], topups: List[dict],
+                 password: str = DEFAULT_PASSWORD, admins: int = 3, report_interval: float = 5.0,
+                 webhook_rate: float = 2.0, think_time: float = 1.0, max_sessions: int = 200, seed: int = 1):
+        self.client = client
+        self.customers = customers
+        self.products = products
+        self.topups = topups
+        self.password = password
+        self.admins = admins
+        self.report_interval = report_interval
+        self.webhook_rate = webhook_rate
+        self.think_time = think_time
+        self.sessions = asyncio.Semaphore(max_sessions)
+        self.rng = random.Random(seed)
+        self.stats = EndpointStats()
+        self.sessions_dropped = 0
+        self._tokens: Dict[str, str] = {}
+
+    async def call(self, name: str, method: str, path: str, token: Optional[str] = None, **kwargs) -> Optional[httpx.Response]:
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers=headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(name, time.perf_counter() - started, e.__class__.__name__)
+            return None
+        self.stats.record(name, time.perf_counter() - started, str(response.status_code))
+        return response
+
+    async def think(self):
+        await asyncio.sleep(self.rng.expovariate(1 / self.think_time) if self.think_time > 0 else 0)
+
+    async def login(self, username: str) -> Optional[str]:
+        # Tokens last 7 days; returning customers (and admins) reuse theirs like the app does
+        if username in self._tokens:
+            return self._tokens[username]
+        response = await self.call("login", "POST", "/api/auth/login", json={"username": username, "password": self.password})
+        if response is None or response.status_code != 200:
+            return None
+        self._tokens[username] = response.json()["access_token"]
+        return self._tokens[username]
+
+    def basket(self, customer: dict) -> dict:
+        allowed = customer.get("allowed_product_ids")
+        pool = [p for p in self.products if not allowed or p["id"] in allowed]
+        items = []
+        for product in self.rng.sample(pool, k=min(len(pool), self.rng.randint(2, 6))):
+            quantity = float(self.rng.choice([1, 2, 3, 5, 6, 10, 12]))
+            items.append({
+                "product_id": product["id"], "product_name": product["name"], "quantity": quantity,
+                "price": product["price"], "subtotal": round(quantity * product["price"], 2)
+            })
+        subtotal = round(sum(item["subtotal"] for item in items), 2)
+        pickup = customer.get("onsite_pickup_only", False)
+        delivery_charge = 0.0 if pickup or customer.get("delivery_charge_waived") else 30.0
+        return {
+            "items": items, "subtotal": subtotal, "delivery_charge": delivery_charge,
+            "total_amount": round(subtotal + delivery_charge, 2),
+            "order_type": "pickup" if pickup else "delivery",
+        }
+
+    async def customer_session(self, customer: dict):
+        try:
+            token = await self.login(customer["username"])
+            if not token:
+                return
+            await self.call("catalog_products", "GET", "/api/products", token)
+            await self.call("catalog_categories", "GET", "/api/categories", token)
+            await self.think()
+            wallet = await self.call("wallet", "GET", "/api/wallet", token)
+            if self.rng.random() < 0.3:
+                await self.call("my_orders", "GET", "/api/orders", token)
+            await self.think()
+
+            order = self.basket(customer)
+            balance = wallet.json()["balance"] if wallet is not None and wallet.status_code == 200 else 0.0
+            if customer.get("pay_later_enabled") and order["total_amount"] <= customer.get("pay_later_max_limit", 0) and self.rng.random() < 0.7:
+                order["payment_method"] = "pay_later"
+            elif balance >= order["total_amount"]:
+                order["payment_method"] = "wallet"
+            else:
+                # Not enough in the wallet: the order is placed for online payment (the Razorpay leg is not driven)
+                order["payment_method"] = "razorpay"
+            await self.call(f"place_order_{order['payment_method']}", "POST", "/api/orders", token, json=order)
+        finally:
+            self.sessions.release()
+
+    async def arrivals(self, deadline: float, start_rate: float, peak_rate: float, sessions: set):
+        started = time.perf_counter()
+        duration = deadline - started
+        while time.perf_counter() < deadline:
+            progress = (time.perf_counter() - started) / duration
+            rate = start_rate + (peak_rate - start_rate) * progress
+            await asyncio.sleep(self.rng.expovariate(rate) if rate > 0 else 1)
+            if self.sessions.locked():
+                # Concurrency cap reached - the customer gives up, which is itself a result
+                self.sessions_dropped += 1
+                continue
+            await self.sessions.acquire()
+            task = asyncio.create_task(self.customer_session(self.rng.choice(self.customers)))
+            sessions.add(task)
+            task.add_done_callback(sessions.discard)
+
+    async def admin_poller(self, username: str, deadline: float):
+        token = await self.login(username)
+        if not token:
+            return
+        while time.perf_counter() < deadline:
+            name, path, params = self.rng.choice(REPORT_PATHS)
+            tomorrow = (datetime.utcnow() + IST_OFFSET + timedelta(days=1)).strftime("%Y-%m-%d")
+            params = dict(params, delivery_date=tomorrow) if name == "admin_orders" else dict(params, date=tomorrow)
+            await self.call(name, "GET", path, token, params=params)
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.report_interval)
+
+    async def webhooks(self, deadline: float):
+        sent = []
+        while time.perf_counter() < deadline and self.topups:
+            await asyncio.sleep(self.rng.expovariate(self.webhook_rate))
+            if sent and self.rng.random() < 0.1:
+                # Razorpay retries reuse the event id
+                event_id, payload = self.rng.choice(sent)
+            else:
+                transaction = self.rng.choice(self.topups)
+                event_id = f"evt_{uuid.uuid4().hex[:14]}"
+                payload = {
+                    "event": "payment_link.paid",
+                    "payload": {"payment_link": {"entity": {
+                        "id": transaction.get("razorpay_payment_link_id"),
+                        "reference_id": transaction["id"],
+                        "amount": int(transaction["amount"] * 100),
+                        "status": "paid",
+                    }}},
+                }
+                sent.append((event_id, payload))
+            await self.call("payment_webhook", "POST", "/api/payments/webhook", json=payload,
+                            headers={"X-Razorpay-Event-Id": event_id})
+
+    async def run(self, duration: float, start_rate: float, peak_rate: float) -> dict:
+        self.stats = EndpointStats()
+        deadline = time.perf_counter() + duration
+        sessions = set()
+        background = [asyncio.create_task(self.webhooks(deadline))]
+        background += [asyncio.create_task(self.admin_poller(name, deadline)) for name in ["admin", "manager", "reports"][:self.admins]]
+        await self.arrivals(deadline, start_rate, peak_rate, sessions)
+        await asyncio.gather(*background, *list(sessions))
+        report = self.stats.report()
+        report["sessions_dropped"] = self.sessions_dropped
+        return report
+
+
+async def load_actors(db, sample: int = 5000):
+    """Customers (owners and agents), available products and top-up transactions from a seeded database"""
+    projection = {"_id": 0, "id": 1, "username": 1, "allowed_product_ids": 1, "onsite_pickup_only": 1,
+                  "delivery_charge_waived": 1, "pay_later_enabled": 1, "pay_later_max_limit": 1}
+    customers = await db.users.find({"role": "customer", "is_active": True}, projection).to_list(sample)
+    products = await db.products.find({"is_available": True}, {"_id": 0, "id": 1, "name": 1, "price": 1}).to_list(1000)
+    topups = await db.transactions.find(
+        {"transaction_type": "wallet_topup"}, {"_id": 0, "id": 1, "amount": 1, "razorpay_payment_link_id": 1}
+    ).to_list(sample)
+    return customers, products, topups
+
+
+def print_report(report: dict):
+    print(f"\n{report['requests']} requests in {report['duration_s']}s "
+          f"({report['throughput_rps']} req/s), {report['errors']} errors, {report['sessions_dropped']} sessions dropped")
+    print(f"{'endpoint':<26}{'reqs':>7}{'rps':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'4xx':>6}{'err':>6}")
+    for name, row in report["endpoints"].items():
+        print(f"{name:<26}{row['requests']:>7}{row['throughput_rps']:>8}{row['p50_ms']:>9}{row['p90_ms']:>9}"
+              f"{row['p99_ms']:>9}{row['max_ms']:>9}{row['rejected']:>6}{row['errors']:>6}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay the 4 AM IST cutoff rush against a local instance")
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.environ.get("DB_NAME", "divine_cakery_bench"), help="the seeded database the server uses")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--duration", type=float, default=120, help="seconds")
+    parser.add_argument("--start-rate", type=float, default=1.0, help="customer sessions/s at the start")
+    parser.add_argument("--peak-rate", type=float, default=10.0, help="customer sessions/s just before the cutoff")
+    parser.add_argument("--max-sessions", type=int, default=200, help="concurrent customer sessions")
+    parser.add_argument("--admins", type=int, default=3, help="admins polling reports (at most 3)")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="mean seconds between an admin's report polls")
+    parser.add_argument("--webhook-rate", type=float, default=2.0, help="payment webhooks/s")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between a customer's steps")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json-out", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    mongo = AsyncIOMotorClient(args.mongo_url)
+    customers, products, topups = await load_actors(mongo[args.db])
+    mongo.close()
+    if not customers or not products:
+        sys.exit(f"No customers/products in {args.db} - run seed_dataset.py first")
+
+    limits = httpx.Limits(max_connections=args.max_sessions + 10, max_keepalive_connections=args.max_sessions)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60.0, limits=limits) as client:
+        rush = CutoffRush(client, customers, products, topups, password=args.password, admins=args.admins,
+                          report_interval=args.report_interval, webhook_rate=args.webhook_rate,
+                          think_time=args.think_time, max_sessions=args.max_sessions, seed=args.seed)
+        report = await rush.run(args.duration, args.start_rate, args.peak_rate)
+
+    print_report(report)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Micro-benchmark: columnar order line store vs the dict-based report code
+
+Generates a seed_dataset.py dataset in memory (no mongod needed), keeps the orders delivering
+around the anchor day, and times each report both ways on the same orders:
+- daily items: reports.build_daily_items vs OrderLineStore.daily_items
+- preparation list: a dict group-by into the $facet shape vs OrderLineStore.preparation_facet (in
+  production the dict side is reports.preparation_pipeline running in mongod, so this leaves
+  out its round trip; benchmarks/test_endpoints.py measures the endpoints end to end)
+Both sides must produce identical reports. Also reports the cost of building a day's block.
+
+    python benchmarks/order_lines_bench.py --scale 100 --iterations 20
+"""
+import argparse
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from order_lines import OrderLineStore
+from report_snapshots import delivery_day
+from reports import CANCELLED_STATUSES, build_daily_items, build_preparation_list
+from seed_dataset import DatasetGenerator
+
+
+def timed(fn, iterations: int) -> float:
+    """Median milliseconds per call"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def dict_preparation_facet(orders_by_day, days, product_ids=None):
+    quantities = defaultdict(float)
+    order_counts = []
+    for day, orders in enumerate(orders_by_day[:days]):
+        active = [order for order in orders if order.get("order_status") not in CANCELLED_STATUSES]
+        if active:
+            order_counts.append({"_id": day, "count": len(active)})
+        for order in active:
+            for item in order.get("items", []):
+                if product_ids is None or item.get("product_id") in product_ids:
+                    quantities[(item.get("product_id"), day)] += item.get("quantity", 0)
+    return {
+        "quantities": [{"_id": {"product_id": p, "day": d}, "quantity": q} for (p, d), q in quantities.items()],
+        "order_counts": order_counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--prep-days", type=int, default=2)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    generator = DatasetGenerator(args.scale, args.seed, weeks=1, password_hash="x")
+    report_day = generator.anchor + timedelta(days=1)
+    first_prep_day = generator.anchor
+    wanted = {first_prep_day + timedelta(days=offset) for offset in range(args.prep_days)} | {report_day}
+    orders_by_day = defaultdict(list)
+    for collection, doc in generator.documents():
+        if collection == "orders":
+            day = delivery_day(doc["delivery_date"])
+            if day in wanted:
+                orders_by_day[day].append(doc)
+    print(f"generated {args.scale:g}x dataset in {time.perf_counter() - started:.1f}s: "
+          f"{len(orders_by_day[report_day])} orders, "
+          f"{sum(len(o.get('items', [])) for o in orders_by_day[report_day])} lines on {report_day}")
+
+    products = generator.products
+    dough_types = [c for c in generator.categories if c.get("category_type") == "dough_type"]
+    dough_type_names = {d["id"]: d["name"] for d in dough_types}
+    dough_type_of = {p["id"]: p.get("dough_type_id") for p in products}
+
+    store = OrderLineStore(db=None)
+    day_orders = orders_by_day[report_day]
+    block = store.build_block(report_day, day_orders)
+    prep_orders = [orders_by_day[first_prep_day + timedelta(days=offset)] for offset in range(args.prep_days)]
+    prep_blocks = [store.build_block(first_prep_day + timedelta(days=offset), orders)
+                   for offset, orders in enumerate(prep_orders)]
+
+    daily_orders = [o for o in day_orders if o.get("order_status") not in CANCELLED_STATUSES]
+
+    cases = [
+        ("daily_items",
+         lambda: build_daily_items(daily_orders, dough_type_of, dough_type_names),
+         lambda: store.daily_items(block, CANCELLED_STATUSES, dough_type_of, dough_type_names)),
+        ("preparation_list",
+         lambda: build_preparation_list(dict_preparation_facet(prep_orders, args.prep_days), products, dough_types, args.prep_days),
+         lambda: build_preparation_list(store.preparation_facet(prep_blocks, CANCELLED_STATUSES), products, dough_types, args.prep_days)),
+    ]
+    print(f"{'report':<18} {'dict ms':>9} {'columnar ms':>12} {'speedup':>8}")
+    for name, with_dicts, with_columns in cases:
+        assert with_dicts() == with_columns(), f"{name}: columnar result differs from the dict-based one"
+        dict_ms = timed(with_dicts, args.iterations)
+        columnar_ms = timed(with_columns, args.iterations)
+        print(f"{name:<18} {dict_ms:9.2f} {columnar_ms:12.2f} {dict_ms / columnar_ms:7.1f}x")
+    build_ms = timed(lambda: OrderLineStore(db=None).build_block(report_day, day_orders), max(3, args.iterations // 4))
+    print(f"{'build day block':<18} {'':>9} {build_ms:12.2f}   (per day on load: after an update or delete, or max age)")
+
+
+if __name__ == "__main__":
+    main()
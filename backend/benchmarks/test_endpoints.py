@@ -0,0 +1,31 @@
+"""
+Endpoint latency and round-trip benchmarks at each dataset scale
+Fails when p50 or Mongo round trips regress beyond the tolerance against baseline.json
+"""
+import pytest
+
+# name, method, path, token (see conftest.bench), query params
+CASES = [
+    ("products_public", "GET", "/api/products", None, {}),
+    ("products_whitelist", "GET", "/api/products", "whitelist", {}),
+    ("products_admin", "GET", "/api/products", "admin", {"include_admin": "true"}),
+    ("orders_owner", "GET", "/api/orders", "owner", {}),
+    ("orders_admin", "GET", "/api/orders", "admin", {}),
+    ("report_route_summary", "GET", "/api/admin/reports/route-summary", "admin", {"date": "{report_date}", "route_type": "short"}),
+    ("report_shortage_check", "GET", "/api/admin/reports/shortage-check", "admin", {"date": "{report_date}"}),
+    ("report_dispatch_board", "GET", "/api/admin/reports/dispatch-board", "admin", {"date": "{report_date}"}),
+    ("report_daily_items", "GET", "/api/admin/reports/daily-items", "admin", {"date": "{report_date}"}),
+    ("report_preparation_list", "GET", "/api/admin/reports/preparation-list", "admin", {"date": "{report_date}"}),
+    ("admin_stats", "GET", "/api/admin/stats", "admin", {}),
+    ("admin_users", "GET", "/api/admin/users", "admin", {}),
+    # Writes on the first call only; later calls find the next 10 days already generated
+    ("standing_orders_regenerate", "POST", "/api/admin/standing-orders/regenerate-all", "admin", {}),
+]
+
+
+@pytest.mark.parametrize("name, method, path, user, params", CASES, ids=[case[0] for case in CASES])
+def test_endpoint(bench, recorder, scale, name, method, path, user, params):
+    result = bench.measure(method, path, user, params)
+    recorder.record(scale, name, result)
+    problems = recorder.regressions(scale, name, result)
+    assert not problems, f"{name} regressed: {'; '.join(problems)}"
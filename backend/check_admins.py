@@ -29,6 +29,7 @@ async def check_admins():
         admin_user = {
             "id": "admin-001",
             "username": "admin",
+            "username_lower": "admin",
             "name": "Admin User",
             "email": "admin@divinecakery.com",
             "phone": "1234567890",
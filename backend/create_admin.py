@@ -32,6 +32,7 @@ async def create_admin():
     admin_dict = {
         "id": admin_id,
         "username": "admin",
+        "username_lower": "admin",
         "email": "admin@divinecakery.in",
         "phone": "9999999999",
         "role": "admin",
@@ -32,6 +32,7 @@ async def create_demo_admins():
     limited_dict = {
         "id": limited_id,
         "username": "ordermanager",
+        "username_lower": "ordermanager",
         "email": "orders@divinecakery.in",
         "phone": "8888888888",
         "role": "admin",
@@ -73,6 +74,7 @@ async def create_demo_admins():
     reports_dict = {
         "id": reports_id,
         "username": "accountant",
+        "username_lower": "accountant",
         "email": "accounts@divinecakery.in",
         "phone": "7777777777",
         "role": "admin",
@@ -0,0 +1,61 @@
+# Database Connection
+# One Motor client per process, owned by MongoConnection. server.py and the route modules
+# capture `db` at import time, so they get a proxy that always resolves to the current
+# connection. Benchmarks and tests call connect() to point the app at their own mongod
+# (and at a client bound to their own event loop) without re-importing server.py.
+import os
+from typing import Iterable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+
+class DatabaseProxy:
+    """Forwards attribute and item access (db.orders, db["orders"], db.command) to the live database"""
+
+    __slots__ = ("_connection",)
+
+    def __init__(self, connection: "MongoConnection"):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection.database, name)
+
+    def __getitem__(self, name):
+        return self._connection.database[name]
+
+    def __repr__(self) -> str:
+        return f"DatabaseProxy({self._connection.database!r})"
+
+
+class MongoConnection:
+    """
+    Holds the client and database. The command listeners (metrics, slow queries, round trips,
+    tracing) are attached to every client it creates, including reconnects.
+    """
+
+    def __init__(self, event_listeners: Iterable = ()):
+        self.event_listeners = list(event_listeners)
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.database: Optional[AsyncIOMotorDatabase] = None
+        self.db = DatabaseProxy(self)
+
+    @classmethod
+    def from_env(cls, event_listeners: Iterable = ()) -> "MongoConnection":
+        """MONGO_URL and DB_NAME"""
+        return cls(event_listeners).connect(os.environ['MONGO_URL'], os.environ['DB_NAME'])
+
+    def connect(self, mongo_url: str, db_name: str, **client_options) -> "MongoConnection":
+        """Open a new client (closing the previous one) and make db_name the current database"""
+        self.close()
+        self.client = AsyncIOMotorClient(mongo_url, event_listeners=self.event_listeners, **client_options)
+        self.database = self.client[db_name]
+        return self
+
+    def use(self, db_name: str) -> "MongoConnection":
+        """Switch to another database on the same client (e.g. one per benchmark scale)"""
+        self.database = self.client[db_name]
+        return self
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
@@ -0,0 +1,299 @@
+# Email Outbox
+# Request handlers only enqueue; a background sender delivers queued messages in
+# batches over a pooled, already-authenticated SMTP connection.
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, Optional
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENDING = "sending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+
+def build_message(sender: str, to_email: str, subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+class SMTPConnectionPool:
+    """
+    Keeps one logged-in SMTP connection alive and reuses it across messages.
+    The connection is opened lazily, re-opened after a disconnect and closed
+    after idle_timeout seconds without traffic.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        start_tls: bool = True,
+        timeout: float = 30.0,
+        idle_timeout: float = 60.0,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._last_used = 0.0
+        self._lock = asyncio.Lock()
+        self.connections_opened = 0
+
+    @classmethod
+    def from_env(cls) -> "SMTPConnectionPool":
+        return cls(
+            hostname=os.environ.get("SMTP_SERVER", "smtp.gmail.com"),
+            port=int(os.environ.get("SMTP_PORT", 587)),
+            username=os.environ.get("SMTP_USERNAME", ""),
+            password=os.environ.get("SMTP_PASSWORD", ""),
+            start_tls=os.environ.get("SMTP_STARTTLS", "true").lower() == "true",
+        )
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            start_tls=self.start_tls,
+            timeout=self.timeout
+        )
+        await smtp.connect()
+        if self.username:
+            await smtp.login(self.username, self.password)
+        self.connections_opened += 1
+        return smtp
+
+    async def _get_connection(self) -> aiosmtplib.SMTP:
+        expired = time.monotonic() - self._last_used > self.idle_timeout
+        if self._smtp is not None and (expired or not self._smtp.is_connected):
+            await self.close()
+        if self._smtp is None:
+            self._smtp = await self._connect()
+        return self._smtp
+
+    async def send(self, message) -> None:
+        async with self._lock:
+            smtp = await self._get_connection()
+            try:
+                await smtp.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                # Server dropped the pooled connection - reconnect once and retry
+                self._smtp = None
+                smtp = await self._get_connection()
+                await smtp.send_message(message)
+            self._last_used = time.monotonic()
+
+    async def close(self):
+        if self._smtp is not None:
+            try:
+                await self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+class EmailOutbox:
+    """Durable email queue backed by the email_outbox collection"""
+
+    def __init__(
+        self,
+        db,
+        pool: SMTPConnectionPool,
+        sender: str = "",
+        batch_size: int = 20,
+        poll_interval: float = 5.0,
+        max_attempts: int = 5,
+        backoff_base: float = 30.0,
+        backoff_max: float = 1800.0,
+        stale_after: float = 300.0,
+        requeue_interval: float = 60.0,
+        tracer=None,
+    ):
+        self.db = db
+        self.pool = pool
+        self.tracer = tracer
+        self.sender = sender or pool.username
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Messages left in 'sending' longer than stale_after (their worker died mid-batch) are
+        # returned to the queue by whichever sender loop checks next, every requeue_interval
+        self.stale_after = stale_after
+        self.requeue_interval = requeue_interval
+        self._requeued_at: Optional[float] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.sent_total = 0
+        self.failed_total = 0
+        self.requeued_total = 0
+
+    @property
+    def collection(self):
+        return self.db.email_outbox
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", 1), ("available_at", 1)])
+        await self.collection.create_index("claim_id")
+        # Delivered messages are kept for a week, then purged by Mongo
+        await self.collection.create_index("sent_at", expireAfterSeconds=7 * 24 * 3600)
+
+    async def enqueue(self, subject: str, body: str, to_email: str) -> str:
+        """Queue an email for background delivery. Returns the outbox message id."""
+        now = datetime.utcnow()
+        message_id = str(uuid.uuid4())
+        await self.collection.insert_one({
+            "id": message_id,
+            "to": to_email,
+            "subject": subject,
+            "body": body,
+            "status": OUTBOX_PENDING,
+            "attempts": 0,
+            "created_at": now,
+            "available_at": now,
+            # The SMTP send shows up as a child span of the request that queued it
+            "traceparent": self.tracer.current_traceparent() if self.tracer else None
+        })
+        self._wakeup.set()
+        return message_id
+
+    async def _claim_batch(self) -> List[dict]:
+        now = datetime.utcnow()
+        candidates = await self.collection.find(
+            {"status": OUTBOX_PENDING, "available_at": {"$lte": now}},
+            {"_id": 1}
+        ).sort("available_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+
+        claim_id = str(uuid.uuid4())
+        await self.collection.update_many(
+            {"_id": {"$in": [c["_id"] for c in candidates]}, "status": OUTBOX_PENDING},
+            {"$set": {"status": OUTBOX_SENDING, "claim_id": claim_id, "claimed_at": now}}
+        )
+        return await self.collection.find({"claim_id": claim_id}).to_list(self.batch_size)
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+
+    async def _send(self, message: dict, attempt: int):
+        email = build_message(self.sender, message["to"], message["subject"], message["body"])
+        if self.tracer is None:
+            await self.pool.send(email)
+            return
+        with self.tracer.span("smtp.send", kind="client", traceparent=message.get("traceparent"),
+                              outbox_id=message.get("id"), attempt=attempt):
+            await self.pool.send(email)
+
+    async def send_batch(self) -> int:
+        """Deliver one batch over the pooled connection. Returns the number of messages claimed."""
+        batch = await self._claim_batch()
+        for message in batch:
+            attempts = message.get("attempts", 0) + 1
+            try:
+                await self._send(message, attempts)
+            except Exception as e:
+                if attempts >= self.max_attempts:
+                    status = OUTBOX_FAILED
+                    self.failed_total += 1
+                    logger.error(f"Failed to send email to {message['to']} after {attempts} attempts: {str(e)}")
+                else:
+                    status = OUTBOX_PENDING
+                    logger.warning(f"Email to {message['to']} failed (attempt {attempts}), retrying: {str(e)}")
+                await self.collection.update_one(
+                    {"_id": message["_id"]},
+                    {"$set": {
+                        "status": status,
+                        "attempts": attempts,
+                        "last_error": str(e),
+                        "available_at": datetime.utcnow() + timedelta(seconds=self._backoff(attempts))
+                    }}
+                )
+                continue
+
+            await self.collection.update_one(
+                {"_id": message["_id"]},
+                {"$set": {"status": OUTBOX_SENT, "attempts": attempts, "sent_at": datetime.utcnow()}}
+            )
+            self.sent_total += 1
+            logger.info(f"Email sent successfully to {message['to']}")
+        return len(batch)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if self._requeued_at is None or time.monotonic() - self._requeued_at >= self.requeue_interval:
+                    self._requeued_at = time.monotonic()
+                    await self.requeue_stale(self.stale_after)
+                while await self.send_batch() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Email outbox sender error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def requeue_stale(self, older_than_seconds: float = 300) -> int:
+        """Return messages stuck in 'sending' (worker died mid-batch) to the queue"""
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+        result = await self.collection.update_many(
+            {"status": OUTBOX_SENDING, "claimed_at": {"$lt": cutoff}},
+            {"$set": {"status": OUTBOX_PENDING}}
+        )
+        if result.modified_count:
+            self.requeued_total += result.modified_count
+            logger.warning(f"Requeued {result.modified_count} emails left in 'sending' by a stopped worker")
+        return result.modified_count
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.pool.close()
+
+    async def stats(self) -> dict:
+        """Queue depth by status plus per-worker delivery counters"""
+        counts = await self.collection.aggregate([
+            {"$match": {"status": {"$in": [OUTBOX_PENDING, OUTBOX_SENDING, OUTBOX_FAILED]}}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(10)
+        by_status = {c["_id"]: c["count"] for c in counts}
+        return {
+            "pending": by_status.get(OUTBOX_PENDING, 0),
+            "sending": by_status.get(OUTBOX_SENDING, 0),
+            "failed": by_status.get(OUTBOX_FAILED, 0),
+            "sent_total": self.sent_total,
+            "failed_total": self.failed_total,
+            "requeued_total": self.requeued_total,
+            "smtp_connections_opened": self.pool.connections_opened
+        }
@@ -0,0 +1,291 @@
+# Cache Invalidation Bus
+# Every worker/instance watches MongoDB for writes to cached collections and tells
+# its in-process caches to drop stale entries, whichever worker handled the write.
+# - change_stream: one database-level change stream, resumable via a persisted token
+# - poll: for standalone mongod (no change streams) - reads one small version document per
+#   collection, bumped by publish_write. Writes that bypass publish_write (scripts, the shell)
+#   are not seen by polling workers.
+# Subscribers that need per-document events (e.g. the order line store) subscribe stream_only:
+# their collections are watched in change stream mode and left out of polling.
+import asyncio
+import inspect
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Collections whose writes are broadcast by default
+DEFAULT_WATCHED_COLLECTIONS = ["users", "products", "categories", "settings", "discounts"]
+
+# Operation used when a cache must drop everything for a collection
+# (polling detected a change, the collection was dropped, or the resume token was lost)
+INVALIDATE_ALL = "invalidate_all"
+
+# Server error codes
+NOT_A_REPLICA_SET = 40573
+CHANGE_STREAM_FATAL = 280
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+@dataclass(frozen=True)
+class InvalidationEvent:
+    """A write that may have made cached data for `collection` stale"""
+    collection: str
+    operation: str  # insert / update / replace / delete / invalidate_all
+    document_key: Any = None  # MongoDB _id of the changed document, None for invalidate_all
+    source: str = "change_stream"  # change_stream / poll / local
+
+
+class InvalidationBus:
+    """Dispatches InvalidationEvents from MongoDB to registered cache callbacks"""
+
+    def __init__(
+        self,
+        db,
+        collections: Optional[Iterable[str]] = None,
+        mode: Optional[str] = None,
+        poll_interval: Optional[float] = None,
+        name: str = "default",
+        token_persist_interval: float = 5.0,
+    ):
+        self.db = db
+        self.collections = set(collections or DEFAULT_WATCHED_COLLECTIONS)
+        self.mode = mode or os.environ.get("INVALIDATION_BUS_MODE", "auto")  # auto / change_stream / poll / off
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.environ.get("INVALIDATION_POLL_SECONDS", 10))
+        self.name = name
+        self.token_persist_interval = token_persist_interval
+        self._subscribers: Dict[str, List[Callable]] = {}
+        self._stream_only: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._resume_token = None
+        self._token_saved_at = 0.0
+        self._token_dirty = False
+        self._collection_versions: Dict[str, int] = {}
+        # In-process counters (per worker)
+        self.active_mode: Optional[str] = None
+        self.events_total = 0
+        self.restarts_total = 0
+        self.last_event_at: Optional[datetime] = None
+
+    @property
+    def state_collection(self):
+        return self.db.invalidation_bus_state
+
+    def subscribe(self, collections: Iterable[str], callback: Callable[[InvalidationEvent], Any],
+                  stream_only: bool = False):
+        """
+        Register a callback (sync or async) for writes to the given collections.
+        stream_only collections are not polled: without change streams their subscribers only
+        hear about writes through publish_local and must bound staleness themselves.
+        """
+        for collection in collections:
+            if stream_only and collection not in self.collections:
+                self._stream_only.add(collection)
+            elif not stream_only:
+                self._stream_only.discard(collection)
+            self.collections.add(collection)
+            self._subscribers.setdefault(collection, []).append(callback)
+
+    @property
+    def polled_collections(self) -> List[str]:
+        return sorted(self.collections - self._stream_only)
+
+    async def dispatch(self, event: InvalidationEvent):
+        self.events_total += 1
+        self.last_event_at = datetime.utcnow()
+        for callback in self._subscribers.get(event.collection, []):
+            try:
+                result = callback(event)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Invalidation callback failed for {event.collection}: {str(e)}")
+
+    async def publish_local(self, collection: str, document_key: Any = None):
+        """Invalidate this worker's caches right away, without waiting for the stream"""
+        operation = "update" if document_key is not None else INVALIDATE_ALL
+        await self.dispatch(InvalidationEvent(collection, operation, document_key, source="local"))
+
+    async def publish_write(self, collection: str, document_key: Any = None):
+        """
+        Call after writing to a watched collection: bumps the collection's version document, which
+        polling workers compare, then invalidates this worker's caches right away
+        """
+        await self.state_collection.update_one(
+            {"_id": f"version:{collection}"},
+            {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        await self.publish_local(collection, document_key)
+
+    async def _invalidate_everything(self, source: str):
+        for collection in self.polled_collections if source == "poll" else sorted(self.collections):
+            await self.dispatch(InvalidationEvent(collection, INVALIDATE_ALL, source=source))
+
+    # ---- resume token persistence ----
+
+    async def _load_resume_token(self):
+        state = await self.state_collection.find_one({"_id": f"resume_token:{self.name}"})
+        return state.get("token") if state else None
+
+    async def _save_resume_token(self, force: bool = False):
+        if not self._token_dirty:
+            return
+        if not force and time.monotonic() - self._token_saved_at < self.token_persist_interval:
+            return
+        await self.state_collection.update_one(
+            {"_id": f"resume_token:{self.name}"},
+            {"$set": {"token": self._resume_token, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        self._token_saved_at = time.monotonic()
+        self._token_dirty = False
+
+    async def _clear_resume_token(self):
+        self._resume_token = None
+        self._token_dirty = False
+        await self.state_collection.delete_one({"_id": f"resume_token:{self.name}"})
+
+    # ---- change stream mode ----
+
+    def _event_from_change(self, change: dict) -> Optional[InvalidationEvent]:
+        collection = change.get("ns", {}).get("coll")
+        operation = change.get("operationType")
+        if operation in ("insert", "update", "replace", "delete"):
+            return InvalidationEvent(collection, operation, change.get("documentKey", {}).get("_id"))
+        if operation in ("drop", "rename"):
+            return InvalidationEvent(collection, INVALIDATE_ALL)
+        return None
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": sorted(self.collections)}}}]
+        async with self.db.watch(pipeline, resume_after=self._resume_token, max_await_time_ms=1000) as stream:
+            self.active_mode = "change_stream"
+            logger.info(f"Invalidation bus watching {sorted(self.collections)} via change stream")
+            while not self._stopping and stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    if change.get("operationType") in ("dropDatabase", "invalidate"):
+                        await self._invalidate_everything("change_stream")
+                    else:
+                        event = self._event_from_change(change)
+                        if event and event.collection in self.collections:
+                            await self.dispatch(event)
+                # resume_token advances even when no events arrive (post-batch token)
+                if stream.resume_token is not None and stream.resume_token != self._resume_token:
+                    self._resume_token = stream.resume_token
+                    self._token_dirty = True
+                await self._save_resume_token()
+        await self._save_resume_token(force=True)
+
+    async def _run_change_stream(self) -> bool:
+        """Watch until stopped. Returns False if change streams are unavailable (standalone mongod)."""
+        self._resume_token = await self._load_resume_token()
+        delay = 1.0
+        while not self._stopping:
+            try:
+                await self._watch()
+                delay = 1.0
+            except OperationFailure as e:
+                if e.code == NOT_A_REPLICA_SET:
+                    return False
+                if e.code in (CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL) and self._resume_token is not None:
+                    # Oplog rolled past our token - we can't know what changed, so flush every cache
+                    logger.warning(f"Invalidation bus resume token lost ({e.code}), restarting stream and flushing caches")
+                    await self._clear_resume_token()
+                    await self._invalidate_everything("change_stream")
+                    continue
+                logger.error(f"Invalidation bus change stream error: {str(e)}")
+            except PyMongoError as e:
+                logger.warning(f"Invalidation bus change stream interrupted, resuming: {str(e)}")
+            if self._stopping:
+                break
+            self.restarts_total += 1
+            await self._sleep(delay)
+            delay = min(delay * 2, 30.0)
+        return True
+
+    # ---- polling mode ----
+
+    async def poll_once(self):
+        """Compare per-collection versions with the previous poll and dispatch for any that changed"""
+        collections = self.polled_collections
+        try:
+            states = await self.state_collection.find(
+                {"_id": {"$in": [f"version:{collection}" for collection in collections]}}, {"version": 1}
+            ).to_list(None)
+        except PyMongoError as e:
+            # No flush needed: the next successful poll still sees any bump made in the meantime
+            logger.warning(f"Invalidation bus poll failed: {str(e)}")
+            return
+        versions = {state["_id"].split(":", 1)[1]: state.get("version", 0) for state in states}
+        for collection in collections:
+            current = versions.get(collection, 0)
+            if collection in self._collection_versions and current != self._collection_versions[collection]:
+                await self.dispatch(InvalidationEvent(collection, INVALIDATE_ALL, source="poll"))
+            self._collection_versions[collection] = current
+
+    async def _run_polling(self):
+        self.active_mode = "poll"
+        logger.info(f"Invalidation bus polling {self.polled_collections} every {self.poll_interval}s")
+        while not self._stopping:
+            await self.poll_once()
+            await self._sleep(self.poll_interval)
+
+    # ---- lifecycle ----
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        try:
+            if self.mode in ("auto", "change_stream"):
+                if await self._run_change_stream():
+                    return
+                if self.mode == "change_stream":
+                    logger.error("Change streams unavailable (standalone mongod) - invalidation bus disabled")
+                    return
+                logger.warning("Change streams unavailable (standalone mongod), falling back to polling")
+            await self._run_polling()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Invalidation bus stopped unexpectedly: {str(e)}")
+
+    def start(self):
+        if self.mode == "off" or self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            # The change stream wakes up at least once a second; cancel if it is stuck on the network
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=5.0)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.active_mode or "stopped",
+            "collections": sorted(self.collections),
+            "events_total": self.events_total,
+            "restarts_total": self.restarts_total,
+            "last_event_at": self.last_event_at.isoformat() if self.last_event_at else None
+        }
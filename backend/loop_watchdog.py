@@ -0,0 +1,209 @@
+# Event Loop Watchdog
+# Measures event-loop lag continuously and, when a single callback blocks the loop for
+# longer than a threshold, captures the stack of whatever is running on the loop thread.
+# Lag percentiles go to /metrics; the worst blocking call sites are logged periodically.
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def _is_app_frame(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    return path.startswith(_APP_DIR) and path != _THIS_FILE and "site-packages" not in path
+
+
+def blocking_site(stack: List[traceback.FrameSummary]) -> str:
+    """
+    Name a blocking call by the innermost application frame and the innermost frame overall,
+    e.g. 'server.py:512 in login -> bcrypt.py:81 in hashpw'.
+    """
+    if not stack:
+        return "unknown"
+    leaf = stack[-1]
+    leaf_name = f"{os.path.basename(leaf.filename)}:{leaf.lineno} in {leaf.name}"
+    for frame in reversed(stack):
+        if _is_app_frame(frame.filename):
+            app_name = f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+            return app_name if frame is leaf else f"{app_name} -> {leaf_name}"
+    return leaf_name
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class EventLoopWatchdog:
+    """
+    A heartbeat coroutine sleeps for `interval` and records how late it woke up (the loop lag).
+    A watchdog thread checks the heartbeat; if it is more than `threshold_ms` overdue the loop is
+    stuck in one callback, so the thread grabs the loop thread's current stack - the blocking
+    coroutine and the call it is stuck in. The block's duration is attributed to that site once
+    the heartbeat gets to run again.
+    """
+
+    def __init__(
+        self,
+        registry=None,
+        threshold_ms: float = None,
+        interval: float = None,
+        report_interval: float = None,
+        window: int = 2048,
+        max_sites: int = 200,
+    ):
+        self.threshold_ms = threshold_ms if threshold_ms is not None else float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", 100))
+        self.interval = interval if interval is not None else float(os.environ.get("LOOP_WATCHDOG_INTERVAL_MS", 50)) / 1000
+        self.report_interval = report_interval if report_interval is not None else float(os.environ.get("LOOP_BLOCK_REPORT_SECONDS", 300))
+        self.max_sites = max_sites
+        self._lags = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._sites: Dict[str, dict] = {}
+        self._last_beat = 0.0
+        self._beat_seq = 0
+        self._captured: Optional[tuple] = None  # (beat_seq, site, stack)
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_report = 0.0
+        # In-process counters (per worker)
+        self.blocks_total = 0
+        self.blocked_seconds_total = 0.0
+        self.lag_histogram = None
+        if registry is not None:
+            self.lag_histogram = registry.histogram(
+                "event_loop_lag_seconds", "How late the event loop ran a timer that was due", buckets=LAG_BUCKETS
+            )
+
+    # ---- watchdog thread ----
+
+    def _watch(self):
+        poll = min(self.interval, self.threshold_ms / 4000)
+        while not self._stop.wait(poll):
+            with self._lock:
+                seq = self._beat_seq
+                overdue = time.perf_counter() - self._last_beat - self.interval
+                already_captured = self._captured is not None and self._captured[0] == seq
+            if overdue * 1000 < self.threshold_ms or already_captured:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            with self._lock:
+                # The loop may have moved on while the stack was being taken
+                if self._beat_seq == seq:
+                    self._captured = (seq, blocking_site(stack), stack)
+
+    # ---- loop side ----
+
+    def _record_block(self, site: str, stack: List[traceback.FrameSummary], blocked: float):
+        self.blocks_total += 1
+        self.blocked_seconds_total += blocked
+        if site not in self._sites and len(self._sites) >= self.max_sites:
+            site = "other"
+        entry = self._sites.get(site)
+        if entry is None:
+            entry = self._sites[site] = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "stack": []}
+            # First sighting of a site: log where it came from
+            logger.warning(
+                f"Event loop blocked for {blocked * 1000:.0f} ms at {site}\n"
+                + "".join(traceback.format_list(stack[-15:]))
+            )
+        entry["count"] += 1
+        entry["total_seconds"] += blocked
+        if blocked >= entry["max_seconds"]:
+            entry["max_seconds"] = blocked
+            entry["stack"] = traceback.format_list(stack[-15:])
+
+    async def _heartbeat(self):
+        while True:
+            due = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - due)
+            with self._lock:
+                captured = self._captured if self._captured and self._captured[0] == self._beat_seq else None
+                self._captured = None
+                self._beat_seq += 1
+                self._last_beat = now
+            self._lags.append(lag)
+            if self.lag_histogram is not None:
+                self.lag_histogram.observe(lag)
+            if captured is not None:
+                self._record_block(captured[1], captured[2], lag)
+            if now - self._last_report >= self.report_interval:
+                self._last_report = now
+                self.log_top_sites()
+
+    def log_top_sites(self, limit: int = 5):
+        sites = self.top_sites(limit)
+        if not sites:
+            return
+        lines = [
+            f"  {s['count']}x, {s['total_seconds']:.2f}s total, {s['max_seconds'] * 1000:.0f} ms max: {s['site']}"
+            for s in sites
+        ]
+        logger.warning("Top event loop blocking sites:\n" + "\n".join(lines))
+
+    def top_sites(self, limit: int = 10) -> List[dict]:
+        ranked = sorted(self._sites.items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        return [
+            {"site": site, "count": s["count"], "total_seconds": round(s["total_seconds"], 4),
+             "max_seconds": round(s["max_seconds"], 4), "stack": s["stack"]}
+            for site, s in ranked[:limit]
+        ]
+
+    def start(self):
+        """Begin watching. Must be called from the event loop that serves requests."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._last_report = self._last_beat
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+        self.log_top_sites()
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        return {
+            "lag_p50_ms": round(percentile(lags, 0.5) * 1000, 3),
+            "lag_p90_ms": round(percentile(lags, 0.9) * 1000, 3),
+            "lag_p99_ms": round(percentile(lags, 0.99) * 1000, 3),
+            "lag_max_ms": round((lags[-1] if lags else 0.0) * 1000, 3),
+            "blocks_total": self.blocks_total,
+            "blocked_seconds_total": round(self.blocked_seconds_total, 4),
+            "threshold_ms": self.threshold_ms
+        }
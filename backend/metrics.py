@@ -0,0 +1,224 @@
+# Metrics
+# Minimal in-process Prometheus registry: counters, gauges and histograms rendered in
+# the text exposition format, plus a pymongo CommandListener for per-collection timings.
+# Values are per worker process - Prometheus sums them across scrape targets.
+import asyncio
+import inspect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# Latency buckets in seconds (Prometheus client defaults plus a 25 s tail for slow reports)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 25.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]}) for key, s in self._values.items()]
+        lines = self.header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics and stats collectors and renders them for /metrics"""
+
+    def __init__(self, collector_timeout: float = 2.0):
+        self.collector_timeout = collector_timeout
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, Callable]] = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def add_stats_collector(self, prefix: str, stats_fn: Callable):
+        """
+        Expose a component's stats() dict (sync or async) as gauges named <prefix>_<key>.
+        Non-numeric values are skipped.
+        """
+        self._collectors.append((prefix, stats_fn))
+
+    async def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in self._collectors:
+            try:
+                stats = stats_fn()
+                if inspect.isawaitable(stats):
+                    # A slow database must not hang the scrape
+                    stats = await asyncio.wait_for(stats, timeout=self.collector_timeout)
+            except Exception as e:
+                lines.append(f"# {prefix} stats unavailable: {_escape(e)}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    name = f"{prefix}_{key}"
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Reply fields that carry the documents a command returned or touched
+def _document_count(command_name: str, reply: dict) -> Optional[int]:
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if command_name in ("insert", "update", "delete", "count"):
+        return reply.get("n")
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    return None
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Records latency, errors and document counts per collection and command.
+    Pass to the client: AsyncIOMotorClient(url, event_listeners=[listener]).
+    Callbacks run on pymongo's threads, so only thread-safe metric updates happen here.
+    """
+
+    # Commands whose first field is not the collection name
+    _COLLECTION_FIELDS = {"getMore": "collection"}
+    # Driver/housekeeping chatter that would only add noise
+    _IGNORED = {"hello", "isMaster", "ismaster", "ping", "saslStart", "saslContinue", "endSessions", "killCursors", "buildInfo"}
+
+    def __init__(self, registry: MetricsRegistry):
+        self.duration = registry.histogram(
+            "mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command")
+        )
+        self.documents = registry.counter(
+            "mongo_command_documents_total", "Documents returned or modified by MongoDB commands", ("collection", "command")
+        )
+        self.errors = registry.counter(
+            "mongo_command_errors_total", "Failed MongoDB commands", ("collection", "command")
+        )
+        self._collections: Dict[Tuple[int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in self._IGNORED:
+            return
+        field = self._COLLECTION_FIELDS.get(event.command_name, event.command_name)
+        collection = event.command.get(field)
+        with self._lock:
+            self._collections[(event.request_id, event.operation_id)] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event) -> Optional[str]:
+        with self._lock:
+            return self._collections.pop((event.request_id, event.operation_id), None)
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        if collection is None:
+            return
+        self.duration.observe(event.duration_micros / 1_000_000, collection=collection, command=event.command_name)
+        count = _document_count(event.command_name, event.reply)
+        if count:
+            self.documents.inc(count, collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        if collection is None:
+            return
+        self.duration.observe(event.duration_micros / 1_000_000, collection=collection, command=event.command_name)
+        self.errors.inc(collection=collection, command=event.command_name)
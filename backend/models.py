@@ -438,6 +438,11 @@ class StockResetEventCreate(BaseModel):
     notes: Optional[str] = None
 
 
+class StockCount(BaseModel):
+    product_id: str
+    closing_stock: int = Field(..., ge=0)
+
+
 # Product Whitelist Model
 class AllowedProductsUpdate(BaseModel):
     product_ids: List[str]
@@ -0,0 +1,236 @@
+# Order Archive
+# Settled orders delivered more than ORDER_ARCHIVE_AFTER_DAYS ago move from `orders` to
+# `orders_archive`, so the hot collection stays small for checkout and the daily reports.
+# Archived orders keep their fields, plus a "month" bucket ("2026-07", IST delivery month),
+# and store items as compact [product_id, product_name, quantity, price] rows; subtotal is
+# dropped when it is price * quantity, any other item fields ride along as a fifth element.
+# Pay-later orders that are still pending stay hot until they are settled.
+# Readers that reach past the horizon union both tiers (see find_orders / archive_union_stage).
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import pytz
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
+
+from report_snapshots import delivery_day
+from stock_snapshots import IST, ist_today, next_capture_at
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+ITEM_FIELDS = ("product_id", "product_name", "quantity", "price")
+
+
+def compact_item(item: dict) -> list:
+    row = [item.get(field) for field in ITEM_FIELDS]
+    extra = {k: v for k, v in item.items() if k not in ITEM_FIELDS}
+    if extra.get("subtotal") == (item.get("price") or 0) * (item.get("quantity") or 0):
+        extra.pop("subtotal")
+    if extra:
+        row.append(extra)
+    return row
+
+
+def expand_item(row) -> dict:
+    if isinstance(row, dict):
+        return row
+    item = dict(zip(ITEM_FIELDS, row))
+    item["subtotal"] = (item["price"] or 0) * (item["quantity"] or 0)
+    if len(row) > len(ITEM_FIELDS):
+        item.update(row[len(ITEM_FIELDS)])
+    return item
+
+
+def compact_order(order: dict, archived_at: datetime) -> dict:
+    """The archive form of a hot order (unset fields and Mongo's _id dropped)"""
+    doc = {k: v for k, v in order.items() if v is not None and k != "_id"}
+    doc["items"] = [compact_item(item) for item in order.get("items", [])]
+    day = delivery_day(order.get("delivery_date")) or delivery_day(order.get("created_at"))
+    doc["month"] = day.strftime("%Y-%m") if day else None
+    doc["archived_at"] = archived_at
+    return doc
+
+
+def expand_order(doc: dict) -> dict:
+    """Back to the hot order shape, flagged as archived"""
+    order = {k: v for k, v in doc.items() if k not in ("_id", "month", "archived_at")}
+    if "items" in order:
+        order["items"] = [expand_item(row) for row in order["items"]]
+    order["archived"] = True
+    return order
+
+
+def archive_projection(projection: Optional[dict]) -> Optional[dict]:
+    """Item rows are arrays in the archive, so items.<field> projections take the whole row"""
+    if not projection:
+        return projection
+    translated = {k: v for k, v in projection.items() if not k.startswith("items.")}
+    if len(translated) != len(projection):
+        translated["items"] = 1
+    return translated
+
+
+class OrderArchive:
+    """Moves old settled orders to orders_archive and reads them back"""
+
+    def __init__(self, db, retention_days: int = 60, batch_size: int = 500, run_hour: int = 2):
+        self.db = db
+        self.retention_days = retention_days  # 0 turns the scheduled job off
+        self.batch_size = batch_size
+        self.run_hour = run_hour
+        self._task: Optional[asyncio.Task] = None
+        # In-process counters (per worker)
+        self.runs_total = 0
+        self.archived_total = 0
+        self.archive_reads_total = 0
+        self.last_run_at: Optional[datetime] = None
+
+    @classmethod
+    def from_env(cls, db) -> "OrderArchive":
+        return cls(
+            db,
+            retention_days=int(os.environ.get("ORDER_ARCHIVE_AFTER_DAYS", 60)),
+            batch_size=int(os.environ.get("ORDER_ARCHIVE_BATCH_SIZE", 500)),
+            run_hour=int(os.environ.get("ORDER_ARCHIVE_HOUR_IST", 2)),
+        )
+
+    @property
+    def collection(self):
+        return self.db.orders_archive
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("user_id", 1), ("created_at", DESCENDING)])
+        await self.collection.create_index([("month", 1), ("delivery_date", 1)])
+        await self.collection.create_index([("created_at", DESCENDING)])
+
+    def horizon(self, now: Optional[datetime] = None) -> datetime:
+        """IST midnight retention_days ago as naive UTC: orders delivered before it are archived"""
+        day = ist_today(now) - timedelta(days=max(self.retention_days, 1))
+        return IST.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.UTC).replace(tzinfo=None)
+
+    def reaches(self, start_utc: Optional[datetime]) -> bool:
+        """Whether a read from start_utc (naive UTC; None = unbounded) may find archived orders"""
+        return start_utc is None or start_utc < self.horizon()
+
+    async def archive(self, now: Optional[datetime] = None, max_batches: Optional[int] = None) -> int:
+        """Move every settled order delivered before the horizon, batch_size at a time"""
+        query = {"delivery_date": {"$lt": self.horizon(now)}, "payment_status": {"$ne": "pending"}}
+        moved = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            orders = await self.db.orders.find(query).sort("delivery_date", 1).to_list(self.batch_size)
+            if not orders:
+                break
+            archived_at = datetime.utcnow()
+            try:
+                await self.collection.insert_many([compact_order(o, archived_at) for o in orders], ordered=False)
+            except BulkWriteError as e:
+                # Already archived by an earlier run that stopped before its delete
+                if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                    raise
+            result = await self.db.orders.delete_many({"_id": {"$in": [o["_id"] for o in orders]}})
+            moved += result.deleted_count
+            batches += 1
+        self.runs_total += 1
+        self.archived_total += moved
+        self.last_run_at = datetime.utcnow()
+        if moved:
+            logger.info(f"Archived {moved} orders delivered before {self.horizon(now).isoformat()}")
+        return moved
+
+    async def find(self, query: dict, projection: Optional[dict] = None, sort: Optional[list] = None,
+                   limit: int = 0) -> List[dict]:
+        """Archived orders matching a hot-collection query, in hot order shape"""
+        self.archive_reads_total += 1
+        cursor = self.collection.find(query, archive_projection(projection))
+        if sort:
+            cursor = cursor.sort(sort)
+        docs = await cursor.to_list(limit or None)
+        return [expand_order(doc) for doc in docs]
+
+    async def find_one(self, query: dict) -> Optional[dict]:
+        doc = await self.collection.find_one(query)
+        return expand_order(doc) if doc else None
+
+    async def find_orders(self, query: dict, projection: Optional[dict] = None, include_archive: bool = True,
+                          sort: Optional[list] = None, limit: Optional[int] = None) -> List[dict]:
+        """
+        Hot orders, plus archived ones when include_archive, merged on the first sort key and cut
+        to `limit`. An order caught mid-move (in both tiers) counts once.
+        """
+        if include_archive and projection and any(projection.values()):
+            projection = {**projection, "id": 1}
+        hot_cursor = self.db.orders.find(query, projection)
+        if sort:
+            hot_cursor = hot_cursor.sort(sort)
+        if not include_archive:
+            return await hot_cursor.to_list(limit)
+        hot, archived = await asyncio.gather(
+            hot_cursor.to_list(limit),
+            self.find(query, projection, sort=sort, limit=limit or 0)
+        )
+        hot_ids = {order.get("id") for order in hot}
+        orders = hot + [order for order in archived if order.get("id") not in hot_ids]
+        if sort:
+            field, direction = sort[0]
+            orders.sort(key=lambda order: order.get(field) or datetime.min, reverse=direction < 0)
+        return orders[:limit] if limit else orders
+
+    def archive_union_stage(self, match: dict, fields=("delivery_date",), items: bool = True) -> dict:
+        """
+        $unionWith for aggregations over orders: archived orders matching `match` with `fields`
+        and (unless items=False) items back as subdocuments (subtotal restored from the row or
+        price * quantity)
+        """
+        projection = {"_id": 0, **{field: 1 for field in fields}}
+        if items:
+            item = {field: {"$arrayElemAt": ["$$this", position]} for position, field in enumerate(ITEM_FIELDS)}
+            item["subtotal"] = {"$let": {
+                "vars": {"extra": {"$arrayElemAt": ["$$this", len(ITEM_FIELDS)]}},
+                "in": {"$ifNull": ["$$extra.subtotal", {"$multiply": [item["price"], item["quantity"]]}]},
+            }}
+            projection["items"] = {"$map": {"input": "$items", "in": item}}
+        return {"$unionWith": {"coll": "orders_archive", "pipeline": [{"$match": match}, {"$project": projection}]}}
+
+    async def count_orders(self, query: dict) -> int:
+        """Orders matching `query` in both tiers"""
+        hot, archived = await asyncio.gather(
+            self.db.orders.count_documents(query), self.collection.count_documents(query)
+        )
+        return hot + archived
+
+    async def _run(self):
+        while True:
+            now = datetime.now(pytz.UTC)
+            await asyncio.sleep((next_capture_at(now, self.run_hour) - now).total_seconds())
+            try:
+                await self.archive()
+            except Exception as e:
+                logger.error(f"Scheduled order archive failed: {str(e)}")
+
+    def start(self):
+        if self._task is None and self.retention_days > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "retention_days": self.retention_days,
+            "runs_total": self.runs_total,
+            "archived_total": self.archived_total,
+            "archive_reads_total": self.archive_reads_total,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+        }
@@ -0,0 +1,370 @@
+# Order Line Store
+# In-process columnar copy of the orders delivering in the live window (yesterday through
+# ORDER_LINE_WINDOW_DAYS ahead, IST), one block of NumPy arrays per delivery day:
+#   orders: customer and status (ordinals), total_amount
+#   lines:  order row, product, product name (ordinals), quantity, price, amount (item subtotal)
+# Daily items and the preparation list for these days are group-bys over the arrays instead of a
+# fetch of every order. The dispatch board stays on reports.build_dispatch_board: per-order
+# customer columns leave little to vectorise there (1.2x at 100x scale, less than a block rebuild).
+# orders_written() appends newly inserted orders to their day's block and drops the days any other
+# write touched, so their next read reloads them (one query). Writes handled by other workers arrive
+# as `orders` change stream events (order_event); ORDER_LINE_STORE_MAX_AGE_SECONDS bounds staleness
+# when change streams are unavailable.
+# Days outside the window (or reached by the order archive) use the existing queries.
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from invalidation_bus import INVALIDATE_ALL, InvalidationEvent
+from report_snapshots import delivery_day
+from sales_rollups import ist_midnight_utc
+from stock_snapshots import ist_today
+
+logger = logging.getLogger(__name__)
+
+ORDER_LINE_PROJECTION = {
+    "_id": 1, "user_id": 1, "order_number": 1, "order_status": 1,
+    "total_amount": 1, "delivery_date": 1,
+    "items.product_id": 1, "items.product_name": 1, "items.quantity": 1, "items.price": 1, "items.subtotal": 1,
+}
+NO_ORDINAL = -1
+
+
+class Ordinals:
+    """Small stable integers for repeated values (product ids, customer ids, statuses, ...)"""
+
+    def __init__(self):
+        self.values: List[Any] = []
+        self._index: Dict[Any, int] = {}
+
+    def __call__(self, value) -> int:
+        ordinal = self._index.get(value)
+        if ordinal is None:
+            ordinal = self._index[value] = len(self.values)
+            self.values.append(value)
+        return ordinal
+
+    def get(self, value) -> int:
+        return self._index.get(value, NO_ORDINAL)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+def group_sum(keys: np.ndarray, weights: Optional[np.ndarray], size: int) -> np.ndarray:
+    """Per-key sums (counts without weights). bincount adds in input order, so the sums match
+    the order-by-order loops they replace exactly."""
+    return np.bincount(keys, weights=weights, minlength=size)
+
+
+def first_seen(keys: np.ndarray, size: int):
+    """
+    For keys in 0..size-1: (distinct keys in order of first appearance, index of that appearance,
+    each key's position in that order). Dict-based code lists groups in that order.
+    """
+    first = np.full(size, len(keys), dtype=np.int64)
+    np.minimum.at(first, keys, np.arange(len(keys)))
+    present = np.flatnonzero(first < len(keys))
+    order = present[np.argsort(first[present], kind="stable")]
+    position = np.empty(size, dtype=np.int64)
+    position[order] = np.arange(len(order))
+    return order, first[order], position[keys]
+
+
+@dataclass
+class DayBlock:
+    """One IST delivery day's orders and order lines as columns"""
+    day: date
+    loaded_at: float
+    order_customer: np.ndarray
+    order_status: np.ndarray
+    order_total: np.ndarray
+    order_numbers: List[str]
+    order_index: Dict[Any, int]  # MongoDB _id -> order row
+    line_order: np.ndarray
+    line_product: np.ndarray
+    line_name: np.ndarray
+    line_quantity: np.ndarray
+    line_price: np.ndarray
+    line_amount: np.ndarray
+
+    @property
+    def lines(self) -> int:
+        return len(self.line_order)
+
+
+class OrderLineStore:
+    """Keeps the live window's order lines in memory and computes the daily reports from them"""
+
+    def __init__(self, db, archive=None, window_days: int = 10, max_age: float = 30.0, enabled: bool = True):
+        self.db = db
+        self.archive = archive  # OrderArchive: days it reaches are never served from here
+        self.window_days = window_days
+        self.max_age = max_age
+        self.enabled = enabled
+        self.products = Ordinals()
+        self.names = Ordinals()
+        self.customers = Ordinals()
+        self.statuses = Ordinals()
+        self._blocks: Dict[date, DayBlock] = {}
+        # Invalidation sequence, so a load that raced a write isn't kept
+        self._sequence = 0
+        self._invalidated: Dict[date, int] = {}
+        self._loading = 0
+        # In-process counters (per worker)
+        self.hits_total = 0
+        self.loads_total = 0
+        self.appends_total = 0
+        self.invalidations_total = 0
+
+    @classmethod
+    def from_env(cls, db, archive=None) -> "OrderLineStore":
+        return cls(
+            db,
+            archive=archive,
+            window_days=int(os.environ.get("ORDER_LINE_WINDOW_DAYS", 10)),
+            max_age=float(os.environ.get("ORDER_LINE_STORE_MAX_AGE_SECONDS", 30)),
+            enabled=os.environ.get("ORDER_LINE_STORE", "on").lower() not in ("off", "false", "0"),
+        )
+
+    # ---- window and freshness ----
+
+    def covers(self, first_day: date, days: int = 1, today: Optional[date] = None) -> bool:
+        """Whether every day of first_day .. first_day + days - 1 can be served from memory"""
+        if not self.enabled:
+            return False
+        today = today or ist_today()
+        last_day = first_day + timedelta(days=days - 1)
+        if first_day < today - timedelta(days=1) or last_day > today + timedelta(days=self.window_days):
+            return False
+        return self.archive is None or not self.archive.reaches(ist_midnight_utc(first_day))
+
+    def orders_written(self, delivery_dates: Iterable[Any], inserted: Optional[List[dict]] = None):
+        """
+        Drop the blocks of these delivery days; the next read reloads them. When the write only
+        inserted orders, pass them as `inserted` and they are appended to their days' blocks instead.
+        """
+        if inserted is None:
+            for day in {delivery_day(value) for value in delivery_dates} - {None}:
+                self._drop(day)
+            return
+        by_day: Dict[date, List[dict]] = {}
+        for order in inserted:
+            by_day.setdefault(delivery_day(order.get("delivery_date")), []).append(order)
+        by_day.pop(None, None)
+        for day, orders in by_day.items():
+            block = self._blocks.get(day)
+            if block is None or any(order.get("_id") is None for order in orders):
+                self._drop(day)
+                continue
+            self._mark(day)
+            new = list({order["_id"]: order for order in orders if order["_id"] not in block.order_index}.values())
+            if new:
+                self._blocks[day] = self.append(block, new)
+                self.appends_total += len(new)
+
+    async def order_event(self, event: InvalidationEvent):
+        """InvalidationBus callback for `orders`: picks up writes handled by other workers"""
+        if event.operation == INVALIDATE_ALL:
+            self.clear()
+            return
+        if event.operation != "insert":
+            for day in [day for day, block in self._blocks.items() if event.document_key in block.order_index]:
+                self._drop(day)
+        if event.operation == "delete" or not (self._blocks or self._loading):
+            return
+        # The event only carries the _id: read the order to find its day (it may also have moved day)
+        order = await self.db.orders.find_one({"_id": event.document_key}, ORDER_LINE_PROJECTION)
+        if order:
+            self.orders_written([order.get("delivery_date")], inserted=[order] if event.operation == "insert" else None)
+
+    def _mark(self, day: date):
+        """Loads in flight for this day may have missed the write, so they won't be kept"""
+        self._sequence += 1
+        self._invalidated[day] = self._sequence
+
+    def _drop(self, day: date):
+        self._mark(day)
+        if self._blocks.pop(day, None) is not None:
+            self.invalidations_total += 1
+
+    def clear(self):
+        self._sequence += 1
+        for day in self._blocks:
+            self._invalidated[day] = self._sequence
+        self._blocks = {}
+
+    async def blocks(self, first_day: date, days: int = 1) -> List[DayBlock]:
+        """The blocks for `days` days from first_day, loading missing or expired ones in one query"""
+        wanted = [first_day + timedelta(days=offset) for offset in range(days)]
+        now = time.monotonic()
+        today = ist_today()
+        # Days that have left the window are never read again
+        for day in [day for day in self._blocks if day < today - timedelta(days=1)]:
+            del self._blocks[day]
+            self._invalidated.pop(day, None)
+        missing = [day for day in wanted if day not in self._blocks or now - self._blocks[day].loaded_at >= self.max_age]
+        self.hits_total += len(wanted) - len(missing)
+        if missing:
+            loaded = await self._load(missing[0], missing[-1])
+            return [loaded.get(day) or self._blocks[day] for day in wanted]
+        return [self._blocks[day] for day in wanted]
+
+    async def _load(self, first_day: date, last_day: date) -> Dict[date, DayBlock]:
+        started = self._sequence
+        loaded_at = time.monotonic()
+        self._loading += 1
+        try:
+            orders = await self.db.orders.find({"delivery_date": {
+                "$gte": ist_midnight_utc(first_day), "$lt": ist_midnight_utc(last_day + timedelta(days=1))
+            }}, ORDER_LINE_PROJECTION).to_list(None)
+        finally:
+            self._loading -= 1
+        by_day: Dict[date, List[dict]] = {}
+        for order in orders:
+            by_day.setdefault(delivery_day(order.get("delivery_date")), []).append(order)
+
+        loaded = {}
+        day = first_day
+        while day <= last_day:
+            block = self.build_block(day, by_day.get(day, []), loaded_at)
+            loaded[day] = block
+            # A write that landed while we were reading may be missing from this block
+            if self._invalidated.get(day, 0) <= started:
+                self._blocks[day] = block
+            day += timedelta(days=1)
+        self.loads_total += 1
+        logger.debug(f"Loaded {len(orders)} orders for {first_day}..{last_day} into the order line store")
+        return loaded
+
+    def build_block(self, day: date, orders: List[dict], loaded_at: Optional[float] = None) -> DayBlock:
+        """Columns for one day's orders (in the order MongoDB returned them)"""
+        order_customer, order_status, order_total, order_numbers, order_index = [], [], [], [], {}
+        line_order, line_product, line_name, line_quantity, line_price, line_amount = [], [], [], [], [], []
+        for row, order in enumerate(orders):
+            order_customer.append(self.customers(order.get("user_id")))
+            order_status.append(self.statuses(order.get("order_status")))
+            order_total.append(order.get("total_amount", 0) or 0)
+            order_numbers.append(order.get("order_number", ""))
+            if "_id" in order:
+                order_index[order["_id"]] = row
+            for item in order.get("items", []):
+                line_order.append(row)
+                line_product.append(self.products(item.get("product_id")))
+                line_name.append(self.names(item.get("product_name", "Unknown")))
+                line_quantity.append(item.get("quantity", 0) or 0)
+                line_price.append(item.get("price", 0) or 0)
+                line_amount.append(item.get("subtotal", 0) or 0)
+        return DayBlock(
+            day=day,
+            loaded_at=time.monotonic() if loaded_at is None else loaded_at,
+            order_customer=np.array(order_customer, dtype=np.int64),
+            order_status=np.array(order_status, dtype=np.int64),
+            order_total=np.array(order_total, dtype=np.float64),
+            order_numbers=order_numbers,
+            order_index=order_index,
+            line_order=np.array(line_order, dtype=np.int64),
+            line_product=np.array(line_product, dtype=np.int64),
+            line_name=np.array(line_name, dtype=np.int64),
+            line_quantity=np.array(line_quantity, dtype=np.float64),
+            line_price=np.array(line_price, dtype=np.float64),
+            line_amount=np.array(line_amount, dtype=np.float64),
+        )
+
+    def append(self, block: DayBlock, orders: List[dict]) -> DayBlock:
+        """A copy of block with these orders added at the end (it keeps the block's load time)"""
+        tail = self.build_block(block.day, orders)
+        rows = len(block.order_numbers)
+        return DayBlock(
+            day=block.day,
+            loaded_at=block.loaded_at,
+            order_customer=np.concatenate([block.order_customer, tail.order_customer]),
+            order_status=np.concatenate([block.order_status, tail.order_status]),
+            order_total=np.concatenate([block.order_total, tail.order_total]),
+            order_numbers=block.order_numbers + tail.order_numbers,
+            order_index={**block.order_index, **{key: rows + row for key, row in tail.order_index.items()}},
+            line_order=np.concatenate([block.line_order, tail.line_order + rows]),
+            line_product=np.concatenate([block.line_product, tail.line_product]),
+            line_name=np.concatenate([block.line_name, tail.line_name]),
+            line_quantity=np.concatenate([block.line_quantity, tail.line_quantity]),
+            line_price=np.concatenate([block.line_price, tail.line_price]),
+            line_amount=np.concatenate([block.line_amount, tail.line_amount]),
+        )
+
+    def _active(self, block: DayBlock, excluded_statuses: List[str]) -> np.ndarray:
+        excluded = [self.statuses.get(status) for status in excluded_statuses]
+        return ~np.isin(block.order_status, [ordinal for ordinal in excluded if ordinal != NO_ORDINAL])
+
+    # ---- reports ----
+
+    def preparation_facet(self, blocks: List[DayBlock], excluded_statuses: List[str],
+                          product_ids: Optional[List[str]] = None) -> dict:
+        """Same shape as reports.preparation_pipeline's $facet result; day 0 is blocks[0]"""
+        quantities: Dict[tuple, float] = {}
+        order_counts = []
+        for day, block in enumerate(blocks):
+            active = self._active(block, excluded_statuses)
+            order_counts.append({"_id": day, "count": int(active.sum())})
+            lines = active[block.line_order]
+            if product_ids is not None:
+                lines &= np.isin(block.line_product, [self.products.get(product_id) for product_id in product_ids])
+            products, _, position = first_seen(block.line_product[lines], len(self.products))
+            for product, quantity in zip(products.tolist(), group_sum(position, block.line_quantity[lines], len(products)).tolist()):
+                quantities[(self.products.values[product], day)] = quantity
+        return {
+            "quantities": [{"_id": {"product_id": product_id, "day": day}, "quantity": quantity}
+                           for (product_id, day), quantity in quantities.items()],
+            "order_counts": [row for row in order_counts if row["count"]],
+        }
+
+    def daily_items(self, block: DayBlock, excluded_statuses: List[str], dough_type_of: Dict[str, Optional[str]],
+                    dough_type_names: Dict[str, str], dough_type_id: Optional[str] = None) -> dict:
+        """Columnar reports.build_daily_items"""
+        active = self._active(block, excluded_statuses)
+        lines = active[block.line_order]
+        if dough_type_id:
+            wanted = [self.products.get(product_id) for product_id, dough in dough_type_of.items() if dough == dough_type_id]
+            lines &= np.isin(block.line_product, wanted)
+        products, first, position = first_seen(block.line_product[lines], len(self.products))
+        quantity = group_sum(position, block.line_quantity[lines], len(products)).tolist()
+        revenue = group_sum(position, block.line_amount[lines], len(products)).tolist()
+        order_count = group_sum(position, None, len(products)).tolist()
+        names = block.line_name[lines][first].tolist()
+        prices = block.line_price[lines][first].tolist()
+
+        items = []
+        for index, product in enumerate(products.tolist()):
+            product_id = self.products.values[product]
+            product_dough_type_id = dough_type_of.get(product_id)
+            items.append({
+                "product_id": product_id,
+                "product_name": self.names.values[names[index]],
+                "quantity": quantity[index],
+                "price": prices[index],
+                "revenue": revenue[index],
+                "order_count": order_count[index],
+                "dough_type_id": product_dough_type_id,
+                "dough_type_name": dough_type_names.get(product_dough_type_id) if product_dough_type_id else None,
+            })
+        totals = block.order_total[active]
+        return {
+            "total_orders": len(totals),
+            "total_revenue": group_sum(np.zeros(len(totals), dtype=np.int64), totals, 1)[0].item() if len(totals) else 0,
+            "items": sorted(items, key=lambda item: item["quantity"], reverse=True),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "days_cached": len(self._blocks),
+            "lines_cached": sum(block.lines for block in self._blocks.values()),
+            "hits_total": self.hits_total,
+            "loads_total": self.loads_total,
+            "appends_total": self.appends_total,
+            "invalidations_total": self.invalidations_total,
+        }
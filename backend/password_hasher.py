@@ -0,0 +1,101 @@
+# Password Hashing
+# bcrypt costs hundreds of milliseconds of CPU per call. Hashing and verification
+# run in a small dedicated thread pool so the event loop keeps serving requests.
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+class PasswordHasher:
+    """
+    Async wrapper around a passlib bcrypt context.
+    - at most max_workers hashes run at once (bcrypt releases the GIL while hashing)
+    - at most max_pending callers wait for a worker; the rest queue on the semaphore
+      instead of piling up unbounded work inside the executor
+    - hashes whose cost factor differs from `rounds` are flagged for rehash on login
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 4, max_pending: Optional[int] = None):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._semaphore = asyncio.Semaphore(max_pending or max_workers * 4)
+        # In-process counters (per worker)
+        self.calls_total = 0
+        self.rehash_total = 0
+        self.in_flight = 0
+        self.busy_seconds_total = 0.0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "PasswordHasher":
+        return cls(
+            rounds=int(os.environ.get("BCRYPT_ROUNDS", 12)),
+            max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", 4))
+        )
+
+    @staticmethod
+    def _timed(fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        return result, started, time.perf_counter()
+
+    async def _run(self, fn, *args):
+        queued_at = time.perf_counter()
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                result, started, finished = await loop.run_in_executor(self._executor, self._timed, fn, *args)
+            finally:
+                self.in_flight -= 1
+        # Counters are only touched on the event loop thread
+        wait = started - queued_at
+        self.calls_total += 1
+        self.busy_seconds_total += finished - started
+        self.wait_seconds_total += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password and, if the stored hash uses an outdated cost factor,
+        return a fresh hash to persist. Returns (valid, new_hash_or_None).
+        """
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehash_total += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "calls_total": self.calls_total,
+            "rehash_total": self.rehash_total,
+            "busy_seconds_total": round(self.busy_seconds_total, 3),
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+            "max_wait_seconds": round(self.max_wait_seconds, 3)
+        }
@@ -0,0 +1,257 @@
+# Async Payment Gateway / Outbound HTTP Client
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying - everything else is returned to the caller as-is
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Methods that are safe to resend after the server may already have acted on them
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Failures before the request left this process - safe to retry for any method
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is open and calls are short-circuited"""
+
+
+class PaymentGatewayError(Exception):
+    """Raised when the payment gateway rejects a request or cannot be reached"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, payload: Optional[dict] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload or {}
+
+
+class CircuitBreaker:
+    """
+    Simple consecutive-failure circuit breaker.
+    - closed: calls go through, failures are counted
+    - open: calls fail fast until reset_timeout has passed
+    - half_open: a single trial call is allowed; success closes, failure re-opens
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_count = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failure_count = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """The trial call ended without an answer either way (cancelled, bad request) - let the next one try"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failure_count += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failure_count >= self.failure_threshold:
+            # Trip (or re-trip after a failed half-open trial)
+            self.opened_at = time.monotonic()
+
+
+class OutboundHTTPClient:
+    """
+    Pooled, non-blocking HTTP client shared by every outbound call in the backend.
+    Adds per-call timeouts, jittered exponential backoff and a circuit breaker on top
+    of a single httpx.AsyncClient so connections are reused across requests.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "",
+        auth: Optional[tuple] = None,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 4.0,
+        max_connections: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        name: str = "http",
+        tracer=None,
+    ):
+        self.name = name
+        self.tracer = tracer
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            auth=auth,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # Full jitter: spreads retries from concurrent callers instead of retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        timeout: Optional[float] = None,
+        retry: bool = True,
+        idempotent: Optional[bool] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """
+        Send a request, retrying transient failures. Returns the final httpx.Response.
+        Non-idempotent requests (POST/PATCH unless idempotent=True) are only retried when
+        they never reached the server, so a slow response can't create a second resource.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        span = self.tracer.start_span(f"{self.name} {method}", kind="client", attributes={
+            "peer.service": self.name, "http.method": method, "http.url": url
+        }, new_trace=False) if self.tracer else None
+        try:
+            response = await self._send_with_retries(method, url, timeout, retry, idempotent, span, **kwargs)
+        except Exception as e:
+            if span is not None:
+                span.end(error=f"{type(e).__name__}: {e}")
+            raise
+        if span is not None:
+            span.set_attribute("http.status_code", response.status_code)
+            span.end(error=f"HTTP {response.status_code}" if response.status_code >= 500 else None)
+        return response
+
+    async def _send_with_retries(self, method: str, url: str, timeout: Optional[float], retry: bool, idempotent: bool,
+                                 span, **kwargs) -> httpx.Response:
+        attempts = max(1, self.max_retries) if retry else 1
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        last_error: Optional[Exception] = None
+        for attempt in range(attempts):
+            if span is not None:
+                span.set_attribute("http.attempts", attempt + 1)
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"{self.name}: circuit open, skipping {method} {url}")
+
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                # Connection resets, refused connections, read/connect timeouts
+                self.breaker.record_failure()
+                last_error = e
+                logger.warning(f"{self.name}: attempt {attempt + 1}/{attempts} {method} {url} failed: {type(e).__name__} - {e}")
+                if not idempotent and not isinstance(e, NOT_SENT_ERRORS):
+                    # The server may have acted on it (e.g. created the payment link)
+                    raise
+            except BaseException:
+                # Cancelled (client disconnect) or a non-transport error: no verdict on the gateway,
+                # but a half-open trial must not keep its slot or the breaker never closes again
+                self.breaker.release_trial()
+                raise
+            else:
+                if response.status_code in RETRYABLE_STATUS_CODES and not idempotent:
+                    self.breaker.record_failure()
+                    return response
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_failure()
+                    logger.warning(f"{self.name}: attempt {attempt + 1}/{attempts} {method} {url} returned {response.status_code}")
+                    if attempt == attempts - 1:
+                        return response
+                else:
+                    self.breaker.record_success()
+                    return response
+
+            if attempt < attempts - 1:
+                await asyncio.sleep(self._backoff_delay(attempt))
+
+        # Only a transport error on the last attempt gets here
+        raise last_error
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class RazorpayGateway:
+    """Async adapter for the subset of the Razorpay REST API used by the backend"""
+
+    def __init__(
+        self,
+        key_id: str,
+        key_secret: str,
+        base_url: str = "https://api.razorpay.com/v1",
+        timeout: float = 15.0,
+        **client_kwargs
+    ):
+        self.client = OutboundHTTPClient(
+            base_url=base_url,
+            auth=(key_id, key_secret),
+            timeout=timeout,
+            name="razorpay",
+            **client_kwargs
+        )
+
+    async def _call(self, method: str, path: str, **kwargs) -> dict:
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except CircuitOpenError as e:
+            raise PaymentGatewayError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise PaymentGatewayError(f"Razorpay unreachable: {type(e).__name__} - {e}") from e
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+
+        if response.status_code >= 400:
+            description = payload.get("error", {}).get("description") or response.text[:200]
+            raise PaymentGatewayError(
+                f"Razorpay error {response.status_code}: {description}",
+                status_code=response.status_code,
+                payload=payload
+            )
+        return payload
+
+    async def create_payment_link(self, data: dict, timeout: Optional[float] = None) -> dict:
+        return await self._call("POST", "/payment_links", json=data, timeout=timeout)
+
+    async def fetch_payment_link(self, payment_link_id: str, timeout: Optional[float] = None) -> dict:
+        return await self._call("GET", f"/payment_links/{payment_link_id}", timeout=timeout)
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,196 @@
+# Payment Webhook Inbox
+# Webhooks are written to the inbox (keyed by event id) and acknowledged immediately.
+# A background worker drains the inbox and applies the payment state transition.
+# Each tick it also runs an optional recovery step (finishing interrupted wallet credits).
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+INBOX_PENDING = "pending"
+INBOX_PROCESSING = "processing"
+INBOX_DONE = "done"
+INBOX_FAILED = "failed"
+
+
+def webhook_event_id(headers, body: bytes) -> str:
+    """
+    Razorpay sends a unique X-Razorpay-Event-Id per event (retries reuse it).
+    Fall back to a hash of the raw body so replays of the same payload still dedupe.
+    """
+    event_id = headers.get("x-razorpay-event-id")
+    if event_id:
+        return event_id
+    return "sha256:" + hashlib.sha256(body).hexdigest()
+
+
+class PaymentInbox:
+    """Durable webhook inbox backed by the payment_webhook_inbox collection"""
+
+    def __init__(
+        self,
+        db,
+        handler: Callable[[dict], Awaitable[None]],
+        poll_interval: float = None,
+        max_attempts: int = 5,
+        claim_timeout: float = 120.0,
+        recover: Optional[Callable[[], Awaitable[int]]] = None,
+    ):
+        self.db = db
+        self.handler = handler
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.environ.get("PAYMENT_INBOX_POLL_SECONDS", 2))
+        self.max_attempts = max_attempts
+        self.claim_timeout = claim_timeout
+        self.recover = recover
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # In-process counters (per worker)
+        self.processed_total = 0
+        self.failed_total = 0
+        self.duplicate_total = 0
+        self.recovered_total = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+
+    @property
+    def collection(self):
+        return self.db.payment_webhook_inbox
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", 1), ("available_at", 1)])
+        # Keep 30 days of processed events for auditing, then let Mongo purge them
+        await self.collection.create_index("processed_at", expireAfterSeconds=30 * 24 * 3600)
+
+    async def enqueue(self, event_id: str, payload: dict) -> bool:
+        """Store a webhook event. Returns False if this event id was already received."""
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": event_id,
+                "event": payload.get("event"),
+                "payload": payload,
+                "status": INBOX_PENDING,
+                "attempts": 0,
+                "received_at": now,
+                "available_at": now
+            })
+        except DuplicateKeyError:
+            self.duplicate_total += 1
+            logger.info(f"Duplicate webhook delivery ignored: {event_id}")
+            return False
+        self._wakeup.set()
+        return True
+
+    async def _claim_next(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": INBOX_PENDING, "available_at": {"$lte": now}},
+                    # Reclaim events left behind by a worker that died mid-processing
+                    {"status": INBOX_PROCESSING, "claimed_at": {"$lt": now - timedelta(seconds=self.claim_timeout)}}
+                ]
+            },
+            {"$set": {"status": INBOX_PROCESSING, "claimed_at": now}, "$inc": {"attempts": 1}},
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def process_one(self) -> bool:
+        """Claim and process a single event. Returns False when the inbox is empty."""
+        event = await self._claim_next()
+        if not event:
+            return False
+
+        try:
+            await self.handler(event["payload"])
+        except Exception as e:
+            attempts = event.get("attempts", 1)
+            if attempts >= self.max_attempts:
+                status = INBOX_FAILED
+                self.failed_total += 1
+                logger.error(f"Webhook {event['_id']} failed permanently after {attempts} attempts: {str(e)}")
+            else:
+                status = INBOX_PENDING
+                logger.warning(f"Webhook {event['_id']} attempt {attempts} failed, will retry: {str(e)}")
+            await self.collection.update_one(
+                {"_id": event["_id"]},
+                {"$set": {
+                    "status": status,
+                    "last_error": str(e),
+                    "available_at": datetime.utcnow() + timedelta(seconds=2 ** attempts)
+                }}
+            )
+            return True
+
+        processed_at = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": event["_id"]},
+            {"$set": {"status": INBOX_DONE, "processed_at": processed_at}, "$unset": {"payload": ""}}
+        )
+        lag = (processed_at - event["received_at"]).total_seconds()
+        self.processed_total += 1
+        self.last_lag_seconds = lag
+        self.max_lag_seconds = max(self.max_lag_seconds, lag)
+        return True
+
+    async def drain(self):
+        """Process events until the inbox is empty"""
+        while await self.process_one():
+            pass
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if self.recover:
+                    self.recovered_total += await self.recover()
+                await self.drain()
+            except Exception as e:
+                logger.error(f"Payment inbox worker error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def stats(self) -> dict:
+        """Inbox depth and lag - oldest_pending_age_seconds is the number to alert on"""
+        now = datetime.utcnow()
+        pending = await self.collection.count_documents({"status": {"$in": [INBOX_PENDING, INBOX_PROCESSING]}})
+        failed = await self.collection.count_documents({"status": INBOX_FAILED})
+        oldest = await self.collection.find_one(
+            {"status": {"$in": [INBOX_PENDING, INBOX_PROCESSING]}},
+            {"received_at": 1},
+            sort=[("received_at", 1)]
+        )
+        return {
+            "pending": pending,
+            "failed": failed,
+            "oldest_pending_age_seconds": round((now - oldest["received_at"]).total_seconds(), 3) if oldest else 0.0,
+            "processed_total": self.processed_total,
+            "failed_total": self.failed_total,
+            "duplicate_total": self.duplicate_total,
+            "recovered_total": self.recovered_total,
+            "last_lag_seconds": round(self.last_lag_seconds, 3),
+            "max_lag_seconds": round(self.max_lag_seconds, 3)
+        }
@@ -0,0 +1,88 @@
+# Payment State Transitions
+# A transaction moves PENDING -> SUCCESS with one conditional update, so only one of webhook /
+# callback / verify wins it. That same update flags it wallet_credit_pending, and the flag is
+# cleared once the wallet has been credited. The credit is guarded on the wallet document
+# (credited_transactions), so finishing a flagged top-up again - after a crash between the two
+# writes - can never credit it twice. The payment inbox worker finishes flags left behind.
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+from models import TransactionStatus, TransactionType
+
+logger = logging.getLogger(__name__)
+
+# Top-up ids remembered per wallet; a flagged credit is finished within minutes, so this is plenty
+CREDITED_TRANSACTIONS_KEPT = 50
+
+
+async def apply_paid_transaction(db, transaction_filter: dict, extra_fields: dict) -> Optional[dict]:
+    """
+    Move a transaction from PENDING to SUCCESS with a single conditional update.
+    Only the caller that wins the transition gets the transaction back and credits the wallet.
+    Returns None if no PENDING transaction matched (already processed or unknown).
+    """
+    transaction = await db.transactions.find_one_and_update(
+        {**transaction_filter, "status": TransactionStatus.PENDING},
+        {"$set": {
+            **extra_fields,
+            "status": TransactionStatus.SUCCESS,
+            "wallet_credit_pending": True,
+            "updated_at": datetime.utcnow()
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if not transaction:
+        return None
+    await complete_wallet_credit(db, transaction)
+    return transaction
+
+
+async def complete_wallet_credit(db, transaction: dict) -> bool:
+    """
+    Credit a paid top-up to its wallet (once) and clear wallet_credit_pending.
+    Returns True if this call did the credit.
+    """
+    credited = False
+    if transaction.get("transaction_type") == TransactionType.WALLET_TOPUP:
+        user_id = transaction["user_id"]
+        amount = transaction["amount"]
+        wallet = await db.wallets.find_one_and_update(
+            {"user_id": user_id, "credited_transactions": {"$ne": transaction["id"]}},
+            {
+                "$inc": {"balance": amount},
+                "$push": {"credited_transactions": {"$each": [transaction["id"]], "$slice": -CREDITED_TRANSACTIONS_KEPT}},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if wallet:
+            credited = True
+            # users.wallet_balance mirrors the wallet, as the admin top-up keeps it
+            await db.users.update_one({"id": user_id}, {"$set": {"wallet_balance": wallet["balance"]}})
+            logger.info(f"✅ Wallet updated successfully: user_id={user_id}, amount={amount}")
+        elif not await db.wallets.find_one({"user_id": user_id}):
+            logger.error(f"No wallet for user {user_id}, top-up {transaction['id']} was not credited")
+
+    await db.transactions.update_one({"id": transaction["id"]}, {"$unset": {"wallet_credit_pending": ""}})
+    return credited
+
+
+async def finish_pending_wallet_credits(db, older_than_seconds: float = 60, limit: int = 100) -> int:
+    """
+    Finish credits flagged by a transition whose worker died before crediting.
+    Flags younger than older_than_seconds are left to the caller that set them.
+    Returns how many wallets were credited.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+    stale = await db.transactions.find(
+        {"wallet_credit_pending": True, "updated_at": {"$lt": cutoff}}
+    ).to_list(limit)
+    finished = 0
+    for transaction in stale:
+        if await complete_wallet_credit(db, transaction):
+            finished += 1
+            logger.warning(f"Finished interrupted wallet credit for transaction {transaction['id']}")
+    return finished
@@ -0,0 +1,156 @@
+# Report Snapshots
+# Computed report payloads for delivery dates that have left the live window, one document per
+# (report, date, params, version) in report_snapshots:
+#   {"report": "daily-items", "date": "2026-10-12", "params": "dough_type_id=...", "version": 2,
+#    "days": ["2026-10-12"], "writes": [3], "payload": {...}, "created_at"}
+# Browsing history is one read of the days' write counters plus one on the unique key; the first
+# request for a date computes and stores. Any write to an order delivering on a covered day bumps
+# the day's counter in report_snapshot_writes and deletes its snapshots. A snapshot is only served
+# while its "writes" (the counters read before it was computed) are current, so a payload computed
+# while a write landed is never served. Writes that can only touch the live window (checkout,
+# standing-order generation) never reach a snapshot.
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Bump when a report's payload changes shape so older snapshots are recomputed
+# 2: dispatch-board shortages judged against the day's stock snapshot
+# 3: daily-items and preparation-list leave out legacy "Cancelled" orders too
+REPORT_SNAPSHOT_VERSION = 3
+
+
+def delivery_day(value) -> Optional[date]:
+    """The IST delivery day of a stored delivery_date (naive UTC datetime, ISO string) or a date"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        aware = value if value.tzinfo else pytz.UTC.localize(value)
+        return aware.astimezone(IST).date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            if 'T' not in value:
+                return date.fromisoformat(value[:10])
+            return delivery_day(datetime.fromisoformat(value.replace('Z', '+00:00')))
+        except ValueError:
+            return None
+    return None
+
+
+def params_key(params: Dict[str, Any]) -> str:
+    """Stable string for the query parameters that shape a report (unset ones are left out)"""
+    return "&".join(f"{name}={params[name]}" for name in sorted(params) if params[name] is not None)
+
+
+class ReportSnapshots:
+    """Stores and serves report payloads for past delivery dates"""
+
+    def __init__(self, db, live_days: int = 1, enabled: bool = True, version: int = REPORT_SNAPSHOT_VERSION):
+        self.db = db
+        # Yesterday (live_days=1) is still live: late cancellations and edits land there
+        self.live_days = live_days
+        self.enabled = enabled
+        self.version = version
+        # In-process counters (per worker)
+        self.hits_total = 0
+        self.misses_total = 0
+        self.stores_total = 0
+        self.invalidations_total = 0
+
+    @classmethod
+    def from_env(cls, db) -> "ReportSnapshots":
+        return cls(
+            db,
+            live_days=int(os.environ.get("REPORT_SNAPSHOT_LIVE_DAYS", 1)),
+            enabled=os.environ.get("REPORT_SNAPSHOTS", "on").lower() not in ("off", "false", "0"),
+        )
+
+    @property
+    def collection(self):
+        return self.db.report_snapshots
+
+    @property
+    def writes_collection(self):
+        return self.db.report_snapshot_writes
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("report", 1), ("date", 1), ("params", 1), ("version", 1)], unique=True)
+        await self.collection.create_index("days")
+
+    def frozen(self, day: date, today: Optional[date] = None) -> bool:
+        """Whether `day` has left the live window, so its reports may be served from a snapshot"""
+        today = today or datetime.now(pytz.UTC).astimezone(IST).date()
+        return day < today - timedelta(days=self.live_days)
+
+    async def serve(self, report: str, first_day: date, days: int, params: Dict[str, Any],
+                    compute: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        The snapshot of `report` for the `days` days starting at first_day, computing and storing
+        it on first use. Ranges reaching into the live window are always computed.
+        """
+        covered = [first_day + timedelta(days=offset) for offset in range(days)]
+        if not self.enabled or not self.frozen(covered[-1]):
+            return await compute()
+
+        key = {"report": report, "date": first_day.isoformat(), "params": params_key(params), "version": self.version}
+        days = [day.isoformat() for day in covered]
+        writes = await self.write_counters(days)
+        snapshot = await self.collection.find_one({**key, "writes": writes}, {"_id": 0, "payload": 1})
+        if snapshot is not None:
+            self.hits_total += 1
+            return snapshot["payload"]
+
+        self.misses_total += 1
+        payload = await compute()
+        try:
+            await self.collection.replace_one(
+                key,
+                {**key, "days": days, "writes": writes, "payload": payload, "created_at": datetime.utcnow()},
+                upsert=True
+            )
+            self.stores_total += 1
+        except Exception as e:
+            # Serving the report matters more than keeping its snapshot
+            logger.warning(f"Could not store {report} snapshot for {first_day}: {str(e)}")
+        return payload
+
+    async def write_counters(self, days: List[str]) -> List[int]:
+        """How many order writes each day has seen (0 if none since snapshots were introduced)"""
+        counters = await self.writes_collection.find({"_id": {"$in": days}}).to_list(None)
+        by_day = {counter["_id"]: counter.get("writes", 0) for counter in counters}
+        return [by_day.get(day, 0) for day in days]
+
+    async def orders_written(self, delivery_dates: Iterable[Any]):
+        """Drop the snapshots covering any of these delivery dates (naive UTC datetimes, ISO strings or dates)"""
+        days: List[str] = sorted({
+            day.isoformat() for day in map(delivery_day, delivery_dates) if day is not None and self.frozen(day)
+        })
+        if not days:
+            return
+        # Bump first: a snapshot being computed right now was keyed on the old counter
+        for day in days:
+            await self.writes_collection.update_one({"_id": day}, {"$inc": {"writes": 1}}, upsert=True)
+        result = await self.collection.delete_many({"days": {"$in": days}})
+        self.invalidations_total += 1
+        if result.deleted_count:
+            logger.info(f"Dropped {result.deleted_count} report snapshots for {', '.join(days)}")
+
+    async def clear(self) -> int:
+        result = await self.collection.delete_many({})
+        return result.deleted_count
+
+    def stats(self) -> dict:
+        return {
+            "hits_total": self.hits_total,
+            "misses_total": self.misses_total,
+            "stores_total": self.stores_total,
+            "invalidations_total": self.invalidations_total,
+        }
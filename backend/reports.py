@@ -0,0 +1,258 @@
+# Report Queries
+# Aggregation pipelines and the pure functions that shape their results for the admin reports.
+# Kept apart from the route handlers so the grouping logic can be tested without a database.
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+DAY_MS = 24 * 60 * 60 * 1000
+# Every report and rollup leaves out cancelled orders, including those cancelled by older app versions
+CANCELLED_STATUSES = ["cancelled", "Cancelled"]
+
+# Products only need these fields to build a production sheet
+PREPARATION_PRODUCT_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "dough_type_id": 1, "unit": 1, "closing_stock": 1, "previous_closing_stock": 1
+}
+
+
+def preparation_pipeline(start_utc: datetime, days: int, product_ids: Optional[List[str]] = None) -> list:
+    """
+    One pass over the orders delivering in [start_utc, start_utc + days): quantities per
+    (product, day) and order counts per day. Day 0 is the report date.
+    """
+    day_index = {"$floor": {"$divide": [{"$subtract": ["$delivery_date", start_utc]}, DAY_MS]}}
+    quantities = [
+        {"$unwind": "$items"},
+        {"$group": {"_id": {"product_id": "$items.product_id", "day": day_index}, "quantity": {"$sum": "$items.quantity"}}},
+    ]
+    if product_ids is not None:
+        quantities.insert(1, {"$match": {"items.product_id": {"$in": product_ids}}})
+    return [
+        {"$match": {
+            "delivery_date": {"$gte": start_utc, "$lt": start_utc + timedelta(days=days)},
+            "order_status": {"$nin": CANCELLED_STATUSES},
+        }},
+        {"$project": {"_id": 0, "delivery_date": 1, "items.product_id": 1, "items.quantity": 1}},
+        {"$facet": {
+            "quantities": quantities,
+            "order_counts": [{"$group": {"_id": day_index, "count": {"$sum": 1}}}],
+        }},
+    ]
+
+
+def build_preparation_list(facet: dict, products: List[dict], dough_types: List[dict], days: int,
+                           previous_stock: Optional[Dict[str, float]] = None) -> dict:
+    """
+    Turn the pipeline result into the production plan: per product the quantity ordered each
+    day, minus the previous closing stock, grouped into one section per dough type.
+    previous_stock (product_id -> count, from the stock snapshot) wins over the product fields.
+    """
+    previous_stock = previous_stock or {}
+    ordered: Dict[str, List[float]] = {}
+    for row in facet.get("quantities", []):
+        day = int(row["_id"]["day"])
+        if 0 <= day < days:
+            ordered.setdefault(row["_id"]["product_id"], [0] * days)[day] += row["quantity"]
+    order_counts = [0] * days
+    for row in facet.get("order_counts", []):
+        if 0 <= int(row["_id"]) < days:
+            order_counts[int(row["_id"])] = row["count"]
+
+    dough_type_names = {dough_type["id"]: dough_type["name"] for dough_type in dough_types}
+    items = []
+    for product in products:
+        by_day = ordered.get(product.get("id"))
+        if by_day is None:
+            continue
+        # Use the snapshot's closing stock, falling back to the product's own fields
+        previous_closing_stock = previous_stock.get(product["id"])
+        if previous_closing_stock is None:
+            previous_closing_stock = product.get("previous_closing_stock", product.get("closing_stock", 0)) or 0
+        total = sum(by_day) - previous_closing_stock
+        items.append({
+            "product_id": product["id"],
+            "product_name": product.get("name"),
+            "dough_type_id": product.get("dough_type_id"),
+            "dough_type_name": dough_type_names.get(product.get("dough_type_id")),
+            "previous_closing_stock": previous_closing_stock,
+            "orders_today": by_day[0],
+            "orders_tomorrow": by_day[1] if days > 1 else 0,
+            "orders_by_day": by_day,
+            "total": total,
+            "units_to_prepare": max(0, total),
+            "unit": product.get("unit", "piece"),
+        })
+    # Items needing the most preparation first
+    items.sort(key=lambda item: item["units_to_prepare"], reverse=True)
+
+    sections = []
+    section_order = [dough_type["id"] for dough_type in sorted(dough_types, key=lambda d: d.get("display_order", 0))] + [None]
+    for dough_type_id in section_order:
+        section_items = [item for item in items if item["dough_type_id"] == dough_type_id
+                         or (dough_type_id is None and item["dough_type_id"] not in dough_type_names)]
+        if section_items:
+            sections.append({
+                "dough_type_id": dough_type_id,
+                "dough_type_name": dough_type_names.get(dough_type_id, "Unassigned"),
+                "total_items": len(section_items),
+                "units_to_prepare": sum(item["units_to_prepare"] for item in section_items),
+                "items": section_items,
+            })
+    return {"items": items, "sections": sections, "order_counts": order_counts}
+
+
+# ---- Daily items ----
+
+def build_daily_items(orders: List[dict], dough_type_of: Dict[str, Optional[str]], dough_type_names: Dict[str, str],
+                      dough_type_id: Optional[str] = None) -> dict:
+    """
+    Quantity, revenue (item subtotals) and line count per product over one day's orders, most
+    ordered first. dough_type_of maps product id -> dough type id; with dough_type_id only those
+    products are listed, while the order totals still cover every order.
+    """
+    item_summary: Dict[str, dict] = {}
+    total_revenue = 0
+    for order in orders:
+        total_revenue += order.get("total_amount", 0)
+        for item in order.get("items", []):
+            product_id = item.get("product_id")
+            if dough_type_id and dough_type_of.get(product_id) != dough_type_id:
+                continue
+            summary = item_summary.get(product_id)
+            if summary is None:
+                product_dough_type_id = dough_type_of.get(product_id)
+                item_summary[product_id] = {
+                    "product_id": product_id,
+                    "product_name": item.get("product_name", "Unknown"),
+                    "quantity": item.get("quantity", 0),
+                    "price": item.get("price", 0),
+                    "revenue": item.get("subtotal", 0),
+                    "order_count": 1,
+                    "dough_type_id": product_dough_type_id,
+                    "dough_type_name": dough_type_names.get(product_dough_type_id) if product_dough_type_id else None,
+                }
+            else:
+                summary["quantity"] += item.get("quantity", 0)
+                summary["revenue"] += item.get("subtotal", 0)
+                summary["order_count"] += 1
+    return {
+        "total_orders": len(orders),
+        "total_revenue": total_revenue,
+        "items": sorted(item_summary.values(), key=lambda x: x["quantity"], reverse=True),
+    }
+
+
+# ---- Dispatch board (route summaries + shortage check) ----
+
+ROUTE_GROUP_ORDER = ["lulu", "short", "long", "onsite"]
+# Used until route codes are configured in the route_codes collection
+DEFAULT_ROUTE_CODES = [{"code": code} for code in ["LFT", "SR1", "SR2", "SR 3", "LR1", "LR2", "ONS"]]
+DISPATCH_ORDER_PROJECTION = {
+    "_id": 0, "user_id": 1, "order_number": 1, "route_code_override": 1,
+    "items.product_id": 1, "items.product_name": 1, "items.quantity": 1
+}
+DISPATCH_CUSTOMER_PROJECTION = {"_id": 0, "id": 1, "username": 1, "business_name": 1, "route_code": 1}
+
+
+def route_group_for(code: str) -> str:
+    """lulu / short / long / onsite from the code's naming convention (LFT, SR1, LR2, ONS)"""
+    if code == "LFT":
+        return "lulu"
+    if code.startswith("SR"):
+        return "short"
+    if code.startswith("LR"):
+        return "long"
+    if code == "ONS":
+        return "onsite"
+    return "other"
+
+
+def _route_sort_key(code: str):
+    digits = "".join(ch for ch in code if ch.isdigit())
+    return (int(digits) if digits else 0, code)
+
+
+def route_groups(route_codes: List[dict]) -> Dict[str, List[str]]:
+    """
+    Group -> route codes, in dispatch order (SR1 before SR2 before 'SR 3'). A route code
+    document's route_type wins over the naming convention.
+    """
+    groups: Dict[str, List[str]] = {}
+    for entry in sorted(route_codes or DEFAULT_ROUTE_CODES, key=lambda e: _route_sort_key(e["code"])):
+        groups.setdefault(entry.get("route_type") or route_group_for(entry["code"]), []).append(entry["code"])
+    rank = {group: position for position, group in enumerate(ROUTE_GROUP_ORDER)}
+    return dict(sorted(groups.items(), key=lambda item: rank.get(item[0], len(rank))))
+
+
+def shortage_routes(groups: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """
+    The first route of each delivery group leaves first (LFT, SR1, LR1) and is checked for
+    shortages; its customers can be shifted to the group's later routes.
+    """
+    return {codes[0]: codes[1:] for group, codes in groups.items() if group != "onsite" and codes}
+
+
+def build_dispatch_board(orders: List[dict], customers: Dict[str, dict], products: List[dict],
+                         groups: Dict[str, List[str]]) -> dict:
+    """
+    Every route group's item x customer matrix plus the shortage analysis for the early
+    routes, from one day's orders. route_code_override on an order beats the customer's route.
+    """
+    code_group = {code: group for group, codes in groups.items() for code in codes}
+    early = shortage_routes(groups)
+    routes = {group: {"route_codes": codes, "customers": [], "items": [], "matrix": {}} for group, codes in groups.items()}
+    demand: Dict[str, dict] = {}
+    customer_orders: Dict[str, dict] = {}
+
+    for order in orders:
+        customer_id = order.get("user_id")
+        customer = customers.get(customer_id)
+        if customer is None:
+            continue
+        effective_route = order.get("route_code_override") or customer.get("route_code", "")
+        group = code_group.get(effective_route)
+        if group is None:
+            continue
+
+        order_number = order.get("order_number", "")
+        order_key = f"{customer_id}_{order_number}"
+        customer_name = customer.get("business_name") or customer.get("username", "")
+        route = routes[group]
+        route["customers"].append({"id": order_key, "name": customer_name, "route_code": effective_route, "order_number": order_number})
+        if effective_route in early:
+            customer_orders.setdefault(customer_id, {"route_code": effective_route, "name": customer_name, "item_count": 0})
+
+        for item in order.get("items", []):
+            product_name = item.get("product_name", "Unknown")
+            quantity = item.get("quantity", 0)
+            if product_name not in route["matrix"]:
+                route["matrix"][product_name] = {}
+                route["items"].append(product_name)
+            route["matrix"][product_name][order_key] = quantity
+            if effective_route in early:
+                entry = demand.setdefault(product_name, {"product_id": item.get("product_id"), "by_route": {code: 0 for code in early}})
+                entry["by_route"][effective_route] += quantity
+                customer_orders[customer_id]["item_count"] += 1
+
+    for route in routes.values():
+        route["customers"].sort(key=lambda c: (c["route_code"], c["name"], c["order_number"]))
+
+    stock_by_id = {p.get("id"): p.get("closing_stock", 0) or 0 for p in products}
+    stock_by_name = {p.get("name"): p.get("closing_stock", 0) or 0 for p in products}
+    shortages = []
+    for product_name, entry in demand.items():
+        total_demand = sum(entry["by_route"].values())
+        stock = stock_by_id.get(entry["product_id"], stock_by_name.get(product_name, 0))
+        if stock < total_demand:
+            shortage = {"item": product_name, "stock": stock, "demand_by_route": entry["by_route"]}
+            # demand_lft / demand_sr1 / demand_lr1 as the shortage screen expects
+            shortage.update({f"demand_{code.lower().replace(' ', '')}": qty for code, qty in entry["by_route"].items()})
+            shortage.update({"total_demand": total_demand, "short_by": total_demand - stock})
+            shortages.append(shortage)
+
+    shiftable = [
+        {"customer_id": customer_id, "customer_name": data["name"], "current_route": data["route_code"],
+         "shift_to_options": early[data["route_code"]], "item_count": data["item_count"]}
+        for customer_id, data in customer_orders.items() if early[data["route_code"]]
+    ]
+    shiftable.sort(key=lambda c: (c["current_route"], c["customer_name"]))
+    return {"routes": routes, "early_routes": list(early), "shortages": shortages, "shiftable_customers": shiftable}
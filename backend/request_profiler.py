@@ -0,0 +1,173 @@
+# On-demand Request Profiling
+# Full-access admins can send `X-Profile: 1` on any request to profile just that request.
+# Profiles go to the capped request_profiles collection and are downloaded from
+# /api/admin/profiles/{id}. Requests without the header pass straight through.
+import asyncio
+import cProfile
+import html
+import io
+import json
+import logging
+import marshal
+import pstats
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from pymongo.errors import CollectionInvalid
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:  # pragma: no cover - cProfile fallback
+    SamplingProfiler = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+
+async def ensure_collection(db, capped_size_bytes: int = 64 * 1024 * 1024):
+    """Profiles are only useful for a while - a capped collection keeps the newest ~64MB"""
+    try:
+        await db.create_collection("request_profiles", capped=True, size=capped_size_bytes)
+    except CollectionInvalid:
+        pass  # already exists
+
+
+class _StoredStats:
+    """pstats.Stats accepts any object with create_stats() and a .stats dict"""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def pstats_text(stats_bytes: bytes, limit: int = 80) -> str:
+    """Render marshalled pstats data as the usual cumulative-time table"""
+    stream = io.StringIO()
+    stats = pstats.Stats(_StoredStats(marshal.loads(stats_bytes)), stream=stream)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+def pstats_html(stats_bytes: bytes, title: str) -> str:
+    return (
+        f"<html><head><title>{html.escape(title)}</title></head><body>"
+        f"<h3>{html.escape(title)}</h3><pre>{html.escape(pstats_text(stats_bytes))}</pre></body></html>"
+    )
+
+
+class RequestProfilerMiddleware:
+    """
+    Pure ASGI middleware. Unflagged requests cost one scan of the header list; flagged
+    requests are only profiled if `authorize(authorization_header)` returns a username.
+
+    `X-Profile: 1` uses pyinstrument (HTML flame view, async-aware) when installed,
+    `X-Profile: cprofile` forces cProfile (downloadable as pstats). cProfile sees
+    everything running on the event loop thread while the request is in flight, so only
+    one cProfile session runs at a time - a second one gets 409.
+    """
+
+    def __init__(self, app, db_getter: Callable, authorize: Callable[[str], Awaitable[Optional[str]]]):
+        self.app = app
+        self.db_getter = db_getter
+        self.authorize = authorize
+        self._store_tasks = set()
+        self._cprofile_active = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        flag = authorization = None
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                flag = value.decode("latin-1").strip().lower()
+            elif name == b"authorization":
+                authorization = value.decode("latin-1")
+        if not flag or flag in ("0", "false"):
+            return await self.app(scope, receive, send)
+
+        username = await self.authorize(authorization or "")
+        if not username:
+            return await self.app(scope, receive, send)
+
+        await self._profile(scope, receive, send, flag, username)
+
+    async def _profile(self, scope, receive, send, flag: str, username: str):
+        profile_id = str(uuid.uuid4())
+        status_code = None
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        use_cprofile = flag == "cprofile" or SamplingProfiler is None
+        if use_cprofile and self._cprofile_active:
+            # A second cProfile session would silently take over the first one's hooks
+            return await self._reject_busy(send)
+        started = time.perf_counter()
+        if use_cprofile:
+            self._cprofile_active = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = SamplingProfiler(interval=0.001, async_mode="enabled")
+            profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if use_cprofile:
+                profiler.disable()
+                self._cprofile_active = False
+            else:
+                profiler.stop()
+            title = f"{scope['method']} {scope['path']} - {duration_ms:.1f} ms"
+            doc = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_string": scope.get("query_string", b"").decode("latin-1"),
+                "status_code": status_code,
+                "username": username,
+                "duration_ms": round(duration_ms, 2),
+                "created_at": datetime.utcnow()
+            }
+            doc["profiler"] = "cprofile" if use_cprofile else "pyinstrument"
+            # Render and store after the response has been sent - never delay the profiled request further
+            task = asyncio.create_task(self._store(doc, title, profiler))
+            self._store_tasks.add(task)
+            task.add_done_callback(self._store_tasks.discard)
+
+    @staticmethod
+    async def _reject_busy(send):
+        body = json.dumps({"detail": "Another cProfile session is running - retry shortly or use X-Profile: 1"}).encode()
+        await send({"type": "http.response.start", "status": 409, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    def _render(doc: dict, profiler):
+        if doc["profiler"] == "cprofile":
+            profiler.create_stats()
+            doc["pstats"] = marshal.dumps(profiler.stats)
+        else:
+            doc["html"] = profiler.output_html()
+
+    async def _store(self, doc: dict, title: str, profiler):
+        try:
+            # Rendering a large profile takes a while; keep it off the event loop
+            await asyncio.to_thread(self._render, doc, profiler)
+            await self.db_getter().request_profiles.insert_one(doc)
+            logger.info(f"Stored request profile {doc['id']} ({title}) for {doc['username']}")
+        except Exception as e:
+            logger.error(f"Failed to store request profile {doc['id']}: {str(e)}")
@@ -0,0 +1,94 @@
+# Mongo Round Trips per Request
+# Counts the MongoDB commands issued while serving each request (via a contextvar that
+# Motor carries into its executor threads) so N+1 query loops show up in Server-Timing,
+# metrics and - when a route goes over its budget - in the logs or a failing test.
+import json
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMongoStats:
+    """Round trips and total Mongo time for one request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.round_trips = 0
+        self.duration_seconds = 0.0
+
+    def record(self, duration_seconds: float):
+        # Commands from asyncio.gather() inside one request finish on different threads
+        with self._lock:
+            self.round_trips += 1
+            self.duration_seconds += duration_seconds
+
+
+_current_stats: ContextVar[Optional[RequestMongoStats]] = ContextVar("mongo_request_stats", default=None)
+
+
+def begin_request():
+    """Start counting for the current request. Returns (stats, token) - pass token to end_request."""
+    stats = RequestMongoStats()
+    return stats, _current_stats.set(stats)
+
+
+def end_request(token):
+    _current_stats.reset(token)
+
+
+def current_request_stats() -> Optional[RequestMongoStats]:
+    return _current_stats.get()
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Adds every completed command to the stats of the request that issued it"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.record(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+class RoundTripBudget:
+    """
+    Per-route round-trip allowance.
+    MONGO_ROUND_TRIP_BUDGET sets the default, MONGO_ROUND_TRIP_BUDGETS is a JSON object of
+    route template -> budget overrides. MONGO_ROUND_TRIP_BUDGET_MODE is 'warn' (log) or
+    'fail' (respond 500 - for test runs, so N+1 regressions break the suite).
+    """
+
+    def __init__(self, default: int = None, overrides: Dict[str, int] = None, mode: str = None):
+        self.default = default if default is not None else int(os.environ.get("MONGO_ROUND_TRIP_BUDGET", 25))
+        if overrides is None:
+            overrides = json.loads(os.environ.get("MONGO_ROUND_TRIP_BUDGETS", "{}"))
+        self.overrides = overrides
+        self.mode = mode or os.environ.get("MONGO_ROUND_TRIP_BUDGET_MODE", "warn")
+        self.exceeded_total = 0
+
+    def budget_for(self, route: str) -> int:
+        return self.overrides.get(route, self.default)
+
+    def check(self, method: str, route: str, round_trips: int) -> bool:
+        """Returns True if the request exceeded its budget (and logs it)"""
+        budget = self.budget_for(route)
+        if round_trips <= budget:
+            return False
+        self.exceeded_total += 1
+        logger.warning(f"Mongo round-trip budget exceeded: {method} {route} made {round_trips} round trips (budget {budget})")
+        return True
+
+    @property
+    def fail_on_exceed(self) -> bool:
+        return self.mode == "fail"
@@ -0,0 +1,345 @@
+# Sales Rollups
+# sales_daily holds one document per (IST delivery day, customer, product):
+#   {"day": "2026-10-19", "customer_id", "product_id", "date": <IST midnight as naive UTC>,
+#    "weekday": 1-7 (Monday-Sunday), "product_name", "quantity", "revenue", "order_lines", "rebuilt_at"}
+# Rows are recomputed from orders and orders_archive by one aggregation that $merges into
+# sales_daily; afterwards the days' rows the merge did not rewrite are zeroed, so a (day, customer,
+# product) whose orders were cancelled or deleted drops to zero instead of going stale (order_lines 0
+# rows are ignored by the analytics) and readers never see a day blanked mid-rebuild.
+# Order writes mark their delivery days dirty in sales_rollup_state ({"_id": "dirty:<day>", "marks"}),
+# so a worker that dies before flushing loses nothing. Every SALES_ROLLUP_FLUSH_SECONDS the worker
+# holding the flush lease recomputes the dirty days (one pass per run of consecutive days) and clears
+# the ones not marked again meanwhile.
+# Long-range analytics read only these rows. On first deploy sales_daily is empty: one worker
+# claims the backfill in sales_rollup_state and builds every row in the background (an admin can
+# also POST /api/admin/analytics/rebuild); until it finishes the analytics cover less history.
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import pytz
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from report_snapshots import delivery_day
+from reports import CANCELLED_STATUSES
+from stock_snapshots import IST
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = "Asia/Kolkata"
+SALES_DAILY_KEY = ["day", "customer_id", "product_id"]
+ROLLUP_FIELDS = ["quantity", "revenue", "order_lines"]
+
+
+def ist_midnight_utc(day: date) -> datetime:
+    return IST.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def day_runs(days: Iterable[date]) -> List[Tuple[date, date]]:
+    """(first, last) of each run of consecutive days, in order"""
+    runs: List[Tuple[date, date]] = []
+    for day in sorted(set(days)):
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+def day_window(start_day: Optional[date], end_day: Optional[date]) -> Tuple[dict, dict]:
+    """(delivery_date filter on orders, day filter on sales_daily) for start_day..end_day inclusive"""
+    delivery_range: dict = {"$type": "date"}
+    day_range: dict = {}
+    if start_day:
+        delivery_range["$gte"] = ist_midnight_utc(start_day)
+        day_range["day"] = {"$gte": start_day.isoformat()}
+    if end_day:
+        delivery_range["$lt"] = ist_midnight_utc(end_day + timedelta(days=1))
+        day_range.setdefault("day", {})["$lte"] = end_day.isoformat()
+    return {"delivery_date": delivery_range, "order_status": {"$nin": CANCELLED_STATUSES}}, day_range
+
+
+def rollup_pipeline(start_day: Optional[date], end_day: Optional[date], stamp: datetime,
+                    archive_union: Optional[Callable[[dict], dict]] = None) -> list:
+    """
+    Recompute the sales_daily rows for delivery days start_day..end_day (inclusive; None = all).
+    archive_union(match) builds the stage that adds archived orders matching `match`.
+    """
+    match, _ = day_window(start_day, end_day)
+    pipeline = [
+        {"$match": match},
+        {"$project": {"_id": 0, "user_id": 1, "delivery_date": 1, "items": 1}},
+    ]
+    if archive_union:
+        pipeline.append(archive_union(match))
+    pipeline += [
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$delivery_date", "timezone": TIMEZONE}},
+                "customer_id": "$user_id",
+                "product_id": "$items.product_id",
+            },
+            "date": {"$min": "$delivery_date"},
+            "weekday": {"$first": {"$isoDayOfWeek": {"date": "$delivery_date", "timezone": TIMEZONE}}},
+            "product_name": {"$last": "$items.product_name"},
+            "quantity": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": {"$ifNull": ["$items.subtotal", {"$multiply": ["$items.price", "$items.quantity"]}]}},
+            "order_lines": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0, "day": "$_id.day", "customer_id": "$_id.customer_id", "product_id": "$_id.product_id",
+            "date": 1, "weekday": 1, "product_name": 1, "quantity": 1, "revenue": 1, "order_lines": 1,
+            "rebuilt_at": {"$literal": stamp},
+        }},
+        {"$merge": {"into": "sales_daily", "on": SALES_DAILY_KEY, "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+    return pipeline
+
+
+def rollup_match(start_day: date, end_day: date, customer_id: Optional[str] = None,
+                 product_ids: Optional[List[str]] = None) -> dict:
+    match = {"day": {"$gte": start_day.isoformat(), "$lte": end_day.isoformat()}, "order_lines": {"$gt": 0}}
+    if customer_id:
+        match["customer_id"] = customer_id
+    if product_ids is not None:
+        match["product_id"] = {"$in": product_ids}
+    return match
+
+
+def totals(group_id, extra: Optional[dict] = None) -> dict:
+    return {"$group": {"_id": group_id, **{field: {"$sum": f"${field}"} for field in ROLLUP_FIELDS}, **(extra or {})}}
+
+
+def top_pipeline(match: dict, by: str, sort: str, limit: int) -> list:
+    """Top products (by="product_id") or customers (by="customer_id") over the matched rows"""
+    extra = {"product_name": {"$last": "$product_name"}} if by == "product_id" else None
+    return [
+        {"$match": match},
+        totals(f"${by}", extra),
+        {"$sort": {sort: -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+
+
+def bucket_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def bucket_series(rows: List[dict], start_day: date, end_day: date, period: str) -> List[dict]:
+    """Per-day totals (rows grouped by "day") into day/week/month buckets, empty buckets included"""
+    by_day = {row["_id"]: row for row in rows}
+    buckets: Dict[date, dict] = {}
+    day = start_day
+    while day <= end_day:
+        bucket = buckets.setdefault(bucket_start(day, period), {field: 0 for field in ROLLUP_FIELDS})
+        row = by_day.get(day.isoformat())
+        if row:
+            for field in ROLLUP_FIELDS:
+                bucket[field] += row[field]
+        day += timedelta(days=1)
+    return [{"period_start": start.isoformat(), **values} for start, values in buckets.items()]
+
+
+def weekday_profile(rows: List[dict]) -> List[dict]:
+    """Per-weekday totals and averages per delivery day from rows grouped by "weekday" with a "days" set"""
+    by_weekday = {row["_id"]: row for row in rows}
+    profile = []
+    for weekday, name in enumerate(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"], start=1):
+        row = by_weekday.get(weekday, {})
+        days = len(row.get("days", []))
+        entry = {"weekday": weekday, "day_name": name, "days": days}
+        for field in ROLLUP_FIELDS:
+            entry[field] = row.get(field, 0)
+            entry[f"avg_{field}"] = round(row.get(field, 0) / days, 2) if days else 0
+        profile.append(entry)
+    return profile
+
+
+class SalesRollups:
+    """Keeps sales_daily current and rebuilds it on demand"""
+
+    def __init__(self, db, archive=None, flush_interval: float = 30.0, backfill_claim_timeout: float = 3600.0):
+        self.db = db
+        self.archive = archive  # OrderArchive, for days that reach past its horizon
+        self.flush_interval = flush_interval
+        self.backfill_claim_timeout = backfill_claim_timeout
+        # Days whose dirty mark could not be saved yet (retried by the next mark or flush)
+        self._unsaved: Set[date] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._backfill_task: Optional[asyncio.Task] = None
+        # In-process counters (per worker)
+        self.rebuilds_total = 0
+        self.days_rebuilt_total = 0
+        self.failures_total = 0
+        self.last_rebuild_at: Optional[datetime] = None
+
+    @classmethod
+    def from_env(cls, db, archive=None) -> "SalesRollups":
+        return cls(db, archive=archive, flush_interval=float(os.environ.get("SALES_ROLLUP_FLUSH_SECONDS", 30)))
+
+    @property
+    def collection(self):
+        return self.db.sales_daily
+
+    @property
+    def state(self):
+        return self.db.sales_rollup_state
+
+    async def ensure_indexes(self):
+        # $merge needs a unique index on its "on" fields
+        await self.collection.create_index([(field, 1) for field in SALES_DAILY_KEY], unique=True)
+        await self.collection.create_index([("product_id", 1), ("day", 1)])
+        await self.collection.create_index([("customer_id", 1), ("day", 1)])
+
+    async def mark_dirty(self, delivery_dates: Iterable):
+        """Queue the delivery days of written orders for the next flush, by whichever worker runs it.
+        Never raises: the order write has already happened."""
+        days = {day for day in map(delivery_day, delivery_dates) if day is not None} | self._unsaved
+        if not days:
+            return
+        self._unsaved = set()
+        try:
+            await self.state.bulk_write([
+                UpdateOne({"_id": f"dirty:{day.isoformat()}"}, {"$set": {"dirty_day": day.isoformat()}, "$inc": {"marks": 1}},
+                          upsert=True)
+                for day in sorted(days)
+            ], ordered=False)
+        except Exception as e:
+            self._unsaved |= days
+            self.failures_total += 1
+            logger.error(f"Could not mark sales rollup days {sorted(days)} dirty: {str(e)}")
+
+    async def rebuild(self, start_day: Optional[date] = None, end_day: Optional[date] = None) -> int:
+        """Recompute sales_daily for start_day..end_day (None = everything); returns the rows written"""
+        stamp = datetime.utcnow()
+        reaches_archive = self.archive is not None and self.archive.reaches(ist_midnight_utc(start_day) if start_day else None)
+        archive_union = (
+            (lambda match: self.archive.archive_union_stage(match, fields=("user_id", "delivery_date")))
+            if reaches_archive else None
+        )
+        _, day_range = day_window(start_day, end_day)
+        await self.db.orders.aggregate(rollup_pipeline(start_day, end_day, stamp, archive_union)).to_list(None)
+        rows = await self.collection.count_documents({"rebuilt_at": stamp})
+        # Rows the merge did not rewrite have no orders left; a newer rebuild's rows are left alone
+        await self.collection.update_many(
+            {**day_range, "$or": [{"rebuilt_at": {"$lt": stamp}}, {"rebuilt_at": {"$exists": False}}]},
+            {"$set": {field: 0 for field in ROLLUP_FIELDS}}
+        )
+        self.rebuilds_total += 1
+        self.last_rebuild_at = datetime.utcnow()
+        return rows
+
+    async def _claim_flush(self) -> bool:
+        """One worker flushes per interval; the lease runs out by itself if that worker dies"""
+        now = datetime.utcnow()
+        leased_until = now + timedelta(seconds=self.flush_interval)
+        result = await self.state.update_one(
+            {"_id": "flush", "leased_until": {"$lte": now}}, {"$set": {"leased_until": leased_until}}
+        )
+        if result.modified_count:
+            return True
+        try:
+            await self.state.insert_one({"_id": "flush", "leased_until": leased_until})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def flush(self):
+        """Rebuild the days any worker marked dirty, one pass per run of consecutive days"""
+        if self._unsaved:
+            await self.mark_dirty([])
+        if not await self._claim_flush():
+            return
+        marks = {
+            date.fromisoformat(doc["dirty_day"]): doc["marks"]
+            for doc in await self.state.find({"dirty_day": {"$exists": True}}).to_list(None)
+        }
+        # A backdated admin order next to today's checkouts is two short runs, not the span between
+        for first, last in day_runs(marks):
+            try:
+                await self.rebuild(first, last)
+            except Exception as e:
+                self.failures_total += 1
+                logger.error(f"Sales rollup flush for {first}..{last} failed: {str(e)}")
+                continue  # the run stays dirty
+            self.days_rebuilt_total += (last - first).days + 1
+            # A day marked again while it was rebuilt keeps its mark for the next flush
+            await self.state.delete_many({"$or": [
+                {"_id": f"dirty:{day.isoformat()}", "marks": count}
+                for day, count in marks.items() if first <= day <= last
+            ]})
+
+    async def backfill_if_empty(self) -> bool:
+        """
+        Build every sales_daily row if they were never built (first deploy). One worker claims the
+        job; a claim older than backfill_claim_timeout (its worker died) is taken over.
+        Returns whether this worker ran it.
+        """
+        state = self.db.sales_rollup_state
+        done = await state.find_one({"_id": "backfill"})
+        if done and done.get("completed_at"):
+            return False
+        if done is None and await self.collection.estimated_document_count() > 0:
+            return False  # built before the backfill existed (admin rebuild)
+        now = datetime.utcnow()
+        try:
+            await state.insert_one({"_id": "backfill", "claimed_at": now})
+        except DuplicateKeyError:
+            result = await state.update_one(
+                {"_id": "backfill", "completed_at": {"$exists": False},
+                 "claimed_at": {"$lt": now - timedelta(seconds=self.backfill_claim_timeout)}},
+                {"$set": {"claimed_at": now}}
+            )
+            if not result.modified_count:
+                return False
+        logger.info("sales_daily has never been built - backfilling it from every order")
+        rows = await self.rebuild()
+        await state.update_one({"_id": "backfill"}, {"$set": {"completed_at": datetime.utcnow(), "rows": rows}})
+        logger.info(f"sales_daily backfill wrote {rows} rows")
+        return True
+
+    async def _backfill(self):
+        try:
+            await self.backfill_if_empty()
+        except Exception as e:
+            self.failures_total += 1
+            logger.error(f"sales_daily backfill failed: {str(e)}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._backfill_task = asyncio.create_task(self._backfill())
+
+    async def stop(self):
+        for task in (self._task, self._backfill_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._backfill_task = None
+        # Save any marks that failed earlier so another worker's flush picks them up
+        await self.mark_dirty([])
+
+    def stats(self) -> dict:
+        return {
+            "unsaved_dirty_days": len(self._unsaved),
+            "rebuilds_total": self.rebuilds_total,
+            "days_rebuilt_total": self.days_rebuilt_total,
+            "failures_total": self.failures_total,
+            "last_rebuild_at": self.last_rebuild_at.isoformat() if self.last_rebuild_at else None,
+        }
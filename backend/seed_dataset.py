@@ -0,0 +1,573 @@
+"""
+Synthetic bakery dataset generator for load and scale testing
+
+Populates a local MongoDB with a realistic, reproducible dataset: customers on every route
+(LFT/SR1/SR2/LR1/LR2/ONS), owners with linked order agents, products with categories and dough
+types, whitelists, weeks of orders, standing orders, wallets, transactions and discounts.
+
+    python seed_dataset.py --scale 10 --seed 42 --weeks 4 --drop
+
+The same seed, scale, weeks and anchor date always produce the same documents. Every synthetic
+account uses --password (default Bench@123); admins are admin / manager / reports.
+Benchmarks import DatasetGenerator and load_dataset directly.
+"""
+import argparse
+import asyncio
+import ipaddress
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ConfigurationError, InvalidURI
+from pymongo.uri_parser import parse_uri
+
+from password_hasher import PasswordHasher
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+DEFAULT_PASSWORD = "Bench@123"
+
+# Share of customers per route; ONS customers collect from the bakery
+ROUTES = [
+    ("LFT", "Lulu / LFT", 0.15),
+    ("SR1", "Short Route 1", 0.20),
+    ("SR2", "Short Route 2", 0.20),
+    ("LR1", "Long Route 1", 0.18),
+    ("LR2", "Long Route 2", 0.17),
+    ("ONS", "Onsite Pickup", 0.10),
+]
+
+PRODUCT_CATEGORIES = [
+    ("Breads", False), ("Buns", False), ("Cakes", False), ("Cookies", False),
+    ("Rusks", False), ("Puffs", False), ("Premium", False), ("Packing", True),
+]
+
+DOUGH_TYPES = ["White Dough", "Brown Dough", "Sweet Dough", "Puff Pastry", "Multigrain Dough"]
+
+PRODUCT_NAMES = {
+    "Breads": ["Sandwich Bread", "Milk Bread", "Brown Bread", "Fruit Bread", "Multigrain Loaf", "Garlic Bread", "Pav"],
+    "Buns": ["Burger Bun", "Hot Dog Bun", "Cream Bun", "Coconut Bun", "Sweet Bun", "Dilkush"],
+    "Cakes": ["Plum Cake", "Tea Cake", "Cup Cake", "Swiss Roll", "Brownie", "Banana Cake"],
+    "Cookies": ["Butter Cookies", "Coconut Cookies", "Jeera Biscuit", "Nankhatai", "Salt Biscuit", "Choco Chip Cookies"],
+    "Rusks": ["Milk Rusk", "Elaichi Rusk", "Cake Rusk", "Suji Rusk"],
+    "Puffs": ["Veg Puff", "Egg Puff", "Paneer Puff", "Mushroom Puff"],
+    "Premium": ["Croissant", "Danish Pastry", "Focaccia", "Sourdough", "Bagel"],
+}
+CATEGORY_DOUGH = {
+    "Breads": "White Dough", "Buns": "Sweet Dough", "Cakes": "Sweet Dough", "Cookies": "Sweet Dough",
+    "Rusks": "Brown Dough", "Puffs": "Puff Pastry", "Premium": "Multigrain Dough",
+}
+PACKET_SIZES = ["200g", "400g", "500g", "6 pcs", "12 pcs", "1 kg"]
+
+BUSINESS_WORDS = ["Sri", "Lakshmi", "Royal", "Fresh", "Daily", "Green", "Star", "Cafe", "Mart", "Stores",
+                  "Bakers", "Tea Stall", "Supermarket", "Kitchen", "Corner", "Traders"]
+AREAS = ["MG Road", "Kakkanad", "Edappally", "Vyttila", "Aluva", "Kaloor", "Fort Kochi", "Palarivattom",
+         "Thrippunithura", "Angamaly"]
+
+# Orders are placed the day before delivery; most land in the evening and in the rush before 4 AM IST
+ORDER_HOUR_WEIGHTS = {h: 1 for h in range(4, 24)}
+ORDER_HOUR_WEIGHTS.update({18: 4, 19: 5, 20: 6, 21: 6, 22: 5, 23: 4, 0: 3, 1: 3, 2: 4, 3: 8})
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+
+def ist_midnight_utc(day: date) -> datetime:
+    """Delivery dates are stored as IST midnight converted to naive UTC"""
+    return datetime.combine(day, datetime.min.time()) - IST_OFFSET
+
+
+class DatasetGenerator:
+    """
+    Builds every document in memory except orders and transactions, which are streamed
+    so that 100x datasets (~100k orders) load without holding them all at once.
+    """
+
+    def __init__(self, scale: float = 1.0, seed: int = 42, weeks: int = 4, anchor: Optional[date] = None,
+                 password_hash: str = ""):
+        self.scale = scale
+        self.seed = seed
+        self.weeks = weeks
+        self.anchor = anchor or (datetime.utcnow() + IST_OFFSET).date()
+        self.password_hash = password_hash
+        self.rng = random.Random(seed)
+        self.now = datetime.combine(self.anchor, datetime.min.time()) - IST_OFFSET + timedelta(hours=10)
+        self.order_number = 100
+
+        self.categories: List[dict] = []
+        self.route_codes: List[dict] = []
+        self.products: List[dict] = []
+        self.admins: List[dict] = []
+        self.owners: List[dict] = []
+        self.agents: List[dict] = []
+        self.discounts: List[dict] = []
+        self.standing_orders: List[dict] = []
+        self._build()
+
+    # ---- helpers ----
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _created_before(self, days: int) -> datetime:
+        return self.now - timedelta(days=days, minutes=self.rng.randint(0, 24 * 60))
+
+    def _user(self, username: str, role: str, **fields) -> dict:
+        user = {
+            "id": self._uuid(),
+            "username": username,
+            "username_lower": username.lower(),
+            "email": f"{username}@example.com",
+            "phone": None,
+            "role": role,
+            "business_name": None,
+            "address": None,
+            "wallet_balance": 0.0,
+            "can_topup_wallet": True,
+            "hashed_password": self.password_hash,
+            "created_at": self._created_before(self.weeks * 7 + 60),
+            "is_active": True,
+            "is_approved": True,
+            "favorite_products": [],
+            "user_type": "owner",
+            "linked_owner_id": None,
+            "onsite_pickup_only": False,
+            "delivery_charge_waived": False,
+            "admin_access_level": None,
+            "is_superadmin": False,
+            "pay_later_enabled": False,
+            "pay_later_max_limit": 0,
+        }
+        user.update(fields)
+        return user
+
+    # ---- fixed-size collections ----
+
+    def _build(self):
+        rng = self.rng
+        for order, (name, admin_only) in enumerate(PRODUCT_CATEGORIES):
+            self.categories.append({
+                "id": self._uuid(), "name": name, "description": f"{name} range", "display_order": order,
+                "is_admin_only": admin_only, "category_type": "product_category", "created_at": self._created_before(400)
+            })
+        dough_ids = {}
+        for order, name in enumerate(DOUGH_TYPES):
+            dough_ids[name] = self._uuid()
+            self.categories.append({
+                "id": dough_ids[name], "name": name, "description": None, "display_order": order,
+                "is_admin_only": True, "category_type": "dough_type", "created_at": self._created_before(400)
+            })
+        for code, label, _ in ROUTES:
+            self.route_codes.append({"id": self._uuid(), "code": code, "label": label, "created_at": self._created_before(300)})
+
+        # Catalogues grow much more slowly than the customer base
+        product_count = min(400, max(20, round(60 * math.sqrt(self.scale))))
+        names = [(category, name) for category, items in PRODUCT_NAMES.items() for name in items]
+        for n in range(product_count):
+            category, base_name = names[n % len(names)]
+            variant = n // len(names)
+            price = round(rng.uniform(15, 350) / 5) * 5
+            categories = [category]
+            if category == "Premium" or rng.random() < 0.1:
+                categories.append("Packing")
+            self.products.append({
+                "id": self._uuid(),
+                "name": base_name if variant == 0 else f"{base_name} {rng.choice(PACKET_SIZES)} #{variant}",
+                "description": f"Freshly baked {base_name.lower()}",
+                "category": category,
+                "categories": categories,
+                "dough_type_id": dough_ids[CATEGORY_DOUGH[category]],
+                "mrp": round(price * rng.uniform(1.1, 1.3)),
+                "price": float(price),
+                "packet_size": rng.choice(PACKET_SIZES),
+                "unit": "piece",
+                "remarks": None,
+                "image_base64": None,
+                "is_available": rng.random() > 0.05,
+                "closing_stock": rng.randint(0, 200),
+                "product_code": n + 1 if n < 100 else None,
+                "shelf_life": rng.choice(["2 days", "3-5 days", "1 week", "3 weeks"]),
+                "storage_instructions": "Store in a cool, dry place",
+                "food_type": "non-veg" if "Egg" in base_name else "veg",
+                "ingredients": "Wheat flour, sugar, yeast, salt",
+                "allergen_info": "Contains gluten",
+                "created_at": self._created_before(365),
+                "updated_at": self._created_before(30),
+            })
+
+        self.admins = [
+            self._user("admin", "admin", admin_access_level="full", is_superadmin=True),
+            self._user("manager", "admin", admin_access_level="limited"),
+            self._user("reports", "admin", admin_access_level="reports"),
+        ]
+
+        owner_count = max(6, round(60 * self.scale))
+        route_weights = [weight for _, _, weight in ROUTES]
+        product_ids = [p["id"] for p in self.products]
+        for n in range(owner_count):
+            route = rng.choices([code for code, _, _ in ROUTES], weights=route_weights)[0]
+            area = rng.choice(AREAS)
+            owner = self._user(
+                f"cust{n:05d}", "customer",
+                phone=f"+919{n:09d}",
+                business_name=f"{rng.choice(BUSINESS_WORDS)} {rng.choice(BUSINESS_WORDS)} {area}",
+                address=f"{rng.randint(1, 300)}, {area}, Kochi",
+                route_code=route,
+                onsite_pickup_only=route == "ONS",
+                delivery_charge_waived=rng.random() < 0.3,
+                favorite_products=rng.sample(product_ids, k=min(len(product_ids), rng.randint(0, 6))),
+            )
+            if rng.random() < 0.2:
+                owner["pay_later_enabled"] = True
+                owner["pay_later_max_limit"] = float(rng.choice([5000, 10000, 20000]))
+            if rng.random() < 0.15:
+                owner["allowed_product_ids"] = rng.sample(product_ids, k=min(len(product_ids), rng.randint(10, 30)))
+            self.owners.append(owner)
+
+            agent_count = 2 if rng.random() < 0.05 else (1 if rng.random() < 0.2 else 0)
+            for _ in range(agent_count):
+                self.agents.append(self._user(
+                    f"agent{len(self.agents):05d}", "customer",
+                    phone=f"+918{len(self.agents):09d}",
+                    business_name=owner["business_name"],
+                    address=owner["address"],
+                    route_code=route,
+                    onsite_pickup_only=owner["onsite_pickup_only"],
+                    user_type="order_agent",
+                    linked_owner_id=owner["id"],
+                    can_topup_wallet=False,
+                ))
+
+            if rng.random() < 0.1:
+                percentage = rng.random() < 0.6
+                self.discounts.append({
+                    "id": self._uuid(),
+                    "customer_id": owner["id"],
+                    "discount_type": "percentage" if percentage else "fixed",
+                    "discount_value": float(rng.choice([5, 10, 15]) if percentage else rng.choice([20, 50, 100])),
+                    "start_date": ist_midnight_utc(self.anchor - timedelta(days=self.weeks * 7 + rng.randint(0, 30))),
+                    "end_date": ist_midnight_utc(self.anchor + timedelta(days=rng.randint(-7, 60))),
+                    "is_active": True,
+                    "created_at": self._created_before(self.weeks * 7 + 30),
+                    "updated_at": self._created_before(10),
+                })
+
+            if rng.random() < 0.1:
+                weekly = rng.random() < 0.7
+                self.standing_orders.append({
+                    "id": self._uuid(),
+                    "customer_id": owner["id"],
+                    "customer_name": owner["username"],
+                    "items": [self._line(product, with_subtotal=False) for product in self._pick_products(owner, 2, 5)],
+                    "recurrence_type": "weekly_days" if weekly else "interval",
+                    "recurrence_config": {"days": sorted(rng.sample(range(7), k=rng.randint(2, 5)))} if weekly else {"days": rng.choice([2, 3])},
+                    "duration_type": "indefinite",
+                    "end_date": None,
+                    "notes": "Regular order",
+                    "status": "active",
+                    "created_at": self._created_before(self.weeks * 7 + 14),
+                    "created_by": "admin",
+                    "next_delivery_date": ist_midnight_utc(self.anchor + timedelta(days=1)),
+                })
+
+    def _pick_products(self, customer: dict, low: int, high: int) -> List[dict]:
+        allowed = customer.get("allowed_product_ids")
+        pool = [p for p in self.products if p["is_available"] and (not allowed or p["id"] in allowed)]
+        return self.rng.sample(pool, k=min(len(pool), self.rng.randint(low, high)))
+
+    def _line(self, product: dict, with_subtotal: bool = True) -> dict:
+        quantity = float(self.rng.choice([1, 2, 3, 5, 6, 10, 12, 20, 24, 30]))
+        line = {"product_id": product["id"], "product_name": product["name"], "quantity": quantity, "price": product["price"]}
+        if with_subtotal:
+            line["subtotal"] = round(quantity * product["price"], 2)
+        return line
+
+    # ---- streamed collections ----
+
+    def _standing_order_runs_on(self, standing_order: dict, day: date) -> bool:
+        config = standing_order["recurrence_config"]
+        if standing_order["recurrence_type"] == "weekly_days":
+            return day.weekday() in config["days"]
+        start = (standing_order["created_at"] + IST_OFFSET).date()
+        return (day - start).days >= 0 and (day - start).days % config["days"] == 0
+
+    def _next_order_number(self) -> str:
+        self.order_number += 1
+        return str(self.order_number)
+
+    def _placed_at(self, delivery_day: date) -> datetime:
+        """A created_at (naive UTC) before the 4 AM IST cutoff for this delivery day"""
+        hour = self.rng.choices(list(ORDER_HOUR_WEIGHTS), weights=list(ORDER_HOUR_WEIGHTS.values()))[0]
+        day = delivery_day if hour < 4 else delivery_day - timedelta(days=1)
+        placed_ist = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, minutes=self.rng.randint(0, 59), seconds=self.rng.randint(0, 59))
+        return placed_ist - IST_OFFSET
+
+    def _status_for(self, delivery_day: date) -> str:
+        if delivery_day < self.anchor:
+            return "cancelled" if self.rng.random() < 0.03 else "delivered"
+        if delivery_day == self.anchor:
+            return self.rng.choice(["confirmed", "processing", "processing"])
+        return self.rng.choice(["pending", "pending", "confirmed"])
+
+    def iter_orders(self, wallets: Dict[str, float]) -> Iterator[Tuple[str, dict]]:
+        """
+        Yields ('orders' | 'transactions', doc) from the first delivery day to two days past the
+        anchor. Wallet orders draw on `wallets`, topping them up first when needed.
+        """
+        rng = self.rng
+        agents_by_owner = defaultdict(list)
+        for agent in self.agents:
+            agents_by_owner[agent["linked_owner_id"]].append(agent)
+        standing_by_customer = defaultdict(list)
+        for standing_order in self.standing_orders:
+            standing_by_customer[standing_order["customer_id"]].append(standing_order)
+        discounts = {d["customer_id"]: d for d in self.discounts}
+        first_day = self.anchor - timedelta(days=self.weeks * 7)
+
+        for offset in range((self.anchor - first_day).days + 3):
+            day = first_day + timedelta(days=offset)
+            delivery_date = ist_midnight_utc(day)
+            for owner in self.owners:
+                standing = [so for so in standing_by_customer[owner["id"]] if self._standing_order_runs_on(so, day)]
+                for standing_order in standing:
+                    items = [{**item, "subtotal": round(item["price"] * item["quantity"], 2)} for item in standing_order["items"]]
+                    total = round(sum(item["subtotal"] for item in items), 2)
+                    yield "orders", {
+                        "id": self._uuid(),
+                        "order_number": self._next_order_number(),
+                        "user_id": owner["id"],
+                        "items": items,
+                        "total_amount": total,
+                        "discount_amount": 0,
+                        "final_amount": total,
+                        "order_status": "delivered" if day < self.anchor else "confirmed",
+                        "payment_status": "pending",
+                        "payment_method": "wallet",
+                        "notes": "Auto-generated from standing order. Regular order",
+                        "delivery_date": delivery_date,
+                        "standing_order_id": standing_order["id"],
+                        "is_standing_order": True,
+                        "created_at": delivery_date - timedelta(days=10),
+                        "updated_at": delivery_date - timedelta(days=10),
+                    }
+                if standing or rng.random() > 0.7:
+                    continue
+
+                placed_by = owner
+                if agents_by_owner[owner["id"]] and rng.random() < 0.4:
+                    placed_by = rng.choice(agents_by_owner[owner["id"]])
+                items = [self._line(product) for product in self._pick_products(owner, 3, 12)]
+                if not items:
+                    continue
+                subtotal = round(sum(item["subtotal"] for item in items), 2)
+                pickup = owner["onsite_pickup_only"]
+                delivery_charge = 0.0 if pickup or owner["delivery_charge_waived"] else 30.0
+                discount = discounts.get(owner["id"])
+                discount_amount = 0.0
+                if discount and discount["start_date"] <= delivery_date <= discount["end_date"]:
+                    if discount["discount_type"] == "percentage":
+                        discount_amount = round(subtotal * discount["discount_value"] / 100, 2)
+                    else:
+                        discount_amount = min(subtotal, discount["discount_value"])
+                total = round(subtotal + delivery_charge - discount_amount, 2)
+
+                if owner["pay_later_enabled"] and total <= owner["pay_later_max_limit"] and rng.random() < 0.7:
+                    payment_method, payment_status = "pay_later", "pending"
+                elif rng.random() < 0.6:
+                    payment_method, payment_status = "wallet", "completed"
+                else:
+                    payment_method, payment_status = "razorpay", "paid"
+
+                placed_at = self._placed_at(day)
+                order_id = self._uuid()
+                if payment_method == "wallet" and wallets[owner["id"]] < total:
+                    topup = float(math.ceil((total - wallets[owner["id"]] + rng.choice([0, 500, 1000, 2000])) / 500) * 500)
+                    wallets[owner["id"]] += topup
+                    yield "transactions", {
+                        "id": self._uuid(),
+                        "user_id": owner["id"],
+                        "amount": topup,
+                        "transaction_type": "wallet_topup",
+                        "payment_method": "razorpay",
+                        "razorpay_payment_link_id": f"plink_{self._uuid()[:14]}",
+                        "status": "success",
+                        "notes": {},
+                        "created_at": placed_at - timedelta(minutes=rng.randint(1, 600)),
+                    }
+
+                order_status = self._status_for(day)
+                order = {
+                    "id": order_id,
+                    "order_number": self._next_order_number(),
+                    "customer_id": placed_by["id"],
+                    "user_id": placed_by["id"],
+                    "items": items,
+                    "subtotal": subtotal,
+                    "delivery_charge": delivery_charge,
+                    "discount_amount": discount_amount,
+                    "total_amount": total,
+                    "payment_method": payment_method,
+                    "payment_status": payment_status,
+                    "order_status": order_status,
+                    "order_type": "pickup" if pickup else "delivery",
+                    "delivery_address": owner["address"],
+                    "delivery_date": delivery_date,
+                    "notes": None,
+                    "is_pay_later": payment_method == "pay_later",
+                    "created_at": placed_at,
+                    "updated_at": placed_at,
+                }
+                if not pickup and rng.random() < 0.02:
+                    order["route_code_override"] = rng.choice([code for code, _, _ in ROUTES if code != "ONS"])
+                yield "orders", order
+
+                if payment_method == "wallet" and order_status != "cancelled":
+                    wallets[owner["id"]] -= total
+                    yield "transactions", {
+                        "id": self._uuid(),
+                        "user_id": placed_by["id"],
+                        "amount": total,
+                        "transaction_type": "order_payment",
+                        "payment_method": "wallet",
+                        "status": "success",
+                        "notes": {"order_id": order_id},
+                        "created_at": placed_at,
+                    }
+
+    def documents(self) -> Iterator[Tuple[str, dict]]:
+        """Every (collection, document) pair in the dataset"""
+        for doc in self.categories:
+            yield "categories", doc
+        for doc in self.route_codes:
+            yield "route_codes", doc
+        yield "settings", {"key": "delivery_charge", "value": 30.0}
+        for doc in self.products:
+            yield "products", doc
+        for doc in self.discounts:
+            yield "discounts", doc
+        for doc in self.standing_orders:
+            yield "standing_orders", doc
+
+        wallets = defaultdict(float)
+        for owner in self.owners:
+            wallets[owner["id"]] = float(self.rng.choice([0, 500, 1000, 2000, 5000]))
+        yield from self.iter_orders(wallets)
+
+        # Balances are final once every order has been drawn from them
+        for user in self.admins + self.owners + self.agents:
+            balance = round(wallets.get(user["id"], 0.0), 2)
+            user["wallet_balance"] = balance
+            yield "users", user
+            yield "wallets", {"user_id": user["id"], "balance": balance, "updated_at": self.now}
+        yield "counters", {"_id": "order_counter", "sequence": self.order_number}
+
+
+async def load_dataset(db, generator: DatasetGenerator, drop: bool = False, batch_size: int = 5000) -> Dict[str, int]:
+    """Insert the generated dataset. Returns document counts per collection."""
+    collections = ["categories", "route_codes", "settings", "products", "discounts", "standing_orders",
+                   "orders", "transactions", "users", "wallets", "counters"]
+    if drop:
+        for name in collections:
+            await db[name].drop()
+
+    counts: Dict[str, int] = defaultdict(int)
+    batches: Dict[str, List[dict]] = defaultdict(list)
+
+    async def flush(name: str):
+        if batches[name]:
+            await db[name].insert_many(batches[name], ordered=False)
+            counts[name] += len(batches[name])
+            batches[name] = []
+
+    for name, doc in generator.documents():
+        batches[name].append(doc)
+        if len(batches[name]) >= batch_size:
+            await flush(name)
+    for name in list(batches):
+        await flush(name)
+    return dict(counts)
+
+
+def hash_password(password: str) -> str:
+    # Hashed once with the API's cost factor, so logins do not trigger a rehash for every account
+    return PasswordHasher.from_env().context.hash(password)
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost" or host.endswith(".sock"):  # unix domain sockets are local too
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+def unsafe_seed_hosts(mongo_url: str, allowed_hosts: List[str]) -> List[str]:
+    """
+    The hosts in mongo_url that are neither loopback nor in allowed_hosts. An unparseable URL and
+    mongodb+srv (resolved through DNS, so never local) count as unsafe in full.
+    """
+    if mongo_url.startswith("mongodb+srv://"):
+        return [mongo_url]
+    try:
+        hosts = [host for host, _ in parse_uri(mongo_url)["nodelist"]]
+    except (InvalidURI, ConfigurationError, ValueError):
+        return [mongo_url]
+    allowed = {host.lower() for host in allowed_hosts}
+    return [host for host in hosts if not is_loopback(host) and host.lower() not in allowed]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Populate a local MongoDB with a synthetic Divine Cakery dataset")
+    parser.add_argument("--scale", type=float, default=1.0, help="1 = ~60 customers and ~1.2k orders over 4 weeks")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--weeks", type=int, default=4, help="weeks of order history before the anchor date")
+    parser.add_argument("--anchor-date", help="YYYY-MM-DD 'today' of the dataset (default: today in IST)")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="password for every synthetic account")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.environ.get("DB_NAME", "divine_cakery_bench"))
+    parser.add_argument("--drop", action="store_true", help="drop the dataset's collections first")
+    parser.add_argument("--allow-host", action="append", default=[h for h in os.environ.get("SEED_ALLOWED_HOSTS", "").split(",") if h],
+                        help="a non-loopback MongoDB host that may be seeded, repeatable (also SEED_ALLOWED_HOSTS, "
+                             "comma-separated) - never production")
+    parser.add_argument("--dry-run", action="store_true", help="generate and print counts without writing")
+    args = parser.parse_args()
+
+    anchor = datetime.strptime(args.anchor_date, "%Y-%m-%d").date() if args.anchor_date else None
+    unsafe = [] if args.dry_run else unsafe_seed_hosts(args.mongo_url, args.allow_host)
+    if unsafe:
+        sys.exit(f"Refusing to seed {', '.join(unsafe)} - pass --allow-host for each host if this really is a scratch database")
+
+    started = time.perf_counter()
+    generator = DatasetGenerator(args.scale, args.seed, args.weeks, anchor, password_hash=hash_password(args.password))
+
+    if args.dry_run:
+        counts = defaultdict(int)
+        for name, _ in generator.documents():
+            counts[name] += 1
+    else:
+        client = AsyncIOMotorClient(args.mongo_url)
+        db = client[args.db]
+        if not args.drop and await db.users.estimated_document_count() > 0:
+            sys.exit(f"Database {args.db} already has users - pass --drop to replace its data")
+        counts = await load_dataset(db, generator, drop=args.drop)
+        client.close()
+
+    print(f"Dataset scale={args.scale} seed={args.seed} weeks={args.weeks} anchor={generator.anchor} "
+          f"({time.perf_counter() - started:.1f}s){'' if args.dry_run else f' -> {args.db}'}")
+    for name in sorted(counts):
+        print(f"  {name}: {counts[name]}")
+    print(f"Logins: admin / manager / reports / cust00000 ... / agent00000 ... (password: {args.password})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
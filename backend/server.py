@@ -1,24 +1,22 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Body
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, Body
+from fastapi.responses import RedirectResponse, PlainTextResponse, JSONResponse, HTMLResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ReturnDocument
-from passlib.context import CryptContext
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+import asyncio
 import os
 import logging
 from pathlib import Path
 from typing import List, Optional
 import uuid
-import razorpay
 import hmac
+import secrets
+import time
 import hashlib
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import re
 import json
 import base64
@@ -26,8 +24,35 @@ import io
 import pytz
 from PIL import Image
 
+from database import MongoConnection
+from payment_gateway import OutboundHTTPClient, RazorpayGateway, PaymentGatewayError
+from payment_inbox import PaymentInbox, webhook_event_id
+import payment_transitions
+from email_outbox import EmailOutbox, SMTPConnectionPool
+from password_hasher import PasswordHasher
+from settings_registry import SettingsRegistry
+from order_archive import OrderArchive
+from order_lines import OrderLineStore
+from report_snapshots import ReportSnapshots
+from sales_rollups import (
+    ROLLUP_FIELDS, SalesRollups, bucket_series, rollup_match, top_pipeline, totals, weekday_profile
+)
+from stock_snapshots import StockSnapshots, apply_stock_counts
+from invalidation_bus import InvalidationBus
+from metrics import MetricsRegistry, MongoCommandMetrics
+from slow_query_monitor import SlowQueryMonitor
+from round_trips import RoundTripBudget, RoundTripCounter, begin_request, end_request
+from loop_watchdog import EventLoopWatchdog
+from tracing import MongoTracingListener, Tracer
+from structured_logging import LogPipeline
+from reports import (
+    CANCELLED_STATUSES, DISPATCH_CUSTOMER_PROJECTION, DISPATCH_ORDER_PROJECTION,
+    PREPARATION_PRODUCT_PROJECTION, build_daily_items, build_dispatch_board, build_preparation_list,
+    preparation_pipeline, route_groups
+)
+from request_profiler import RequestProfilerMiddleware, ensure_collection as ensure_profiles_collection, pstats_html
 from models import (
-    UserCreate, UserLogin, User, UserInDB, UserRole, UserUpdate, Token, TokenData,
+    UserCreate, UserLogin, User, UserInDB, UserRole, UserUpdate, Token,
     ProductCreate, ProductUpdate, Product,
     OrderCreate, OrderUpdate, Order, OrderStatus,
     Wallet, Transaction, TransactionCreate, TransactionType, TransactionStatus,
@@ -37,17 +62,24 @@ from models import (
     StandingOrder, StandingOrderCreate, StandingOrderUpdate, StandingOrderStatus,
     RecurrenceType, DurationType, StandingOrderItem,
     PasswordResetRequest, PasswordResetVerifyOTP, PasswordResetComplete,
-    AppVersionInfo, AllowedProductsUpdate
+    AppVersionInfo, AllowedProductsUpdate, StockCount
 )
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Metrics (exposed in Prometheus format at /metrics)
+metrics_registry = MetricsRegistry()
+mongo_metrics = MongoCommandMetrics(metrics_registry)
+slow_query_monitor = SlowQueryMonitor()
+round_trip_budget = RoundTripBudget()
+loop_watchdog = EventLoopWatchdog(metrics_registry)
+tracer = Tracer.from_env()
+
+# MongoDB connection - `db` follows mongo.connect(), so benchmarks can point the app at their own mongod
+mongo = MongoConnection.from_env(event_listeners=[mongo_metrics, slow_query_monitor, RoundTripCounter(), MongoTracingListener(tracer)])
+db = mongo.db
 
 # Security
 SECRET_KEY = os.environ.get("SECRET_KEY", "divine_cakery_secret_key_change_in_production")
@@ -55,14 +87,58 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 10080  # 7 days = 7 * 24 * 60 minutes
 # Upgraded to Starter plan (2GB RAM) for better performance
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher.from_env()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-# Razorpay Client
-razorpay_client = razorpay.Client(auth=(
-    os.environ.get("RAZORPAY_KEY_ID", ""),
-    os.environ.get("RAZORPAY_KEY_SECRET", "")
-))
+# Razorpay Client (async, pooled - never blocks the event loop)
+razorpay_gateway = RazorpayGateway(
+    key_id=os.environ.get("RAZORPAY_KEY_ID", ""),
+    key_secret=os.environ.get("RAZORPAY_KEY_SECRET", ""),
+    base_url=os.environ.get("RAZORPAY_API_URL", "https://api.razorpay.com/v1"),
+    timeout=float(os.environ.get("RAZORPAY_TIMEOUT_SECONDS", 15)),
+    tracer=tracer
+)
+
+# Settings documents are served from memory; write endpoints invalidate the cache through the bus
+settings_registry = SettingsRegistry(db)
+PUBLIC_SETTINGS_CACHE_CONTROL = f"public, max-age={int(settings_registry.ttl)}"
+# Reports for dates that have left the live window (report_snapshots.frozen); browsers may reuse them a while
+PAST_REPORT_CACHE_CONTROL = "private, max-age=3600"
+
+# Broadcasts writes from any worker/instance to every worker's in-process caches
+invalidation_bus = InvalidationBus(db)
+invalidation_bus.subscribe(
+    ["settings", "app_settings", "cleaning_tasks", "route_codes"],
+    lambda event: settings_registry.invalidate()
+)
+invalidation_bus.subscribe(["logging_config"], lambda event: load_runtime_logging_config())
+
+# Daily closing-stock snapshots (captured at the order cutoff) feed previous_closing_stock in reports
+stock_snapshots = StockSnapshots.from_env(db)
+# Past-date report payloads, served with one read and dropped by writes to that day's orders
+report_snapshots = ReportSnapshots.from_env(db)
+# Settled orders past the retention horizon live in orders_archive; history reads union both tiers
+order_archive = OrderArchive.from_env(db)
+# sales_daily rows per (delivery day, customer, product) for long-range analytics
+sales_rollups = SalesRollups.from_env(db, archive=order_archive)
+# Columnar order lines for yesterday .. +10 days; the daily reports for these days are computed in memory
+order_lines = OrderLineStore.from_env(db, archive=order_archive)
+# Order writes made by other workers (change stream mode only; max age bounds staleness otherwise)
+invalidation_bus.subscribe(["orders"], order_lines.order_event, stream_only=True)
+
+
+async def orders_written(delivery_dates, inserted: Optional[List[dict]] = None):
+    """Call after any order write: drops past-date report snapshots and the days' cached order lines,
+    queues the days' sales rollups. When the write only inserted orders, pass the inserted documents
+    (with their _id) as `inserted` so the order line store appends them instead of reloading the day."""
+    delivery_dates = list(delivery_dates)
+    order_lines.orders_written(delivery_dates, inserted)
+    await sales_rollups.mark_dirty(delivery_dates)
+    await report_snapshots.orders_written(delivery_dates)
+
+
+# Shared client for all other outbound HTTP calls
+http_client = OutboundHTTPClient(timeout=30.0, name="outbound", tracer=tracer)
 
 # Create the main app
 app = FastAPI(title="Divine Cakery API", version="1.0.0")
@@ -70,11 +146,8 @@ app = FastAPI(title="Divine Cakery API", version="1.0.0")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging - records are queued and written as JSON lines by a background thread
+log_pipeline = LogPipeline.from_env().install()
 logger = logging.getLogger(__name__)
 
 
@@ -91,53 +164,61 @@ def compress_base64_image(base64_string: str, max_width: int = 800, quality: int
     Returns:
         Compressed base64 encoded image string
     """
-    try:
-        # Remove data URI prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',', 1)[1]
-        
-        # Decode base64 to bytes
-        image_bytes = base64.b64decode(base64_string)
-        
-        # Open image with PIL
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert RGBA to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        
-        # Resize if image is too large
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-        
-        # Save to bytes buffer as JPEG
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=quality, optimize=True)
-        buffer.seek(0)
-        
-        # Encode to base64
-        compressed_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-        
-        # Add data URI prefix back for React Native Image component
-        compressed_base64_with_prefix = f"data:image/jpeg;base64,{compressed_base64}"
-        
-        # Calculate compression ratio
-        original_size = len(base64_string)
-        compressed_size = len(compressed_base64)
-        ratio = (1 - compressed_size / original_size) * 100
-        
-        logger.info(f"Image compressed: {original_size} -> {compressed_size} bytes ({ratio:.1f}% reduction)")
-        
-        return compressed_base64_with_prefix
-    except Exception as e:
-        logger.error(f"Error compressing image: {e}")
-        return base64_string  # Return original if compression fails
+    with tracer.span("image.compress", input_bytes=len(base64_string), max_width=max_width, quality=quality) as span:
+        try:
+            # Remove data URI prefix if present
+            if ',' in base64_string:
+                base64_string = base64_string.split(',', 1)[1]
+        
+            # Decode base64 to bytes
+            image_bytes = base64.b64decode(base64_string)
+        
+            # Open image with PIL
+            img = Image.open(io.BytesIO(image_bytes))
+        
+            # Convert RGBA to RGB if necessary
+            if img.mode in ('RGBA', 'LA', 'P'):
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                if img.mode == 'P':
+                    img = img.convert('RGBA')
+                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+                img = background
+        
+            # Resize if image is too large
+            if img.width > max_width:
+                ratio = max_width / img.width
+                new_height = int(img.height * ratio)
+                img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+        
+            # Save to bytes buffer as JPEG
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=quality, optimize=True)
+            buffer.seek(0)
+        
+            # Encode to base64
+            compressed_base64 = base64.b64encode(buffer.read()).decode('utf-8')
+        
+            # Add data URI prefix back for React Native Image component
+            compressed_base64_with_prefix = f"data:image/jpeg;base64,{compressed_base64}"
+        
+            # Calculate compression ratio
+            original_size = len(base64_string)
+            compressed_size = len(compressed_base64)
+            ratio = (1 - compressed_size / original_size) * 100
+        
+            logger.info(f"Image compressed: {original_size} -> {compressed_size} bytes ({ratio:.1f}% reduction)")
+            if span is not None:
+                span.set_attribute("output_bytes", compressed_size)
+        
+            return compressed_base64_with_prefix
+        except Exception as e:
+            logger.error(f"Error compressing image: {e}")
+            return base64_string  # Return original if compression fails
+
+
+# Usernames are matched case-insensitively through the indexed username_lower field
+def normalize_username(username: str) -> str:
+    return username.lower() if username else username
 
 
 # Helper function to normalize phone numbers with +91 country code
@@ -216,7 +297,8 @@ def calculate_delivery_date() -> datetime:
     # Return as naive UTC datetime (MongoDB stores as UTC)
     delivery_datetime_naive_utc = delivery_datetime_utc.replace(tzinfo=None)
     
-    logger.info(f"Order time IST: {now_ist.strftime('%Y-%m-%d %H:%M:%S')} (Hour: {current_hour_ist}) → Delivery date: {delivery_date} → Stored as UTC: {delivery_datetime_naive_utc}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Order time IST: {now_ist.strftime('%Y-%m-%d %H:%M:%S')} (Hour: {current_hour_ist}) → Delivery date: {delivery_date} → Stored as UTC: {delivery_datetime_naive_utc}")
     
     return delivery_datetime_naive_utc
 
@@ -274,47 +356,35 @@ def get_delivery_date_info() -> dict:
 
 
 # Email Helper Function
-def send_email_notification(subject: str, body: str, to_email: str):
-    """Send email notification using SMTP"""
+# Emails are written to the outbox and delivered by a background sender over a
+# pooled SMTP connection, so request handlers never wait on the mail server.
+email_outbox = EmailOutbox(
+    db,
+    pool=SMTPConnectionPool.from_env(),
+    batch_size=int(os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", 20)),
+    poll_interval=float(os.environ.get("EMAIL_OUTBOX_POLL_SECONDS", 5)),
+    tracer=tracer
+)
+
+
+async def send_email_notification(subject: str, body: str, to_email: str):
+    """Queue an email notification for background delivery"""
     try:
-        smtp_server = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
-        smtp_port = int(os.environ.get("SMTP_PORT", 587))
-        smtp_username = os.environ.get("SMTP_USERNAME", "")
-        smtp_password = os.environ.get("SMTP_PASSWORD", "")
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = smtp_username
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        # Add body to email
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Create SMTP session
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()  # Enable TLS encryption
-        server.login(smtp_username, smtp_password)
-        
-        # Send email
-        text = msg.as_string()
-        server.sendmail(smtp_username, to_email, text)
-        server.quit()
-        
-        logger.info(f"Email sent successfully to {to_email}")
+        await email_outbox.enqueue(subject, body, to_email)
         return True
     except Exception as e:
-        logger.error(f"Failed to send email: {str(e)}")
+        logger.error(f"Failed to queue email: {str(e)}")
         return False
 
 
 # Helper Functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt runs in the password_hasher thread pool - always await these
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -328,6 +398,24 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+async def find_token_user(payload: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    """
+    The user a decoded access token belongs to. Tokens carry the user id ("uid"); older tokens only
+    carry the username ("sub"), which is matched case-insensitively and refused if that is ambiguous
+    (usernames differing only by case that predate the unique username_lower index).
+    """
+    if payload.get("uid"):
+        return await db.users.find_one({"id": payload["uid"]}, projection)
+    username = payload.get("sub")
+    if not username:
+        return None
+    matches = await db.users.find({"username_lower": normalize_username(username)}, projection).to_list(2)
+    if len(matches) > 1:
+        logger.warning(f"Token username {username} matches more than one user, refusing it")
+        return None
+    return matches[0] if matches else None
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -336,15 +424,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        role: str = payload.get("role")
-        if username is None:
+        if payload.get("sub") is None:
             raise credentials_exception
-        token_data = TokenData(username=username, role=role)
     except JWTError:
         raise credentials_exception
     
-    user_dict = await db.users.find_one({"username": token_data.username})
+    user_dict = await find_token_user(payload)
     if user_dict is None:
         raise credentials_exception
     
@@ -366,23 +451,20 @@ async def get_current_user_optional(request: Request) -> User | None:
     try:
         # Get token from Authorization header
         auth_header = request.headers.get("Authorization")
-        logger.info(f"get_current_user_optional: auth_header present: {auth_header is not None}")
         if not auth_header or not auth_header.startswith("Bearer "):
-            logger.info("get_current_user_optional: No valid auth header, returning None")
             return None
         
         token = auth_header.split(" ")[1]
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            logger.info("get_current_user_optional: No username in token")
+            logger.debug("get_current_user_optional: No username in token")
             return None
         
-        user_dict = await db.users.find_one({"username": username})
+        user_dict = await find_token_user(payload)
         if user_dict is None:
-            logger.info(f"get_current_user_optional: User {username} not found in DB")
+            logger.debug(f"get_current_user_optional: User {username} not found in DB")
             return None
-        logger.info(f"get_current_user_optional: Found user {username}, role: {user_dict.get('role')}")
         return User(**user_dict)
     except Exception as e:
         logger.error(f"get_current_user_optional error: {str(e)}")
@@ -402,17 +484,18 @@ async def get_current_admin(current_user: User = Depends(get_current_user)) -> U
 @api_router.post("/auth/register", response_model=User)
 async def register(user_data: UserCreate):
     # Check if user exists
-    existing_user = await db.users.find_one({"username": user_data.username})
+    existing_user = await db.users.find_one({"username_lower": normalize_username(user_data.username)})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # Create user
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     
     user_dict = {
         "id": user_id,
         "username": user_data.username,
+        "username_lower": normalize_username(user_data.username),
         "email": user_data.email,
         "phone": normalize_phone_number(user_data.phone) if user_data.phone else None,
         "role": UserRole.CUSTOMER,
@@ -496,13 +579,9 @@ async def register(user_data: UserCreate):
     </html>
     """
     
-    # Send email notification (non-blocking)
-    try:
-        send_email_notification(subject, email_body, admin_email)
-        logger.info(f"Registration email sent for user: {user_data.username}")
-    except Exception as e:
-        logger.error(f"Failed to send registration email: {str(e)}")
-        # Continue even if email fails - don't block registration
+    # Queue email notification (delivered in the background - never blocks registration)
+    if await send_email_notification(subject, email_body, admin_email):
+        logger.info(f"Registration email queued for user: {user_data.username}")
     
     return User(**user_dict)
 
@@ -510,8 +589,11 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_data: UserLogin):
     logger.info(f"Login attempt for username: {user_data.username}")
-    import re
-    user_dict = await db.users.find_one({"username": re.compile(f"^{re.escape(user_data.username)}$", re.IGNORECASE)})
+    matches = await db.users.find({"username_lower": normalize_username(user_data.username)}).to_list(10)
+    if len(matches) > 1:
+        # Usernames differing only by case (see log_duplicate_usernames): only an exact match may log in
+        matches = [user for user in matches if user.get("username") == user_data.username]
+    user_dict = matches[0] if len(matches) == 1 else None
     
     if not user_dict:
         logger.warning(f"User not found: {user_data.username}")
@@ -523,7 +605,8 @@ async def login(user_data: UserLogin):
     
     logger.info(f"User found: {user_data.username}, role: {user_dict.get('role')}, approved: {user_dict.get('is_approved')}")
     
-    if not verify_password(user_data.password, user_dict["hashed_password"]):
+    password_valid, new_hash = await password_hasher.verify_and_update(user_data.password, user_dict["hashed_password"])
+    if not password_valid:
         logger.warning(f"Password verification failed for user: {user_data.username}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -533,6 +616,10 @@ async def login(user_data: UserLogin):
     
     logger.info(f"Password verified for user: {user_data.username}")
     
+    if new_hash:
+        # Stored hash used an old cost factor - upgrade it transparently
+        await db.users.update_one({"id": user_dict["id"]}, {"$set": {"hashed_password": new_hash}})
+    
     # Check if account is active
     if not user_dict.get("is_active", True):
         logger.warning(f"Inactive account login attempt: {user_data.username}")
@@ -551,7 +638,7 @@ async def login(user_data: UserLogin):
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user_dict["username"], "role": user_dict["role"]},
+        data={"sub": user_dict["username"], "uid": user_dict["id"], "role": user_dict["role"]},
         expires_delta=access_token_expires
     )
     logger.info(f"Login successful for user: {user_data.username}")
@@ -565,6 +652,15 @@ async def get_me(current_user: User = Depends(get_current_user)):
 
 
 # Password Reset Routes
+async def find_user_by_identifier(identifier: str):
+    """Resolve a username, else a phone number (any format), through the indexed username_lower/phone fields.
+    A username wins over another user's phone number, whatever order the documents are stored in."""
+    user = await db.users.find_one({"username_lower": normalize_username(identifier)})
+    if user is None and len(re.sub(r'\D', '', identifier or "")) >= 10:
+        user = await db.users.find_one({"phone": normalize_phone_number(identifier)})
+    return user
+
+
 @api_router.post("/auth/request-password-reset")
 async def request_password_reset(request: PasswordResetRequest):
     """
@@ -575,12 +671,7 @@ async def request_password_reset(request: PasswordResetRequest):
     """
     try:
         # Find user by username or phone
-        user = await db.users.find_one({
-            "$or": [
-                {"username": request.identifier},
-                {"phone": request.identifier}
-            ]
-        })
+        user = await find_user_by_identifier(request.identifier)
         
         if not user:
             # Don't reveal if user exists (security best practice)
@@ -650,12 +741,7 @@ async def verify_otp(request: PasswordResetVerifyOTP):
     """
     try:
         # Find user
-        user = await db.users.find_one({
-            "$or": [
-                {"username": request.identifier},
-                {"phone": request.identifier}
-            ]
-        })
+        user = await find_user_by_identifier(request.identifier)
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -729,7 +815,7 @@ async def reset_password(request: PasswordResetComplete):
         )
         
         # Hash new password
-        hashed_password = pwd_context.hash(request.new_password)
+        hashed_password = await get_password_hash(request.new_password)
         
         # Update user password
         await db.users.update_one(
@@ -752,14 +838,14 @@ async def reset_password(request: PasswordResetComplete):
 
 # App Version Route
 @api_router.get("/app-version/latest", response_model=AppVersionInfo)
-async def get_latest_app_version():
+async def get_latest_app_version(response: Response):
     """
     Get latest app version information for update prompts.
     No authentication required - public endpoint.
     Returns the current production version details from database.
     """
-    # Fetch version settings from database
-    settings = await db.settings.find_one({"key": "app_version_settings"})
+    response.headers["Cache-Control"] = PUBLIC_SETTINGS_CACHE_CONTROL
+    settings = (await settings_registry.get()).app_version
     
     if settings:
         return AppVersionInfo(
@@ -785,7 +871,7 @@ async def get_latest_app_version():
 @api_router.get("/admin/settings/app-version")
 async def get_app_version_settings(current_user: User = Depends(get_current_admin)):
     """Get app version settings for admin configuration"""
-    settings = await db.settings.find_one({"key": "app_version_settings"})
+    settings = (await settings_registry.get()).app_version
     
     if settings:
         return {
@@ -839,6 +925,7 @@ async def update_app_version_settings(
         }},
         upsert=True
     )
+    await invalidation_bus.publish_write("settings")
     
     logger.info(f"Admin {current_user.username} updated app version settings: v{latest_version} (code {latest_version_code}), force_update={force_update_enabled}")
     
@@ -1263,23 +1350,13 @@ async def fix_image_prefixes_endpoint(
 
 @api_router.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str):
-    import time
-    
-    # Time the database query
-    start_query = time.time()
+    # Query latency is recorded by the Mongo command metrics (mongo_command_duration_seconds)
     product = await db.products.find_one({"id": product_id})
-    query_time = time.time() - start_query
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
     # Images are now pre-compressed in database, no need to compress on read
-    if product.get("image_base64"):
-        image_size = len(product["image_base64"])
-        logger.info(f"TIMING - Product {product_id}: Query={query_time:.3f}s, ImageSize={image_size} bytes (pre-compressed in DB)")
-    else:
-        logger.info(f"TIMING - Product {product_id}: Query={query_time:.3f}s, No image")
-    
     return Product(**product)
 
 
@@ -1409,15 +1486,12 @@ async def reset_all_stock(
     try:
         from models import StockResetEvent
         
-        # Get all products
-        products = await db.products.find({}).to_list(10000)
-        products_count = len(products)
-        
         # Reset all products closing_stock to 0
-        await db.products.update_many(
+        result = await db.products.update_many(
             {},
             {"$set": {"closing_stock": 0}}
         )
+        products_count = result.matched_count
         
         # Create stock reset event record
         reset_event = {
@@ -1458,6 +1532,54 @@ async def get_stock_reset_history(
         raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
 
 
+@api_router.put("/admin/stock")
+async def update_closing_stock(
+    counts: List[StockCount],
+    current_user: User = Depends(get_current_admin)
+):
+    """Apply closing-stock counts for many products in one bulk write. Each item: {product_id, closing_stock}"""
+    if not counts:
+        raise HTTPException(status_code=400, detail="No stock counts supplied")
+    
+    # A product counted twice keeps its last count (reported in duplicate_product_ids)
+    result = await apply_stock_counts(db, [(count.product_id, count.closing_stock) for count in counts])
+    
+    logger.info(f"Admin {current_user.username} updated closing stock for {result['matched']} products")
+    return {"message": f"Updated closing stock for {result['matched']} products", **result}
+
+
+@api_router.post("/admin/stock/snapshots")
+async def capture_stock_snapshot(current_user: User = Depends(get_current_admin)):
+    """Capture (or re-capture) today's closing-stock snapshot now"""
+    snapshot = await stock_snapshots.capture(taken_by=current_user.username, source="manual")
+    return {"date": snapshot["date"], "taken_at": snapshot["taken_at"], "products_count": len(snapshot["items"])}
+
+
+@api_router.get("/admin/stock/snapshots")
+async def list_stock_snapshots(
+    limit: int = 30,
+    current_user: User = Depends(get_current_admin)
+):
+    """Most recent snapshots, without their items"""
+    limit = min(max(limit, 1), 366)
+    return await stock_snapshots.collection.aggregate([
+        {"$sort": {"date": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "date": 1, "taken_at": 1, "taken_by": 1, "source": 1, "products_count": {"$size": "$items"}}}
+    ]).to_list(limit)
+
+
+@api_router.get("/admin/stock/snapshots/{snapshot_date}")
+async def get_stock_snapshot(
+    snapshot_date: str,
+    current_user: User = Depends(get_current_admin)
+):
+    snapshot = await stock_snapshots.collection.find_one({"date": snapshot_date}, {"_id": 0})
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="No stock snapshot for that date")
+    return snapshot
+
+
 # Product Code Mapping Endpoints
 @api_router.get("/admin/product-codes")
 async def get_product_codes(current_user: User = Depends(get_current_admin)):
@@ -1521,29 +1643,13 @@ async def create_payment_order(
     current_user: User = Depends(get_current_user)
 ):
     try:
-        # Enhanced debug logging
-        logger.info(f"🔍🔍🔍 PAYMENT REQUEST DEBUG START 🔍🔍🔍")
-        logger.info(f"🔍 transaction_type: {payment_data.transaction_type} (type: {type(payment_data.transaction_type)})")
-        logger.info(f"🔍 amount: {payment_data.amount}")
-        logger.info(f"🔍 has_notes: {payment_data.notes is not None}")
-        logger.info(f"🔍 user_id: {current_user.id}")
-        logger.info(f"🔍 username: {current_user.username}")
-        
-        if payment_data.notes:
-            logger.info(f"🔍 Notes keys: {list(payment_data.notes.keys())}")
-            logger.info(f"🔍 Notes content (first 500 chars): {str(payment_data.notes)[:500]}")
-            if 'order_data' in payment_data.notes:
-                order_data = payment_data.notes['order_data']
-                logger.info(f"🔍 Order data found!")
-                logger.info(f"🔍 Order customer_id: {order_data.get('customer_id')}")
-                logger.info(f"🔍 Order items count: {len(order_data.get('items', []))}")
-                logger.info(f"🔍 Order total_amount: {order_data.get('total_amount')}")
-            else:
-                logger.warning(f"⚠️ No order_data in notes! This will be treated as wallet topup!")
-        else:
-            logger.warning(f"⚠️ No notes provided! This will be treated as wallet topup!")
-        
-        logger.info(f"🔍🔍🔍 PAYMENT REQUEST DEBUG END 🔍🔍🔍")
+        order_data = (payment_data.notes or {}).get("order_data")
+        logger.info(
+            f"Creating payment order: type={payment_data.transaction_type}, amount={payment_data.amount}, "
+            f"user={current_user.username}, order_items={len(order_data.get('items', [])) if order_data else 0}"
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Payment order notes (first 500 chars): {str(payment_data.notes)[:500]}")
         
         # Create transaction record first
         transaction_id = str(uuid.uuid4())
@@ -1607,47 +1713,15 @@ async def create_payment_order(
         
         logger.info(f"Creating payment link with data: amount={payment_link_data['amount']}, callback={payment_link_data['callback_url']}")
         
-        # Retry logic for handling transient connection errors
-        max_retries = 3
-        retry_delay = 1  # seconds
-        payment_link = None
-        
-        for attempt in range(max_retries):
-            try:
-                # Call Razorpay API with timeout handling
-                payment_link = razorpay_client.payment_link.create(payment_link_data)
-                logger.info(f"Payment link created successfully: {payment_link.get('id')}")
-                break  # Success, exit retry loop
-            except Exception as razorpay_error:
-                error_type = type(razorpay_error).__name__
-                error_msg = str(razorpay_error)
-                
-                # Check if it's a connection-related error that we should retry
-                is_connection_error = (
-                    'ConnectionResetError' in error_type or
-                    'ConnectionResetError' in error_msg or
-                    'Connection reset' in error_msg or
-                    'Connection aborted' in error_msg
-                )
-                
-                if is_connection_error and attempt < max_retries - 1:
-                    # Transient connection error, retry
-                    logger.warning(f"Attempt {attempt + 1}/{max_retries}: Connection error, retrying in {retry_delay}s... Error: {error_msg}")
-                    import time
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    # Non-retryable error or final attempt failed
-                    logger.error(f"Razorpay API error after {attempt + 1} attempts: {error_type} - {error_msg}")
-                    raise HTTPException(
-                        status_code=503, 
-                        detail=f"Payment gateway temporarily unavailable. Please try again in a moment."
-                    )
-        
-        if not payment_link:
+        # Gateway handles pooled connections, timeouts, jittered retries and circuit breaking
+        try:
+            payment_link = await razorpay_gateway.create_payment_link(payment_link_data)
+            logger.info(f"Payment link created successfully: {payment_link.get('id')}")
+        except PaymentGatewayError as razorpay_error:
+            logger.error(f"Razorpay API error: {razorpay_error}")
             raise HTTPException(
                 status_code=503,
-                detail="Failed to create payment link after multiple attempts. Please try again."
+                detail="Payment gateway temporarily unavailable. Please try again in a moment."
             )
         
         # Create transaction record
@@ -1674,137 +1748,314 @@ async def create_payment_order(
             "transaction_id": transaction_id
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating payment link: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Payment state transitions
+async def apply_paid_transaction(transaction_filter: dict, extra_fields: dict) -> Optional[dict]:
+    """
+    Move a transaction from PENDING to SUCCESS and credit a top-up exactly once
+    (see payment_transitions.py). Returns None if no PENDING transaction matched.
+    """
+    return await payment_transitions.apply_paid_transaction(db, transaction_filter, extra_fields)
+
+
+async def create_order_for_paid_transaction(transaction: dict):
+    """
+    Create the order paid for by an ORDER_PAYMENT transaction.
+    The order id is derived from the transaction id so a retried webhook can never create it twice.
+    """
+    order_data = (transaction.get("notes") or {}).get("order_data")
+    if not order_data:
+        logger.error("Order data not found in transaction notes")
+        return
+    
+    order_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"divine-cakery/transaction/{transaction['id']}"))
+    
+    # Calculate delivery date using backend logic (IST timezone)
+    # This ensures consistent delivery date calculation regardless of customer's device timezone
+    delivery_date = calculate_delivery_date()
+    
+    # Create order document
+    order_dict = {
+        "id": order_id,
+        "customer_id": order_data.get("customer_id"),  # Primary field
+        "user_id": order_data.get("customer_id"),  # Backward compatibility
+        "items": order_data["items"],
+        "total_amount": order_data["total_amount"],
+        "delivery_date": delivery_date,  # Always use backend-calculated date
+        "delivery_address": order_data.get("delivery_address"),
+        "delivery_notes": order_data.get("delivery_notes"),
+        "notes": order_data.get("notes"),
+        "order_type": order_data.get("order_type", "delivery"),  # Use order_type instead of onsite_pickup
+        "payment_method": order_data.get("payment_method", "razorpay"),
+        "payment_status": "paid",
+        "order_status": OrderStatus.PENDING,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
+    
+    # Insert order (no-op if a previous attempt already inserted it)
+    result = await db.orders.update_one({"id": order_id}, {"$setOnInsert": order_dict}, upsert=True)
+    
+    # Number it only once it exists, so retries don't burn order numbers. The $exists guard
+    # also numbers an order whose first attempt died between the insert and this update.
+    numbered = result.upserted_id is not None or await db.orders.find_one(
+        {"id": order_id, "order_number": {"$exists": False}}, {"_id": 1}
+    )
+    order_number = None
+    if numbered:
+        order_number = await generate_order_number()
+        await db.orders.update_one(
+            {"id": order_id, "order_number": {"$exists": False}},
+            {"$set": {"order_number": order_number}}
+        )
+    # Not appended as an insert: a read between the upsert and the numbering may have cached it unnumbered
+    await orders_written([delivery_date])
+    
+    # Mark transaction as having created an order
+    await db.transactions.update_one(
+        {"id": transaction["id"]},
+        {"$set": {"order_created": True, "order_id": order_id}}
+    )
+    
+    logger.info(f"✅ Order created successfully after payment: order_id={order_id}, order_number={order_number}, customer_id={order_data['customer_id']}")
+
+
+async def process_payment_webhook(payload: dict):
+    """Apply a Razorpay webhook event. Called by the payment inbox worker, never inline."""
+    event = payload.get("event")
+    if event != "payment_link.paid":
+        logger.info(f"Unhandled webhook event: {event}")
+        return
+    
+    payment_entity = payload.get("payload", {}).get("payment_link", {}).get("entity", {})
+    payment_link_id = payment_entity.get("id")
+    reference_id = payment_entity.get("reference_id")
+    amount = payment_entity.get("amount", 0) / 100  # Convert from paise
+    
+    logger.info(f"Payment link paid: link_id={payment_link_id}, reference_id={reference_id}, amount={amount}")
+    
+    # Find transaction by payment link ID or reference ID
+    transaction_filter = {
+        "$or": [
+            {"razorpay_payment_link_id": payment_link_id},
+            {"id": reference_id}
+        ]
+    }
+    transaction = await apply_paid_transaction(transaction_filter, {"razorpay_payment_link_id": payment_link_id})
+    
+    if not transaction:
+        transaction = await db.transactions.find_one(transaction_filter)
+        if not transaction:
+            # May arrive before create_payment_order stored the transaction - the inbox retries
+            raise LookupError(f"Transaction not found for payment_link_id: {payment_link_id}")
+        if transaction.get("status") != TransactionStatus.SUCCESS:
+            logger.warning(f"Transaction {transaction['id']} is {transaction.get('status')}, ignoring paid webhook")
+            return
+        logger.info(f"⚠️ Transaction {transaction['id']} already marked paid, skipping wallet credit")
+    
+    # Order creation is idempotent, so it is safe even if callback/verify won the transition
+    if transaction["transaction_type"] == TransactionType.ORDER_PAYMENT and not transaction.get("order_created"):
+        await create_order_for_paid_transaction(transaction)
+
+
+payment_inbox = PaymentInbox(
+    db,
+    handler=process_payment_webhook,
+    recover=lambda: payment_transitions.finish_pending_wallet_credits(db)
+)
+
+
 @api_router.post("/payments/webhook")
 async def payment_webhook(request: Request):
     """
     Razorpay webhook endpoint - receives payment notifications from Razorpay
-    This is the proper way to handle payment confirmations
+    The event is written to the inbox and acknowledged immediately; the inbox worker
+    applies it in the background. Duplicate deliveries of the same event are ignored.
     """
+    body = await request.body()
     try:
-        # Get webhook payload
-        payload = await request.json()
-        logger.info(f"Webhook received: {payload.get('event', 'unknown event')}")
-        
-        event = payload.get("event")
-        payment_entity = payload.get("payload", {}).get("payment_link", {}).get("entity", {})
-        
-        if event == "payment_link.paid":
-            payment_link_id = payment_entity.get("id")
-            reference_id = payment_entity.get("reference_id")
-            amount = payment_entity.get("amount", 0) / 100  # Convert from paise
-            
-            logger.info(f"Payment link paid: link_id={payment_link_id}, reference_id={reference_id}, amount={amount}")
-            
-            # Find transaction by payment link ID or reference ID
-            transaction = await db.transactions.find_one({
-                "$or": [
-                    {"razorpay_payment_link_id": payment_link_id},
-                    {"id": reference_id}
-                ]
-            })
-            
-            if not transaction:
-                logger.error(f"Transaction not found for payment_link_id: {payment_link_id}")
-                return {"status": "error", "message": "Transaction not found"}
-            
-            # Update transaction status
-            await db.transactions.update_one(
-                {"id": transaction["id"]},
-                {
-                    "$set": {
-                        "razorpay_payment_link_id": payment_link_id,
-                        "status": TransactionStatus.SUCCESS,
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
-            
-            # Handle different transaction types
-            if transaction["transaction_type"] == TransactionType.WALLET_TOPUP:
-                # Only update wallet if not already processed (prevent double-credit)
-                if transaction.get("status") != TransactionStatus.SUCCESS:
-                    user_id = transaction["user_id"]
-                    amount = transaction["amount"]
-                    
-                    # Update wallet balance
-                    await db.wallets.update_one(
-                        {"user_id": user_id},
-                        {
-                            "$inc": {"balance": amount},
-                            "$set": {"updated_at": datetime.utcnow()}
-                        }
-                    )
-                    
-                    # Update user's wallet balance
-                    await db.users.update_one(
-                        {"id": user_id},
-                        {"$inc": {"wallet_balance": amount}}
-                    )
-                    
-                    logger.info(f"✅ Wallet updated successfully: user_id={user_id}, amount={amount}")
-                else:
-                    logger.info(f"⚠️ Wallet already updated for transaction {transaction['id']}, skipping duplicate")
-            
-            elif transaction["transaction_type"] == TransactionType.ORDER_PAYMENT:
-                # Create the order after successful payment
-                order_data = transaction.get("notes", {}).get("order_data")
-                
-                if order_data:
-                    # Generate order number
-                    order_number = await generate_order_number()
-                    order_id = str(uuid.uuid4())
-                    
-                    # Calculate delivery date using backend logic (IST timezone)
-                    # This ensures consistent delivery date calculation regardless of customer's device timezone
-                    delivery_date = calculate_delivery_date()
-                    
-                    # Create order document
-                    order_dict = {
-                        "id": order_id,
-                        "order_number": order_number,
-                        "customer_id": order_data.get("customer_id"),  # Primary field
-                        "user_id": order_data.get("customer_id"),  # Backward compatibility
-                        "items": order_data["items"],
-                        "total_amount": order_data["total_amount"],
-                        "delivery_date": delivery_date,  # Always use backend-calculated date
-                        "delivery_address": order_data.get("delivery_address"),
-                        "delivery_notes": order_data.get("delivery_notes"),
-                        "notes": order_data.get("notes"),
-                        "order_type": order_data.get("order_type", "delivery"),  # Use order_type instead of onsite_pickup
-                        "payment_method": order_data.get("payment_method", "razorpay"),
-                        "payment_status": "paid",
-                        "order_status": OrderStatus.PENDING,
-                        "created_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
-                    }
-                    
-                    # Insert order
-                    await db.orders.insert_one(order_dict)
-                    
-                    # Mark transaction as having created an order
-                    await db.transactions.update_one(
-                        {"id": transaction["id"]},
-                        {"$set": {"order_created": True, "order_id": order_id}}
-                    )
-                    
-                    logger.info(f"✅ Order created successfully after payment: order_id={order_id}, order_number={order_number}, customer_id={order_data['customer_id']}")
-                else:
-                    logger.error("Order data not found in transaction notes")
-            
-            return {"status": "success", "message": "Payment processed"}
-        
-        else:
-            logger.info(f"Unhandled webhook event: {event}")
-            return {"status": "ok", "message": "Event received"}
+        payload = json.loads(body)
+    except ValueError:
+        logger.error("Webhook received with invalid JSON body")
+        return {"status": "error", "message": "Invalid payload"}
     
-    except Exception as e:
-        logger.error(f"Error processing webhook: {str(e)}")
-        return {"status": "error", "message": str(e)}
+    event_id = webhook_event_id(request.headers, body)
+    queued = await payment_inbox.enqueue(event_id, payload)
+    logger.info(f"Webhook received: {payload.get('event', 'unknown event')} ({event_id}, queued={queued})")
+    
+    return {"status": "ok", "message": "Event received" if queued else "Duplicate event ignored"}
+
+
+@api_router.get("/admin/payments/inbox-stats")
+async def get_payment_inbox_stats(current_user: User = Depends(get_current_admin)):
+    """Webhook inbox depth and processing lag"""
+    return await payment_inbox.stats()
+
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_query_report(
+    hours: int = 24,
+    limit: int = 20,
+    current_user: User = Depends(get_current_admin)
+):
+    """
+    Worst query shapes by total time over the last `hours`, from the capped slow_queries collection.
+    collscan=True means a sampled explain found a full collection scan - the shape needs an index.
+    """
+    since = datetime.utcnow() - timedelta(hours=hours)
+    shapes = await db.slow_queries.aggregate([
+        {"$match": {"at": {"$gte": since}}},
+        {"$sort": {"at": -1}},
+        {"$group": {
+            "_id": {"collection": "$collection", "command": "$command", "shape": "$shape"},
+            "count": {"$sum": 1},
+            "total_ms": {"$sum": "$duration_ms"},
+            "max_ms": {"$max": "$duration_ms"},
+            "collscan": {"$max": {"$ifNull": ["$collscan", False]}},
+            "last_seen": {"$first": "$at"},
+            "latest_explain": {"$first": "$explain"}
+        }},
+        {"$sort": {"total_ms": -1}},
+        {"$limit": limit}
+    ]).to_list(limit)
+    return {
+        "threshold_ms": slow_query_monitor.threshold_ms,
+        "hours": hours,
+        "shapes": [
+            {
+                "collection": s["_id"]["collection"],
+                "command": s["_id"]["command"],
+                "shape": s["_id"]["shape"],
+                "count": s["count"],
+                "total_ms": round(s["total_ms"], 2),
+                "avg_ms": round(s["total_ms"] / s["count"], 2),
+                "max_ms": s["max_ms"],
+                "collscan": s["collscan"],
+                "last_seen": s["last_seen"],
+                "explain": s.get("latest_explain")
+            }
+            for s in shapes
+        ]
+    }
+
+
+async def load_runtime_logging_config():
+    """Apply the levels/sampling saved through /api/admin/logging (shared by every worker)"""
+    config = await db.logging_config.find_one({"_id": "runtime"})
+    if not config:
+        return
+    log_pipeline.apply(
+        {entry["logger"]: entry["level"] for entry in config.get("levels", [])},
+        {entry["logger"]: entry["rate"] for entry in config.get("sampling", [])}
+    )
+
+
+@api_router.get("/admin/logging")
+async def get_logging_config(current_user: User = Depends(get_current_admin)):
+    """Current log levels, sample rates and queue stats (this worker)"""
+    return {**log_pipeline.snapshot(), **log_pipeline.stats()}
+
+
+@api_router.put("/admin/logging")
+async def update_logging_config(
+    config_update: dict = Body(...),
+    current_user: User = Depends(get_current_admin)
+):
+    """
+    Change log levels and per-logger sampling at runtime, e.g.
+    {"levels": {"server": "DEBUG"}, "sampling": {"server": 0.1}}.
+    Each key replaces the whole mapping; omitted keys are left unchanged. Applies to every worker.
+    """
+    if current_user.admin_access_level != "full":
+        raise HTTPException(status_code=403, detail="Only full-access admins can change logging")
+    levels = config_update.get("levels")
+    sampling = config_update.get("sampling")
+    if levels is not None and not isinstance(levels, dict):
+        raise HTTPException(status_code=400, detail="levels must be an object of logger name -> level")
+    if sampling is not None and (
+        not isinstance(sampling, dict)
+        or not all(isinstance(rate, (int, float)) and 0 <= rate <= 1 for rate in sampling.values())
+    ):
+        raise HTTPException(status_code=400, detail="sampling must be an object of logger name -> rate between 0 and 1")
+    try:
+        log_pipeline.apply(levels, sampling)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    snapshot = log_pipeline.snapshot()
+    # Logger names contain dots, so they are stored as values rather than field names
+    await db.logging_config.update_one(
+        {"_id": "runtime"},
+        {"$set": {
+            "levels": [{"logger": name, "level": level} for name, level in snapshot["levels"].items()],
+            "sampling": [{"logger": name, "rate": rate} for name, rate in snapshot["sampling"].items()],
+            "updated_at": datetime.utcnow(),
+            "updated_by": current_user.username
+        }},
+        upsert=True
+    )
+    await invalidation_bus.publish_write("logging_config")
+    logger.warning(f"Logging config changed by {current_user.username}: levels={snapshot['levels']}, sampling={snapshot['sampling']}")
+    return snapshot
+
+
+@api_router.get("/admin/event-loop/blocking")
+async def get_event_loop_blocking_report(limit: int = 10, current_user: User = Depends(get_current_admin)):
+    """Loop lag percentiles and the call sites that blocked the event loop longest (this worker only)"""
+    return {**loop_watchdog.stats(), "sites": loop_watchdog.top_sites(limit)}
+
+
+@api_router.get("/admin/profiles")
+async def list_request_profiles(limit: int = 50, current_user: User = Depends(get_current_admin)):
+    """Most recent X-Profile captures (metadata only)"""
+    if current_user.admin_access_level != "full":
+        raise HTTPException(status_code=403, detail="Only full-access admins can view request profiles")
+    return await db.request_profiles.find(
+        {}, {"_id": 0, "html": 0, "pstats": 0}
+    ).sort("$natural", -1).limit(limit).to_list(limit)
+
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_request_profile(
+    profile_id: str,
+    format: str = "html",
+    current_user: User = Depends(get_current_admin)
+):
+    """Download a request profile as HTML (viewable in a browser) or pstats (cProfile captures only)"""
+    if current_user.admin_access_level != "full":
+        raise HTTPException(status_code=403, detail="Only full-access admins can view request profiles")
+    if format not in ("html", "pstats"):
+        raise HTTPException(status_code=400, detail="format must be 'html' or 'pstats'")
+
+    profile = await db.request_profiles.find_one({"id": profile_id}, {"_id": 0})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    if format == "pstats":
+        if profile["profiler"] != "cprofile":
+            raise HTTPException(status_code=400, detail="pstats is only available for profiles captured with 'X-Profile: cprofile'")
+        return Response(
+            content=profile["pstats"],
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'}
+        )
+
+    if profile["profiler"] == "cprofile":
+        title = f"{profile['method']} {profile['path']} - {profile['duration_ms']} ms"
+        return HTMLResponse(content=pstats_html(profile["pstats"], title))
+    return HTMLResponse(content=profile["html"])
+
+
+@api_router.get("/admin/email/outbox-stats")
+async def get_email_outbox_stats(current_user: User = Depends(get_current_admin)):
+    """Email outbox queue depth and delivery counters"""
+    return await email_outbox.stats()
 
 
 @api_router.get("/payments/callback")
@@ -1826,64 +2077,38 @@ async def payment_callback(
         logger.info(f"Payment callback: payment_id={razorpay_payment_id}, link_id={razorpay_payment_link_id}, status={razorpay_payment_link_status}")
         
         if razorpay_payment_link_status == "paid":
-            # Find transaction by payment link ID
-            transaction = await db.transactions.find_one({
-                "razorpay_payment_link_id": razorpay_payment_link_id
-            })
+            # Mark transaction paid (credits the wallet only if this call wins the transition)
+            transaction = await apply_paid_transaction(
+                {"razorpay_payment_link_id": razorpay_payment_link_id},
+                {"razorpay_payment_id": razorpay_payment_id}
+            )
             
             if not transaction:
-                logger.error(f"Transaction not found for payment_link_id: {razorpay_payment_link_id}")
-                return RedirectResponse(url="/payment-failed")
-            
-            # Update transaction status
-            await db.transactions.update_one(
-                {"id": transaction["id"]},
-                {
-                    "$set": {
-                        "razorpay_payment_id": razorpay_payment_id,
-                        "status": TransactionStatus.SUCCESS,
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
+                existing = await db.transactions.find_one(
+                    {"razorpay_payment_link_id": razorpay_payment_link_id},
+                    {"_id": 0, "id": 1}
+                )
+                if not existing:
+                    logger.error(f"Transaction not found for payment_link_id: {razorpay_payment_link_id}")
+                    return RedirectResponse(url="/payment-failed")
+                logger.info(f"⚠️ Callback: Wallet already updated for transaction {existing['id']}, skipping duplicate")
             
-            # Update wallet if wallet topup (only if not already processed)
-            if transaction["transaction_type"] == TransactionType.WALLET_TOPUP:
-                if transaction.get("status") != TransactionStatus.SUCCESS:
-                    user_id = transaction["user_id"]
-                    amount = transaction["amount"]
-                    
-                    # Update wallet balance
-                    await db.wallets.update_one(
-                        {"user_id": user_id},
-                        {
-                            "$inc": {"balance": amount},
-                            "$set": {"updated_at": datetime.utcnow()}
-                        }
-                    )
-                    
-                    # Update user's wallet balance
-                    await db.users.update_one(
-                        {"id": user_id},
-                        {"$inc": {"wallet_balance": amount}}
-                    )
-                    
-                    # Get user details for notification
-                    user = await db.users.find_one({"id": user_id})
-                    
-                    # Send WhatsApp confirmation if phone available
-                    if user and user.get("phone"):
-                        phone = user["phone"]
-                        # Normalize phone number
-                        phone_normalized = normalize_phone_number(phone).replace("+", "")
-                        message = f"✅ Payment Successful! ₹{amount:.2f} has been added to your Divine Cakery wallet. Thank you!"
-                        
-                        # Log for now (WhatsApp integration can be added later)
-                        logger.info(f"Would send WhatsApp to {phone_normalized}: {message}")
+            elif transaction["transaction_type"] == TransactionType.WALLET_TOPUP:
+                user_id = transaction["user_id"]
+                amount = transaction["amount"]
+                
+                # Get user details for notification
+                user = await db.users.find_one({"id": user_id}, {"_id": 0, "phone": 1})
+                
+                # Send WhatsApp confirmation if phone available
+                if user and user.get("phone"):
+                    phone = user["phone"]
+                    # Normalize phone number
+                    phone_normalized = normalize_phone_number(phone).replace("+", "")
+                    message = f"✅ Payment Successful! ₹{amount:.2f} has been added to your Divine Cakery wallet. Thank you!"
                     
-                    logger.info(f"Wallet updated: user_id={user_id}, amount={amount}")
-                else:
-                    logger.info(f"⚠️ Callback: Wallet already updated for transaction {transaction['id']}, skipping duplicate")
+                    # Log for now (WhatsApp integration can be added later)
+                    logger.info(f"Would send WhatsApp to {phone_normalized}: {message}")
             
             # Return success page or redirect
             return {"status": "success", "message": "Payment successful and wallet updated"}
@@ -1914,42 +2139,20 @@ async def verify_payment(
         if not hmac.compare_digest(expected_signature, verification_data.razorpay_signature):
             return {"verified": False, "message": "Invalid signature"}
         
-        # Update transaction
-        transaction = await db.transactions.find_one({
-            "razorpay_order_id": verification_data.razorpay_order_id
-        })
-        
-        if not transaction:
-            raise HTTPException(status_code=404, detail="Transaction not found")
-        
-        await db.transactions.update_one(
-            {"id": transaction["id"]},
-            {
-                "$set": {
-                    "razorpay_payment_id": verification_data.razorpay_payment_id,
-                    "status": TransactionStatus.SUCCESS
-                }
-            }
+        # Mark transaction paid (credits the wallet only if this call wins the transition)
+        transaction = await apply_paid_transaction(
+            {"razorpay_order_id": verification_data.razorpay_order_id},
+            {"razorpay_payment_id": verification_data.razorpay_payment_id}
         )
         
-        # Update wallet if wallet topup (only if not already processed)
-        if transaction["transaction_type"] == TransactionType.WALLET_TOPUP:
-            if transaction.get("status") != TransactionStatus.SUCCESS:
-                await db.wallets.update_one(
-                    {"user_id": current_user.id},
-                    {
-                        "$inc": {"balance": transaction["amount"]},
-                        "$set": {"updated_at": datetime.utcnow()}
-                    }
-                )
-                
-                # Update user's wallet balance
-                await db.users.update_one(
-                    {"id": current_user.id},
-                    {"$inc": {"wallet_balance": transaction["amount"]}}
-                )
-            else:
-                logger.info(f"⚠️ Verify: Wallet already updated for transaction {transaction['id']}, skipping duplicate")
+        if not transaction:
+            transaction = await db.transactions.find_one(
+                {"razorpay_order_id": verification_data.razorpay_order_id},
+                {"_id": 0, "id": 1}
+            )
+            if not transaction:
+                raise HTTPException(status_code=404, detail="Transaction not found")
+            logger.info(f"⚠️ Verify: Wallet already updated for transaction {transaction['id']}, skipping duplicate")
         
         return {
             "verified": True,
@@ -1957,6 +2160,8 @@ async def verify_payment(
             "transaction_id": transaction["id"]
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error verifying payment: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2021,23 +2226,24 @@ async def create_order(
         if current_user.user_type == "order_agent" and current_user.linked_owner_id:
             wallet_user_id = current_user.linked_owner_id
         
-        wallet = await db.wallets.find_one({"user_id": wallet_user_id})
-        if not wallet or wallet["balance"] < order_data.total_amount:
-            raise HTTPException(status_code=400, detail="Insufficient wallet balance")
-        
-        # Deduct from wallet (owner's wallet for order agents)
-        await db.wallets.update_one(
-            {"user_id": wallet_user_id},
-            {
-                "$inc": {"balance": -order_data.total_amount},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
-        
-        await db.users.update_one(
-            {"id": wallet_user_id},
-            {"$inc": {"wallet_balance": -order_data.total_amount}}
-        )
+        with tracer.span("checkout.wallet"):
+            wallet = await db.wallets.find_one({"user_id": wallet_user_id})
+            if not wallet or wallet["balance"] < order_data.total_amount:
+                raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+            
+            # Deduct from wallet (owner's wallet for order agents)
+            await db.wallets.update_one(
+                {"user_id": wallet_user_id},
+                {
+                    "$inc": {"balance": -order_data.total_amount},
+                    "$set": {"updated_at": datetime.utcnow()}
+                }
+            )
+            
+            await db.users.update_one(
+                {"id": wallet_user_id},
+                {"$inc": {"wallet_balance": -order_data.total_amount}}
+            )
         
         payment_status = "completed"
     else:
@@ -2049,15 +2255,17 @@ async def create_order(
     # STANDING ORDER OVERRIDE: Delete auto-generated standing order for this customer on this delivery date
     # Manual customer orders take precedence over auto-generated ones
     delivery_date_only = delivery_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    await db.orders.delete_many({
-        "user_id": current_user.id,
-        "delivery_date": delivery_date_only,
-        "is_standing_order": True
-    })
+    with tracer.span("checkout.standing_order_cleanup"):
+        replaced = await db.orders.delete_many({
+            "user_id": current_user.id,
+            "delivery_date": delivery_date_only,
+            "is_standing_order": True
+        })
     
     # Create order with both UUID id and sequential order_number
     order_id = str(uuid.uuid4())
-    order_number = await generate_order_number()
+    with tracer.span("checkout.order_number"):
+        order_number = await generate_order_number()
     order_dict = {
         "id": order_id,
         "order_number": order_number,
@@ -2080,7 +2288,10 @@ async def create_order(
         "updated_at": datetime.utcnow()
     }
     
-    await db.orders.insert_one(order_dict)
+    with tracer.span("checkout.insert_order"):
+        await db.orders.insert_one(order_dict)
+    # A replaced standing order means the day's cached lines must be reloaded, not appended to
+    await orders_written([delivery_date], inserted=None if replaced.deleted_count else [order_dict])
     
     # Create transaction record for wallet payment
     if order_data.payment_method == "wallet":
@@ -2094,7 +2305,8 @@ async def create_order(
             "notes": {"order_id": order_id},
             "created_at": datetime.utcnow()
         }
-        await db.transactions.insert_one(transaction_dict)
+        with tracer.span("checkout.transaction"):
+            await db.transactions.insert_one(transaction_dict)
     
     return Order(**order_dict)
 
@@ -2170,6 +2382,8 @@ async def admin_place_order(
     }
 
     await db.orders.insert_one(order_dict)
+    # Admins may backdate an order onto a day whose reports are already snapshotted
+    await orders_written([delivery_date], inserted=[order_dict])
     order_dict.pop("_id", None)
     logger.info(f"Admin {current_user.username} placed order {order_number} for customer {customer.get('username', customer_id)}")
     return order_dict
@@ -2219,6 +2433,7 @@ async def admin_record_payment(
     }).sort("created_at", 1).to_list(500)
 
     settled_count = 0
+    settled_dates = []
     for order in pending_orders:
         if remaining <= 0:
             break
@@ -2230,8 +2445,10 @@ async def admin_record_payment(
             )
             remaining -= order_amt
             settled_count += 1
+            settled_dates.append(order.get("delivery_date"))
         else:
             break
+    await orders_written(settled_dates)
 
     logger.info(f"Admin {current_user.username} recorded payment {amount} for customer {customer.get('username')}, settled {settled_count} orders")
 
@@ -2282,23 +2499,17 @@ async def get_customer_balance(
 @api_router.delete("/admin/orders/cleanup")
 async def delete_old_orders(current_user: User = Depends(get_current_admin)):
     """
-    Admin endpoint to delete orders older than 7 days.
-    WARNING: This permanently deletes data!
+    Admin endpoint to move settled orders delivered before the retention horizon
+    (ORDER_ARCHIVE_AFTER_DAYS) into orders_archive now instead of waiting for the nightly job.
+    Nothing is deleted: history endpoints and past reports still read archived orders.
     """
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    
-    # Count orders to be deleted
-    count_to_delete = await db.orders.count_documents({"created_at": {"$lt": seven_days_ago}})
-    
-    # Delete old orders
-    result = await db.orders.delete_many({"created_at": {"$lt": seven_days_ago}})
-    
-    logger.info(f"Deleted {result.deleted_count} orders older than 7 days")
+    moved = await order_archive.archive()
+    logger.info(f"Admin {current_user.username} archived {moved} orders delivered before {order_archive.horizon().date()}")
     
     return {
         "success": True,
-        "message": f"Deleted {result.deleted_count} orders older than 7 days",
-        "deleted_count": result.deleted_count
+        "message": f"Archived {moved} orders delivered more than {order_archive.retention_days} days ago",
+        "archived_count": moved
     }
 
 @api_router.delete("/admin/orders/{order_id}")
@@ -2314,6 +2525,7 @@ async def delete_order_by_admin(
     result = await db.orders.delete_one({"id": order_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=500, detail="Failed to delete order")
+    await orders_written([order.get("delivery_date")])
     
     logger.info(f"Admin {current_user.username} deleted order #{order.get('order_number', order_id)}")
     return {"success": True, "message": f"Order #{order.get('order_number', order_id)} deleted"}
@@ -2322,16 +2534,21 @@ async def delete_order_by_admin(
 @api_router.get("/orders")
 async def get_orders(
     delivery_date: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = 100,
     current_user: User = Depends(get_current_user)
 ):
-    """Get orders for the current user. When filtering by delivery_date, show all orders for that date."""
+    """Get orders for the current user. When filtering by delivery_date, show all orders for that date.
+    Older history: pass `before` (created_at of the last order shown) to get the next `limit` orders,
+    including archived ones.
+    """
     import pytz
     
     # Filter: Only show orders from last 7 days for performance (unless filtering by delivery_date)
     seven_days_ago = datetime.utcnow() - timedelta(days=7)
     
-    # Check if we're filtering by delivery_date
-    filtering_by_delivery_date = delivery_date is not None
+    # Check if we're filtering by delivery_date (or paging through history)
+    filtering_by_delivery_date = delivery_date is not None or before is not None
     
     # Build query based on user role and type
     if current_user.role == UserRole.ADMIN:
@@ -2386,7 +2603,19 @@ async def get_orders(
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format")
     
-    orders = await db.orders.find(query).sort("created_at", -1).to_list(1000)
+    if before:
+        try:
+            before_dt = datetime.fromisoformat(before.replace('Z', '+00:00'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid before timestamp")
+        if before_dt.tzinfo is not None:
+            before_dt = before_dt.astimezone(pytz.UTC).replace(tzinfo=None)
+        query["created_at"] = {"$lt": before_dt}
+        orders = await order_archive.find_orders(query, sort=[("created_at", -1)], limit=min(max(limit, 1), 1000))
+    elif delivery_date and order_archive.reaches(query["delivery_date"]["$gte"]):
+        orders = await order_archive.find_orders(query, sort=[("created_at", -1)], limit=1000)
+    else:
+        orders = await db.orders.find(query).sort("created_at", -1).to_list(1000)
     
     # IST timezone for delivery date conversion
     ist = pytz.timezone('Asia/Kolkata')
@@ -2460,7 +2689,7 @@ async def get_orders(
 
 @api_router.get("/orders/{order_id}")
 async def get_order(order_id: str, current_user: User = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id})
+    order = await db.orders.find_one({"id": order_id}) or await order_archive.find_one({"id": order_id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -2539,6 +2768,7 @@ async def update_order(
     update_data["updated_at"] = datetime.utcnow()
     
     await db.orders.update_one({"id": order_id}, {"$set": update_data})
+    await orders_written([order.get("delivery_date"), update_data.get("delivery_date")])
     
     updated_order = await db.orders.find_one({"id": order_id})
     updated_order.pop('_id', None)
@@ -2626,7 +2856,7 @@ async def create_user_by_admin(
     current_user: User = Depends(get_current_admin)
 ):
     # Check if user exists
-    existing_user = await db.users.find_one({"username": user_data.username})
+    existing_user = await db.users.find_one({"username_lower": normalize_username(user_data.username)})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
@@ -2639,11 +2869,12 @@ async def create_user_by_admin(
     
     # Create user
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     
     user_dict = {
         "id": user_id,
         "username": user_data.username,
+        "username_lower": normalize_username(user_data.username),
         "email": user_data.email,
         "phone": normalize_phone_number(user_data.phone) if user_data.phone else None,
         "role": role,
@@ -2705,10 +2936,11 @@ async def update_user_by_admin(
     
     if user_data.username is not None:
         # Check if new username is taken
-        existing = await db.users.find_one({"username": user_data.username, "id": {"$ne": user_id}})
+        existing = await db.users.find_one({"username_lower": normalize_username(user_data.username), "id": {"$ne": user_id}})
         if existing:
             raise HTTPException(status_code=400, detail="Username already exists")
         update_data["username"] = user_data.username
+        update_data["username_lower"] = normalize_username(user_data.username)
     
     if user_data.email is not None:
         update_data["email"] = user_data.email
@@ -2753,7 +2985,7 @@ async def update_user_by_admin(
     
     # Handle password change
     if user_data.new_password is not None and user_data.new_password.strip():
-        update_data["hashed_password"] = get_password_hash(user_data.new_password)
+        update_data["hashed_password"] = await get_password_hash(user_data.new_password)
         logger.info(f"Password changed for user {user_id} by admin {current_user.username}")
     
     if not update_data:
@@ -2796,17 +3028,18 @@ async def create_order_agent(
         raise HTTPException(status_code=400, detail="This owner already has an order agent")
     
     # Check if username exists
-    existing_user = await db.users.find_one({"username": agent_data.username})
+    existing_user = await db.users.find_one({"username_lower": normalize_username(agent_data.username)})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
     # Create order agent
     agent_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(agent_data.password)
+    hashed_password = await get_password_hash(agent_data.password)
     
     agent_dict = {
         "id": agent_id,
         "username": agent_data.username,
+        "username_lower": normalize_username(agent_data.username),
         "email": agent_data.email,
         "phone": normalize_phone_number(agent_data.phone) if agent_data.phone else None,
         "role": UserRole.CUSTOMER,
@@ -3236,15 +3469,12 @@ async def update_user_allowed_products(
 
 @api_router.get("/admin/stats")
 async def get_admin_stats(current_user: User = Depends(get_current_admin)):
+    # Order counts and revenue cover both tiers (orders and orders_archive)
     total_users = await db.users.count_documents({"role": UserRole.CUSTOMER})
     total_products = await db.products.count_documents({})
     # Exclude cancelled orders from total count
-    total_orders = await db.orders.count_documents({"order_status": {"$ne": OrderStatus.CANCELLED}})
-    pending_orders = await db.orders.count_documents({"order_status": OrderStatus.PENDING})
-    
-    # Calculate total revenue from completed orders (excludes cancelled)
-    completed_orders = await db.orders.find({"payment_status": "completed"}).to_list(10000)
-    total_revenue = sum(order["total_amount"] for order in completed_orders)
+    total_orders = await order_archive.count_orders({"order_status": {"$ne": OrderStatus.CANCELLED}})
+    pending_orders = await order_archive.count_orders({"order_status": OrderStatus.PENDING})
     
     # Calculate revenue based on delivery date (orders created 1 day before)
     from datetime import datetime as dt, timedelta
@@ -3252,41 +3482,38 @@ async def get_admin_stats(current_user: User = Depends(get_current_admin)):
     
     # Today's revenue (orders delivered today = created yesterday)
     yesterday_start = today - timedelta(days=1)
-    yesterday_end = today
-    today_orders = await db.orders.find({
-        "payment_status": "completed",
-        "created_at": {"$gte": yesterday_start, "$lt": yesterday_end}
-    }).to_list(10000)
-    today_revenue = sum(order["total_amount"] for order in today_orders)
-    
-    # This week's revenue (deliveries this week = orders created last week + this week)
-    week_start = today - timedelta(days=today.weekday())
-    # Orders created from (week_start - 1 day) onwards
-    week_order_start = week_start - timedelta(days=1)
-    week_orders = await db.orders.find({
-        "payment_status": "completed",
-        "created_at": {"$gte": week_order_start, "$lt": today}
-    }).to_list(10000)
-    week_revenue = sum(order["total_amount"] for order in week_orders)
-    
+    # This week's revenue (deliveries this week = orders created from the day before the week started)
+    week_order_start = today - timedelta(days=today.weekday()) - timedelta(days=1)
     # This month's revenue (deliveries this month = orders created from last day of prev month)
-    month_start = today.replace(day=1)
-    month_order_start = month_start - timedelta(days=1)
-    month_orders = await db.orders.find({
-        "payment_status": "completed",
-        "created_at": {"$gte": month_order_start, "$lt": today}
-    }).to_list(10000)
-    month_revenue = sum(order["total_amount"] for order in month_orders)
+    month_order_start = today.replace(day=1) - timedelta(days=1)
+    
+    def created_between(start):
+        return {"$and": [{"$gte": ["$created_at", start]}, {"$lt": ["$created_at", today]}]}
+    
+    # Total revenue from completed orders (excludes cancelled) and the three windows, in one pass
+    match = {"payment_status": "completed"}
+    totals = await db.orders.aggregate([
+        {"$match": match},
+        order_archive.archive_union_stage(match, fields=("total_amount", "created_at"), items=False),
+        {"$group": {
+            "_id": None,
+            "total_revenue": {"$sum": "$total_amount"},
+            "today_revenue": {"$sum": {"$cond": [created_between(yesterday_start), "$total_amount", 0]}},
+            "week_revenue": {"$sum": {"$cond": [created_between(week_order_start), "$total_amount", 0]}},
+            "month_revenue": {"$sum": {"$cond": [created_between(month_order_start), "$total_amount", 0]}},
+        }},
+    ]).to_list(1)
+    revenue = totals[0] if totals else {}
     
     return {
         "total_users": total_users,
         "total_products": total_products,
         "total_orders": total_orders,
         "pending_orders": pending_orders,
-        "total_revenue": total_revenue,
-        "today_revenue": today_revenue,
-        "week_revenue": week_revenue,
-        "month_revenue": month_revenue,
+        "total_revenue": revenue.get("total_revenue", 0),
+        "today_revenue": revenue.get("today_revenue", 0),
+        "week_revenue": revenue.get("week_revenue", 0),
+        "month_revenue": revenue.get("month_revenue", 0),
     }
 
 
@@ -3296,29 +3523,32 @@ async def get_daily_revenue(current_user: User = Depends(get_current_admin)):
     from datetime import datetime as dt, timedelta
     
     today = dt.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    daily_revenue = []
     
+    # Orders created 1 day before delivery date (since delivery is next day), grouped by creation day
+    first_order_day = today - timedelta(days=7)
+    match = {"payment_status": "completed", "created_at": {"$gte": first_order_day, "$lt": today}}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+            "revenue": {"$sum": "$total_amount"},
+            "order_count": {"$sum": 1},
+        }},
+    ]
+    # Only a retention window under a week puts these orders in the archive
+    if order_archive.reaches(first_order_day):
+        pipeline.insert(1, order_archive.archive_union_stage(match, fields=("total_amount", "created_at"), items=False))
+    by_order_day = {row["_id"]: row for row in await db.orders.aggregate(pipeline).to_list(None)}
+    
+    daily_revenue = []
     for i in range(6, -1, -1):  # Last 7 days (6 days ago to today)
         delivery_date = today - timedelta(days=i)
-        
-        # Orders created 1 day before delivery date (since delivery is next day)
-        order_date = delivery_date - timedelta(days=1)
-        order_start = order_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        order_end = order_start + timedelta(days=1)
-        
-        # Get orders created on order_date (will be delivered on delivery_date)
-        day_orders = await db.orders.find({
-            "payment_status": "completed",
-            "created_at": {"$gte": order_start, "$lt": order_end}
-        }).to_list(10000)
-        
-        revenue = sum(order["total_amount"] for order in day_orders)
-        
+        row = by_order_day.get((delivery_date - timedelta(days=1)).strftime("%Y-%m-%d"), {})
         daily_revenue.append({
             "date": delivery_date.strftime("%Y-%m-%d"),
             "day_name": delivery_date.strftime("%A"),
-            "revenue": revenue,
-            "order_count": len(day_orders)
+            "revenue": row.get("revenue", 0),
+            "order_count": row.get("order_count", 0)
         })
     
     return {"daily_revenue": daily_revenue}
@@ -3327,7 +3557,7 @@ async def get_daily_revenue(current_user: User = Depends(get_current_admin)):
 @api_router.get("/admin/delivery-notes")
 async def get_delivery_notes(current_user: User = Depends(get_current_admin)):
     """Get delivery notes settings"""
-    settings = await db.settings.find_one({"type": "delivery_notes"})
+    settings = (await settings_registry.get()).delivery_notes
     if not settings:
         # Return default settings
         return {
@@ -3349,8 +3579,6 @@ async def update_delivery_notes(
     enabled = request.get("enabled", False)
     message = request.get("message", "")
     
-    settings = await db.settings.find_one({"type": "delivery_notes"})
-    
     settings_data = {
         "type": "delivery_notes",
         "enabled": enabled,
@@ -3358,22 +3586,21 @@ async def update_delivery_notes(
         "updated_at": datetime.utcnow()
     }
     
-    if settings:
-        await db.settings.update_one(
-            {"type": "delivery_notes"},
-            {"$set": settings_data}
-        )
-    else:
-        settings_data["created_at"] = datetime.utcnow()
-        await db.settings.insert_one(settings_data)
+    await db.settings.update_one(
+        {"type": "delivery_notes"},
+        {"$set": settings_data, "$setOnInsert": {"created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    await invalidation_bus.publish_write("settings")
     
     return {"success": True, "message": "Delivery notes updated successfully"}
 
 
 @api_router.get("/delivery-notes")
-async def get_customer_delivery_notes():
+async def get_customer_delivery_notes(response: Response):
     """Get delivery notes for customers (public endpoint)"""
-    settings = await db.settings.find_one({"type": "delivery_notes"})
+    response.headers["Cache-Control"] = PUBLIC_SETTINGS_CACHE_CONTROL
+    settings = (await settings_registry.get()).delivery_notes
     if not settings or not settings.get("enabled", False):
         return {"enabled": False, "message": ""}
     return {
@@ -3413,7 +3640,7 @@ DEFAULT_WEEKLY_TASKS = {
 @api_router.get("/admin/cleaning-tasks")
 async def get_cleaning_tasks(current_user: User = Depends(get_current_admin)):
     """Get cleaning tasks configuration (admin/order agents only)"""
-    config = await db.cleaning_tasks.find_one({"type": "config"})
+    config = (await settings_registry.get()).cleaning_tasks
     if not config:
         # Return default tasks
         return {
@@ -3450,6 +3677,7 @@ async def update_cleaning_tasks(
         {"$set": update_data},
         upsert=True
     )
+    await invalidation_bus.publish_write("cleaning_tasks")
     
     return {"message": "Cleaning tasks updated successfully"}
 
@@ -3640,8 +3868,7 @@ async def remove_section_staff(section_key: str, staff_id: str, current_user: Us
 @api_router.get("/admin/route-codes")
 async def get_route_codes(current_user: User = Depends(get_current_admin)):
     """Get all route codes"""
-    codes = await db.route_codes.find({}, {"_id": 0}).sort("code", 1).to_list(1000)
-    return codes
+    return (await settings_registry.get()).route_codes
 
 @api_router.post("/admin/route-codes")
 async def create_route_code(data: dict, current_user: User = Depends(get_current_admin)):
@@ -3656,8 +3883,12 @@ async def create_route_code(data: dict, current_user: User = Depends(get_current
     if existing:
         raise HTTPException(status_code=400, detail=f"Route code '{code}' already exists")
     entry = {"id": str(uuid.uuid4()), "code": code, "label": label or code, "created_at": datetime.utcnow()}
+    # Report grouping (lulu/short/long/onsite/...); derived from the code when not given
+    if data.get("route_type"):
+        entry["route_type"] = data["route_type"].strip().lower()
     await db.route_codes.insert_one(entry)
-    return {"id": entry["id"], "code": entry["code"], "label": entry["label"]}
+    await invalidation_bus.publish_write("route_codes")
+    return {"id": entry["id"], "code": entry["code"], "label": entry["label"], "route_type": entry.get("route_type")}
 
 @api_router.put("/admin/route-codes/{code_id}")
 async def update_route_code(code_id: str, data: dict, current_user: User = Depends(get_current_admin)):
@@ -3669,9 +3900,12 @@ async def update_route_code(code_id: str, data: dict, current_user: User = Depen
         update["code"] = data["code"].strip().upper()
     if "label" in data:
         update["label"] = data["label"].strip()
+    if "route_type" in data:
+        update["route_type"] = (data["route_type"] or "").strip().lower() or None
     if not update:
         raise HTTPException(status_code=400, detail="Nothing to update")
     await db.route_codes.update_one({"id": code_id}, {"$set": update})
+    await invalidation_bus.publish_write("route_codes")
     return {"message": "Route code updated"}
 
 @api_router.delete("/admin/route-codes/{code_id}")
@@ -3680,33 +3914,18 @@ async def delete_route_code(code_id: str, current_user: User = Depends(get_curre
     if current_user.admin_access_level != "full":
         raise HTTPException(status_code=403, detail="Only full-access admins can manage route codes")
     await db.route_codes.delete_one({"id": code_id})
+    await invalidation_bus.publish_write("route_codes")
     return {"message": "Route code deleted"}
 
 
 # ==================== ROUTE SUMMARY REPORT ====================
 
-@api_router.get("/admin/reports/route-summary")
-async def get_route_summary(
-    date: str = None,
-    route_type: str = "lulu",
-    current_user: User = Depends(get_current_admin)
-):
-    """Get route summary: pivot table of items x customers for a given route type and date.
-    route_type: lulu, short, long, onsite
-    """
+async def load_dispatch_board(date: Optional[str]) -> dict:
+    """One day's orders and their customers, loaded once, grouped by route for every route report.
+    Route groups come from the route_codes collection (see reports.route_groups)."""
     import pytz
     from datetime import datetime as dt, timedelta
 
-    ROUTE_MAP = {
-        "lulu": ["LFT"],
-        "short": ["SR1", "SR2", "SR 3"],
-        "long": ["LR1", "LR2"],
-        "onsite": ["ONS"],
-    }
-    route_codes = ROUTE_MAP.get(route_type)
-    if not route_codes:
-        raise HTTPException(status_code=400, detail=f"Invalid route_type: {route_type}. Use: lulu, short, long, onsite")
-
     ist = pytz.timezone('Asia/Kolkata')
     if date:
         try:
@@ -3717,92 +3936,70 @@ async def get_route_summary(
         report_date = dt.now(ist).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
 
     ist_start = ist.localize(report_date.replace(hour=0, minute=0, second=0, microsecond=0))
-    ist_end = ist_start + timedelta(days=1)
     date_start = ist_start.astimezone(pytz.UTC).replace(tzinfo=None)
-    date_end = ist_end.astimezone(pytz.UTC).replace(tzinfo=None)
+    date_end = (ist_start + timedelta(days=1)).astimezone(pytz.UTC).replace(tzinfo=None)
 
-    # Get customers with matching permanent route codes
-    customers = await db.users.find(
-        {"role": "customer", "route_code": {"$in": route_codes}},
-        {"_id": 0, "id": 1, "username": 1, "business_name": 1, "route_code": 1}
-    ).to_list(10000)
-    customer_map = {c["id"]: c for c in customers}
-    permanent_customer_ids = list(customer_map.keys())
-
-    # Also find orders that were SHIFTED to these route codes (route_code_override)
-    shifted_orders = await db.orders.find({
-        "delivery_date": {"$gte": date_start, "$lt": date_end},
-        "order_status": {"$nin": ["cancelled", "Cancelled"]},
-        "route_code_override": {"$in": route_codes}
-    }).to_list(10000)
-    shifted_customer_ids = list(set(o.get("user_id") for o in shifted_orders if o.get("user_id")))
-    
-    # Load shifted customers' info if not already in map
-    for scid in shifted_customer_ids:
-        if scid not in customer_map:
-            sc = await db.users.find_one({"id": scid}, {"_id": 0, "id": 1, "username": 1, "business_name": 1, "route_code": 1})
-            if sc:
-                customer_map[scid] = sc
-
-    all_customer_ids = list(set(permanent_customer_ids + shifted_customer_ids))
-
-    if not all_customer_ids:
-        return {"date": report_date.strftime("%Y-%m-%d"), "route_type": route_type, "route_codes": route_codes, "customers": [], "items": [], "matrix": {}}
-
-    # Get all orders for these customers on this date
-    orders = await db.orders.find({
-        "delivery_date": {"$gte": date_start, "$lt": date_end},
-        "order_status": {"$nin": ["cancelled", "Cancelled"]},
-        "user_id": {"$in": all_customer_ids}
-    }).to_list(10000)
-
-    # Build matrix
-    item_customer_matrix = {}
-    items_order = []
-    order_instances = []
+    async def compute():
+        return await build_dispatch_board_for(report_date, date_start, date_end)
 
-    for order in orders:
-        cid = order.get("user_id")
-        if cid not in customer_map:
-            continue
-        
-        # Use route_code_override if present, otherwise use customer's permanent route
-        effective_route = order.get("route_code_override") or customer_map[cid].get("route_code", "")
-        
-        # Only include if effective route matches requested route codes
-        if effective_route not in route_codes:
-            continue
-        
-        order_number = order.get("order_number", "")
-        order_key = f"{cid}_{order_number}"
-        customer_name = customer_map[cid].get("business_name") or customer_map[cid].get("username", "")
-        
-        order_instances.append({
-            "id": order_key,
-            "name": customer_name,
-            "route_code": effective_route,
-            "order_number": order_number
-        })
-        
-        for item in order.get("items", []):
-            product_name = item.get("product_name", "Unknown")
-            qty = item.get("quantity", 0)
-            if product_name not in item_customer_matrix:
-                item_customer_matrix[product_name] = {}
-                items_order.append(product_name)
-            item_customer_matrix[product_name][order_key] = qty
+    return await report_snapshots.serve("dispatch-board", report_date.date(), 1, {}, compute)
 
-    # Sort order instances by route_code, then customer name, then order_number
-    order_instances.sort(key=lambda x: (x["route_code"], x["name"], x["order_number"]))
 
-    return {
-        "date": report_date.strftime("%Y-%m-%d"),
-        "route_type": route_type,
-        "route_codes": route_codes,
-        "customers": order_instances,
-        "items": items_order,
-        "matrix": item_customer_matrix
-    }
+async def build_dispatch_board_for(report_date, date_start, date_end) -> dict:
+    orders, products, settings = await asyncio.gather(
+        order_archive.find_orders({
+            "delivery_date": {"$gte": date_start, "$lt": date_end},
+            "order_status": {"$nin": CANCELLED_STATUSES}
+        }, DISPATCH_ORDER_PROJECTION, include_archive=order_archive.reaches(date_start)),
+        db.products.find({}, {"_id": 0, "id": 1, "name": 1, "closing_stock": 1}).to_list(10000),
+        settings_registry.get()
+    )
+    customer_ids = list({order["user_id"] for order in orders if order.get("user_id")})
+    customers = await db.users.find({"id": {"$in": customer_ids}}, DISPATCH_CUSTOMER_PROJECTION).to_list(None)
+    customers = {c["id"]: c for c in customers}
+
+    # A past day's board is snapshotted, so its shortages are judged against that day's stock
+    # snapshot rather than today's closing stock; with no snapshot they can't be judged at all
+    stock_as_of = "live"
+    if report_snapshots.frozen(report_date.date()):
+        stock_as_of, stock = await stock_snapshots.closing_stock_as_of(report_date.date())
+        products = [{**p, "closing_stock": stock.get(p.get("id"), 0)} for p in products]
+
+    groups = route_groups(settings.route_codes)
+    board = build_dispatch_board(orders, customers, products, groups)
+    if stock_as_of is None:
+        board["shortages"] = []
+    board["date"] = report_date.strftime("%Y-%m-%d")
+    board["route_groups"] = groups
+    board["stock_as_of"] = stock_as_of
+    return board
+
+
+@api_router.get("/admin/reports/dispatch-board")
+async def get_dispatch_board(
+    date: str = None,
+    current_user: User = Depends(get_current_admin)
+):
+    """Every route's item x customer matrix (lulu, short, long, onsite, ...) and the early-route
+    shortage analysis for one delivery date, in one response"""
+    return await load_dispatch_board(date)
+
+
+@api_router.get("/admin/reports/route-summary")
+async def get_route_summary(
+    date: str = None,
+    route_type: str = "lulu",
+    current_user: User = Depends(get_current_admin)
+):
+    """Get route summary: pivot table of items x customers for a given route type and date.
+    route_type: lulu, short, long, onsite (or any other group in route_codes).
+    The dispatch board returns every route type at once.
+    """
+    board = await load_dispatch_board(date)
+    route = board["routes"].get(route_type)
+    if route is None:
+        raise HTTPException(status_code=400, detail=f"Invalid route_type: {route_type}. Use: {', '.join(board['routes'])}")
+    return {"date": board["date"], "route_type": route_type, **route}
 
 
 @api_router.get("/admin/reports/shortage-check")
@@ -3810,122 +4007,22 @@ async def check_shortages(
     date: str = None,
     current_user: User = Depends(get_current_admin)
 ):
-    """Check shortages for early routes (LFT, SR1, LR1).
-    For each product, if closing_stock < (LFT qty + SR1 qty + LR1 qty), flag as shortage.
+    """Check shortages for early routes (the first route of each group: LFT, SR1, LR1).
+    For each product, if closing_stock < demand on those routes, flag as shortage.
     Also returns customers on those routes for potential shifting.
     """
-    import pytz
-    from datetime import datetime as dt, timedelta
+    board = await load_dispatch_board(date)
+    return {"date": board["date"], "shortages": board["shortages"], "shiftable_customers": board["shiftable_customers"]}
 
-    ist = pytz.timezone('Asia/Kolkata')
-    if date:
-        try:
-            report_date = dt.strptime(date, "%Y-%m-%d")
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid date format")
-    else:
-        report_date = dt.now(ist).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
 
-    ist_start = ist.localize(report_date.replace(hour=0, minute=0, second=0, microsecond=0))
-    ist_end = ist_start + timedelta(days=1)
-    date_start = ist_start.astimezone(pytz.UTC).replace(tzinfo=None)
-    date_end = ist_end.astimezone(pytz.UTC).replace(tzinfo=None)
-
-    early_routes = ["LFT", "SR1", "LR1"]
-
-    # Get customers on early routes
-    customers = await db.users.find(
-        {"role": "customer", "route_code": {"$in": early_routes}},
-        {"_id": 0, "id": 1, "username": 1, "business_name": 1, "route_code": 1}
-    ).to_list(10000)
-    customer_map = {c["id"]: c for c in customers}
-    customer_ids = list(customer_map.keys())
-
-    if not customer_ids:
-        return {"date": report_date.strftime("%Y-%m-%d"), "shortages": [], "shiftable_customers": []}
-
-    # Get orders for these customers on this date
-    orders = await db.orders.find({
-        "delivery_date": {"$gte": date_start, "$lt": date_end},
-        "order_status": {"$nin": ["cancelled", "Cancelled"]},
-        "user_id": {"$in": customer_ids}
-    }).to_list(10000)
-
-    # Build per-route item demand: { item_name: { SR1: qty, SR2: qty, LR1: qty } }
-    route_demand = {}
-    # Track customers with their items for shifting suggestions
-    customer_orders = {}  # cust_id -> { route_code, name, items: [{name, qty}] }
-
-    for order in orders:
-        cid = order.get("user_id")
-        if cid not in customer_map:
-            continue
-        
-        # If this order was already shifted to a different route, skip it from demand
-        override = order.get("route_code_override")
-        if override and override not in early_routes:
-            continue
-        
-        cust = customer_map[cid]
-        route_code = override or cust.get("route_code", "")
-        cust_name = cust.get("business_name") or cust.get("username", "")
-
-        if cid not in customer_orders:
-            customer_orders[cid] = {"route_code": route_code, "name": cust_name, "items": []}
-
-        for item in order.get("items", []):
-            pname = item.get("product_name", "Unknown")
-            qty = item.get("quantity", 0)
-            if pname not in route_demand:
-                route_demand[pname] = {"LFT": 0, "SR1": 0, "LR1": 0}
-            route_demand[pname][route_code] = route_demand[pname].get(route_code, 0) + qty
-            customer_orders[cid]["items"].append({"name": pname, "qty": qty})
-
-    # Get closing_stock for all products that appear in orders
-    product_names = list(route_demand.keys())
-    products = await db.products.find(
-        {"name": {"$in": product_names}},
-        {"_id": 0, "name": 1, "closing_stock": 1}
-    ).to_list(1000)
-    stock_map = {p["name"]: p.get("closing_stock", 0) for p in products}
-
-    # Compute shortages
-    shortages = []
-    for item_name, demand in route_demand.items():
-        total_demand = demand.get("LFT", 0) + demand.get("SR1", 0) + demand.get("LR1", 0)
-        stock = stock_map.get(item_name, 0)
-        if stock < total_demand:
-            shortages.append({
-                "item": item_name,
-                "stock": stock,
-                "demand_lft": demand.get("LFT", 0),
-                "demand_sr1": demand.get("SR1", 0),
-                "demand_lr1": demand.get("LR1", 0),
-                "total_demand": total_demand,
-                "short_by": total_demand - stock
-            })
-
-    # Build shiftable customers list
-    # SR1 -> SR2 or SR3, LR1 -> LR2
-    shift_options = {"SR1": ["SR2", "SR 3"], "LR1": ["LR2"]}
-    shiftable = []
-    for cid, cdata in customer_orders.items():
-        rc = cdata["route_code"]
-        if rc in shift_options:
-            shiftable.append({
-                "customer_id": cid,
-                "customer_name": cdata["name"],
-                "current_route": rc,
-                "shift_to_options": shift_options[rc],
-                "item_count": len(cdata["items"])
-            })
-    shiftable.sort(key=lambda x: (x["current_route"], x["customer_name"]))
-
-    return {
-        "date": report_date.strftime("%Y-%m-%d"),
-        "shortages": shortages,
-        "shiftable_customers": shiftable
-    }
+@api_router.delete("/admin/reports/snapshots")
+async def clear_report_snapshots(current_user: User = Depends(get_current_admin)):
+    """Drop every stored past-date report; each is recomputed on its next request"""
+    if current_user.admin_access_level != "full":
+        raise HTTPException(status_code=403, detail="Only full-access admins can clear report snapshots")
+    deleted = await report_snapshots.clear()
+    logger.info(f"Admin {current_user.username} cleared {deleted} report snapshots")
+    return {"message": f"Cleared {deleted} report snapshots", "deleted_count": deleted}
 
 
 @api_router.post("/admin/reports/shift-customer-route")
@@ -3966,10 +4063,11 @@ async def shift_customer_route(
         {
             "user_id": customer_id,
             "delivery_date": {"$gte": date_start, "$lt": date_end},
-            "order_status": {"$nin": ["cancelled", "Cancelled"]},
+            "order_status": {"$nin": CANCELLED_STATUSES},
         },
         {"$set": {"route_code_override": new_route}}
     )
+    await orders_written([date_start])
 
     logger.info(f"Admin {current_user.username} shifted customer {cust_name} from {old_route} to {new_route} for {date_str} ({result.modified_count} orders)")
 
@@ -3987,16 +4085,17 @@ async def shift_customer_route(
 @api_router.get("/admin/whatsapp-numbers")
 async def get_whatsapp_numbers(current_user: User = Depends(get_current_admin)):
     """Get the list of WhatsApp numbers for report sending"""
-    config = await db.app_settings.find_one({"key": "whatsapp_numbers"})
-    if not config:
+    numbers = (await settings_registry.get()).whatsapp_numbers
+    if numbers is None:
         # Default numbers
         default = [
             {"id": str(uuid.uuid4()), "name": "Divine Office", "phone": "918075946225"},
             {"id": str(uuid.uuid4()), "name": "Soman Nair", "phone": "919544183334"}
         ]
         await db.app_settings.insert_one({"key": "whatsapp_numbers", "numbers": default})
+        await invalidation_bus.publish_write("app_settings")
         return {"numbers": default}
-    return {"numbers": config.get("numbers", [])}
+    return {"numbers": numbers}
 
 @api_router.post("/admin/whatsapp-numbers/add")
 async def add_whatsapp_number(data: dict, current_user: User = Depends(get_current_admin)):
@@ -4013,6 +4112,7 @@ async def add_whatsapp_number(data: dict, current_user: User = Depends(get_curre
         {"$push": {"numbers": new_entry}, "$set": {"key": "whatsapp_numbers"}},
         upsert=True
     )
+    await invalidation_bus.publish_write("app_settings")
     return {"message": "Number added", "entry": new_entry}
 
 @api_router.delete("/admin/whatsapp-numbers/{number_id}")
@@ -4024,6 +4124,7 @@ async def delete_whatsapp_number(number_id: str, current_user: User = Depends(ge
         {"key": "whatsapp_numbers"},
         {"$pull": {"numbers": {"id": number_id}}}
     )
+    await invalidation_bus.publish_write("app_settings")
     return {"message": "Number removed"}
 
 
@@ -4068,76 +4169,38 @@ async def get_daily_items_report(
     
     logger.info(f"Daily items report: IST date={date}, UTC range={date_start} to {date_end}")
     
-    # Get all orders with this delivery date, excluding cancelled
-    orders = await db.orders.find({
-        "delivery_date": {"$gte": date_start, "$lt": date_end},
-        "order_status": {"$ne": OrderStatus.CANCELLED}
-    }).to_list(10000)
+    async def compute():
+        return await build_daily_items_report(delivery_date, date_start, date_end, dough_type_id)
     
-    # If filtering by dough_type_id, get the list of product_ids that match
-    product_dough_type_map = {}
-    if dough_type_id:
-        products_with_dough_type = await db.products.find(
-            {"dough_type_id": dough_type_id}, 
-            {"id": 1, "dough_type_id": 1}
-        ).to_list(10000)
-        product_dough_type_map = {p["id"]: p["dough_type_id"] for p in products_with_dough_type}
-    
-    # Get dough types for enrichment
-    dough_types = await db.categories.find({"category_type": "dough_type"}).to_list(100)
+    return await report_snapshots.serve("daily-items", delivery_date.date(), 1, {"dough_type_id": dough_type_id}, compute)
+
+
+async def build_daily_items_report(delivery_date, date_start, date_end, dough_type_id: Optional[str]) -> dict:
+    """Quantities and revenue per product for the orders delivering in [date_start, date_end)"""
+    products, dough_types = await asyncio.gather(
+        db.products.find({}, {"_id": 0, "id": 1, "dough_type_id": 1}).to_list(10000),
+        db.categories.find({"category_type": "dough_type"}, {"_id": 0, "id": 1, "name": 1}).to_list(100)
+    )
+    dough_type_of = {product["id"]: product.get("dough_type_id") for product in products}
     dough_type_name_map = {dt_item["id"]: dt_item["name"] for dt_item in dough_types}
     
-    # Aggregate items
-    item_summary = {}
-    total_orders = len(orders)
-    total_revenue = 0
-    
-    for order in orders:
-        total_revenue += order.get("total_amount", 0)
-        for item in order.get("items", []):
-            product_id = item.get("product_id")
-            product_name = item.get("product_name", "Unknown")
-            quantity = item.get("quantity", 0)
-            price = item.get("price", 0)
-            subtotal = item.get("subtotal", 0)
-            
-            # If filtering by dough_type, skip products that don't match
-            if dough_type_id and product_id not in product_dough_type_map:
-                continue
-            
-            if product_id in item_summary:
-                item_summary[product_id]["quantity"] += quantity
-                item_summary[product_id]["revenue"] += subtotal
-                item_summary[product_id]["order_count"] += 1
-            else:
-                # Get dough type for this product
-                product_data = await db.products.find_one({"id": product_id}, {"dough_type_id": 1})
-                product_dough_type_id = product_data.get("dough_type_id") if product_data else None
-                
-                item_summary[product_id] = {
-                    "product_id": product_id,
-                    "product_name": product_name,
-                    "quantity": quantity,
-                    "price": price,
-                    "revenue": subtotal,
-                    "order_count": 1,
-                    "dough_type_id": product_dough_type_id,
-                    "dough_type_name": dough_type_name_map.get(product_dough_type_id) if product_dough_type_id else None
-                }
-    
-    # Convert to list and sort by quantity
-    items_list = sorted(
-        item_summary.values(),
-        key=lambda x: x["quantity"],
-        reverse=True
-    )
+    if order_lines.covers(delivery_date.date()):
+        (block,) = await order_lines.blocks(delivery_date.date())
+        summary = order_lines.daily_items(block, CANCELLED_STATUSES, dough_type_of, dough_type_name_map, dough_type_id)
+    else:
+        # Get all orders with this delivery date, excluding cancelled
+        orders = await order_archive.find_orders({
+            "delivery_date": {"$gte": date_start, "$lt": date_end},
+            "order_status": {"$nin": CANCELLED_STATUSES}
+        }, {"_id": 0, "total_amount": 1, "items": 1}, include_archive=order_archive.reaches(date_start), limit=10000)
+        summary = build_daily_items(orders, dough_type_of, dough_type_name_map, dough_type_id)
     
     return {
         "date": delivery_date.strftime("%Y-%m-%d"),
         "day_name": delivery_date.strftime("%A"),
-        "total_orders": total_orders,
-        "total_revenue": total_revenue,
-        "items": items_list,
+        "total_orders": summary["total_orders"],
+        "total_revenue": summary["total_revenue"],
+        "items": summary["items"],
         "filter_dough_type_id": dough_type_id,
         "filter_dough_type_name": dough_type_name_map.get(dough_type_id) if dough_type_id else None
     }
@@ -4145,19 +4208,26 @@ async def get_daily_items_report(
 
 @api_router.get("/admin/reports/preparation-list")
 async def get_preparation_list_report(
+    response: Response,
     date: str = None,
     dough_type_id: str = None,
+    days: int = 2,
     current_user: User = Depends(get_current_admin)
 ):
-    """Get preparation list report: Shows products with orders for today and/or tomorrow
-    Optional filter by dough_type_id
+    """Get preparation list report: products with orders from `date` (default today) over `days` days
+    (2 = today and tomorrow), grouped into one section per dough type.
+    Optional filter by dough_type_id. One aggregation over the orders covers every day and section.
     """
     import pytz
     from datetime import datetime as dt
     from datetime import timedelta
     
+    if not 1 <= days <= 14:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 14")
+    
     # Use IST timezone for date calculations
     ist = pytz.timezone('Asia/Kolkata')
+    today_ist = dt.now(ist).replace(hour=0, minute=0, second=0, microsecond=0)
     
     # Parse date or use today (in IST)
     if date:
@@ -4168,151 +4238,227 @@ async def get_preparation_list_report(
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     else:
-        # Use current IST date
-        now_ist = dt.now(ist)
-        report_date = now_ist.replace(hour=0, minute=0, second=0, microsecond=0)
+        report_date = today_ist
     
-    # Get all products (exclude images for performance)
-    product_query = {}
-    if dough_type_id:
-        product_query["dough_type_id"] = dough_type_id
-    
-    products_cursor = db.products.find(product_query, {"image_base64": 0})
-    products = await products_cursor.to_list(10000)
-    
-    # Get dough types for enrichment
-    dough_types = await db.categories.find({"category_type": "dough_type"}).to_list(100)
-    dough_type_map = {dt["id"]: dt["name"] for dt in dough_types}
-    
-    # Set date ranges for today and tomorrow (in IST, then convert to UTC for DB query)
-    today_start_ist = report_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end_ist = today_start_ist + timedelta(days=1)
-    tomorrow_start_ist = today_end_ist
-    tomorrow_end_ist = tomorrow_start_ist + timedelta(days=1)
-    
-    # Convert to UTC for MongoDB query (MongoDB stores dates in UTC)
-    today_start_utc = today_start_ist.astimezone(pytz.UTC).replace(tzinfo=None)
-    today_end_utc = today_end_ist.astimezone(pytz.UTC).replace(tzinfo=None)
-    tomorrow_start_utc = tomorrow_start_ist.astimezone(pytz.UTC).replace(tzinfo=None)
-    tomorrow_end_utc = tomorrow_end_ist.astimezone(pytz.UTC).replace(tzinfo=None)
-    
-    logger.info(f"Preparation list for IST date: {report_date.date()}")
-    logger.info(f"Today range (UTC): {today_start_utc} to {today_end_utc}")
-    logger.info(f"Tomorrow range (UTC): {tomorrow_start_utc} to {tomorrow_end_utc}")
-    
-    # Get orders for today (both pending and confirmed, but not cancelled)
-    # Use UTC ranges since MongoDB stores delivery_date in UTC
-    orders_today_cursor = db.orders.find({
-        "delivery_date": {"$gte": today_start_utc, "$lt": today_end_utc},
-        "order_status": {"$nin": [OrderStatus.CANCELLED, "cancelled"]}
-    })
-    orders_today = await orders_today_cursor.to_list(10000)
+    # Only a plan whose days have all left the live window stops changing (late edits land on yesterday)
+    if report_snapshots.frozen((report_date + timedelta(days=days - 1)).date()):
+        response.headers["Cache-Control"] = PAST_REPORT_CACHE_CONTROL
     
-    # Get orders for tomorrow
-    orders_tomorrow_cursor = db.orders.find({
-        "delivery_date": {"$gte": tomorrow_start_utc, "$lt": tomorrow_end_utc},
-        "order_status": {"$nin": [OrderStatus.CANCELLED, "cancelled"]}
-    })
-    orders_tomorrow = await orders_tomorrow_cursor.to_list(10000)
+    async def compute():
+        return await build_preparation_list_report(report_date, days, dough_type_id)
     
-    logger.info(f"Found {len(orders_today)} orders for today, {len(orders_tomorrow)} orders for tomorrow")
-    
-    # Calculate ordered quantities for today
-    ordered_quantities_today = {}
-    for order in orders_today:
-        for item in order.get("items", []):
-            product_id = item.get("product_id")
-            quantity = item.get("quantity", 0)
-            
-            if product_id in ordered_quantities_today:
-                ordered_quantities_today[product_id] += quantity
-            else:
-                ordered_quantities_today[product_id] = quantity
-    
-    # Calculate ordered quantities for tomorrow
-    ordered_quantities_tomorrow = {}
-    for order in orders_tomorrow:
-        for item in order.get("items", []):
-            product_id = item.get("product_id")
-            quantity = item.get("quantity", 0)
-            
-            if product_id in ordered_quantities_tomorrow:
-                ordered_quantities_tomorrow[product_id] += quantity
-            else:
-                ordered_quantities_tomorrow[product_id] = quantity
-    
-    # Get all product IDs that have orders (either today or tomorrow)
-    all_product_ids = set(ordered_quantities_today.keys()) | set(ordered_quantities_tomorrow.keys())
+    return await report_snapshots.serve(
+        "preparation-list", report_date.date(), days, {"days": days, "dough_type_id": dough_type_id}, compute
+    )
+
+
+async def build_preparation_list_report(report_date, days: int, dough_type_id: Optional[str]) -> dict:
+    """Production plan for the `days` days from report_date (IST-aware midnight)"""
+    # MongoDB stores delivery dates as IST midnight in UTC
+    start_utc = report_date.astimezone(pytz.UTC).replace(tzinfo=None)
     
-    # Calculate preparation list
-    preparation_list = []
-    for product in products:
-        product_id = product.get("id")
-        
-        # Skip products with no orders
-        if product_id not in all_product_ids:
-            continue
-            
-        product_name = product.get("name")
-        
-        # Use previous day's closing stock (stored in previous_closing_stock field)
-        # If not available, fallback to current closing_stock
-        previous_closing_stock = product.get("previous_closing_stock", product.get("closing_stock", 0))
-        
-        ordered_today = ordered_quantities_today.get(product_id, 0)
-        ordered_tomorrow = ordered_quantities_tomorrow.get(product_id, 0)
-        
-        # New formula: Total = Orders for today + Orders for tomorrow - Last closing stock
-        total = ordered_today + ordered_tomorrow - previous_closing_stock
-        
-        # Units to prepare is the total (if positive, need to prepare; if negative, have surplus)
-        units_to_prepare = max(0, total)  # Only show positive values
-        
-        preparation_list.append({
-            "product_id": product_id,
-            "product_name": product_name,
-            "dough_type_id": product.get("dough_type_id"),
-            "dough_type_name": dough_type_map.get(product.get("dough_type_id"), None),
-            "previous_closing_stock": previous_closing_stock,
-            "orders_today": ordered_today,
-            "orders_tomorrow": ordered_tomorrow,
-            "total": total,
-            "units_to_prepare": units_to_prepare,
-            "unit": product.get("unit", "piece")
-        })
+    product_query = {"dough_type_id": dough_type_id} if dough_type_id else {}
+    products, dough_types = await asyncio.gather(
+        db.products.find(product_query, PREPARATION_PRODUCT_PROJECTION).to_list(10000),
+        db.categories.find({"category_type": "dough_type"}, {"_id": 0, "id": 1, "name": 1, "display_order": 1}).to_list(100)
+    )
+    product_ids = [product["id"] for product in products] if dough_type_id else None
+    if order_lines.covers(report_date.date(), days):
+        blocks, (snapshot_date, previous_stock) = await asyncio.gather(
+            order_lines.blocks(report_date.date(), days),
+            stock_snapshots.closing_stock_as_of(report_date.date())
+        )
+        facet = [order_lines.preparation_facet(blocks, CANCELLED_STATUSES, product_ids)]
+    else:
+        pipeline = preparation_pipeline(start_utc, days, product_ids)
+        if order_archive.reaches(start_utc):
+            pipeline.insert(2, order_archive.archive_union_stage(pipeline[0]["$match"]))
+        facet, (snapshot_date, previous_stock) = await asyncio.gather(
+            db.orders.aggregate(pipeline).to_list(1),
+            stock_snapshots.closing_stock_as_of(report_date.date())
+        )
+    plan = build_preparation_list(facet[0] if facet else {}, products, dough_types, days, previous_stock)
     
-    # Sort by units_to_prepare (descending) so items needing most preparation appear first
-    preparation_list.sort(key=lambda x: x["units_to_prepare"], reverse=True)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Preparation list for IST date {report_date.date()} over {days} days: {plan['order_counts']} orders")
     
     return {
         "date": report_date.strftime("%Y-%m-%d"),
         "day_name": report_date.strftime("%A"),
-        "total_items": len(preparation_list),
-        "orders_today_count": len(orders_today),
-        "orders_tomorrow_count": len(orders_tomorrow),
-        "items": preparation_list
+        "days": [
+            {"date": (report_date + timedelta(days=day)).strftime("%Y-%m-%d"), "order_count": plan["order_counts"][day]}
+            for day in range(days)
+        ],
+        "total_items": len(plan["items"]),
+        "orders_today_count": plan["order_counts"][0],
+        "orders_tomorrow_count": plan["order_counts"][1] if days > 1 else 0,
+        "stock_snapshot_date": snapshot_date,
+        "items": plan["items"],
+        "sections": plan["sections"]
+    }
+
+
+# ==================== SALES ANALYTICS ====================
+# Read only the sales_daily rollups (see sales_rollups.py), never the orders
+
+ANALYTICS_MAX_DAYS = 3 * 366
+
+
+def _analytics_range(start: Optional[str], end: Optional[str], default_days: int = 30):
+    """(start, end) IST dates from YYYY-MM-DD strings; defaults to the last `default_days` days through today"""
+    import pytz
+    from datetime import date as date_cls
+
+    today = datetime.now(pytz.timezone('Asia/Kolkata')).date()
+    try:
+        end_day = date_cls.fromisoformat(end) if end else today
+        start_day = date_cls.fromisoformat(start) if start else end_day - timedelta(days=default_days - 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if start_day > end_day:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end_day - start_day).days >= ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range is limited to {ANALYTICS_MAX_DAYS} days")
+    return start_day, end_day
+
+
+async def _analytics_product_ids(product_id: Optional[str], dough_type_id: Optional[str]) -> Optional[List[str]]:
+    if product_id:
+        return [product_id]
+    if dough_type_id:
+        products = await db.products.find({"dough_type_id": dough_type_id}, {"_id": 0, "id": 1}).to_list(10000)
+        return [product["id"] for product in products]
+    return None
+
+
+@api_router.get("/admin/analytics/top-products")
+async def get_top_products(
+    start: str = None,
+    end: str = None,
+    sort: str = "quantity",
+    limit: int = 20,
+    customer_id: str = None,
+    current_user: User = Depends(get_current_admin)
+):
+    """Products ranked by quantity or revenue over a date range (default the last 30 days)"""
+    if sort not in ROLLUP_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(ROLLUP_FIELDS)}")
+    start_day, end_day = _analytics_range(start, end)
+    rows = await db.sales_daily.aggregate(
+        top_pipeline(rollup_match(start_day, end_day, customer_id), "product_id", sort, min(max(limit, 1), 500))
+    ).to_list(None)
+    return {
+        "start": start_day.isoformat(),
+        "end": end_day.isoformat(),
+        "products": [{"product_id": row.pop("_id"), **row} for row in rows],
+    }
+
+
+@api_router.get("/admin/analytics/top-customers")
+async def get_top_customers(
+    start: str = None,
+    end: str = None,
+    sort: str = "revenue",
+    limit: int = 20,
+    product_id: str = None,
+    current_user: User = Depends(get_current_admin)
+):
+    """Customers ranked by revenue or quantity over a date range (default the last 30 days)"""
+    if sort not in ROLLUP_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(ROLLUP_FIELDS)}")
+    start_day, end_day = _analytics_range(start, end)
+    product_ids = [product_id] if product_id else None
+    rows = await db.sales_daily.aggregate(
+        top_pipeline(rollup_match(start_day, end_day, product_ids=product_ids), "customer_id", sort, min(max(limit, 1), 500))
+    ).to_list(None)
+    customers = await db.users.find(
+        {"id": {"$in": [row["_id"] for row in rows]}}, {"_id": 0, "id": 1, "username": 1, "business_name": 1}
+    ).to_list(None)
+    names = {c["id"]: c.get("business_name") or c.get("username") for c in customers}
+    return {
+        "start": start_day.isoformat(),
+        "end": end_day.isoformat(),
+        "customers": [{"customer_id": row["_id"], "customer_name": names.get(row["_id"]),
+                       **{field: row[field] for field in ROLLUP_FIELDS}} for row in rows],
+    }
+
+
+@api_router.get("/admin/analytics/trend")
+async def get_sales_trend(
+    start: str = None,
+    end: str = None,
+    period: str = "week",
+    customer_id: str = None,
+    product_id: str = None,
+    dough_type_id: str = None,
+    current_user: User = Depends(get_current_admin)
+):
+    """Quantity, revenue and order lines per day, week (from Monday) or month, optionally for one
+    customer, product or dough type (default the last 90 days)"""
+    if period not in ("day", "week", "month"):
+        raise HTTPException(status_code=400, detail="period must be day, week or month")
+    start_day, end_day = _analytics_range(start, end, default_days=90)
+    product_ids = await _analytics_product_ids(product_id, dough_type_id)
+    rows = await db.sales_daily.aggregate([
+        {"$match": rollup_match(start_day, end_day, customer_id, product_ids)},
+        totals("$day"),
+    ]).to_list(None)
+    return {
+        "start": start_day.isoformat(),
+        "end": end_day.isoformat(),
+        "period": period,
+        "series": bucket_series(rows, start_day, end_day, period),
     }
 
 
+@api_router.get("/admin/analytics/day-of-week")
+async def get_day_of_week_profile(
+    start: str = None,
+    end: str = None,
+    customer_id: str = None,
+    product_id: str = None,
+    dough_type_id: str = None,
+    current_user: User = Depends(get_current_admin)
+):
+    """Totals and per-delivery-day averages for each weekday (default the last 90 days)"""
+    start_day, end_day = _analytics_range(start, end, default_days=90)
+    product_ids = await _analytics_product_ids(product_id, dough_type_id)
+    rows = await db.sales_daily.aggregate([
+        {"$match": rollup_match(start_day, end_day, customer_id, product_ids)},
+        totals("$weekday", {"days": {"$addToSet": "$day"}}),
+    ]).to_list(None)
+    return {"start": start_day.isoformat(), "end": end_day.isoformat(), "weekdays": weekday_profile(rows)}
+
+
+@api_router.post("/admin/analytics/rebuild")
+async def rebuild_sales_rollups(
+    start: str = None,
+    end: str = None,
+    current_user: User = Depends(get_current_admin)
+):
+    """Recompute sales_daily from the orders and the archive (every day when start and end are omitted)"""
+    if current_user.admin_access_level != "full":
+        raise HTTPException(status_code=403, detail="Only full-access admins can rebuild analytics")
+    start_day, end_day = _analytics_range(start, end) if start or end else (None, None)
+    rows = await sales_rollups.rebuild(start_day, end_day)
+    logger.info(f"Admin {current_user.username} rebuilt sales rollups {start_day or 'all'}..{end_day or 'all'}: {rows} rows")
+    return {"message": "Sales rollups rebuilt", "rows": rows}
+
+
 # Delivery Charge Settings Endpoints
 @api_router.get("/settings/delivery-charge")
-async def get_delivery_charge_public():
+async def get_delivery_charge_public(response: Response):
     """Get current delivery charge (public endpoint for customers)"""
-    settings = await db.settings.find_one({"key": "delivery_charge"})
-    if not settings:
-        return {"delivery_charge": 0.0}
-    return {"delivery_charge": settings.get("value", 0.0)}
+    response.headers["Cache-Control"] = PUBLIC_SETTINGS_CACHE_CONTROL
+    delivery_charge = (await settings_registry.get()).delivery_charge
+    return {"delivery_charge": delivery_charge if delivery_charge is not None else 0.0}
 
 
 @api_router.get("/admin/settings/delivery-charge")
 async def get_delivery_charge(current_user: User = Depends(get_current_admin)):
     """Get current delivery charge (admin endpoint)"""
-    settings = await db.settings.find_one({"key": "delivery_charge"})
-    if not settings:
-        # Create default setting
-        await db.settings.insert_one({"key": "delivery_charge", "value": 0.0})
-        return {"delivery_charge": 0.0}
-    return {"delivery_charge": settings.get("value", 0.0)}
+    delivery_charge = (await settings_registry.get()).delivery_charge
+    return {"delivery_charge": delivery_charge if delivery_charge is not None else 0.0}
 
 
 @api_router.put("/admin/settings/delivery-charge")
@@ -4326,6 +4472,7 @@ async def update_delivery_charge(
         {"$set": {"value": delivery_charge}},
         upsert=True
     )
+    await invalidation_bus.publish_write("settings")
     return {"message": "Delivery charge updated", "delivery_charge": delivery_charge}
 
 
@@ -4333,7 +4480,7 @@ async def update_delivery_charge(
 @api_router.get("/admin/settings/order-messages")
 async def get_order_confirmation_messages(current_user: User = Depends(get_current_admin)):
     """Get order confirmation messages for paid and pay later orders"""
-    settings = await db.settings.find_one({"key": "order_confirmation_messages"})
+    settings = (await settings_registry.get()).order_messages
     if not settings:
         return {
             "paid_order_message": "Thank you for your order! Your payment has been received and your order is being processed.",
@@ -4360,6 +4507,7 @@ async def update_order_confirmation_messages(
         }},
         upsert=True
     )
+    await invalidation_bus.publish_write("settings")
     return {
         "message": "Order confirmation messages updated",
         "paid_order_message": paid_order_message,
@@ -4738,18 +4886,18 @@ async def setup_admin():
     results = []
     
     # Setup admin user
-    existing_admin = await users_collection.find_one({"username": "admin"})
+    existing_admin = await users_collection.find_one({"username_lower": "admin"})
     
     if existing_admin:
         # Update existing admin
         result = await users_collection.update_one(
-            {"username": "admin"},
+            {"username_lower": "admin"},
             {"$set": {
                 "role": "admin",
                 "is_approved": True,
                 "is_active": True,
                 "admin_access_level": "superadmin",
-                "hashed_password": pwd_context.hash("Admin@123")
+                "hashed_password": await get_password_hash("Admin@123")
             }}
         )
         results.append({
@@ -4764,9 +4912,10 @@ async def setup_admin():
         admin_user = {
             "id": admin_id,
             "username": "admin",
+            "username_lower": "admin",
             "email": "admin@divinecakery.in",
-            "hashed_password": pwd_context.hash("Admin@123"),
-            "phone": "9544183334",
+            "hashed_password": await get_password_hash("Admin@123"),
+            "phone": normalize_phone_number("9544183334"),
             "role": "admin",
             "business_name": "Divine Cakery",
             "address": "Thiruvananthapuram",
@@ -4789,17 +4938,17 @@ async def setup_admin():
         })
     
     # Setup testcustomer user
-    existing_customer = await users_collection.find_one({"username": "testcustomer"})
+    existing_customer = await users_collection.find_one({"username_lower": "testcustomer"})
     
     if existing_customer:
         # Update existing customer
         result = await users_collection.update_one(
-            {"username": "testcustomer"},
+            {"username_lower": "testcustomer"},
             {"$set": {
                 "role": "customer",
                 "is_approved": True,
                 "is_active": True,
-                "hashed_password": pwd_context.hash("Test@123")
+                "hashed_password": await get_password_hash("Test@123")
             }}
         )
         results.append({
@@ -4814,9 +4963,10 @@ async def setup_admin():
         customer_user = {
             "id": customer_id,
             "username": "testcustomer",
+            "username_lower": "testcustomer",
             "email": "testcustomer@divinecakery.in",
-            "hashed_password": pwd_context.hash("Test@123"),
-            "phone": "9999888877",
+            "hashed_password": await get_password_hash("Test@123"),
+            "phone": normalize_phone_number("9999888877"),
             "role": "customer",
             "business_name": "Test Customer Business",
             "address": "Test Address, Test City",
@@ -4851,7 +5001,7 @@ _standing_orders_path = os.path.join(os.path.dirname(__file__), 'standing_orders
 _spec = importlib.util.spec_from_file_location("standing_orders_routes", _standing_orders_path)
 _standing_orders_module = importlib.util.module_from_spec(_spec)
 _spec.loader.exec_module(_standing_orders_module)
-_standing_orders_module.setup_standing_orders_routes(api_router, db, get_current_admin)
+_standing_orders_module.setup_standing_orders_routes(api_router, db, get_current_admin, orders_written)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -4862,9 +5012,123 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "X-Profile-Id"],
 )
 
 
+# Request Metrics
+http_request_duration = metrics_registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+http_requests_total = metrics_registry.counter(
+    "http_requests_total", "HTTP responses by route template and status code", ("method", "route", "status")
+)
+http_requests_in_flight = metrics_registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"
+)
+http_request_mongo_round_trips = metrics_registry.histogram(
+    "http_request_mongo_round_trips", "MongoDB round trips per request", ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500)
+)
+mongo_round_trip_budget_exceeded = metrics_registry.counter(
+    "mongo_round_trip_budget_exceeded_total", "Requests that exceeded their Mongo round-trip budget", ("method", "route")
+)
+
+metrics_registry.add_stats_collector("payment_inbox", payment_inbox.stats)
+metrics_registry.add_stats_collector("email_outbox", email_outbox.stats)
+metrics_registry.add_stats_collector("password_hasher", password_hasher.stats)
+metrics_registry.add_stats_collector("invalidation_bus", invalidation_bus.stats)
+metrics_registry.add_stats_collector("settings_registry", lambda: {"loads_total": settings_registry.loads_total})
+metrics_registry.add_stats_collector("slow_queries", slow_query_monitor.stats)
+metrics_registry.add_stats_collector("event_loop", loop_watchdog.stats)
+metrics_registry.add_stats_collector("tracing", tracer.stats)
+metrics_registry.add_stats_collector("logging", log_pipeline.stats)
+metrics_registry.add_stats_collector("stock_snapshots", stock_snapshots.stats)
+metrics_registry.add_stats_collector("report_snapshots", report_snapshots.stats)
+metrics_registry.add_stats_collector("order_archive", order_archive.stats)
+metrics_registry.add_stats_collector("sales_rollups", sales_rollups.stats)
+metrics_registry.add_stats_collector("order_lines", order_lines.stats)
+
+
+def route_template(request: Request) -> str:
+    """Label by route template (/api/products/{product_id}), never by raw path"""
+    route = request.scope.get("route")
+    return route.path if route is not None else "other"
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    http_requests_in_flight.inc()
+    started = time.perf_counter()
+    mongo_stats, mongo_token = begin_request()
+    trace_span, trace_token = tracer.start_trace(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent"),
+        attributes={"http.method": request.method, "http.target": request.url.path}
+    )
+    status_code = 500
+    try:
+        response = await call_next(request)
+        
+        route_path = route_template(request)
+        trace_span.name = f"{request.method} {route_path}"
+        trace_span.set_attribute("http.route", route_path)
+        http_request_mongo_round_trips.observe(mongo_stats.round_trips, method=request.method, route=route_path)
+        if route_path != "other" and round_trip_budget.check(request.method, route_path, mongo_stats.round_trips):
+            mongo_round_trip_budget_exceeded.inc(method=request.method, route=route_path)
+            if round_trip_budget.fail_on_exceed:
+                response = JSONResponse(status_code=500, content={
+                    "detail": f"Mongo round-trip budget exceeded: {mongo_stats.round_trips} > {round_trip_budget.budget_for(route_path)}"
+                })
+        
+        response.headers["Server-Timing"] = (
+            f'mongo;dur={mongo_stats.duration_seconds * 1000:.1f};desc="{mongo_stats.round_trips} round trips", '
+            f'app;dur={(time.perf_counter() - started) * 1000:.1f}'
+        )
+        response.headers["X-Trace-Id"] = trace_span.trace_id
+        status_code = response.status_code
+        return response
+    finally:
+        trace_span.set_attribute("http.status_code", status_code)
+        tracer.end_trace(trace_span, trace_token, error=f"HTTP {status_code}" if status_code >= 500 else None)
+        end_request(mongo_token)
+        http_requests_in_flight.dec()
+        route_path = route_template(request)
+        http_request_duration.observe(time.perf_counter() - started, method=request.method, route=route_path)
+        http_requests_total.inc(method=request.method, route=route_path, status=status_code)
+
+
+async def authorize_profiling(authorization: str) -> Optional[str]:
+    """X-Profile is honoured only for full-access admins - returns their username"""
+    if not authorization.startswith("Bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    user_dict = await find_token_user(payload, {"_id": 0, "username": 1, "role": 1, "admin_access_level": 1})
+    if not user_dict or user_dict.get("role") != UserRole.ADMIN or user_dict.get("admin_access_level") != "full":
+        return None
+    return user_dict["username"]
+
+
+# Added last so it wraps everything else - the profile covers the whole request
+app.add_middleware(RequestProfilerMiddleware, db_getter=lambda: db, authorize=authorize_profiling)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Prometheus scrape endpoint - disabled unless METRICS_TOKEN is set"""
+    metrics_token = os.environ.get("METRICS_TOKEN", "")
+    if not metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    auth_header = request.headers.get("Authorization", "")
+    supplied = auth_header[7:] if auth_header.startswith("Bearer ") else request.query_params.get("token", "")
+    if not secrets.compare_digest(supplied, metrics_token):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(await metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # Privacy Policy Endpoint (for Play Store requirement)
 @app.get("/privacy-policy")
 async def get_privacy_policy():
@@ -4948,14 +5212,13 @@ async def get_privacy_policy():
 # Temporary download endpoint for code export bundle
 @app.get("/api/download/daily-reports-bundle")
 async def download_daily_reports_bundle():
-    import requests as req
     STORAGE_URL = "https://integrations.emergentagent.com/objstore/api/v1/storage"
     EMERGENT_KEY = "sk-emergent-bEe3dDeAb66F8817fC"
     try:
-        init_resp = req.post(f"{STORAGE_URL}/init", json={"emergent_key": EMERGENT_KEY}, timeout=30)
+        init_resp = await http_client.post(f"{STORAGE_URL}/init", json={"emergent_key": EMERGENT_KEY}, timeout=30)
         init_resp.raise_for_status()
         storage_key = init_resp.json()["storage_key"]
-        resp = req.get(
+        resp = await http_client.get(
             f"{STORAGE_URL}/objects/divine-cakery/exports/daily-reports-staff-bundle.txt",
             headers={"X-Storage-Key": storage_key}, timeout=60
         )
@@ -4971,9 +5234,237 @@ async def download_daily_reports_bundle():
 
 
 
+async def backfill_username_lower():
+    """Populate username_lower for users created before the field existed"""
+    updates = []
+    async for user in db.users.find({"username_lower": {"$exists": False}}, {"_id": 1, "username": 1}):
+        updates.append(UpdateOne({"_id": user["_id"]}, {"$set": {"username_lower": normalize_username(user.get("username"))}}))
+    if updates:
+        await db.users.bulk_write(updates, ordered=False)
+        logger.info(f"Backfilled username_lower for {len(updates)} users")
+
+
+async def backfill_normalized_phones():
+    """Rewrite phone numbers stored before normalization into normalize_phone_number form"""
+    updates = []
+    async for user in db.users.find({"phone": {"$type": "string", "$not": re.compile(r"^\+91\d{10}$")}}, {"_id": 1, "phone": 1}):
+        normalized = normalize_phone_number(user["phone"])
+        if normalized != user["phone"]:
+            updates.append(UpdateOne({"_id": user["_id"]}, {"$set": {"phone": normalized}}))
+    if updates:
+        await db.users.bulk_write(updates, ordered=False)
+        logger.info(f"Normalized phone numbers for {len(updates)} users")
+
+
+async def log_duplicate_usernames():
+    duplicates = await db.users.aggregate([
+        {"$group": {"_id": "$username_lower", "count": {"$sum": 1}, "usernames": {"$push": "$username"}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]).to_list(100)
+    if duplicates:
+        # Until then they can only log in with the exact username, and old tokens naming them are refused
+        logger.error(f"Usernames that differ only by case must be renamed: {[d['usernames'] for d in duplicates]}")
+
+
+@app.on_event("startup")
+async def ensure_user_indexes():
+    try:
+        await db.users.create_index("id")
+        await db.users.create_index("phone")
+        await backfill_normalized_phones()
+        await backfill_username_lower()
+        await db.users.create_index(
+            "username_lower",
+            unique=True,
+            partialFilterExpression={"username_lower": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        # Usernames that differ only by case block the unique index / backfill
+        logger.error(f"Could not enforce unique usernames: {str(e)}")
+        await log_duplicate_usernames()
+    except Exception as e:
+        logger.error(f"Failed to prepare user indexes: {str(e)}")
+
+
+@app.on_event("startup")
+async def ensure_password_reset_indexes():
+    try:
+        await db.password_reset_otps.create_index([("user_id", 1), ("otp", 1)])
+        await db.password_reset_tokens.create_index("reset_token")
+        # expires_at is the actual expiry time, so expire documents as soon as it passes
+        await db.password_reset_otps.create_index("expires_at", expireAfterSeconds=0)
+        await db.password_reset_tokens.create_index("expires_at", expireAfterSeconds=0)
+    except Exception as e:
+        logger.error(f"Failed to create password reset indexes: {str(e)}")
+
+
+@app.on_event("startup")
+async def start_payment_inbox():
+    try:
+        await payment_inbox.ensure_indexes()
+        await db.transactions.create_index("wallet_credit_pending", sparse=True)
+    except Exception as e:
+        logger.error(f"Failed to create payment inbox indexes: {str(e)}")
+    payment_inbox.start()
+
+
+@app.on_event("shutdown")
+async def stop_payment_inbox():
+    await payment_inbox.stop()
+
+
+@app.on_event("startup")
+async def start_email_outbox():
+    try:
+        await email_outbox.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to prepare email outbox: {str(e)}")
+    email_outbox.start()
+
+
+@app.on_event("shutdown")
+async def stop_email_outbox():
+    await email_outbox.stop()
+
+
+@app.on_event("startup")
+async def start_slow_query_monitor():
+    try:
+        await slow_query_monitor.ensure_collection(db)
+    except Exception as e:
+        logger.error(f"Failed to create slow_queries collection: {str(e)}")
+    slow_query_monitor.start(mongo.client, db)
+
+
+@app.on_event("shutdown")
+async def stop_slow_query_monitor():
+    await slow_query_monitor.stop()
+
+
+@app.on_event("startup")
+async def ensure_request_profiles_collection():
+    try:
+        await ensure_profiles_collection(db)
+    except Exception as e:
+        logger.error(f"Failed to create request_profiles collection: {str(e)}")
+
+
+@app.on_event("startup")
+async def start_loop_watchdog():
+    loop_watchdog.start()
+
+
+@app.on_event("shutdown")
+async def stop_loop_watchdog():
+    await loop_watchdog.stop()
+
+
+@app.on_event("startup")
+async def start_tracer():
+    tracer.start()
+
+
+@app.on_event("shutdown")
+async def stop_tracer():
+    await tracer.stop()
+
+
+@app.on_event("startup")
+async def apply_runtime_logging_config():
+    try:
+        await load_runtime_logging_config()
+    except Exception as e:
+        logger.error(f"Failed to load runtime logging config: {str(e)}")
+
+
+@app.on_event("startup")
+async def ensure_stock_snapshot_indexes():
+    try:
+        await stock_snapshots.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create stock_snapshots indexes: {str(e)}")
+
+
+@app.on_event("startup")
+async def ensure_report_snapshot_indexes():
+    try:
+        await report_snapshots.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create report_snapshots indexes: {str(e)}")
+
+
+@app.on_event("startup")
+async def ensure_order_archive_indexes():
+    try:
+        await order_archive.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create orders_archive indexes: {str(e)}")
+
+
+@app.on_event("startup")
+async def start_order_archive():
+    order_archive.start()
+
+
+@app.on_event("shutdown")
+async def stop_order_archive():
+    await order_archive.stop()
+
+
+@app.on_event("startup")
+async def ensure_sales_rollup_indexes():
+    try:
+        await sales_rollups.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create sales_daily indexes: {str(e)}")
+
+
+@app.on_event("startup")
+async def start_sales_rollups():
+    sales_rollups.start()
+
+
+@app.on_event("shutdown")
+async def stop_sales_rollups():
+    await sales_rollups.stop()
+
+
+@app.on_event("startup")
+async def start_stock_snapshots():
+    stock_snapshots.start()
+
+
+@app.on_event("shutdown")
+async def stop_stock_snapshots():
+    await stock_snapshots.stop()
+
+
+@app.on_event("startup")
+async def start_invalidation_bus():
+    invalidation_bus.start()
+
+
+@app.on_event("shutdown")
+async def stop_invalidation_bus():
+    await invalidation_bus.stop()
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    mongo.close()
+
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await razorpay_gateway.aclose()
+    await http_client.aclose()
+    password_hasher.shutdown()
+
+
+@app.on_event("shutdown")
+async def flush_logs():
+    # Registered last so shutdown messages from the other hooks are written out
+    log_pipeline.stop()
 
 # Serve web frontend static files (must be AFTER all API routes)
 import os
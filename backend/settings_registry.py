@@ -0,0 +1,88 @@
+# Settings Registry
+# All small configuration documents (settings, app_settings, cleaning task config,
+# route codes) are loaded together and served from memory. Write endpoints call
+# invalidate(); the TTL bounds staleness for other workers that missed the write.
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SettingsSnapshot:
+    """Point-in-time view of every settings document. None means 'not configured'."""
+    app_version: Optional[dict] = None
+    delivery_charge: Optional[float] = None
+    delivery_notes: Optional[dict] = None
+    order_messages: Optional[dict] = None
+    whatsapp_numbers: Optional[List[dict]] = None
+    cleaning_tasks: Optional[dict] = None
+    route_codes: List[dict] = field(default_factory=list)
+    loaded_at: float = 0.0
+
+
+class SettingsRegistry:
+    """In-memory cache of the settings collections with explicit invalidation and a TTL"""
+
+    def __init__(self, db, ttl: float = None):
+        self.db = db
+        self.ttl = ttl if ttl is not None else float(os.environ.get("SETTINGS_CACHE_TTL_SECONDS", 30))
+        self._snapshot: Optional[SettingsSnapshot] = None
+        self._lock = asyncio.Lock()
+        self._generation = 0
+        self.loads_total = 0
+
+    def _is_fresh(self) -> bool:
+        return self._snapshot is not None and time.monotonic() - self._snapshot.loaded_at < self.ttl
+
+    async def _load(self) -> SettingsSnapshot:
+        settings_docs, app_settings_docs, cleaning_config, route_codes = await asyncio.gather(
+            self.db.settings.find({}, {"_id": 0}).to_list(1000),
+            self.db.app_settings.find({}, {"_id": 0}).to_list(1000),
+            self.db.cleaning_tasks.find_one({"type": "config"}, {"_id": 0}),
+            self.db.route_codes.find({}, {"_id": 0}).sort("code", 1).to_list(1000),
+        )
+        # db.settings mixes documents keyed by "key" and by "type"
+        settings = {}
+        for doc in settings_docs:
+            name = doc.get("key") or doc.get("type")
+            if name:
+                settings[name] = doc
+        app_settings = {doc["key"]: doc for doc in app_settings_docs if doc.get("key")}
+
+        delivery_charge = settings.get("delivery_charge")
+        whatsapp = app_settings.get("whatsapp_numbers")
+        self.loads_total += 1
+        return SettingsSnapshot(
+            app_version=settings.get("app_version_settings"),
+            delivery_charge=delivery_charge.get("value", 0.0) if delivery_charge else None,
+            delivery_notes=settings.get("delivery_notes"),
+            order_messages=settings.get("order_confirmation_messages"),
+            whatsapp_numbers=whatsapp.get("numbers", []) if whatsapp else None,
+            cleaning_tasks=cleaning_config,
+            route_codes=route_codes,
+            loaded_at=time.monotonic()
+        )
+
+    async def get(self) -> SettingsSnapshot:
+        if self._is_fresh():
+            return self._snapshot
+        async with self._lock:
+            # Another request may have reloaded while we waited for the lock
+            if self._is_fresh():
+                return self._snapshot
+            generation = self._generation
+            snapshot = await self._load()
+            # Don't keep a snapshot that raced with a write - it may predate the write
+            if generation == self._generation:
+                self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self):
+        """Drop the cached snapshot - the next read reloads from MongoDB"""
+        self._generation += 1
+        self._snapshot = None
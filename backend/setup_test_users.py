@@ -50,6 +50,7 @@ async def setup_test_users():
         
         user_doc = {
             "username": username,
+            "username_lower": username.lower(),
             "email": user_data["email"],
             "full_name": user_data["full_name"],
             "phone": user_data["phone"],
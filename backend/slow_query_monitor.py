@@ -0,0 +1,249 @@
+# Slow Query Monitor
+# A pymongo CommandListener that records queries slower than a threshold together with
+# their filter shape, explains a sample of them off the request path, and stores the
+# results in the capped slow_queries collection for the admin slow-query report.
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+MONITORED_COMMANDS = {"find", "aggregate", "update", "delete", "findAndModify", "count", "distinct"}
+
+# Driver-added fields that must not be sent back with explain
+_DRIVER_FIELDS = {"lsid", "$clusterTime", "$db", "txnNumber", "$readPreference", "readConcern", "writeConcern", "apiVersion"}
+
+
+def shape_of(value: Any) -> Any:
+    """Replace literal values with '?' but keep field names and operators"""
+    if isinstance(value, dict):
+        return {key: shape_of(val) for key, val in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        # $in/$or lists: keep the shape of the first element only
+        return [shape_of(value[0])] if value else []
+    return "?"
+
+
+def query_filter(command_name: str, command: dict) -> Any:
+    """Extract the part of a command that decides which index is used"""
+    if command_name == "find":
+        return {"filter": command.get("filter", {}), "sort": command.get("sort")}
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline", [])
+        return {"$match": pipeline[0].get("$match", {}) if pipeline else {}}
+    if command_name == "update":
+        return {"q": (command.get("updates") or [{}])[0].get("q", {})}
+    if command_name == "delete":
+        return {"q": (command.get("deletes") or [{}])[0].get("q", {})}
+    if command_name in ("findAndModify", "count", "distinct"):
+        return {"query": command.get("query", {}), "sort": command.get("sort")}
+    return {}
+
+
+def filter_shape(command_name: str, command: dict) -> str:
+    shape = shape_of(query_filter(command_name, command))
+    if command_name == "aggregate":
+        shape["stages"] = [next(iter(stage)) for stage in command.get("pipeline", [])]
+    return json.dumps(shape, sort_keys=True, default=str)
+
+
+def explainable_command(command_name: str, command: dict) -> Optional[dict]:
+    """Strip driver fields; explain supports a single update/delete statement"""
+    cmd = {key: val for key, val in command.items() if key not in _DRIVER_FIELDS}
+    if command_name == "update":
+        cmd["updates"] = cmd.get("updates", [])[:1]
+    elif command_name == "delete":
+        cmd["deletes"] = cmd.get("deletes", [])[:1]
+    elif command_name == "aggregate":
+        if any(("$out" in stage or "$merge" in stage) for stage in cmd.get("pipeline", [])):
+            return None
+        cmd.pop("cursor", None)
+    return cmd
+
+
+def plan_stages(plan: Any) -> list:
+    """All stage names in a (possibly nested) explain plan"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def summarize_explain(explain: dict) -> dict:
+    """Pull the winning plan stages and execution counters out of an explain result"""
+    # aggregate explains nest the find-layer explain under stages[0].$cursor
+    if "stages" in explain and explain["stages"]:
+        explain = explain["stages"][0].get("$cursor", explain)
+    planner = explain.get("queryPlanner", {})
+    stats = explain.get("executionStats", {})
+    stages = plan_stages(planner.get("winningPlan", {}))
+    return {
+        "plan_stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "n_returned": stats.get("nReturned"),
+        "execution_time_ms": stats.get("executionTimeMillis")
+    }
+
+
+class SlowQueryMonitor(monitoring.CommandListener):
+    """Captures slow commands from any thread and hands them to an asyncio worker"""
+
+    def __init__(
+        self,
+        threshold_ms: float = None,
+        explain_interval: float = 300.0,
+        sample_rate: float = None,
+        capped_size_bytes: int = 16 * 1024 * 1024,
+        queue_size: int = 1000,
+    ):
+        self.threshold_ms = threshold_ms if threshold_ms is not None else float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 100))
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.environ.get("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 0.1))
+        self.explain_interval = explain_interval
+        self.capped_size_bytes = capped_size_bytes
+        self._pending: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        self._explained_at: Dict[str, float] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._client = None
+        self._db = None
+        # In-process counters (per worker)
+        self.slow_total = 0
+        self.explained_total = 0
+        self.dropped_total = 0
+
+    # ---- listener callbacks (pymongo threads) ----
+
+    def started(self, event):
+        if self._loop is None or event.command_name not in MONITORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._pending[(event.request_id, event.operation_id)] = (event.database_name, collection, event.command)
+
+    def _finish(self, event, error: Optional[str] = None):
+        loop = self._loop
+        with self._lock:
+            pending = self._pending.pop((event.request_id, event.operation_id), None)
+        if pending is None or loop is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+        database, collection, command = pending
+        record = {
+            "database": database,
+            "collection": collection,
+            "command": event.command_name,
+            "shape": filter_shape(event.command_name, command),
+            "duration_ms": round(duration_ms, 2),
+            "error": error,
+            "at": datetime.utcnow()
+        }
+        try:
+            loop.call_soon_threadsafe(self._enqueue, record, command)
+        except RuntimeError:
+            pass  # loop closed during shutdown
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, error=str(event.failure.get("errmsg", "")) if isinstance(event.failure, dict) else "failed")
+
+    # ---- asyncio side ----
+
+    def _enqueue(self, record: dict, command: dict):
+        self.slow_total += 1
+        try:
+            self._queue.put_nowait((record, command))
+        except asyncio.QueueFull:
+            self.dropped_total += 1
+
+    def _should_explain(self, record: dict) -> bool:
+        key = f"{record['collection']}:{record['command']}:{record['shape']}"
+        now = time.monotonic()
+        last = self._explained_at.get(key)
+        # Always explain a shape the first time it shows up in an interval, then sample
+        if last is None or now - last > self.explain_interval or random.random() < self.sample_rate:
+            self._explained_at[key] = now
+            return True
+        return False
+
+    async def _explain(self, record: dict, command: dict) -> Optional[dict]:
+        cmd = explainable_command(record["command"], command)
+        if cmd is None:
+            return None
+        try:
+            result = await self._client[record["database"]].command("explain", cmd, verbosity="executionStats")
+        except PyMongoError as e:
+            return {"error": str(e)}
+        self.explained_total += 1
+        return summarize_explain(result)
+
+    async def _run(self):
+        while True:
+            record, command = await self._queue.get()
+            try:
+                if record["error"] is None and self._should_explain(record):
+                    explain = await self._explain(record, command)
+                    if explain:
+                        record["explain"] = explain
+                        record["collscan"] = explain.get("collscan", False)
+                await self._db.slow_queries.insert_one(record)
+            except Exception as e:
+                logger.error(f"Slow query monitor failed to record query: {str(e)}")
+
+    async def ensure_collection(self, db):
+        try:
+            await db.create_collection("slow_queries", capped=True, size=self.capped_size_bytes)
+        except CollectionInvalid:
+            pass  # already exists
+
+    def start(self, client, db):
+        """Begin recording. Must be called from the event loop that serves requests."""
+        if self._task is not None:
+            return
+        self._client = client
+        self._db = db
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._loop = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "slow_total": self.slow_total,
+            "explained_total": self.explained_total,
+            "dropped_total": self.dropped_total,
+            "queue_depth": self._queue.qsize() if self._queue else 0
+        }
@@ -139,13 +139,28 @@ async def generate_orders_for_standing_order(db, standing_order: dict, days_ahea
     return generated_orders
 
 
-def setup_standing_orders_routes(api_router, db, get_current_admin):
+def setup_standing_orders_routes(api_router, db, get_current_admin, orders_written=None):
     """Setup all standing orders routes"""
     print("🔧 SETUP_STANDING_ORDERS_ROUTES CALLED - Routes are being registered!")
     import logging
     logger = logging.getLogger(__name__)
     logger.info("🔧 SETUP_STANDING_ORDERS_ROUTES CALLED - Routes are being registered!")
     
+    # orders_written(delivery_dates, inserted=None) is told about every order write, after it lands
+    # (report snapshots, sales rollups, the order line store)
+    async def delete_orders_and_notify(query: dict):
+        delivery_dates = await db.orders.distinct("delivery_date", query) if orders_written else []
+        result = await db.orders.delete_many(query)
+        if orders_written:
+            await orders_written(delivery_dates)
+        return result
+    
+    async def generate_and_notify(standing_order: dict, days_ahead: int = 10):
+        generated = await generate_orders_for_standing_order(db, standing_order, days_ahead=days_ahead)
+        if orders_written and generated:
+            await orders_written([order["delivery_date"] for order in generated], inserted=generated)
+        return generated
+    
     @api_router.post("/admin/standing-orders", response_model=StandingOrder)
     async def create_standing_order(
         standing_order_data: StandingOrderCreate,
@@ -183,7 +198,7 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         await db.standing_orders.insert_one(standing_order_dict)
         
         # Generate orders for next 10 days
-        await generate_orders_for_standing_order(db, standing_order_dict, days_ahead=10)
+        await generate_and_notify(standing_order_dict, days_ahead=10)
         
         return StandingOrder(**standing_order_dict)
     
@@ -311,11 +326,12 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         
         # If cancelling, delete future auto-generated orders
         if update_data.get("status") == StandingOrderStatus.CANCELLED:
-            await db.orders.delete_many({
+            future_orders = {
                 "standing_order_id": standing_order_id,
                 "delivery_date": {"$gte": today},
                 "is_standing_order": True
-            })
+            }
+            await delete_orders_and_notify(future_orders)
         
         # Update the standing order configuration
         result = await db.standing_orders.update_one(
@@ -332,14 +348,15 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         # Handle frequency changes - delete future orders and regenerate on new schedule
         if frequency_changed and update_data.get("status") != StandingOrderStatus.CANCELLED:
             # Delete all future orders for this standing order
-            delete_result = await db.orders.delete_many({
+            future_orders = {
                 "standing_order_id": standing_order_id,
                 "delivery_date": {"$gte": today},
                 "is_standing_order": True
-            })
+            }
+            delete_result = await delete_orders_and_notify(future_orders)
             
             # Regenerate orders with new frequency (and new items from updated standing order)
-            await generate_orders_for_standing_order(db, updated_standing_order, days_ahead=10)
+            await generate_and_notify(updated_standing_order, days_ahead=10)
             
             # Mark that update logic was executed
             await db.standing_orders.update_one(
@@ -377,12 +394,14 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
                 })
                 
                 # Update all current and future orders with new items and totals
+                future_orders = {
+                    "standing_order_id": standing_order_id,
+                    "delivery_date": {"$gte": today},
+                    "is_standing_order": True
+                }
+                affected_dates = await db.orders.distinct("delivery_date", future_orders) if orders_written else []
                 update_order_result = await db.orders.update_many(
-                    {
-                        "standing_order_id": standing_order_id,
-                        "delivery_date": {"$gte": today},
-                        "is_standing_order": True
-                    },
+                    future_orders,
                     {
                         "$set": {
                             "items": items_with_subtotal,
@@ -393,6 +412,8 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
                         }
                     }
                 )
+                if orders_written:
+                    await orders_written(affected_dates)
                 
                 # Mark that update logic was executed by updating the standing order directly in DB
                 await db.standing_orders.update_one(
@@ -423,7 +444,7 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         
         # If reactivating, regenerate orders
         if update_data.get("status") == StandingOrderStatus.ACTIVE:
-            await generate_orders_for_standing_order(db, updated_standing_order, days_ahead=10)
+            await generate_and_notify(updated_standing_order, days_ahead=10)
         
         return StandingOrder(**updated_standing_order)
     
@@ -442,7 +463,7 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         if standing_order["status"] != StandingOrderStatus.ACTIVE:
             raise HTTPException(status_code=400, detail="Can only regenerate active standing orders")
         
-        generated_orders = await generate_orders_for_standing_order(db, standing_order, days_ahead=days_ahead)
+        generated_orders = await generate_and_notify(standing_order, days_ahead=days_ahead)
         
         return {
             "message": f"Generated {len(generated_orders)} orders",
@@ -462,11 +483,12 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         
         # Delete future auto-generated orders
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        await db.orders.delete_many({
+        future_orders = {
             "standing_order_id": standing_order_id,
             "delivery_date": {"$gte": today},
             "is_standing_order": True
-        })
+        }
+        await delete_orders_and_notify(future_orders)
         
         # Delete standing order
         result = await db.standing_orders.delete_one({"id": standing_order_id})
@@ -511,7 +533,7 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         await db.standing_orders.insert_one(new_standing_order)
         
         # Generate orders for next 10 days
-        await generate_orders_for_standing_order(db, new_standing_order, days_ahead=10)
+        await generate_and_notify(new_standing_order, days_ahead=10)
         
         return {
             "message": "Standing order duplicated successfully",
@@ -537,6 +559,8 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
         
         # Delete the order
         await db.orders.delete_one({"id": order_id})
+        if orders_written:
+            await orders_written([order.get("delivery_date")])
         
         return {"message": "Order occurrence deleted successfully"}
     
@@ -579,6 +603,8 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
             {"id": order_id},
             {"$set": filtered_update}
         )
+        if orders_written:
+            await orders_written([order.get("delivery_date"), filtered_update.get("delivery_date")])
         
         updated_order = await db.orders.find_one({"id": order_id})
         return updated_order
@@ -621,7 +647,7 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
                         logger.info(f"Standing order {standing_order['id']} marked as completed (end date passed)")
                         continue
                 
-                generated = await generate_orders_for_standing_order(db, standing_order, days_ahead=days_ahead)
+                generated = await generate_and_notify(standing_order, days_ahead=days_ahead)
                 total_generated += len(generated)
                 processed_count += 1
                 
@@ -679,7 +705,7 @@ def setup_standing_orders_routes(api_router, db, get_current_admin):
                         )
                         continue
                 
-                generated = await generate_orders_for_standing_order(db, standing_order, days_ahead=days_ahead)
+                generated = await generate_and_notify(standing_order, days_ahead=days_ahead)
                 total_generated += len(generated)
                 processed_count += 1
             except Exception as e:
@@ -0,0 +1,151 @@
+# Stock Snapshots
+# One compact document per IST day in stock_snapshots holding every product's closing stock:
+#   {"date": "2026-10-19", "taken_at", "taken_by", "source", "items": [{"product_id", "closing_stock"}]}
+# A background job captures it at the order cutoff (4 AM IST); admins can capture on demand.
+# Reports resolve previous_closing_stock from the latest snapshot on or before their date
+# with a single indexed read instead of trusting the live closing_stock.
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import pytz
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def ist_today(now: Optional[datetime] = None) -> date:
+    return (now or datetime.now(pytz.UTC)).astimezone(IST).date()
+
+
+def next_capture_at(now: datetime, hour: int) -> datetime:
+    """The next `hour`:00 IST strictly after `now` (timezone-aware)"""
+    local = now.astimezone(IST)
+    target = IST.localize(datetime.combine(local.date(), datetime.min.time()).replace(hour=hour))
+    if target <= local:
+        target = IST.localize(datetime.combine(local.date() + timedelta(days=1), datetime.min.time()).replace(hour=hour))
+    return target
+
+
+async def apply_stock_counts(db, counts: Iterable[Tuple[str, float]]) -> dict:
+    """
+    Set closing_stock for many products with one bulk write. A product counted more than once
+    keeps its last count. Returns matched / modified counts and the unknown and repeated ids.
+    """
+    latest: Dict[str, float] = {}
+    duplicates = set()
+    for product_id, closing_stock in counts:
+        if product_id in latest:
+            duplicates.add(product_id)
+        latest[product_id] = closing_stock
+    now = datetime.utcnow()
+    result = await db.products.bulk_write(
+        [UpdateOne({"id": product_id}, {"$set": {"closing_stock": stock, "updated_at": now}}) for product_id, stock in latest.items()],
+        ordered=False
+    )
+    unknown = []
+    if result.matched_count < len(latest):
+        found = await db.products.distinct("id", {"id": {"$in": list(latest)}})
+        unknown = sorted(set(latest) - set(found))
+    return {
+        "matched": result.matched_count,
+        "modified": result.modified_count,
+        "unknown_product_ids": unknown,
+        "duplicate_product_ids": sorted(duplicates),
+    }
+
+
+class StockSnapshots:
+    """Captures and reads daily closing-stock snapshots"""
+
+    def __init__(self, db, capture_hour: int = 4):
+        self.db = db
+        self.capture_hour = capture_hour
+        self._task: Optional[asyncio.Task] = None
+        self.captures_total = 0
+
+    @classmethod
+    def from_env(cls, db) -> "StockSnapshots":
+        return cls(db, capture_hour=int(os.environ.get("STOCK_SNAPSHOT_HOUR_IST", 4)))
+
+    @property
+    def collection(self):
+        return self.db.stock_snapshots
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("date", unique=True)
+
+    async def capture(self, day: Optional[date] = None, taken_by: str = "system", source: str = "manual",
+                      replace: bool = True) -> Optional[dict]:
+        """
+        Snapshot every product's closing_stock under `day` (default today in IST).
+        With replace=False an existing snapshot for the day is kept - every worker runs the
+        scheduled job, and the first one to reach the cutoff wins; the others get None.
+        """
+        day_str = (day or ist_today()).isoformat()
+        products = await self.db.products.find({}, {"_id": 0, "id": 1, "closing_stock": 1}).to_list(None)
+        snapshot = {
+            "date": day_str,
+            "taken_at": datetime.utcnow(),
+            "taken_by": taken_by,
+            "source": source,
+            "items": [{"product_id": p["id"], "closing_stock": p.get("closing_stock") or 0} for p in products if p.get("id")],
+        }
+        if replace:
+            await self.collection.replace_one({"date": day_str}, snapshot, upsert=True)
+        else:
+            try:
+                result = await self.collection.update_one({"date": day_str}, {"$setOnInsert": snapshot}, upsert=True)
+            except DuplicateKeyError:
+                return None  # another worker's upsert won the race
+            if result.upserted_id is None:
+                return None  # already captured
+        self.captures_total += 1
+        logger.info(f"Stock snapshot for {day_str} captured by {taken_by} ({len(snapshot['items'])} products, {source})")
+        return snapshot
+
+    async def closing_stock_as_of(self, day: date) -> Tuple[Optional[str], Dict[str, float]]:
+        """(snapshot date, product_id -> closing stock) from the latest snapshot on or before `day`"""
+        snapshot = await self.collection.find_one(
+            {"date": {"$lte": day.isoformat()}}, {"_id": 0, "date": 1, "items": 1}, sort=[("date", DESCENDING)]
+        )
+        if not snapshot:
+            return None, {}
+        return snapshot["date"], {item["product_id"]: item["closing_stock"] for item in snapshot["items"]}
+
+    async def _run(self):
+        # Catch up if this worker starts after today's cutoff and nobody has captured yet
+        now = datetime.now(pytz.UTC)
+        if now.astimezone(IST).hour >= self.capture_hour:
+            try:
+                await self.capture(ist_today(now), source="scheduled", replace=False)
+            except Exception as e:
+                logger.error(f"Stock snapshot catch-up failed: {str(e)}")
+        while True:
+            now = datetime.now(pytz.UTC)
+            await asyncio.sleep((next_capture_at(now, self.capture_hour) - now).total_seconds())
+            try:
+                await self.capture(source="scheduled", replace=False)
+            except Exception as e:
+                logger.error(f"Scheduled stock snapshot failed: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"captures_total": self.captures_total}
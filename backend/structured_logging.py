@@ -0,0 +1,187 @@
+# Structured Logging
+# Request handlers only put log records on an in-memory queue; a QueueListener thread
+# formats them as JSON lines and writes them out, so log I/O never adds to request latency.
+# INFO/DEBUG records can be sampled per logger, and levels and sample rates can be changed
+# at runtime (see /api/admin/logging) without a restart.
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from tracing import current_span
+
+LEVEL_NAMES = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message, trace_id and exception text"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            payload["trace_id"] = trace_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of DEBUG/INFO records per logger. Rates apply to a logger and its
+    children ('server' also covers 'server.x'); WARNING and above are never dropped.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rates: Dict[str, float] = {}
+        self._resolved: Dict[str, float] = {}
+        self.dropped_total = 0
+        self.set_rates(rates or {})
+
+    def set_rates(self, rates: Dict[str, float]):
+        self.rates = {name: max(0.0, min(1.0, float(rate))) for name, rate in rates.items()}
+        self._resolved = {}
+
+    def rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            else:
+                rate = self.rates.get("root", 1.0)
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped_total += 1
+        return False
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Captures what only the calling thread knows (the trace id, the merged message) and
+    hands the record to the listener thread. Formatting happens on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        span = current_span()
+        record.trace_id = span.trace_id if span is not None else None
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks cannot cross threads safely once the frames move on
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """The root QueueHandler/QueueListener pair plus the runtime-adjustable levels and sampling"""
+
+    def __init__(self, level: str = "INFO", fmt: str = "json", levels: Optional[Dict[str, str]] = None,
+                 sampling: Optional[Dict[str, float]] = None, stream=None):
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.sampler = SamplingFilter(sampling)
+        self.handler = ContextQueueHandler(self.queue)
+        self.handler.addFilter(self.sampler)
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        if fmt == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        self.listener = logging.handlers.QueueListener(self.queue, output, respect_handler_level=False)
+
+        self._running = False
+        self.default_level = level.upper()
+        self.levels: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.apply(levels or {}, None)
+
+    @classmethod
+    def from_env(cls) -> "LogPipeline":
+        """LOG_LEVEL, LOG_FORMAT (json/text), LOG_LEVELS and LOG_SAMPLING (JSON objects keyed by logger name)"""
+        return cls(
+            level=os.environ.get("LOG_LEVEL", "INFO"),
+            fmt=os.environ.get("LOG_FORMAT", "json").lower(),
+            levels=json.loads(os.environ.get("LOG_LEVELS", "{}")),
+            sampling=json.loads(os.environ.get("LOG_SAMPLING", "{}"))
+        )
+
+    def install(self):
+        """Replace the root logger's handlers with the queue handler and start the writer thread"""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.default_level)
+        self.listener.start()
+        self._running = True
+        return self
+
+    def apply(self, levels: Optional[Dict[str, str]], sampling: Optional[Dict[str, float]]):
+        """
+        Set logger levels ({'server': 'DEBUG', 'httpx': 'WARNING'}; 'root' is the root logger)
+        and sample rates. Loggers no longer listed go back to inheriting their parent's level.
+        """
+        with self._lock:
+            if levels is not None:
+                for name, level in levels.items():
+                    if str(level).upper() not in LEVEL_NAMES:
+                        raise ValueError(f"Unknown log level for {name}: {level}")
+                for name in set(self.levels) - set(levels):
+                    if name != "root":
+                        logging.getLogger(name).setLevel(logging.NOTSET)
+                for name, level in levels.items():
+                    if name == "root":
+                        logging.getLogger().setLevel(str(level).upper())
+                    else:
+                        logging.getLogger(name).setLevel(str(level).upper())
+                if "root" not in levels:
+                    logging.getLogger().setLevel(self.default_level)
+                self.levels = {name: str(level).upper() for name, level in levels.items()}
+            if sampling is not None:
+                self.sampler.set_rates(sampling)
+
+    def snapshot(self) -> dict:
+        return {
+            "default_level": self.default_level,
+            "levels": dict(self.levels),
+            "sampling": dict(self.sampler.rates)
+        }
+
+    def stop(self):
+        """Flush queued records. Call last on shutdown."""
+        if self._running:
+            self._running = False
+            self.listener.stop()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "sampled_out_total": self.sampler.dropped_total
+        }
@@ -0,0 +1,305 @@
+"""
+A small in-memory stand-in for the Motor collections the background workers use
+Covers the query and update operators those modules issue - not a general Mongo emulator
+"""
+import copy
+import itertools
+import operator
+import re
+from types import SimpleNamespace
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+_ids = itertools.count(1)
+
+
+def get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def set_path(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def unset_path(doc, path):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def _equals(value, expected):
+    if isinstance(expected, re.Pattern):
+        return isinstance(value, str) and expected.search(value) is not None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+COMPARISONS = {
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+}
+TYPES = {"string": str, "double": float, "int": int, "bool": bool, "object": dict, "array": list}
+
+
+def _condition(value, condition):
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        return value is not _MISSING and _equals(value, condition)
+    for op, operand in condition.items():
+        present = value is not _MISSING
+        if op == "$exists":
+            ok = present == bool(operand)
+        elif op == "$ne":
+            ok = not (present and _equals(value, operand))
+        elif op == "$in":
+            ok = present and any(_equals(value, item) for item in operand)
+        elif op == "$nin":
+            ok = not (present and any(_equals(value, item) for item in operand))
+        elif op in ("$lt", "$lte", "$gt", "$gte"):
+            ok = present and value is not None and COMPARISONS[op](value, operand)
+        elif op == "$type":
+            ok = present and isinstance(value, TYPES[operand])
+        elif op == "$not":
+            ok = not _condition(value, operand)
+        else:
+            raise NotImplementedError(op)
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif not _condition(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                set_path(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                unset_path(doc, path)
+            elif op == "$inc":
+                current = get_path(doc, path)
+                set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$push":
+                current = get_path(doc, path)
+                items = list([] if current is _MISSING else current)
+                if isinstance(value, dict) and "$each" in value:
+                    items.extend(value["$each"])
+                    if "$slice" in value:
+                        items = items[value["$slice"]:] if value["$slice"] < 0 else items[:value["$slice"]]
+                else:
+                    items.append(value)
+                set_path(doc, path, items)
+            elif op != "$setOnInsert":
+                raise NotImplementedError(op)
+
+
+def _sorted(docs, sort):
+    for field, direction in reversed(sort or []):
+        docs = sorted(docs, key=lambda d: (get_path(d, field) is _MISSING, get_path(d, field)), reverse=direction < 0)
+    return docs
+
+
+def _project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        doc = {k: v for k, v in doc.items() if k in included or (k == "_id" and projection.get("_id", 1))}
+    else:
+        doc = {k: v for k, v in doc.items() if projection.get(k, 1)}
+    return doc
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs = _sorted(self.docs, key if isinstance(key, list) else [(key, direction)])
+        return self
+
+    def limit(self, count):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs[:length] if length else list(self.docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = []
+        self.indexes = {}  # key -> create_index options
+        self.unique = {"_id": None}  # field -> partialFilterExpression
+        for doc in docs:
+            self._insert(doc)
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        self.indexes[keys if isinstance(keys, str) else tuple(keys)] = {"unique": unique, **kwargs}
+        if unique and isinstance(keys, str):
+            self.unique[keys] = kwargs.get("partialFilterExpression")
+
+    def _check_unique(self, doc):
+        for field, partial in self.unique.items():
+            value = doc.get(field, _MISSING)
+            if value is _MISSING or (partial and not matches(doc, partial)):
+                continue
+            if any(other is not doc and other.get(field, _MISSING) == value and not (partial and not matches(other, partial))
+                   for other in self.docs):
+                raise DuplicateKeyError(f"E11000 duplicate key {field}: {value!r}", code=11000)
+
+    def _insert(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", f"oid-{next(_ids)}")
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return doc
+
+    def _matching(self, query, sort=None):
+        return _sorted([doc for doc in self.docs if matches(doc, query)], sort)
+
+    def _upsert(self, query, update):
+        doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        apply_update(doc, update, inserting=True)
+        return self._insert(doc)
+
+    async def insert_one(self, doc):
+        return SimpleNamespace(inserted_id=self._insert(doc)["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        errors, inserted = [], []
+        for index, doc in enumerate(docs):
+            try:
+                inserted.append(self._insert(doc)["_id"])
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted)
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([_project(doc, projection) for doc in self._matching(query)])
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        found = self._matching(query, sort)
+        return _project(found[0], projection) if found else None
+
+    async def count_documents(self, query):
+        return len(self._matching(query))
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+    async def find_one_and_update(self, query, update, sort=None, upsert=False, projection=None,
+                                  return_document=ReturnDocument.BEFORE):
+        found = self._matching(query, sort)
+        if not found:
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+            return _project(doc, projection) if return_document == ReturnDocument.AFTER else None
+        doc = found[0]
+        before = _project(doc, projection)
+        apply_update(doc, update)
+        return _project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def update_one(self, query, update, upsert=False):
+        found = self._matching(query)
+        if found:
+            apply_update(found[0], update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._upsert(query, update)["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update):
+        found = self._matching(query)
+        for doc in found:
+            apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found))
+
+    async def bulk_write(self, requests, ordered=True):
+        matched = modified = 0
+        for request in requests:
+            result = await self.update_one(request._filter, request._doc, upsert=request._upsert)
+            matched += result.matched_count
+            modified += result.modified_count
+        return SimpleNamespace(matched_count=matched, modified_count=modified)
+
+    async def distinct(self, key, query=None):
+        values = []
+        for doc in self._matching(query):
+            value = get_path(doc, key)
+            if value is not _MISSING and value not in values:
+                values.append(value)
+        return values
+
+    async def replace_one(self, query, replacement, upsert=False):
+        found = self._matching(query)
+        if found:
+            index = self.docs.index(found[0])
+            self.docs[index] = {**copy.deepcopy(replacement), "_id": found[0]["_id"]}
+            return SimpleNamespace(matched_count=1, upserted_id=None)
+        if upsert:
+            return SimpleNamespace(matched_count=0, upserted_id=self._upsert(query, {"$set": replacement})["_id"])
+        return SimpleNamespace(matched_count=0, upserted_id=None)
+
+    async def delete_many(self, query):
+        found = self._matching(query)
+        removed = {id(doc) for doc in found}
+        self.docs = [doc for doc in self.docs if id(doc) not in removed]
+        return SimpleNamespace(deleted_count=len(found))
+
+
+class FakeDB:
+    """Collections are created on first access, like a Motor database"""
+
+    def __init__(self, **collections):
+        for name, docs in collections.items():
+            setattr(self, name, FakeCollection(docs))
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        collection = FakeCollection()
+        setattr(self, name, collection)
+        return collection
+
+    def __getitem__(self, name):
+        return getattr(self, name)
@@ -0,0 +1,140 @@
+"""
+Tests for username / token resolution in server.py
+Run against the in-memory collections in fake_mongo.py - no mongod needed
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_auth")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import server
+from fake_mongo import FakeDB
+from models import UserLogin
+
+
+def user(user_id, username, password_hash="", **fields):
+    return {
+        "id": user_id, "username": username, "username_lower": username.lower(), "role": "customer",
+        "hashed_password": password_hash, "created_at": datetime.utcnow(), **fields,
+    }
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(server, "db", fake)
+    return fake
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestUsernameIndex:
+    def test_backfill_and_unique_partial_index(self, db):
+        db.users.docs += [
+            {"_id": 1, "id": "u1", "username": "Alice"},
+            {"_id": 2, "id": "u2", "username": "bob", "username_lower": "bob"},
+            {"_id": 3, "id": "u3"},  # no username at all
+        ]
+        run(server.ensure_user_indexes())
+
+        assert [u.get("username_lower") for u in db.users.docs] == ["alice", "bob", None]
+        assert db.users.indexes["username_lower"] == {
+            "unique": True, "partialFilterExpression": {"username_lower": {"$type": "string"}}
+        }
+        with pytest.raises(DuplicateKeyError):
+            run(db.users.insert_one({"id": "u4", "username": "ALICE", "username_lower": "alice"}))
+        # Users without a string username_lower are outside the index
+        run(db.users.insert_one({"id": "u5", "username_lower": None}))
+
+
+class TestLogin:
+    def test_case_insensitive_login(self, db):
+        db.users.docs.append(user("u1", "Alice", run(server.get_password_hash("pw"))))
+        token = run(server.login(UserLogin(username="ALICE", password="pw")))["access_token"]
+        assert run(server.get_current_user(token)).id == "u1"
+
+    def test_ambiguous_username_needs_the_exact_spelling(self, db):
+        hashed = run(server.get_password_hash("pw"))
+        db.users.docs += [user("u1", "Alice", hashed), user("u2", "ALICE", hashed)]
+
+        with pytest.raises(HTTPException) as exc_info:
+            run(server.login(UserLogin(username="alice", password="pw")))
+        assert exc_info.value.status_code == 401
+
+        token = run(server.login(UserLogin(username="ALICE", password="pw")))["access_token"]
+        assert run(server.get_current_user(token)).id == "u2"
+
+
+class TestTokenUser:
+    def test_uid_claim_wins_over_the_username(self, db):
+        db.users.docs += [user("u1", "Alice"), user("u2", "ALICE")]
+        token = server.create_access_token({"sub": "Alice", "uid": "u1", "role": "customer"})
+        assert run(server.get_current_user(token)).id == "u1"
+        # Renamed since the token was issued: still the same user
+        db.users.docs[0].update(username="Alicia", username_lower="alicia")
+        assert run(server.find_token_user({"sub": "Alice", "uid": "u1"}))["username"] == "Alicia"
+
+    def test_legacy_token_without_uid(self, db):
+        db.users.docs.append(user("u1", "Alice"))
+        assert run(server.find_token_user({"sub": "alice"}))["id"] == "u1"
+
+        # Once another user differs only by case, a username-only token is refused
+        db.users.docs.append(user("u2", "ALICE"))
+        assert run(server.find_token_user({"sub": "Alice"})) is None
+        with pytest.raises(HTTPException) as exc_info:
+            run(server.get_current_user(server.create_access_token({"sub": "Alice", "role": "customer"})))
+        assert exc_info.value.status_code == 401
+
+
+class TestIdentifierLookup:
+    def test_phone_formats_resolve_to_the_same_user(self, db):
+        db.users.docs.append(user("u1", "alice", phone="+919876543210"))
+        for identifier in ["9876543210", "+91 98765 43210", "98765-43210", "919876543210", "+91-98765-43210", "Alice"]:
+            assert run(server.find_user_by_identifier(identifier))["id"] == "u1", identifier
+
+    def test_username_wins_over_another_users_phone(self, db):
+        # The phone owner is stored first, so a single $or query would return them
+        db.users.docs += [user("u1", "alice", phone="+919876543210"), user("u2", "9876543210")]
+        assert run(server.find_user_by_identifier("9876543210"))["id"] == "u2"
+        assert run(server.find_user_by_identifier("+91 98765 43210"))["id"] == "u1"
+
+    def test_short_identifiers_are_not_phone_numbers(self, db):
+        # Short numbers normalize to "+12345", which a legacy phone might have been stored as
+        db.users.docs.append(user("u1", "alice", phone="+12345"))
+        assert run(server.find_user_by_identifier("12345")) is None
+        assert run(server.find_user_by_identifier("")) is None
+
+
+class TestStartupIndexes:
+    def test_phone_backfill(self, db):
+        run(db.users.insert_many([
+            user("u1", "a", phone="98765 43210"),
+            user("u2", "b", phone="919876543211"),
+            user("u3", "c", phone="+919876543212"),
+            user("u4", "d", phone="09876543213"),
+            user("u5", "e", phone=None),
+            user("u6", "f"),
+        ]))
+        run(server.backfill_normalized_phones())
+        assert [u.get("phone") for u in db.users.docs] == [
+            "+919876543210", "+919876543211", "+919876543212", "+919876543213", None, None
+        ]
+        assert run(server.find_user_by_identifier("9876543213"))["id"] == "u4"
+
+    def test_reset_documents_expire_at_expires_at(self, db):
+        run(server.ensure_password_reset_indexes())
+        for collection in (db.password_reset_otps, db.password_reset_tokens):
+            assert collection.indexes["expires_at"] == {"unique": False, "expireAfterSeconds": 0}
+        assert (("user_id", 1), ("otp", 1)) in db.password_reset_otps.indexes
+        assert "reset_token" in db.password_reset_tokens.indexes
@@ -0,0 +1,193 @@
+"""
+Tests for the email outbox and its pooled SMTP sender
+The pool runs against a local aiosmtpd sink - no mail server or credentials needed; the outbox
+queue runs on the in-memory collections in fake_mongo.py
+"""
+import asyncio
+import os
+import socket
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_outbox import OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENDING, OUTBOX_SENT, EmailOutbox, SMTPConnectionPool, build_message
+from fake_mongo import FakeDB
+
+
+class SinkHandler:
+    """Records every delivered message and every SMTP session that was opened"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_sink():
+    handler = SinkHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def make_pool(controller, **kwargs):
+    return SMTPConnectionPool(
+        hostname=controller.hostname,
+        port=controller.port,
+        start_tls=False,
+        **kwargs
+    )
+
+
+class TestSMTPConnectionPool:
+    """Message delivery through the pooled connection"""
+
+    def test_batch_reuses_one_connection(self, smtp_sink):
+        controller, handler = smtp_sink
+
+        async def scenario():
+            pool = make_pool(controller)
+            try:
+                for i in range(5):
+                    await pool.send(build_message("noreply@example.com", "admin@example.com", f"Subject {i}", "<p>Hi</p>"))
+            finally:
+                await pool.close()
+            return pool
+
+        pool = asyncio.run(scenario())
+        assert len(handler.messages) == 5
+        assert pool.connections_opened == 1
+        assert len(handler.sessions) == 1
+        assert handler.messages[0].rcpt_tos == ["admin@example.com"]
+        assert b"Subject 0" in handler.messages[0].content
+
+    def test_idle_connection_is_reopened(self, smtp_sink):
+        controller, handler = smtp_sink
+
+        async def scenario():
+            pool = make_pool(controller, idle_timeout=0)
+            try:
+                for i in range(2):
+                    await pool.send(build_message("noreply@example.com", "admin@example.com", f"Subject {i}", "body"))
+            finally:
+                await pool.close()
+            return pool
+
+        pool = asyncio.run(scenario())
+        assert len(handler.messages) == 2
+        assert pool.connections_opened == 2
+
+    def test_unreachable_server_raises(self):
+        async def scenario():
+            pool = SMTPConnectionPool(hostname="127.0.0.1", port=1, start_tls=False, timeout=2)
+            await pool.send(build_message("a@example.com", "b@example.com", "s", "b"))
+
+        with pytest.raises(Exception):
+            asyncio.run(scenario())
+
+
+class FakePool:
+    """Records delivered messages; fails for recipients listed in failing"""
+
+    def __init__(self, failing=()):
+        self.username = "noreply@example.com"
+        self.failing = set(failing)
+        self.sent = []
+        self.connections_opened = 1
+
+    async def send(self, message):
+        if message["To"] in self.failing:
+            raise ConnectionError("mailbox unavailable")
+        self.sent.append(message["To"])
+
+    async def close(self):
+        pass
+
+
+class TestEmailOutbox:
+    """Claiming, retries and recovery of queued messages"""
+
+    def make_outbox(self, pool, **kwargs):
+        self.db = FakeDB()
+        return EmailOutbox(self.db, pool, batch_size=2, backoff_base=30, backoff_max=100, **kwargs)
+
+    def due_now(self):
+        """Make every retry due now, as if its backoff had passed"""
+        return self.db.email_outbox.update_many({"status": OUTBOX_PENDING}, {"$set": {"available_at": datetime.utcnow()}})
+
+    def test_batches_are_claimed_oldest_first(self):
+        pool = FakePool()
+        outbox = self.make_outbox(pool)
+
+        async def scenario():
+            for i in range(3):
+                await outbox.enqueue(f"Subject {i}", "<p>Hi</p>", f"c{i}@example.com")
+            claimed = [await outbox.send_batch() for _ in range(3)]
+            return claimed
+
+        assert asyncio.run(scenario()) == [2, 1, 0]
+        assert pool.sent == ["c0@example.com", "c1@example.com", "c2@example.com"]
+        assert {doc["status"] for doc in self.db.email_outbox.docs} == {OUTBOX_SENT}
+        assert outbox.sent_total == 3
+
+    def test_failures_back_off_then_dead_letter(self):
+        pool = FakePool(failing={"bounce@example.com"})
+        outbox = self.make_outbox(pool, max_attempts=3)
+
+        async def scenario():
+            await outbox.enqueue("Hello", "<p>Hi</p>", "bounce@example.com")
+            delays = []
+            for _ in range(3):
+                before = datetime.utcnow()
+                assert await outbox.send_batch() == 1
+                message = await self.db.email_outbox.find_one({})
+                delays.append(round((message["available_at"] - before).total_seconds() / 10) * 10)
+                # Not due again until its backoff has passed
+                assert await outbox.send_batch() == 0
+                await self.due_now()
+            return delays, message
+
+        delays, message = asyncio.run(scenario())
+        assert delays == [30, 60, 100]
+        assert message["status"] == OUTBOX_FAILED and message["attempts"] == 3
+        assert message["last_error"] == "mailbox unavailable"
+        assert outbox.failed_total == 1 and pool.sent == []
+
+    def test_stale_claims_are_requeued_by_the_sender_loop(self):
+        pool = FakePool()
+        outbox = self.make_outbox(pool, poll_interval=0.01, stale_after=60, requeue_interval=0)
+        long_ago = datetime.utcnow() - timedelta(minutes=10)
+        self.db.email_outbox.docs = [
+            # Claimed by a worker that died mid-batch
+            {"_id": 1, "id": "m1", "to": "a@example.com", "subject": "s", "body": "b", "status": OUTBOX_SENDING,
+             "attempts": 0, "claim_id": "dead", "claimed_at": long_ago, "available_at": long_ago},
+            # Claimed moments ago by a live worker
+            {"_id": 2, "id": "m2", "to": "b@example.com", "subject": "s", "body": "b", "status": OUTBOX_SENDING,
+             "attempts": 0, "claim_id": "live", "claimed_at": datetime.utcnow(), "available_at": long_ago},
+        ]
+
+        async def scenario():
+            outbox.start()
+            await asyncio.sleep(0.05)
+            await outbox.stop()
+
+        asyncio.run(scenario())
+        assert pool.sent == ["a@example.com"]
+        assert outbox.requeued_total == 1
+        assert [doc["status"] for doc in self.db.email_outbox.docs] == [OUTBOX_SENT, OUTBOX_SENDING]
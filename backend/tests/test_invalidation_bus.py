@@ -0,0 +1,160 @@
+"""
+Tests for the cache invalidation bus
+Dispatch and polling run anywhere; the change stream tests need a local single-node
+replica set, e.g.:
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval "rs.initiate()"
+    MONGO_REPLSET_URL="mongodb://localhost:27017/?replicaSet=rs0" pytest tests/test_invalidation_bus.py
+"""
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_mongo import FakeDB
+from invalidation_bus import INVALIDATE_ALL, InvalidationBus, InvalidationEvent
+
+MONGO_REPLSET_URL = os.environ.get("MONGO_REPLSET_URL")
+
+
+class FailingCursor:
+    async def to_list(self, length=None):
+        raise PyMongoError("connection reset")
+
+
+class TestDispatch:
+    """Routing events to subscribed caches"""
+
+    def test_sync_and_async_subscribers(self):
+        received = []
+
+        async def async_callback(event):
+            received.append(("async", event.collection))
+
+        async def scenario():
+            bus = InvalidationBus(FakeDB(), collections=["settings"], mode="off")
+            bus.subscribe(["settings"], lambda event: received.append(("sync", event.collection)))
+            bus.subscribe(["products"], async_callback)
+            await bus.publish_local("settings")
+            await bus.dispatch(InvalidationEvent("products", "update", "abc"))
+            await bus.dispatch(InvalidationEvent("users", "delete", "xyz"))
+            return bus
+
+        bus = asyncio.run(scenario())
+        assert received == [("sync", "settings"), ("async", "products")]
+        assert bus.events_total == 3
+        assert "products" in bus.collections
+
+    def test_failing_callback_does_not_block_others(self):
+        received = []
+
+        def broken(event):
+            raise RuntimeError("boom")
+
+        async def scenario():
+            bus = InvalidationBus(FakeDB(), mode="off")
+            bus.subscribe(["users"], broken)
+            bus.subscribe(["users"], lambda event: received.append(event.operation))
+            await bus.dispatch(InvalidationEvent("users", "update", 1))
+
+        asyncio.run(scenario())
+        assert received == ["update"]
+
+
+class TestPolling:
+    """Version-document fallback for standalone mongod"""
+
+    def test_poll_dispatches_changed_collections_only(self):
+        db = FakeDB()
+        received = []
+
+        async def scenario():
+            writer = InvalidationBus(db, mode="off")
+            bus = InvalidationBus(db, collections=["settings", "products"], mode="poll")
+            bus.subscribe(["settings", "products"], lambda event: received.append((event.collection, event.source)))
+            # Stream-only subscribers are never polled
+            bus.subscribe(["orders"], lambda event: received.append((event.collection, event.source)), stream_only=True)
+            assert "orders" in bus.collections and "orders" not in bus.polled_collections
+            await bus.poll_once()  # baseline
+            # Another worker's writes
+            await writer.publish_write("products")
+            await writer.publish_write("orders")
+            await bus.poll_once()
+            await bus.poll_once()
+            # This worker's own write is dispatched at once, and again by the next poll
+            await bus.publish_write("settings")
+            await bus.poll_once()
+
+        asyncio.run(scenario())
+        assert received == [("products", "poll"), ("settings", "local"), ("settings", "poll")]
+
+    def test_changes_during_a_failed_poll_are_caught_up(self):
+        db = FakeDB()
+        received = []
+
+        async def scenario():
+            bus = InvalidationBus(db, collections=["settings"], mode="poll")
+            bus.subscribe(["settings"], lambda event: received.append(event.operation))
+            await bus.poll_once()
+            await InvalidationBus(db, mode="off").publish_write("settings")
+            db.invalidation_bus_state.find = lambda *args, **kwargs: FailingCursor()
+            await bus.poll_once()
+            assert received == []
+            del db.invalidation_bus_state.find
+            await bus.poll_once()
+
+        asyncio.run(scenario())
+        assert received == [INVALIDATE_ALL]
+
+
+@pytest.mark.skipif(not MONGO_REPLSET_URL, reason="MONGO_REPLSET_URL not set (needs a single-node replica set)")
+class TestChangeStream:
+    """End-to-end against a real replica set"""
+
+    async def _wait_for(self, predicate, timeout=10.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not predicate():
+            if asyncio.get_running_loop().time() > deadline:
+                raise AssertionError("timed out waiting for invalidation event")
+            await asyncio.sleep(0.05)
+
+    def test_change_stream_delivers_and_resumes(self):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        async def scenario():
+            client = AsyncIOMotorClient(MONGO_REPLSET_URL)
+            db = client[f"test_invalidation_{uuid.uuid4().hex[:8]}"]
+            received = []
+
+            def make_bus():
+                bus = InvalidationBus(db, collections=["settings"], mode="change_stream", token_persist_interval=0)
+                bus.subscribe(["settings"], lambda event: received.append(event))
+                return bus
+
+            try:
+                bus = make_bus()
+                bus.start()
+                await self._wait_for(lambda: bus.active_mode == "change_stream")
+                await asyncio.sleep(0.5)
+                await db.settings.insert_one({"key": "delivery_charge", "value": 10.0})
+                await self._wait_for(lambda: len(received) == 1)
+                await bus.stop()
+
+                # Written while no worker was listening - must be replayed from the saved token
+                await db.settings.update_one({"key": "delivery_charge"}, {"$set": {"value": 20.0}})
+                bus = make_bus()
+                bus.start()
+                await self._wait_for(lambda: len(received) == 2)
+                await bus.stop()
+                return received
+            finally:
+                await client.drop_database(db.name)
+                client.close()
+
+        received = asyncio.run(scenario())
+        assert [e.operation for e in received] == ["insert", "update"]
+        assert all(e.collection == "settings" for e in received)
@@ -0,0 +1,49 @@
+"""
+Smoke test for benchmarks/load_cutoff_rush.py
+Drives a few seconds of the mix against the app over an ASGI transport with the in-memory
+collections in fake_mongo.py, so the scenario keeps up with the endpoints it calls
+"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_load_cutoff_rush")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import server
+from fake_mongo import FakeDB
+from load_cutoff_rush import CutoffRush, load_actors
+from seed_dataset import DEFAULT_PASSWORD, DatasetGenerator, hash_password, load_dataset
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # server.db and the stores built on it follow mongo.database
+    fake = FakeDB()
+    monkeypatch.setattr(server.mongo, "database", fake)
+    return fake
+
+
+def test_cutoff_rush_runs_against_the_app(db):
+    async def scenario():
+        await load_dataset(db, DatasetGenerator(0.05, 42, 1, password_hash=hash_password(DEFAULT_PASSWORD)))
+        customers, products, topups = await load_actors(db)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            rush = CutoffRush(client, customers, products, topups, report_interval=0.2, webhook_rate=5.0, think_time=0.05)
+            return await rush.run(duration=3.0, start_rate=2.0, peak_rate=5.0)
+
+    report = asyncio.run(scenario())
+
+    assert report["requests"] > 0
+    assert report["errors"] == 0, {name: row["statuses"] for name, row in report["endpoints"].items() if row["errors"]}
+    succeeded = {name for name, row in report["endpoints"].items() if row["statuses"].get("200")}
+    assert {"login", "catalog_products", "catalog_categories", "wallet", "payment_webhook"} <= succeeded
+    assert any(name.startswith("place_order_") for name in succeeded)
+    assert any(name.startswith("report_") for name in succeeded)
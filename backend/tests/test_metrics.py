@@ -0,0 +1,93 @@
+"""
+Tests for the Prometheus metrics registry and the Mongo command listener
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import MetricsRegistry, MongoCommandMetrics
+
+
+def render(registry):
+    return asyncio.run(registry.render())
+
+
+class TestMetricsRegistry:
+    """Text exposition format"""
+
+    def test_counter_and_gauge(self):
+        registry = MetricsRegistry()
+        requests = registry.counter("http_requests_total", "Requests", ("route", "status"))
+        in_flight = registry.gauge("http_requests_in_flight", "In flight")
+        requests.inc(route="/api/products", status=200)
+        requests.inc(route="/api/products", status=200)
+        in_flight.inc()
+        in_flight.inc()
+        in_flight.dec()
+
+        text = render(registry)
+        assert "# TYPE http_requests_total counter" in text
+        assert 'http_requests_total{route="/api/products",status="200"} 2' in text
+        assert "http_requests_in_flight 1" in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            latency.observe(value, route="/x")
+
+        text = render(registry)
+        assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{route="/x",le="1.0"} 3' in text
+        assert 'latency_seconds_bucket{route="/x",le="+Inf"} 4' in text
+        assert 'latency_seconds_count{route="/x"} 4' in text
+        assert 'latency_seconds_sum{route="/x"} 4.05' in text
+
+    def test_stats_collectors(self):
+        async def inbox_stats():
+            return {"pending": 3, "mode": "change_stream", "healthy": True}
+
+        registry = MetricsRegistry()
+        registry.add_stats_collector("payment_inbox", inbox_stats)
+        registry.add_stats_collector("broken", lambda: 1 / 0)
+
+        text = render(registry)
+        assert "payment_inbox_pending 3" in text
+        assert "payment_inbox_healthy 1" in text
+        assert "payment_inbox_mode" not in text
+        assert "# broken stats unavailable" in text
+
+
+class TestMongoCommandMetrics:
+    """Per-collection command timings from monitoring events"""
+
+    def _run_command(self, listener, command_name, command, reply, request_id=1, micros=2500):
+        listener.started(SimpleNamespace(command_name=command_name, command=command, request_id=request_id, operation_id=request_id))
+        listener.succeeded(SimpleNamespace(command_name=command_name, reply=reply, request_id=request_id, operation_id=request_id, duration_micros=micros))
+
+    def test_find_and_get_more(self):
+        registry = MetricsRegistry()
+        listener = MongoCommandMetrics(registry)
+        self._run_command(listener, "find", {"find": "orders"}, {"cursor": {"firstBatch": [{}] * 101}}, request_id=1)
+        self._run_command(listener, "getMore", {"getMore": 123, "collection": "orders"}, {"cursor": {"nextBatch": [{}] * 50}}, request_id=2)
+        self._run_command(listener, "update", {"update": "wallets"}, {"n": 1}, request_id=3)
+        self._run_command(listener, "hello", {"hello": 1}, {"ok": 1}, request_id=4)
+
+        text = render(registry)
+        assert 'mongo_command_documents_total{collection="orders",command="find"} 101' in text
+        assert 'mongo_command_documents_total{collection="orders",command="getMore"} 50' in text
+        assert 'mongo_command_documents_total{collection="wallets",command="update"} 1' in text
+        assert 'mongo_command_duration_seconds_count{collection="orders",command="find"} 1' in text
+        assert "hello" not in text
+
+    def test_failed_command(self):
+        registry = MetricsRegistry()
+        listener = MongoCommandMetrics(registry)
+        listener.started(SimpleNamespace(command_name="insert", command={"insert": "orders"}, request_id=7, operation_id=7))
+        listener.failed(SimpleNamespace(command_name="insert", request_id=7, operation_id=7, duration_micros=1000))
+
+        text = render(registry)
+        assert 'mongo_command_errors_total{collection="orders",command="insert"} 1' in text
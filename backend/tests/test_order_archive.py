@@ -0,0 +1,88 @@
+"""
+Tests for the order archive document format, horizon and archiving run
+The run uses the in-memory collections in fake_mongo.py
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_mongo import FakeDB
+from order_archive import OrderArchive, archive_projection, compact_order, expand_order
+
+
+ORDER = {
+    "_id": "mongo-id",
+    "id": "o1",
+    "user_id": "c1",
+    "delivery_date": datetime(2026, 7, 31, 18, 30),  # 1 August in IST
+    "notes": None,
+    "payment_status": "completed",
+    "items": [
+        {"product_id": "bun", "product_name": "Cream Bun", "quantity": 4, "price": 12.5, "subtotal": 50.0},
+        {"product_id": "cake", "product_name": "Plum Cake", "quantity": 1, "price": 300, "subtotal": 270, "unit": "kg"},
+    ],
+}
+
+
+class TestArchiveFormat:
+    def test_round_trip(self):
+        doc = compact_order(ORDER, datetime(2026, 10, 1))
+        assert doc["month"] == "2026-08"
+        assert "_id" not in doc and "notes" not in doc
+        assert doc["items"][0] == ["bun", "Cream Bun", 4, 12.5]
+        # A discounted subtotal and extra fields are kept
+        assert doc["items"][1][4] == {"subtotal": 270, "unit": "kg"}
+
+        order = expand_order(doc)
+        assert order["items"] == ORDER["items"]
+        assert order["archived"] is True and "month" not in order
+
+    def test_item_projections_take_whole_rows(self):
+        assert archive_projection({"_id": 0, "user_id": 1, "items.product_id": 1, "items.quantity": 1}) == {
+            "_id": 0, "user_id": 1, "items": 1
+        }
+        assert archive_projection(None) is None
+
+    def test_horizon_is_ist_midnight(self):
+        archive = OrderArchive(db=None, retention_days=60)
+        now = pytz.UTC.localize(datetime(2026, 10, 19, 3, 0))
+        assert archive.horizon(now) == datetime(2026, 8, 19, 18, 30)
+
+
+class TestArchiveRun:
+    def test_moves_settled_orders_in_batches_and_tolerates_earlier_partial_runs(self):
+        now = pytz.UTC.localize(datetime(2026, 10, 19, 3, 0))
+        old = datetime(2026, 7, 1, 18, 30)
+        orders = [{**ORDER, "_id": f"m{i}", "id": f"o{i}", "delivery_date": old + timedelta(days=i)} for i in range(5)]
+        orders += [
+            {**ORDER, "_id": "pay-later", "id": "p1", "delivery_date": old, "payment_status": "pending"},
+            {**ORDER, "_id": "recent", "id": "r1", "delivery_date": datetime(2026, 10, 10, 18, 30)},
+        ]
+        db = FakeDB(orders=orders)
+        archive = OrderArchive(db, retention_days=60, batch_size=2)
+
+        async def scenario():
+            await archive.ensure_indexes()
+            # An earlier run archived o0 but died before deleting it from the hot tier
+            await db.orders_archive.insert_one(compact_order(orders[0], datetime(2026, 10, 18)))
+            return await archive.archive(now)
+
+        assert asyncio.run(scenario()) == 5
+        assert sorted(order["id"] for order in db.orders.docs) == ["p1", "r1"]
+        assert sorted(doc["id"] for doc in db.orders_archive.docs) == ["o0", "o1", "o2", "o3", "o4"]
+        assert archive.stats()["archived_total"] == 5
+        # Nothing left to move: one empty batch
+        assert asyncio.run(archive.archive(now)) == 0
+
+    def test_max_batches_bounds_a_run(self):
+        now = pytz.UTC.localize(datetime(2026, 10, 19, 3, 0))
+        orders = [{**ORDER, "_id": f"m{i}", "id": f"o{i}"} for i in range(5)]
+        db = FakeDB(orders=orders)
+        archive = OrderArchive(db, retention_days=60, batch_size=2)
+        assert asyncio.run(archive.archive(now, max_batches=2)) == 4
+        assert [order["id"] for order in db.orders.docs] == ["o4"]
@@ -0,0 +1,143 @@
+"""
+Tests for the columnar order line store
+Its reports must match the dict-based ones in reports.py on the same orders
+"""
+import asyncio
+import os
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from invalidation_bus import InvalidationEvent
+from order_lines import OrderLineStore
+from report_snapshots import delivery_day
+from reports import CANCELLED_STATUSES, build_daily_items, build_preparation_list
+from sales_rollups import ist_midnight_utc
+from seed_dataset import DatasetGenerator
+from stock_snapshots import ist_today
+
+ANCHOR = date(2026, 10, 19)
+DAY = ANCHOR + timedelta(days=1)
+
+
+def dataset():
+    generator = DatasetGenerator(1, 42, 1, ANCHOR, password_hash="x")
+    orders = defaultdict(list)
+    for name, doc in generator.documents():
+        if name == "orders":
+            orders[delivery_day(doc["delivery_date"])].append(doc)
+    # Both cancelled spellings
+    for index, order in enumerate(orders[DAY][:12]):
+        if index % 4 == 3:
+            order["order_status"] = "Cancelled" if index % 8 == 3 else "cancelled"
+    return generator, orders
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs
+
+
+class FakeOrders:
+    def __init__(self, docs, on_find=None):
+        self.docs = docs
+        self.on_find = on_find
+        self.finds = 0
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        if self.on_find:
+            self.on_find()
+        return FakeCursor(self.docs)
+
+    async def find_one(self, query, projection=None):
+        return next((doc for doc in self.docs if doc["_id"] == query["_id"]), None)
+
+
+class FakeDB:
+    def __init__(self, docs, on_find=None):
+        self.orders = FakeOrders(docs, on_find)
+
+
+class TestOrderLineStore:
+    def setup_method(self):
+        self.generator, self.orders = dataset()
+        self.store = OrderLineStore(db=None)
+        self.block = self.store.build_block(DAY, self.orders[DAY])
+
+    def test_daily_items_match_with_and_without_dough_filter(self):
+        products = self.generator.products
+        dough_type_of = {p["id"]: p.get("dough_type_id") for p in products}
+        names = {c["id"]: c["name"] for c in self.generator.categories if c.get("category_type") == "dough_type"}
+        active = [o for o in self.orders[DAY] if o.get("order_status") not in CANCELLED_STATUSES]
+        for dough_type_id in [None, products[0]["dough_type_id"]]:
+            expected = build_daily_items(active, dough_type_of, names, dough_type_id)
+            assert self.store.daily_items(self.block, CANCELLED_STATUSES, dough_type_of, names, dough_type_id) == expected
+
+    def test_preparation_facet_builds_the_same_plan(self):
+        days = [ANCHOR, DAY]
+        blocks = [self.store.build_block(day, self.orders[day]) for day in days]
+        facet = self.store.preparation_facet(blocks, CANCELLED_STATUSES)
+        quantities = defaultdict(float)
+        for offset, day in enumerate(days):
+            for order in self.orders[day]:
+                if order.get("order_status") not in CANCELLED_STATUSES:
+                    for item in order["items"]:
+                        quantities[(item["product_id"], offset)] += item["quantity"]
+        assert {(r["_id"]["product_id"], r["_id"]["day"]): r["quantity"] for r in facet["quantities"]} == dict(quantities)
+        plan = build_preparation_list(facet, self.generator.products, [], 2)
+        assert plan["order_counts"][1] == sum(1 for o in self.orders[DAY] if o.get("order_status") not in CANCELLED_STATUSES)
+
+    def test_window_and_write_invalidation(self):
+        today = date.today()
+        assert self.store.covers(today - timedelta(days=1), 2, today=today)
+        assert not self.store.covers(today - timedelta(days=2), 1, today=today)
+        assert not self.store.covers(today + timedelta(days=10), 2, today=today)
+
+        live_day = ist_today()
+        db = FakeDB([{**order, "delivery_date": ist_midnight_utc(live_day)} for order in self.orders[DAY]])
+        # A write during the load: the result is served but not kept
+        store = OrderLineStore(db, max_age=3600)
+        db.orders.on_find = lambda: store.orders_written([live_day])
+        (block,) = asyncio.run(store.blocks(live_day))
+        assert block.lines == self.block.lines and store.stats()["days_cached"] == 0
+
+        db.orders.on_find = None
+        asyncio.run(store.blocks(live_day))
+        asyncio.run(store.blocks(live_day))
+        assert db.orders.finds == 2 and store.stats()["hits_total"] == 1
+        store.orders_written([live_day.isoformat()])
+        asyncio.run(store.blocks(live_day))
+        assert db.orders.finds == 3
+
+    def test_inserted_orders_are_appended_and_other_writes_reload(self):
+        live_day = ist_today()
+        orders = [{**order, "_id": index, "delivery_date": ist_midnight_utc(live_day)}
+                  for index, order in enumerate(self.orders[DAY])]
+        db = FakeDB(orders[:-5])
+        store = OrderLineStore(db, max_age=3600)
+        asyncio.run(store.blocks(live_day))
+
+        # This worker's inserts (one delivered twice), then another worker's via the change stream
+        store.orders_written([live_day], inserted=orders[-5:-2] + orders[-3:-2])
+        db.orders.docs = orders
+        asyncio.run(store.order_event(InvalidationEvent("orders", "insert", orders[-2]["_id"])))
+        asyncio.run(store.order_event(InvalidationEvent("orders", "insert", orders[-1]["_id"])))
+        (block,) = asyncio.run(store.blocks(live_day))
+        assert db.orders.finds == 1 and store.stats()["appends_total"] == 5
+        expected = self.store.build_block(live_day, orders)
+        assert block.order_numbers == expected.order_numbers and block.lines == expected.lines
+        assert self.store.daily_items(expected, ["cancelled"], {}, {}) == store.daily_items(block, ["cancelled"], {}, {})
+
+        # An update or delete handled elsewhere drops the day
+        asyncio.run(store.order_event(InvalidationEvent("orders", "update", orders[0]["_id"])))
+        assert store.stats()["days_cached"] == 0
+        asyncio.run(store.blocks(live_day))
+        assert db.orders.finds == 2
+        asyncio.run(store.order_event(InvalidationEvent("orders", "delete", "unknown")))
+        assert store.stats()["days_cached"] == 1
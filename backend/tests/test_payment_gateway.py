@@ -0,0 +1,248 @@
+"""
+Tests for the async Razorpay gateway adapter
+Runs against a local fake Razorpay server - no network or credentials needed
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payment_gateway import CircuitBreaker, PaymentGatewayError, RazorpayGateway
+
+
+class FakeRazorpayHandler(BaseHTTPRequestHandler):
+    """Serves /payment_links; fails the first N calls with the configured status"""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        server.calls.append({"path": self.path, "auth": self.headers.get("Authorization"), "body": payload})
+        time.sleep(server.delay)
+
+        if server.failures_remaining > 0:
+            server.failures_remaining -= 1
+            return self._send(server.failure_status, {"error": {"description": "Service unavailable"}})
+
+        if payload.get("amount", 0) <= 0:
+            return self._send(400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "amount must be positive"}})
+
+        self._send(200, {
+            "id": "plink_test123",
+            "short_url": "https://rzp.io/i/test123",
+            "amount": payload["amount"],
+            "currency": payload.get("currency", "INR"),
+            "reference_id": payload.get("reference_id"),
+        })
+
+    def do_GET(self):
+        server = self.server
+        server.calls.append({"path": self.path, "auth": self.headers.get("Authorization"), "body": None})
+        if server.failures_remaining > 0:
+            server.failures_remaining -= 1
+            return self._send(server.failure_status, {"error": {"description": "Service unavailable"}})
+        self._send(200, {"id": self.path.rsplit("/", 1)[-1], "status": "paid"})
+
+
+@pytest.fixture
+def fake_razorpay():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRazorpayHandler)
+    server.calls = []
+    server.failures_remaining = 0
+    server.failure_status = 503
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_gateway(server, **kwargs):
+    host, port = server.server_address
+    return RazorpayGateway(
+        key_id="rzp_test_key",
+        key_secret="secret",
+        base_url=f"http://{host}:{port}",
+        backoff_base=0.01,
+        backoff_max=0.02,
+        **kwargs
+    )
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestRazorpayGateway:
+    """Payment link creation through the pooled async client"""
+
+    def test_create_payment_link(self, fake_razorpay):
+        async def scenario():
+            gateway = make_gateway(fake_razorpay)
+            try:
+                return await gateway.create_payment_link({"amount": 50000, "currency": "INR", "reference_id": "txn_1"})
+            finally:
+                await gateway.aclose()
+
+        link = run(scenario())
+        assert link["id"] == "plink_test123"
+        assert link["amount"] == 50000
+        assert len(fake_razorpay.calls) == 1
+        assert fake_razorpay.calls[0]["path"] == "/payment_links"
+        assert fake_razorpay.calls[0]["auth"].startswith("Basic ")
+
+    def test_retries_transient_errors(self, fake_razorpay):
+        fake_razorpay.failures_remaining = 2
+
+        async def scenario():
+            gateway = make_gateway(fake_razorpay, max_retries=3)
+            try:
+                return await gateway.fetch_payment_link("plink_test123")
+            finally:
+                await gateway.aclose()
+
+        link = run(scenario())
+        assert link["id"] == "plink_test123"
+        assert len(fake_razorpay.calls) == 3
+
+    def test_link_creation_is_not_resent_after_the_server_saw_it(self, fake_razorpay):
+        fake_razorpay.failures_remaining = 1
+
+        async def scenario(**kwargs):
+            gateway = make_gateway(fake_razorpay, max_retries=3, **kwargs)
+            try:
+                await gateway.create_payment_link({"amount": 100, "reference_id": "txn_1"})
+            finally:
+                await gateway.aclose()
+
+        # A 5xx may come after Razorpay created the link
+        with pytest.raises(PaymentGatewayError) as exc_info:
+            run(scenario())
+        assert exc_info.value.status_code == 503
+        assert len(fake_razorpay.calls) == 1
+
+        # So may a read timeout
+        fake_razorpay.calls.clear()
+        fake_razorpay.delay = 0.3
+        with pytest.raises(PaymentGatewayError) as exc_info:
+            run(scenario(timeout=0.1))
+        assert "ReadTimeout" in str(exc_info.value)
+        assert len(fake_razorpay.calls) == 1
+
+    def test_zero_retries_still_sends_once(self, fake_razorpay):
+        async def scenario():
+            gateway = make_gateway(fake_razorpay, max_retries=0)
+            try:
+                return await gateway.create_payment_link({"amount": 100})
+            finally:
+                await gateway.aclose()
+
+        assert run(scenario())["id"] == "plink_test123"
+        assert len(fake_razorpay.calls) == 1
+
+    def test_client_errors_are_not_retried(self, fake_razorpay):
+        async def scenario():
+            gateway = make_gateway(fake_razorpay, max_retries=3)
+            try:
+                await gateway.create_payment_link({"amount": 0})
+            finally:
+                await gateway.aclose()
+
+        with pytest.raises(PaymentGatewayError) as exc_info:
+            run(scenario())
+        assert exc_info.value.status_code == 400
+        assert "amount must be positive" in str(exc_info.value)
+        assert len(fake_razorpay.calls) == 1
+
+    def test_circuit_breaker_fails_fast(self, fake_razorpay):
+        fake_razorpay.failures_remaining = 100
+
+        async def scenario():
+            gateway = make_gateway(
+                fake_razorpay,
+                max_retries=1,
+                breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60)
+            )
+            try:
+                for _ in range(2):
+                    with pytest.raises(PaymentGatewayError):
+                        await gateway.create_payment_link({"amount": 100})
+                # Breaker is now open - the third call never reaches the server
+                with pytest.raises(PaymentGatewayError) as exc_info:
+                    await gateway.create_payment_link({"amount": 100})
+                return exc_info.value
+            finally:
+                await gateway.aclose()
+
+        error = run(scenario())
+        assert "circuit open" in str(error)
+        assert len(fake_razorpay.calls) == 2
+
+    def test_unreachable_gateway(self):
+        async def scenario():
+            gateway = RazorpayGateway(
+                key_id="k", key_secret="s", base_url="http://127.0.0.1:1",
+                max_retries=2, backoff_base=0.01, backoff_max=0.02
+            )
+            try:
+                await gateway.create_payment_link({"amount": 100})
+            finally:
+                await gateway.aclose()
+
+        with pytest.raises(PaymentGatewayError) as exc_info:
+            run(scenario())
+        assert "unreachable" in str(exc_info.value)
+
+
+class TestCircuitBreaker:
+    """State transitions of the breaker itself"""
+
+    def test_half_open_allows_single_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.state == "half_open"
+        assert breaker.allow() is True
+        assert breaker.allow() is False
+        breaker.record_success()
+        assert breaker.state == "closed"
+
+    def test_cancelled_half_open_trial_releases_the_slot(self, fake_razorpay):
+        fake_razorpay.delay = 0.5
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        async def scenario():
+            gateway = make_gateway(fake_razorpay, max_retries=1, breaker=breaker)
+            try:
+                # The caller goes away (client disconnect) while the trial is in flight
+                trial = asyncio.create_task(gateway.create_payment_link({"amount": 100}))
+                await asyncio.sleep(0.1)
+                trial.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await trial
+                fake_razorpay.delay = 0
+                return await gateway.create_payment_link({"amount": 100})
+            finally:
+                await gateway.aclose()
+
+        assert run(scenario())["id"] == "plink_test123"
+        assert breaker.state == "closed"
@@ -0,0 +1,172 @@
+"""
+Tests for the payment webhook inbox and the paid-transaction transition
+Run against the in-memory collections in fake_mongo.py - no mongod needed
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payment_transitions
+from fake_mongo import FakeDB
+from payment_inbox import INBOX_DONE, INBOX_FAILED, INBOX_PENDING, PaymentInbox
+
+
+def topup_db(amount=250.0):
+    return FakeDB(
+        transactions=[{
+            "id": "txn-1",
+            "user_id": "u1",
+            "amount": amount,
+            "transaction_type": "wallet_topup",
+            "status": "pending",
+            "razorpay_payment_link_id": "plink_1",
+            "updated_at": datetime.utcnow(),
+        }],
+        wallets=[{"user_id": "u1", "balance": 100.0}],
+        users=[{"id": "u1", "wallet_balance": 100.0}],
+    )
+
+
+def paid_event(link_id="plink_1", reference_id="txn-1"):
+    return {"event": "payment_link.paid", "payload": {"payment_link": {"entity": {"id": link_id, "reference_id": reference_id}}}}
+
+
+def webhook_handler(db, calls):
+    """The transition part of server.process_payment_webhook"""
+    async def handle(payload):
+        calls.append(payload)
+        entity = payload["payload"]["payment_link"]["entity"]
+        await payment_transitions.apply_paid_transaction(
+            db, {"$or": [{"razorpay_payment_link_id": entity["id"]}, {"id": entity["reference_id"]}]},
+            {"razorpay_payment_link_id": entity["id"]}
+        )
+    return handle
+
+
+async def balances(db):
+    wallet = await db.wallets.find_one({"user_id": "u1"})
+    user = await db.users.find_one({"id": "u1"})
+    return wallet["balance"], user["wallet_balance"]
+
+
+class TestPaymentInbox:
+    def test_duplicate_event_is_acknowledged_and_applied_once(self):
+        db, calls = topup_db(), []
+        inbox = PaymentInbox(db, handler=webhook_handler(db, calls), poll_interval=0.01)
+
+        async def scenario():
+            assert await inbox.enqueue("evt_1", paid_event())
+            assert not await inbox.enqueue("evt_1", paid_event())
+            await inbox.drain()
+            # A redelivery after processing is still a duplicate
+            assert not await inbox.enqueue("evt_1", paid_event())
+            await inbox.drain()
+            return await balances(db)
+
+        assert asyncio.run(scenario()) == (350.0, 350.0)
+        assert len(calls) == 1
+        assert inbox.duplicate_total == 2 and inbox.processed_total == 1
+
+    def test_failed_event_is_retried_after_backoff(self):
+        db, calls = topup_db(), []
+        apply = webhook_handler(db, calls)
+
+        async def flaky(payload):
+            if not calls:
+                calls.append("boom")
+                raise LookupError("transaction not stored yet")
+            await apply(payload)
+
+        inbox = PaymentInbox(db, handler=flaky, max_attempts=3)
+
+        async def scenario():
+            await inbox.enqueue("evt_1", paid_event())
+            await inbox.drain()
+            event = await db.payment_webhook_inbox.find_one({"_id": "evt_1"})
+            assert event["status"] == INBOX_PENDING and event["attempts"] == 1
+            assert event["available_at"] > datetime.utcnow()
+            # Not due yet: a drain leaves it alone
+            await inbox.drain()
+            assert len(calls) == 1
+            await db.payment_webhook_inbox.update_one({"_id": "evt_1"}, {"$set": {"available_at": datetime.utcnow()}})
+            await inbox.drain()
+            return await db.payment_webhook_inbox.find_one({"_id": "evt_1"})
+
+        event = asyncio.run(scenario())
+        assert event["status"] == INBOX_DONE and event["attempts"] == 2 and "payload" not in event
+        assert asyncio.run(balances(db)) == (350.0, 350.0)
+
+    def test_event_fails_permanently_after_max_attempts(self):
+        async def broken(payload):
+            raise RuntimeError("bad payload")
+
+        db = topup_db()
+        inbox = PaymentInbox(db, handler=broken, max_attempts=2)
+
+        async def scenario():
+            await inbox.enqueue("evt_1", paid_event())
+            for _ in range(2):
+                await db.payment_webhook_inbox.update_one({"_id": "evt_1"}, {"$set": {"available_at": datetime.utcnow()}})
+                await inbox.drain()
+            return await db.payment_webhook_inbox.find_one({"_id": "evt_1"})
+
+        assert asyncio.run(scenario())["status"] == INBOX_FAILED
+        assert inbox.failed_total == 1
+
+
+class TestPaidTransition:
+    def test_webhook_and_callback_racing_credit_once(self):
+        db = topup_db()
+
+        async def scenario():
+            return await asyncio.gather(
+                payment_transitions.apply_paid_transaction(db, {"razorpay_payment_link_id": "plink_1"}, {}),
+                payment_transitions.apply_paid_transaction(db, {"id": "txn-1"}, {"razorpay_payment_id": "pay_1"}),
+                payment_transitions.apply_paid_transaction(db, {"id": "txn-1"}, {}),
+            )
+
+        results = asyncio.run(scenario())
+        assert sum(result is not None for result in results) == 1
+        assert asyncio.run(balances(db)) == (350.0, 350.0)
+        transaction = asyncio.run(db.transactions.find_one({"id": "txn-1"}))
+        assert transaction["status"] == "success" and "wallet_credit_pending" not in transaction
+
+    def test_interrupted_credit_is_finished_once_by_the_worker(self):
+        db = topup_db()
+        stale = datetime.utcnow() - timedelta(minutes=5)
+
+        async def scenario():
+            # The transition committed, then the worker died before crediting
+            await db.transactions.update_one({"id": "txn-1"}, {"$set": {
+                "status": "success", "wallet_credit_pending": True, "updated_at": stale
+            }})
+            recovered = [await payment_transitions.finish_pending_wallet_credits(db) for _ in range(2)]
+            return recovered, await balances(db)
+
+        recovered, balance = asyncio.run(scenario())
+        assert recovered == [1, 0]
+        assert balance == (350.0, 350.0)
+
+    def test_credit_already_applied_is_not_repeated(self):
+        db = topup_db()
+
+        async def scenario():
+            # Died after the wallet $inc but before the flag was cleared
+            await db.transactions.update_one({"id": "txn-1"}, {"$set": {
+                "status": "success", "wallet_credit_pending": True, "updated_at": datetime.utcnow() - timedelta(minutes=5)
+            }})
+            await db.wallets.update_one({"user_id": "u1"}, {"$set": {"balance": 350.0, "credited_transactions": ["txn-1"]}})
+            inbox = PaymentInbox(db, handler=None, poll_interval=0.01,
+                                 recover=lambda: payment_transitions.finish_pending_wallet_credits(db))
+            inbox.start()
+            await asyncio.sleep(0.05)
+            await inbox.stop()
+            return inbox, await db.transactions.find_one({"id": "txn-1"})
+
+        inbox, transaction = asyncio.run(scenario())
+        assert inbox.recovered_total == 0
+        assert "wallet_credit_pending" not in transaction
+        assert asyncio.run(balances(db))[0] == 350.0
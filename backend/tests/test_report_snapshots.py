@@ -0,0 +1,78 @@
+"""
+Tests for past-date report snapshots
+Uses the in-memory collections in fake_mongo.py
+"""
+import asyncio
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_mongo import FakeDB
+from report_snapshots import IST, ReportSnapshots, delivery_day, params_key
+
+
+def ist_today():
+    return datetime.now(IST).date()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestReportSnapshots:
+    def setup_method(self):
+        self.db = FakeDB()
+        self.snapshots = ReportSnapshots(self.db, live_days=1)
+        self.computed = 0
+
+    async def compute(self):
+        self.computed += 1
+        return {"computed": self.computed}
+
+    def test_past_dates_are_computed_once(self):
+        past = ist_today() - timedelta(days=10)
+        assert run(self.snapshots.serve("daily-items", past, 1, {"dough_type_id": None}, self.compute)) == {"computed": 1}
+        assert run(self.snapshots.serve("daily-items", past, 1, {"dough_type_id": None}, self.compute)) == {"computed": 1}
+        # Different parameters are a different snapshot
+        assert run(self.snapshots.serve("daily-items", past, 1, {"dough_type_id": "sweet"}, self.compute)) == {"computed": 2}
+        assert self.snapshots.stats()["hits_total"] == 1
+
+    def test_live_window_is_never_snapshotted(self):
+        yesterday = ist_today() - timedelta(days=1)
+        run(self.snapshots.serve("dispatch-board", yesterday, 1, {}, self.compute))
+        run(self.snapshots.serve("dispatch-board", yesterday, 1, {}, self.compute))
+        # A range is frozen only once its last day is
+        run(self.snapshots.serve("preparation-list", yesterday - timedelta(days=1), 2, {"days": 2}, self.compute))
+        assert self.computed == 3 and self.db.report_snapshots.docs == []
+
+    def test_order_writes_drop_every_snapshot_covering_the_day(self):
+        first = ist_today() - timedelta(days=10)
+        run(self.snapshots.serve("preparation-list", first, 3, {"days": 3}, self.compute))
+        run(self.snapshots.serve("daily-items", first + timedelta(days=5), 1, {}, self.compute))
+
+        # Delivery dates are stored as IST midnight in naive UTC: 18:30 the day before
+        stored = datetime.combine(first + timedelta(days=1), datetime.min.time()) - timedelta(hours=5, minutes=30)
+        assert delivery_day(stored) == first + timedelta(days=1)
+        run(self.snapshots.orders_written([stored, None, datetime.utcnow()]))
+        assert [doc["report"] for doc in self.db.report_snapshots.docs] == ["daily-items"]
+
+    def test_snapshot_computed_while_a_write_landed_is_not_served(self):
+        past = ist_today() - timedelta(days=10)
+
+        async def compute_racing_a_write():
+            payload = await self.compute()
+            # The write lands after compute() read the orders, before the snapshot is stored
+            await self.snapshots.orders_written([past])
+            return payload
+
+        run(self.snapshots.serve("daily-items", past, 1, {}, compute_racing_a_write))
+        assert len(self.db.report_snapshots.docs) == 1
+        assert run(self.snapshots.serve("daily-items", past, 1, {}, self.compute)) == {"computed": 2}
+        assert run(self.snapshots.serve("daily-items", past, 1, {}, self.compute)) == {"computed": 2}
+        assert run(self.snapshots.write_counters([past.isoformat(), "2000-01-01"])) == [1, 0]
+
+    def test_params_key_ignores_unset_params(self):
+        assert params_key({"dough_type_id": None, "days": 2}) == "days=2"
+        assert delivery_day("2026-10-12") == date(2026, 10, 12)
@@ -0,0 +1,117 @@
+"""
+Tests for report query building and result shaping
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reports import build_dispatch_board, build_preparation_list, preparation_pipeline, route_groups, shortage_routes
+
+DOUGH_TYPES = [
+    {"id": "sweet", "name": "Sweet Dough", "display_order": 1},
+    {"id": "white", "name": "White Dough", "display_order": 0},
+]
+PRODUCTS = [
+    {"id": "bun", "name": "Cream Bun", "dough_type_id": "sweet", "closing_stock": 5, "previous_closing_stock": 4},
+    {"id": "bread", "name": "Milk Bread", "dough_type_id": "white", "closing_stock": 0, "unit": "packet"},
+    {"id": "rusk", "name": "Milk Rusk", "dough_type_id": None, "closing_stock": 50},
+    {"id": "puff", "name": "Veg Puff", "dough_type_id": "white"},
+]
+
+
+def facet(quantities, order_counts):
+    return {
+        "quantities": [{"_id": {"product_id": pid, "day": day}, "quantity": q} for pid, day, q in quantities],
+        "order_counts": [{"_id": day, "count": count} for day, count in order_counts],
+    }
+
+
+class TestPreparationList:
+    def test_pipeline_matches_the_whole_range_once(self):
+        start = datetime(2026, 10, 18, 18, 30)
+        pipeline = preparation_pipeline(start, 3)
+        assert pipeline[0]["$match"]["delivery_date"] == {"$gte": start, "$lt": datetime(2026, 10, 21, 18, 30)}
+        assert set(pipeline[-1]["$facet"]) == {"quantities", "order_counts"}
+        filtered = preparation_pipeline(start, 2, ["bun"])
+        assert filtered[-1]["$facet"]["quantities"][1] == {"$match": {"items.product_id": {"$in": ["bun"]}}}
+
+    def test_quantities_by_day_and_sections_by_dough_type(self):
+        plan = build_preparation_list(
+            facet([("bun", 0, 10), ("bun", 1, 6), ("bread", 1, 20), ("rusk", 0, 12), ("bun", 5, 99)], [(0, 3), (1, 2)]),
+            PRODUCTS, DOUGH_TYPES, days=2
+        )
+        items = {item["product_id"]: item for item in plan["items"]}
+        assert set(items) == {"bun", "bread", "rusk"}
+        assert items["bun"]["orders_by_day"] == [10, 6]
+        assert (items["bun"]["orders_today"], items["bun"]["orders_tomorrow"]) == (10, 6)
+        assert items["bun"]["total"] == 12
+        assert items["rusk"]["total"] == -38 and items["rusk"]["units_to_prepare"] == 0
+        assert items["bread"]["unit"] == "packet"
+        assert [item["product_id"] for item in plan["items"]] == ["bread", "bun", "rusk"]
+        assert plan["order_counts"] == [3, 2]
+
+        # White dough sorts first by display_order; products without a dough type come last
+        assert [(s["dough_type_name"], s["total_items"], s["units_to_prepare"]) for s in plan["sections"]] == [
+            ("White Dough", 1, 20), ("Sweet Dough", 1, 12), ("Unassigned", 1, 0)
+        ]
+
+    def test_single_day_horizon(self):
+        plan = build_preparation_list(facet([("bread", 0, 7)], [(0, 1)]), PRODUCTS, DOUGH_TYPES, days=1)
+        assert plan["items"][0]["orders_by_day"] == [7]
+        assert plan["items"][0]["orders_tomorrow"] == 0
+
+    def test_snapshot_stock_wins_over_product_fields(self):
+        plan = build_preparation_list(
+            facet([("bun", 0, 10), ("bread", 0, 3)], [(0, 2)]), PRODUCTS, DOUGH_TYPES, days=2, previous_stock={"bun": 1}
+        )
+        items = {item["product_id"]: item for item in plan["items"]}
+        assert items["bun"]["previous_closing_stock"] == 1
+        assert items["bread"]["previous_closing_stock"] == 0
+
+
+ROUTE_CODES = [{"code": c} for c in ["SR 3", "LR1", "SR1", "ONS", "LFT", "SR2", "LR2"]]
+
+
+class TestDispatchBoard:
+    def test_groups_follow_route_codes(self):
+        groups = route_groups(ROUTE_CODES + [{"code": "X9", "route_type": "short"}, {"code": "VAN"}])
+        assert list(groups) == ["lulu", "short", "long", "onsite", "other"]
+        assert groups["short"] == ["SR1", "SR2", "SR 3", "X9"]
+        assert shortage_routes(groups) == {"LFT": [], "SR1": ["SR2", "SR 3", "X9"], "LR1": ["LR2"], "VAN": []}
+        # Nothing configured yet: fall back to the standard routes
+        assert route_groups([])["short"] == ["SR1", "SR2", "SR 3"]
+
+    def test_matrix_shortages_and_override(self):
+        groups = route_groups(ROUTE_CODES)
+        customers = {
+            "c1": {"id": "c1", "business_name": "Alpha", "route_code": "SR1"},
+            "c2": {"id": "c2", "username": "beta", "route_code": "SR2"},
+            "c3": {"id": "c3", "business_name": "Gamma", "route_code": "LFT"},
+        }
+        orders = [
+            {"user_id": "c1", "order_number": "1", "items": [{"product_id": "bun", "product_name": "Cream Bun", "quantity": 4}]},
+            # Shifted into the early short route for this order only
+            {"user_id": "c2", "order_number": "2", "route_code_override": "SR1",
+             "items": [{"product_id": "bun", "product_name": "Cream Bun", "quantity": 3}]},
+            {"user_id": "c3", "order_number": "3", "items": [{"product_id": "bread", "product_name": "Milk Bread", "quantity": 2}]},
+            {"user_id": "gone", "order_number": "4", "items": [{"product_id": "bun", "product_name": "Cream Bun", "quantity": 50}]},
+        ]
+        products = [{"id": "bun", "name": "Cream Bun", "closing_stock": 5}, {"id": "bread", "name": "Milk Bread", "closing_stock": 9}]
+        board = build_dispatch_board(orders, customers, products, groups)
+
+        short = board["routes"]["short"]
+        assert [c["route_code"] for c in short["customers"]] == ["SR1", "SR1"]
+        assert short["matrix"] == {"Cream Bun": {"c1_1": 4, "c2_2": 3}}
+        assert board["routes"]["lulu"]["items"] == ["Milk Bread"]
+        assert board["routes"]["onsite"]["customers"] == []
+        assert board["early_routes"] == ["LFT", "SR1", "LR1"]
+
+        [shortage] = board["shortages"]
+        assert shortage["item"] == "Cream Bun"
+        assert (shortage["demand_sr1"], shortage["demand_lft"], shortage["demand_lr1"]) == (7, 0, 0)
+        assert (shortage["total_demand"], shortage["short_by"]) == (7, 2)
+        assert {c["customer_id"]: c["shift_to_options"] for c in board["shiftable_customers"]} == {
+            "c1": ["SR2", "SR 3"], "c2": ["SR2", "SR 3"]
+        }
@@ -0,0 +1,129 @@
+"""
+Tests for on-demand request profiling
+Unflagged and unauthorised requests pass through, authorised ones are profiled and stored
+"""
+import asyncio
+import marshal
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from request_profiler import RequestProfilerMiddleware, pstats_text
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.request_profiles = FakeCollection()
+
+
+def busy_work():
+    return sum(i * i for i in range(20000))
+
+
+async def app(scope, receive, send):
+    busy_work()
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def run_request(headers, authorized_users=("admin",)):
+    db = FakeDatabase()
+    auth_calls = []
+
+    async def authorize(authorization):
+        auth_calls.append(authorization)
+        token = authorization[7:] if authorization.startswith("Bearer ") else None
+        return token if token in authorized_users else None
+
+    middleware = RequestProfilerMiddleware(app, db_getter=lambda: db, authorize=authorize)
+    scope = {"type": "http", "method": "GET", "path": "/api/products", "query_string": b"", "headers": headers}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    async def scenario():
+        await middleware(scope, receive, send)
+        await asyncio.gather(*middleware._store_tasks)  # profiles are rendered and stored in the background
+
+    asyncio.run(scenario())
+    return sent[0], db.request_profiles.docs, auth_calls
+
+
+class TestRequestProfiler:
+    """Only flagged requests from authorised admins are profiled"""
+
+    def test_unflagged_request_skips_authorization(self):
+        start, docs, auth_calls = run_request([(b"authorization", b"Bearer admin")])
+        assert start["status"] == 200
+        assert auth_calls == []
+        assert docs == []
+        assert b"x-profile-id" not in dict(start["headers"])
+
+    def test_flag_from_unauthorised_user_is_ignored(self):
+        start, docs, auth_calls = run_request([(b"x-profile", b"1"), (b"authorization", b"Bearer customer")])
+        assert auth_calls == ["Bearer customer"]
+        assert docs == []
+        assert b"x-profile-id" not in dict(start["headers"])
+
+    def test_pyinstrument_profile_is_stored(self):
+        start, docs, _ = run_request([(b"x-profile", b"1"), (b"authorization", b"Bearer admin")])
+        profile_id = dict(start["headers"])[b"x-profile-id"].decode()
+        assert len(docs) == 1
+        assert docs[0]["id"] == profile_id
+        assert docs[0]["profiler"] == "pyinstrument"
+        assert docs[0]["username"] == "admin"
+        assert docs[0]["status_code"] == 200
+        assert "<html" in docs[0]["html"].lower()
+
+    def test_cprofile_profile_is_loadable_as_pstats(self):
+        _, docs, _ = run_request([(b"x-profile", b"cprofile"), (b"authorization", b"Bearer admin")])
+        assert docs[0]["profiler"] == "cprofile"
+        assert isinstance(marshal.loads(docs[0]["pstats"]), dict)
+        assert "busy_work" in pstats_text(docs[0]["pstats"])
+
+    def test_concurrent_cprofile_session_is_refused(self):
+        db = FakeDatabase()
+
+        async def slow_app(scope, receive, send):
+            await asyncio.sleep(0.05)
+            await app(scope, receive, send)
+
+        async def authorize(authorization):
+            return "admin"
+
+        middleware = RequestProfilerMiddleware(slow_app, db_getter=lambda: db, authorize=authorize)
+
+        async def request(flag):
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {"type": "http", "method": "GET", "path": "/api/products", "query_string": b"",
+                     "headers": [(b"x-profile", flag), (b"authorization", b"Bearer admin")]}
+            await middleware(scope, None, send)
+            return sent[0]["status"]
+
+        async def scenario():
+            statuses = await asyncio.gather(request(b"cprofile"), request(b"cprofile"), request(b"1"))
+            await asyncio.gather(*middleware._store_tasks)
+            # The session is released once the first request finishes
+            statuses.append(await request(b"cprofile"))
+            await asyncio.gather(*middleware._store_tasks)
+            return statuses
+
+        assert asyncio.run(scenario()) == [200, 409, 200, 200]
+        assert sorted(doc["profiler"] for doc in db.request_profiles.docs) == ["cprofile", "cprofile", "pyinstrument"]
@@ -0,0 +1,69 @@
+"""
+Tests for per-request Mongo round-trip counting and budgets
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+from motor.frameworks import asyncio as motor_asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from round_trips import RoundTripBudget, RoundTripCounter, begin_request, current_request_stats, end_request
+
+
+def fake_command(listener, micros=2000):
+    """What Motor does for every operation: run the driver call on its executor thread"""
+    listener.succeeded(SimpleNamespace(duration_micros=micros))
+
+
+class TestRoundTripCounter:
+    """Counts follow the request through Motor's executor threads"""
+
+    def test_counts_are_isolated_per_request(self):
+        listener = RoundTripCounter()
+
+        async def handle_request(n_queries):
+            stats, token = begin_request()
+            try:
+                for _ in range(n_queries):
+                    await motor_asyncio.run_on_executor(asyncio.get_running_loop(), fake_command, listener)
+                await asyncio.sleep(0)
+                return stats.round_trips, stats.duration_seconds
+            finally:
+                end_request(token)
+
+        async def scenario():
+            results = await asyncio.gather(handle_request(1), handle_request(7), handle_request(3))
+            # Background work outside any request is not attributed to anyone
+            await motor_asyncio.run_on_executor(asyncio.get_running_loop(), fake_command, listener)
+            return results, current_request_stats()
+
+        results, outside = asyncio.run(scenario())
+        assert [count for count, _ in results] == [1, 7, 3]
+        assert abs(results[1][1] - 0.014) < 1e-9
+        assert outside is None
+
+    def test_concurrent_queries_within_one_request(self):
+        listener = RoundTripCounter()
+
+        async def scenario():
+            stats, token = begin_request()
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[motor_asyncio.run_on_executor(loop, fake_command, listener) for _ in range(50)])
+            end_request(token)
+            return stats.round_trips
+
+        assert asyncio.run(scenario()) == 50
+
+
+class TestRoundTripBudget:
+    """Default and per-route allowances"""
+
+    def test_budget_overrides(self):
+        budget = RoundTripBudget(default=5, overrides={"/api/admin/users": 2}, mode="fail")
+        assert budget.check("GET", "/api/products", 5) is False
+        assert budget.check("GET", "/api/admin/users", 3) is True
+        assert budget.exceeded_total == 1
+        assert budget.fail_on_exceed is True
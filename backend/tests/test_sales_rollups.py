@@ -0,0 +1,192 @@
+"""
+Tests for the sales_daily rollup pipeline and the analytics bucketing
+"""
+import asyncio
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_mongo import FakeDB
+from sales_rollups import (
+    SALES_DAILY_KEY, SalesRollups, bucket_series, day_runs, day_window, rollup_pipeline, weekday_profile
+)
+
+
+def test_day_window_uses_ist_midnights():
+    match, day_range = day_window(date(2026, 10, 1), date(2026, 10, 3))
+    assert match["delivery_date"]["$gte"] == datetime(2026, 9, 30, 18, 30)
+    assert match["delivery_date"]["$lt"] == datetime(2026, 10, 3, 18, 30)
+    assert day_range == {"day": {"$gte": "2026-10-01", "$lte": "2026-10-03"}}
+
+
+def test_pipeline_merges_on_the_key_and_unions_the_archive():
+    stamp = datetime(2026, 10, 19)
+    pipeline = rollup_pipeline(date(2026, 10, 1), date(2026, 10, 1), stamp)
+    assert pipeline[-1]["$merge"]["on"] == SALES_DAILY_KEY
+    assert not any("$unionWith" in stage for stage in pipeline)
+
+    unioned = rollup_pipeline(None, None, stamp, archive_union=lambda match: {"$unionWith": {"match": match}})
+    union = next(stage for stage in unioned if "$unionWith" in stage)
+    # Same filter on both tiers, and it runs before items are unwound
+    assert union["$unionWith"]["match"] == unioned[0]["$match"]
+    assert unioned.index(union) < unioned.index({"$unwind": "$items"})
+
+
+def test_bucket_series_fills_empty_weeks_and_months():
+    rows = [
+        {"_id": "2026-09-29", "quantity": 5, "revenue": 50, "order_lines": 1},
+        {"_id": "2026-10-01", "quantity": 2, "revenue": 20, "order_lines": 1},
+    ]
+    weeks = bucket_series(rows, date(2026, 9, 28), date(2026, 10, 11), "week")
+    assert [(w["period_start"], w["quantity"]) for w in weeks] == [("2026-09-28", 7), ("2026-10-05", 0)]
+    months = bucket_series(rows, date(2026, 9, 28), date(2026, 10, 11), "month")
+    assert [(m["period_start"], m["revenue"]) for m in months] == [("2026-09-01", 50), ("2026-10-01", 20)]
+
+
+def test_weekday_profile_averages_per_delivery_day():
+    profile = weekday_profile([{"_id": 1, "days": ["2026-09-28", "2026-10-05"], "quantity": 9, "revenue": 90, "order_lines": 3}])
+    assert len(profile) == 7
+    assert profile[0]["avg_quantity"] == 4.5 and profile[0]["days"] == 2
+    assert profile[6] == {**profile[6], "day_name": "Sunday", "days": 0, "avg_revenue": 0}
+
+
+def dirty_days(db):
+    return sorted(doc["dirty_day"] for doc in db.sales_rollup_state.docs if "dirty_day" in doc)
+
+
+def test_dirty_days_are_saved_as_ist_days():
+    db = FakeDB()
+    asyncio.run(SalesRollups(db).mark_dirty([datetime(2026, 10, 18, 18, 30), "2026-10-19", None]))
+    assert dirty_days(db) == ["2026-10-19"]
+
+
+def test_unsaved_marks_are_retried():
+    db = FakeDB()
+    rollups = SalesRollups(db)
+
+    async def down(*args, **kwargs):
+        raise ConnectionError("mongod unreachable")
+
+    db.sales_rollup_state.bulk_write = down
+    asyncio.run(rollups.mark_dirty(["2026-10-19"]))
+    assert rollups.stats()["unsaved_dirty_days"] == 1
+    del db.sales_rollup_state.bulk_write
+    asyncio.run(rollups.mark_dirty(["2026-10-20"]))
+    assert dirty_days(db) == ["2026-10-19", "2026-10-20"] and rollups.stats()["unsaved_dirty_days"] == 0
+
+
+class RecordingRollups(SalesRollups):
+    """Records rebuild ranges instead of running the aggregation; fails for days in failing"""
+
+    def __init__(self, db=None, failing=(), during_rebuild=None):
+        super().__init__(db)
+        self.rebuilt = []
+        self.failing = set(failing)
+        self.during_rebuild = during_rebuild
+
+    async def rebuild(self, start_day=None, end_day=None):
+        if start_day in self.failing:
+            raise RuntimeError("aggregation failed")
+        self.rebuilt.append((start_day, end_day))
+        if self.during_rebuild:
+            await self.during_rebuild()
+        return 1
+
+
+def test_flush_rebuilds_runs_of_consecutive_days():
+    days = [date(2026, 10, 19), date(2026, 10, 20), date(2026, 10, 21), date(2026, 9, 1)]
+    assert day_runs(days + days[:1]) == [(date(2026, 9, 1), date(2026, 9, 1)), (date(2026, 10, 19), date(2026, 10, 21))]
+
+    db = FakeDB()
+    rollups = RecordingRollups(db, failing={date(2026, 9, 1)})
+    asyncio.run(rollups.mark_dirty(days))
+    asyncio.run(rollups.flush())
+    assert rollups.rebuilt == [(date(2026, 10, 19), date(2026, 10, 21))]
+    # Only the failed run stays dirty
+    assert dirty_days(db) == ["2026-09-01"] and rollups.stats()["days_rebuilt_total"] == 3
+
+
+def test_dirty_days_outlive_the_worker_that_marked_them():
+    db = FakeDB()
+    crashed, survivor = SalesRollups(db), RecordingRollups(db)
+    asyncio.run(crashed.mark_dirty(["2026-10-19"]))
+    # The crashed worker never flushed; the survivor's flush still rebuilds the day
+    asyncio.run(survivor.flush())
+    assert survivor.rebuilt == [(date(2026, 10, 19), date(2026, 10, 19))] and dirty_days(db) == []
+
+
+def test_flush_lease_and_marks_made_during_a_rebuild():
+    db = FakeDB()
+    rollups = RecordingRollups(db, during_rebuild=lambda: rollups.mark_dirty(["2026-10-19"]))
+    other = RecordingRollups(db)
+    asyncio.run(rollups.mark_dirty(["2026-10-19", "2026-10-25"]))
+    asyncio.run(rollups.flush())
+    # 2026-10-19 got another order while it was being rebuilt, so it stays dirty
+    assert dirty_days(db) == ["2026-10-19"]
+    # Within the lease other workers skip the flush
+    asyncio.run(other.flush())
+    assert other.rebuilt == []
+    asyncio.run(db.sales_rollup_state.update_one({"_id": "flush"}, {"$set": {"leased_until": datetime.utcnow()}}))
+    asyncio.run(other.flush())
+    assert other.rebuilt == [(date(2026, 10, 19), date(2026, 10, 19))] and dirty_days(db) == []
+
+
+class MergingOrders:
+    """Stands in for the rollup aggregation: $merges fixed rows into sales_daily with the pipeline's stamp"""
+
+    def __init__(self, db, rows):
+        self.db = db
+        self.rows = rows
+        self.seen_at_merge = None
+
+    def aggregate(self, pipeline):
+        stamp = pipeline[-2]["$project"]["rebuilt_at"]["$literal"]
+        orders = self
+
+        class Cursor:
+            async def to_list(self, length=None):
+                orders.seen_at_merge = [dict(doc) for doc in orders.db.sales_daily.docs]
+                for row in orders.rows:
+                    key = {field: row[field] for field in SALES_DAILY_KEY}
+                    await orders.db.sales_daily.replace_one(key, {**row, "rebuilt_at": stamp}, upsert=True)
+                return []
+
+        return Cursor()
+
+
+def test_rebuild_zeroes_only_rows_the_merge_did_not_rewrite():
+    old = datetime(2026, 1, 1)
+    db = FakeDB(sales_daily=[
+        {"day": "2026-10-19", "customer_id": "c1", "product_id": "p1", "quantity": 5, "revenue": 50, "order_lines": 1, "rebuilt_at": old},
+        {"day": "2026-10-19", "customer_id": "c1", "product_id": "p2", "quantity": 3, "revenue": 30, "order_lines": 1, "rebuilt_at": old},
+        {"day": "2026-10-20", "customer_id": "c1", "product_id": "p2", "quantity": 7, "revenue": 70, "order_lines": 2},
+    ])
+    db.orders = MergingOrders(db, [
+        {"day": "2026-10-19", "customer_id": "c1", "product_id": "p1", "quantity": 6, "revenue": 60, "order_lines": 2},
+    ])
+    rows = asyncio.run(SalesRollups(db).rebuild(date(2026, 10, 19), date(2026, 10, 19)))
+
+    # Nothing was blanked before the merge ran
+    assert [row["quantity"] for row in db.orders.seen_at_merge] == [5, 3, 7]
+    assert rows == 1
+    assert [(row["product_id"], row["day"], row["quantity"]) for row in db.sales_daily.docs] == [
+        ("p1", "2026-10-19", 6), ("p2", "2026-10-19", 0), ("p2", "2026-10-20", 7)
+    ]
+
+
+def test_backfill_runs_once_on_an_empty_collection():
+    db = FakeDB()
+    first, second = RecordingRollups(db), RecordingRollups(db)
+    assert asyncio.run(first.backfill_if_empty())
+    assert not asyncio.run(second.backfill_if_empty())
+    assert first.rebuilt == [(None, None)] and second.rebuilt == []
+
+    # A claim left by a worker that died is taken over once it is old
+    db.sales_rollup_state.docs = [{"_id": "backfill", "claimed_at": datetime.utcnow() - timedelta(hours=2)}]
+    assert asyncio.run(second.backfill_if_empty())
+
+    # Rows built before the backfill existed are left alone
+    db = FakeDB(sales_daily=[{"day": "2026-10-19"}])
+    assert not asyncio.run(RecordingRollups(db).backfill_if_empty())
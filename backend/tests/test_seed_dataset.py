@@ -0,0 +1,80 @@
+"""
+Tests for the synthetic dataset generator
+Same seed gives the same data; references between collections line up
+"""
+import os
+import sys
+from collections import defaultdict
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed_dataset import ROUTES, DatasetGenerator, unsafe_seed_hosts
+
+ANCHOR = date(2026, 10, 19)
+
+
+def collections(scale=1, seed=42, weeks=2):
+    docs = defaultdict(list)
+    for name, doc in DatasetGenerator(scale, seed, weeks, ANCHOR, password_hash="x").documents():
+        docs[name].append(doc)
+    return docs
+
+
+class TestDatasetGenerator:
+    def test_same_seed_same_dataset(self):
+        assert collections() == collections()
+        assert collections()["orders"] != collections(seed=7)["orders"]
+
+    def test_scale_grows_customers_and_orders(self):
+        small, large = collections(scale=1), collections(scale=3)
+        assert len(large["users"]) > 2.5 * len(small["users"])
+        assert len(large["orders"]) > 2.5 * len(small["orders"])
+
+    def test_references_line_up(self):
+        docs = collections()
+        users = {u["id"]: u for u in docs["users"]}
+        products = {p["id"] for p in docs["products"]}
+        dough_types = {c["id"] for c in docs["categories"] if c["category_type"] == "dough_type"}
+
+        assert {u["route_code"] for u in users.values() if u["role"] == "customer"} == {code for code, _, _ in ROUTES}
+        assert all(u["onsite_pickup_only"] == (u["route_code"] == "ONS") for u in users.values() if u["role"] == "customer")
+        agents = [u for u in users.values() if u["user_type"] == "order_agent"]
+        assert agents and all(users[a["linked_owner_id"]]["user_type"] == "owner" for a in agents)
+        assert all(p["dough_type_id"] in dough_types for p in docs["products"])
+
+        for order in docs["orders"]:
+            assert order["user_id"] in users
+            assert all(item["product_id"] in products for item in order["items"])
+            allowed = users[order["user_id"]].get("allowed_product_ids")
+            if allowed and not order.get("is_standing_order"):
+                assert all(item["product_id"] in allowed for item in order["items"])
+        assert docs["counters"][0]["sequence"] == max(int(o["order_number"]) for o in docs["orders"])
+        assert len({o["order_number"] for o in docs["orders"]}) == len(docs["orders"])
+        assert {o["standing_order_id"] for o in docs["orders"] if o.get("is_standing_order")} <= {s["id"] for s in docs["standing_orders"]}
+
+    def test_wallets_reconcile_with_transactions(self):
+        docs = collections()
+        balances = defaultdict(float)
+        owners = {u["id"]: u.get("linked_owner_id") or u["id"] for u in docs["users"]}
+        for transaction in docs["transactions"]:
+            sign = 1 if transaction["transaction_type"] == "wallet_topup" else -1
+            balances[owners[transaction["user_id"]]] += sign * transaction["amount"]
+        for wallet in docs["wallets"]:
+            assert wallet["balance"] >= 0
+            # Opening balances carry no transaction, so the ledger can only fall short of the wallet
+            assert round(wallet["balance"] - balances[wallet["user_id"]], 2) >= 0
+
+
+class TestSeedTargetGuard:
+    def test_only_loopback_or_allowed_hosts_are_seeded(self):
+        assert unsafe_seed_hosts("mongodb://localhost:27017", []) == []
+        assert unsafe_seed_hosts("mongodb://127.0.0.2,[::1]:27018/?replicaSet=rs0", []) == []
+        # Substrings of a local name don't count
+        assert unsafe_seed_hosts("mongodb://localhost.prod.example.com", []) == ["localhost.prod.example.com"]
+        assert unsafe_seed_hosts("mongodb://user:pw@db.example.com/?authSource=localhost", []) == ["db.example.com"]
+        # Every host of a replica set has to pass
+        assert unsafe_seed_hosts("mongodb://localhost,mongo:27017", []) == ["mongo"]
+        assert unsafe_seed_hosts("mongodb://localhost,mongo:27017", ["mongo"]) == []
+        assert unsafe_seed_hosts("mongodb+srv://cluster0.example.mongodb.net", ["cluster0.example.mongodb.net"])
+        assert unsafe_seed_hosts("not a url", []) == ["not a url"]
@@ -0,0 +1,101 @@
+"""
+Tests for the in-memory settings registry
+Uses a minimal in-memory stand-in for the Motor collections it reads
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings_registry import SettingsRegistry
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs = sorted(self.docs, key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return [dict(d) for d in self.docs[:length]]
+
+
+class FakeCollection:
+    def __init__(self, db, docs=None):
+        self.db = db
+        self.docs = docs or []
+
+    def find(self, query=None, projection=None):
+        self.db.queries += 1
+        return FakeCursor(list(self.docs))
+
+    async def find_one(self, query, projection=None):
+        self.db.queries += 1
+        for doc in self.docs:
+            if all(doc.get(k) == v for k, v in query.items()):
+                return dict(doc)
+        return None
+
+
+class FakeDB:
+    def __init__(self):
+        self.queries = 0
+        self.settings = FakeCollection(self, [
+            {"key": "delivery_charge", "value": 25.0},
+            {"type": "delivery_notes", "enabled": True, "message": "Ring the bell"},
+        ])
+        self.app_settings = FakeCollection(self, [{"key": "whatsapp_numbers", "numbers": [{"id": "1", "phone": "91999"}]}])
+        self.cleaning_tasks = FakeCollection(self)
+        self.route_codes = FakeCollection(self, [{"code": "SR2"}, {"code": "LFT"}])
+
+
+class TestSettingsRegistry:
+    """Snapshot loading, caching and invalidation"""
+
+    def test_snapshot_is_typed_and_cached(self):
+        db = FakeDB()
+
+        async def scenario():
+            registry = SettingsRegistry(db, ttl=60)
+            first = await registry.get()
+            await asyncio.gather(*[registry.get() for _ in range(20)])
+            return first, registry
+
+        snapshot, registry = asyncio.run(scenario())
+        assert snapshot.delivery_charge == 25.0
+        assert snapshot.delivery_notes["message"] == "Ring the bell"
+        assert snapshot.whatsapp_numbers == [{"id": "1", "phone": "91999"}]
+        assert snapshot.app_version is None
+        assert snapshot.cleaning_tasks is None
+        assert [r["code"] for r in snapshot.route_codes] == ["LFT", "SR2"]
+        assert registry.loads_total == 1
+        assert db.queries == 4
+
+    def test_invalidate_reloads(self):
+        db = FakeDB()
+
+        async def scenario():
+            registry = SettingsRegistry(db, ttl=60)
+            await registry.get()
+            db.settings.docs[0]["value"] = 40.0
+            cached = (await registry.get()).delivery_charge
+            registry.invalidate()
+            return cached, (await registry.get()).delivery_charge
+
+        cached, reloaded = asyncio.run(scenario())
+        assert cached == 25.0
+        assert reloaded == 40.0
+
+    def test_ttl_expiry_reloads(self):
+        db = FakeDB()
+
+        async def scenario():
+            registry = SettingsRegistry(db, ttl=0)
+            await registry.get()
+            await registry.get()
+            return registry.loads_total
+
+        assert asyncio.run(scenario()) == 2
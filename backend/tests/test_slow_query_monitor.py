@@ -0,0 +1,107 @@
+"""
+Tests for the slow query monitor
+Query shapes, explain summaries and the listener -> asyncio hand-off
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from slow_query_monitor import SlowQueryMonitor, explainable_command, filter_shape, summarize_explain
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+class FakeDatabase:
+    def __init__(self, explain_result):
+        self.slow_queries = FakeCollection()
+        self.explain_result = explain_result
+        self.commands = []
+
+    async def command(self, name, cmd, verbosity=None):
+        self.commands.append((name, cmd, verbosity))
+        return self.explain_result
+
+
+class FakeClient(dict):
+    pass
+
+
+COLLSCAN_EXPLAIN = {
+    "queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}},
+    "executionStats": {"totalDocsExamined": 5000, "totalKeysExamined": 0, "nReturned": 12, "executionTimeMillis": 180}
+}
+
+
+class TestQueryShapes:
+    """Literal values are stripped, structure is kept"""
+
+    def test_find_shapes_match_regardless_of_values(self):
+        first = filter_shape("find", {"find": "orders", "filter": {"user_id": "a", "delivery_date": {"$gte": 1, "$lt": 2}}})
+        second = filter_shape("find", {"find": "orders", "filter": {"delivery_date": {"$lt": 9, "$gte": 8}, "user_id": "b"}})
+        assert first == second
+        assert json.loads(first)["filter"] == {"delivery_date": {"$gte": "?", "$lt": "?"}, "user_id": "?"}
+
+    def test_aggregate_shape_includes_stage_names(self):
+        shape = json.loads(filter_shape("aggregate", {"pipeline": [{"$match": {"status": "pending"}}, {"$group": {"_id": "$x"}}]}))
+        assert shape == {"$match": {"status": "?"}, "stages": ["$match", "$group"]}
+
+    def test_explainable_command(self):
+        cmd = explainable_command("update", {"update": "users", "updates": [{"q": {"id": 1}}, {"q": {"id": 2}}], "lsid": {}, "$db": "x"})
+        assert cmd == {"update": "users", "updates": [{"q": {"id": 1}}]}
+        assert explainable_command("aggregate", {"aggregate": "orders", "pipeline": [{"$merge": "x"}]}) is None
+
+    def test_summarize_explain_flags_collscan(self):
+        summary = summarize_explain(COLLSCAN_EXPLAIN)
+        assert summary["collscan"] is True
+        assert summary["plan_stages"] == ["SORT", "COLLSCAN"]
+        assert summary["docs_examined"] == 5000
+
+
+class TestSlowQueryMonitor:
+    """Commands over the threshold are recorded and explained off the calling thread"""
+
+    def test_slow_query_is_recorded_with_explain(self):
+        async def scenario():
+            db = FakeDatabase(COLLSCAN_EXPLAIN)
+            client = FakeClient(divine=db)
+            monitor = SlowQueryMonitor(threshold_ms=50, sample_rate=0)
+            monitor.start(client, db)
+
+            def emit(request_id, micros):
+                command = {"find": "orders", "filter": {"user_id": "u1"}, "lsid": {"id": 1}}
+                monitor.started(SimpleNamespace(command_name="find", command=command, database_name="divine", request_id=request_id, operation_id=request_id))
+                monitor.succeeded(SimpleNamespace(command_name="find", request_id=request_id, operation_id=request_id, duration_micros=micros))
+
+            # Listener callbacks arrive on driver threads
+            thread = threading.Thread(target=lambda: [emit(1, 120_000), emit(2, 10_000), emit(3, 90_000)])
+            thread.start()
+            thread.join()
+            for _ in range(50):
+                if len(db.slow_queries.docs) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            await monitor.stop()
+            return db, monitor
+
+        db, monitor = asyncio.run(scenario())
+        first, second = db.slow_queries.docs
+        assert first["duration_ms"] == 120.0
+        assert first["collscan"] is True
+        assert first["explain"]["docs_examined"] == 5000
+        # Same shape within the explain interval is not explained again
+        assert "explain" not in second
+        assert len(db.commands) == 1
+        assert db.commands[0][1] == {"find": "orders", "filter": {"user_id": "u1"}}
+        assert db.commands[0][2] == "executionStats"
+        assert monitor.stats()["slow_total"] == 2
@@ -0,0 +1,105 @@
+"""
+Tests for daily stock snapshots and the admin stock count update
+"""
+import asyncio
+import os
+import sys
+from datetime import date, datetime
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_mongo import FakeDB
+from stock_snapshots import IST, StockSnapshots, apply_stock_counts, ist_today, next_capture_at
+
+
+class TestSchedule:
+    def test_next_capture_is_the_coming_cutoff_in_ist(self):
+        # 2026-10-18 21:00 UTC is 02:30 IST on the 19th - the cutoff is 90 minutes away
+        before = pytz.UTC.localize(datetime(2026, 10, 18, 21, 0))
+        assert next_capture_at(before, 4) == IST.localize(datetime(2026, 10, 19, 4, 0))
+        assert ist_today(before).isoformat() == "2026-10-19"
+
+        # Exactly at and after the cutoff, the next one is tomorrow's
+        at = IST.localize(datetime(2026, 10, 19, 4, 0))
+        assert next_capture_at(at, 4) == IST.localize(datetime(2026, 10, 20, 4, 0))
+        assert next_capture_at(pytz.UTC.localize(datetime(2026, 10, 19, 12, 0)), 4) == IST.localize(datetime(2026, 10, 20, 4, 0))
+
+
+def stock_db():
+    return FakeDB(products=[
+        {"id": "p1", "closing_stock": 4},
+        {"id": "p2", "closing_stock": 0},
+        {"id": "p3"},
+    ])
+
+
+class TestCapture:
+    def test_scheduled_capture_keeps_the_first_snapshot(self):
+        snapshots = StockSnapshots(stock_db())
+
+        async def scenario():
+            await snapshots.ensure_indexes()
+            first = await snapshots.capture(date(2026, 10, 19), source="scheduled", replace=False)
+            await snapshots.db.products.update_one({"id": "p1"}, {"$set": {"closing_stock": 9}})
+            second = await snapshots.capture(date(2026, 10, 19), source="scheduled", replace=False)
+            return first, second, await snapshots.closing_stock_as_of(date(2026, 10, 19))
+
+        first, second, (as_of, stock) = asyncio.run(scenario())
+        assert first["items"] == [
+            {"product_id": "p1", "closing_stock": 4},
+            {"product_id": "p2", "closing_stock": 0},
+            {"product_id": "p3", "closing_stock": 0},
+        ]
+        assert second is None and snapshots.captures_total == 1
+        assert as_of == "2026-10-19" and stock["p1"] == 4
+
+    def test_manual_capture_replaces_the_day(self):
+        snapshots = StockSnapshots(stock_db())
+
+        async def scenario():
+            await snapshots.capture(date(2026, 10, 19))
+            await snapshots.db.products.update_one({"id": "p1"}, {"$set": {"closing_stock": 9}})
+            await snapshots.capture(date(2026, 10, 19))
+            return await snapshots.closing_stock_as_of(date(2026, 10, 19))
+
+        as_of, stock = asyncio.run(scenario())
+        assert stock["p1"] == 9 and snapshots.captures_total == 2
+        assert len(snapshots.collection.docs) == 1
+
+    def test_closing_stock_comes_from_the_latest_snapshot_on_or_before_the_day(self):
+        snapshots = StockSnapshots(stock_db())
+
+        async def scenario():
+            await snapshots.capture(date(2026, 10, 17))
+            await snapshots.db.products.update_one({"id": "p1"}, {"$set": {"closing_stock": 7}})
+            await snapshots.capture(date(2026, 10, 19))
+            return [await snapshots.closing_stock_as_of(date(2026, 10, d)) for d in (16, 17, 18, 19, 25)]
+
+        results = asyncio.run(scenario())
+        assert results[0] == (None, {})
+        assert [(as_of, stock["p1"]) for as_of, stock in results[1:]] == [
+            ("2026-10-17", 4), ("2026-10-17", 4), ("2026-10-19", 7), ("2026-10-19", 7)
+        ]
+
+
+class TestStockCounts:
+    def test_unknown_and_repeated_products_are_reported(self):
+        db = stock_db()
+        result = asyncio.run(apply_stock_counts(db, [("p1", 3), ("nope", 5), ("p2", 1), ("p1", 6), ("gone", 1)]))
+        assert result == {
+            "matched": 2,
+            "modified": 2,
+            "unknown_product_ids": ["gone", "nope"],
+            "duplicate_product_ids": ["p1"],
+        }
+        stock = {p["id"]: p.get("closing_stock") for p in db.products.docs}
+        # The last count for a repeated product wins; unknown ids are not created
+        assert stock == {"p1": 6, "p2": 1, "p3": None}
+
+    def test_all_known_products_skip_the_lookup(self):
+        db = stock_db()
+        result = asyncio.run(apply_stock_counts(db, [("p3", 2)]))
+        assert result["unknown_product_ids"] == [] and result["duplicate_product_ids"] == []
+        assert db.products.docs[2]["closing_stock"] == 2
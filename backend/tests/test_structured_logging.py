@@ -0,0 +1,104 @@
+"""
+Tests for the queued JSON logging pipeline
+Formatting, per-logger sampling and runtime level changes
+"""
+import io
+import json
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_logging import LogPipeline, SamplingFilter
+from tracing import Tracer
+
+
+@pytest.fixture
+def pipeline():
+    """Install a pipeline writing to a buffer, then put the root logger back as it was"""
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    buffer = io.StringIO()
+    created = []
+
+    def make(**kwargs):
+        log_pipeline = LogPipeline(stream=buffer, **kwargs).install()
+        created.append(log_pipeline)
+        return log_pipeline, buffer
+
+    yield make
+    for log_pipeline in created:
+        log_pipeline.apply({}, {})
+        log_pipeline.stop()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+
+
+def records(buffer):
+    return [json.loads(line) for line in buffer.getvalue().splitlines()]
+
+
+class TestSamplingFilter:
+    """Rates apply to a logger and its children; warnings always pass"""
+
+    def test_rates_by_logger_prefix(self):
+        sampler = SamplingFilter({"server": 0.0, "server.payments": 1.0})
+        info = lambda name: logging.LogRecord(name, logging.INFO, __file__, 1, "x", None, None)
+        assert sampler.filter(info("server")) is False
+        assert sampler.filter(info("server.orders")) is False
+        assert sampler.filter(info("server.payments")) is True
+        assert sampler.filter(info("email_outbox")) is True
+        assert sampler.filter(logging.LogRecord("server", logging.WARNING, __file__, 1, "x", None, None)) is True
+        assert sampler.dropped_total == 2
+
+
+class TestLogPipeline:
+    """Records are written as JSON by the listener thread"""
+
+    def test_json_lines_with_trace_id_and_exception(self, pipeline):
+        log_pipeline, buffer = pipeline()
+        tracer = Tracer()
+        logger = logging.getLogger("test_structured_logging.json")
+        root_span, token = tracer.start_trace("GET /api/products")
+        logger.info("Order %s created", "ORD-1")
+        tracer.end_trace(root_span, token)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Failed")
+        log_pipeline.stop()
+
+        first, second = records(buffer)
+        assert first["message"] == "Order ORD-1 created"
+        assert first["level"] == "INFO"
+        assert first["logger"] == "test_structured_logging.json"
+        assert first["trace_id"] == root_span.trace_id
+        assert "trace_id" not in second
+        assert "ValueError: boom" in second["exc"]
+
+    def test_runtime_levels_and_sampling(self, pipeline):
+        log_pipeline, buffer = pipeline(sampling={"test_structured_logging.noisy": 0.0})
+        noisy = logging.getLogger("test_structured_logging.noisy")
+        quiet = logging.getLogger("test_structured_logging.quiet")
+        noisy.info("dropped")
+        noisy.warning("kept")
+        quiet.debug("below level")
+        log_pipeline.apply({"test_structured_logging.quiet": "DEBUG"}, {})
+        quiet.debug("now visible")
+        noisy.info("sampling removed")
+        log_pipeline.stop()
+
+        assert [r["message"] for r in records(buffer)] == ["kept", "now visible", "sampling removed"]
+        assert log_pipeline.snapshot()["levels"] == {"test_structured_logging.quiet": "DEBUG"}
+        assert log_pipeline.stats()["sampled_out_total"] == 1
+
+    def test_unknown_level_is_rejected(self, pipeline):
+        log_pipeline, _ = pipeline()
+        with pytest.raises(ValueError):
+            log_pipeline.apply({"server": "LOUD"}, None)
@@ -0,0 +1,170 @@
+"""
+Tests for request tracing
+Span nesting, Mongo spans across Motor's executor threads, and both exporters
+"""
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+from motor.frameworks import asyncio as motor_asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payment_gateway import OutboundHTTPClient
+from tracing import JsonLinesExporter, MongoTracingListener, OTLPHttpExporter, Tracer, parse_traceparent
+
+
+class MemoryExporter:
+    def __init__(self):
+        self.spans = []
+
+    async def export(self, spans, service_name):
+        self.spans.extend(spans)
+
+    async def aclose(self):
+        pass
+
+
+def mongo_command(listener, request_id):
+    """Listener callbacks as the driver emits them on Motor's executor thread"""
+    command = {"find": "orders", "filter": {}}
+    listener.started(SimpleNamespace(command_name="find", command=command, database_name="divine", request_id=request_id, operation_id=request_id))
+    listener.succeeded(SimpleNamespace(command_name="find", request_id=request_id, operation_id=request_id, duration_micros=1000))
+
+
+class TestTraceparent:
+    def test_parse(self):
+        header = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+        assert parse_traceparent(header) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+        assert parse_traceparent("00-xyz-00f067aa0ba902b7-01") is None
+        assert parse_traceparent("00-" + "0" * 32 + "-00f067aa0ba902b7-01") is None
+        assert parse_traceparent(None) is None
+
+
+class TestTracer:
+    """Child spans share the request's trace id and point at their parent"""
+
+    def test_request_trace_with_mongo_and_step_spans(self):
+        exporter = MemoryExporter()
+        tracer = Tracer(exporter=exporter)
+        listener = MongoTracingListener(tracer)
+
+        async def scenario():
+            tracer.start()
+            root, token = tracer.start_trace("POST /api/orders", traceparent="00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01")
+            loop = asyncio.get_running_loop()
+            with tracer.span("checkout.wallet"):
+                await motor_asyncio.run_on_executor(loop, mongo_command, listener, 1)
+            await motor_asyncio.run_on_executor(loop, mongo_command, listener, 2)
+            tracer.end_trace(root, token)
+            # Commands outside a request are not traced
+            await motor_asyncio.run_on_executor(loop, mongo_command, listener, 3)
+            await tracer.stop()
+            return root
+
+        root = asyncio.run(scenario())
+        spans = {span.name: span for span in exporter.spans}
+        assert len(exporter.spans) == 4
+        assert {span.trace_id for span in exporter.spans} == {"4bf92f3577b34da6a3ce929d0e0e4736"}
+        assert root.parent_span_id == "00f067aa0ba902b7"
+        assert spans["checkout.wallet"].parent_span_id == root.span_id
+        wallet_find, request_find = [span for span in exporter.spans if span.name == "mongo.find"]
+        assert wallet_find.parent_span_id == spans["checkout.wallet"].span_id
+        assert request_find.parent_span_id == root.span_id
+        assert wallet_find.attributes["db.mongodb.collection"] == "orders"
+
+    def test_disabled_tracer_still_issues_trace_ids(self):
+        tracer = Tracer()
+
+        async def scenario():
+            root, token = tracer.start_trace("GET /api/products")
+            with tracer.span("image.compress") as span:
+                assert span is None
+            tracer.end_trace(root, token)
+            return root
+
+        root = asyncio.run(scenario())
+        assert len(root.trace_id) == 32
+        assert tracer.stats()["spans_finished_total"] == 0
+
+    def test_span_records_errors(self):
+        exporter = MemoryExporter()
+        tracer = Tracer(exporter=exporter)
+
+        async def scenario():
+            try:
+                with tracer.span("checkout.wallet"):
+                    raise ValueError("insufficient balance")
+            except ValueError:
+                pass
+            await tracer.flush()
+
+        asyncio.run(scenario())
+        assert exporter.spans[0].error == "ValueError: insufficient balance"
+
+    def test_outbound_http_span(self):
+        exporter = MemoryExporter()
+        tracer = Tracer(exporter=exporter)
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"id": "plink_1"}))
+        client = OutboundHTTPClient(base_url="https://api.razorpay.com/v1", name="razorpay", tracer=tracer, transport=transport)
+
+        async def scenario():
+            root, token = tracer.start_trace("POST /api/payments/create-order")
+            await client.post("/payment_links", json={})
+            tracer.end_trace(root, token)
+            await client.aclose()
+            await tracer.flush()
+
+        asyncio.run(scenario())
+        http_span = exporter.spans[0]
+        assert http_span.name == "razorpay POST"
+        assert http_span.kind == "client"
+        assert http_span.attributes["http.status_code"] == 200
+
+
+class TestExporters:
+    def test_jsonl_exporter(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        tracer = Tracer(exporter=JsonLinesExporter(str(path)))
+
+        async def scenario():
+            root, token = tracer.start_trace("GET /api/products")
+            with tracer.span("image.compress", input_bytes=10):
+                pass
+            tracer.end_trace(root, token)
+            await tracer.flush()
+
+        asyncio.run(scenario())
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line["name"] for line in lines] == ["image.compress", "GET /api/products"]
+        assert lines[0]["attributes"] == {"input_bytes": 10}
+        assert lines[0]["parent_span_id"] == lines[1]["span_id"]
+
+    def test_otlp_exporter_posts_json(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={})
+
+        exporter = OTLPHttpExporter("http://collector:4318/", headers={"x-api-key": "k"}, transport=httpx.MockTransport(handler))
+        tracer = Tracer(exporter=exporter, service_name="test-api")
+
+        async def scenario():
+            root, token = tracer.start_trace("GET /api/products")
+            tracer.end_trace(root, token, error="HTTP 500")
+            await tracer.stop()
+
+        asyncio.run(scenario())
+        assert requests[0].url == "http://collector:4318/v1/traces"
+        assert requests[0].headers["x-api-key"] == "k"
+        body = json.loads(requests[0].content)
+        resource_spans = body["resourceSpans"][0]
+        assert resource_spans["resource"]["attributes"][0]["value"]["stringValue"] == "test-api"
+        span = resource_spans["scopeSpans"][0]["spans"][0]
+        assert span["kind"] == 2
+        assert span["status"] == {"code": 2, "message": "HTTP 500"}
+        assert tracer.stats()["spans_exported_total"] == 1
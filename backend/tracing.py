@@ -0,0 +1,383 @@
+# Request Tracing
+# Lightweight spans for incoming requests and the work they fan out to (Mongo commands,
+# Razorpay calls, SMTP sends, image compression). The current span travels in a contextvar -
+# like the round-trip counter - so Motor's executor threads see the request that issued a
+# command. Finished spans are batched and exported to an OTLP/HTTP collector or a JSON-lines file.
+import asyncio
+import json
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "sampled",
+                 "start_ns", "end_ns", "attributes", "error", "_tracer")
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_span_id: Optional[str], sampled: bool,
+                 kind: str = "internal", attributes: Optional[dict] = None):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, error: Optional[str] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = error
+        if self.sampled:
+            self._tracer._finish(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self, service_name: str) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": service_name,
+            "start_time": datetime.utcfromtimestamp(self.start_ns / 1e9).isoformat() + "Z",
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": "error" if self.error else "ok",
+            "error": self.error
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def parse_traceparent(header: Optional[str]):
+    """W3C traceparent '00-<trace_id>-<parent_id>-<flags>' -> (trace_id, parent_id, sampled) or None"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per span to a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: List[str]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    async def export(self, spans: List[Span], service_name: str):
+        lines = [json.dumps(span.to_dict(service_name), default=str) + "\n" for span in spans]
+        await asyncio.to_thread(self._write, lines)
+
+    async def aclose(self):
+        pass
+
+
+class OTLPHttpExporter:
+    """Posts spans to an OTLP/HTTP collector using the JSON encoding (POST <endpoint>/v1/traces)"""
+
+    def __init__(self, endpoint: str, headers: Optional[Dict[str, str]] = None, timeout: float = 10.0,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self._client = httpx.AsyncClient(timeout=timeout, headers=headers or {}, transport=transport)
+
+    def payload(self, spans: List[Span], service_name: str) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "divine-cakery.tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_span_id or "",
+                    "name": span.name,
+                    "kind": SPAN_KINDS.get(span.kind, 1),
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items() if v is not None],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+                } for span in spans]
+            }]
+        }]}
+
+    async def export(self, spans: List[Span], service_name: str):
+        response = await self._client.post(self.url, json=self.payload(spans, service_name))
+        response.raise_for_status()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class Tracer:
+    """
+    Creates spans and exports finished ones in batches from a background task.
+    Without an exporter, requests still get a trace id (echoed in X-Trace-Id) but no
+    child spans are created, so tracing costs nothing beyond an id per request.
+    """
+
+    def __init__(
+        self,
+        exporter=None,
+        service_name: str = "divine-cakery-api",
+        sample_rate: float = 1.0,
+        batch_size: int = 512,
+        flush_interval: float = 5.0,
+        max_queue: int = 20000,
+    ):
+        self.exporter = exporter
+        self.service_name = service_name
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = deque(maxlen=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # In-process counters (per worker)
+        self.spans_finished_total = 0
+        self.spans_exported_total = 0
+        self.export_errors_total = 0
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """
+        TRACING_EXPORTER: 'otlp' (OTEL_EXPORTER_OTLP_ENDPOINT, OTEL_EXPORTER_OTLP_HEADERS='k=v,k2=v2'),
+        'jsonl' (TRACING_JSONL_PATH) or 'none' (default).
+        """
+        kind = os.environ.get("TRACING_EXPORTER", "none").lower()
+        exporter = None
+        if kind == "otlp":
+            headers = dict(
+                item.split("=", 1) for item in os.environ.get("OTEL_EXPORTER_OTLP_HEADERS", "").split(",") if "=" in item
+            )
+            exporter = OTLPHttpExporter(os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"), headers)
+        elif kind == "jsonl":
+            exporter = JsonLinesExporter(os.environ.get("TRACING_JSONL_PATH", "traces.jsonl"))
+        return cls(
+            exporter=exporter,
+            service_name=os.environ.get("OTEL_SERVICE_NAME", "divine-cakery-api"),
+            sample_rate=float(os.environ.get("TRACING_SAMPLE_RATE", 1.0))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    # ---- span creation ----
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, kind: str = "server", attributes: Optional[dict] = None):
+        """Root span for an incoming request, continuing the caller's trace if it sent traceparent. Returns (span, token)."""
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace_id, parent_span_id, sampled = parent
+        else:
+            trace_id, parent_span_id = secrets.token_hex(16), None
+            sampled = random.random() < self.sample_rate
+        span = Span(self, name, trace_id, parent_span_id, sampled and self.enabled, kind, attributes)
+        return span, _current_span.set(span)
+
+    def end_trace(self, span: Span, token, error: Optional[str] = None):
+        _current_span.reset(token)
+        span.end(error)
+
+    def start_span(self, name: str, kind: str = "internal", attributes: Optional[dict] = None,
+                   parent: Optional[Span] = None, new_trace: bool = True,
+                   traceparent: Optional[str] = None) -> Optional[Span]:
+        """
+        Child of `parent` (default: the current span), or of a `traceparent` saved earlier -
+        e.g. by the request that queued a background job. Does not change the current span.
+        With no parent a new trace is started unless new_trace=False. Returns None when not recorded.
+        """
+        if not self.enabled:
+            return None
+        if parent is None and traceparent is not None:
+            saved = parse_traceparent(traceparent)
+            if saved is not None:
+                trace_id, parent_span_id, sampled = saved
+                return Span(self, name, trace_id, parent_span_id, True, kind, attributes) if sampled else None
+        parent = parent or _current_span.get()
+        if parent is None:
+            if not new_trace or random.random() >= self.sample_rate:
+                return None
+            return Span(self, name, secrets.token_hex(16), None, True, kind, attributes)
+        if not parent.sampled:
+            return None
+        return Span(self, name, parent.trace_id, parent.span_id, True, kind, attributes)
+
+    def current_traceparent(self) -> Optional[str]:
+        """traceparent of the current span, for background work that should join this trace later"""
+        span = _current_span.get()
+        return span.traceparent if span is not None and span.sampled else None
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", traceparent: Optional[str] = None, **attributes):
+        """`with tracer.span("checkout.wallet"):` - nested spans and Mongo commands become children"""
+        span = self.start_span(name, kind, attributes, traceparent=traceparent)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    # ---- export ----
+
+    def _finish(self, span: Span):
+        # May be called from driver threads; deque appends are thread-safe
+        self._queue.append(span)
+        self.spans_finished_total += 1
+        if len(self._queue) >= self.batch_size and self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # loop closed during shutdown
+
+    async def flush(self):
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            try:
+                await self.exporter.export(batch, self.service_name)
+                self.spans_exported_total += len(batch)
+            except Exception as e:
+                self.export_errors_total += 1
+                logger.warning(f"Failed to export {len(batch)} spans: {str(e)}")
+                return
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is not None or not self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._loop = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled:
+            await self.flush()
+            await self.exporter.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "spans_finished_total": self.spans_finished_total,
+            "spans_exported_total": self.spans_exported_total,
+            "spans_dropped_total": self.spans_finished_total - self.spans_exported_total - len(self._queue),
+            "export_errors_total": self.export_errors_total,
+            "queue_depth": len(self._queue)
+        }
+
+
+class MongoTracingListener(monitoring.CommandListener):
+    """One client span per Mongo command issued inside a traced request"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._spans: Dict[tuple, Span] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        # Motor copies the request's context into its executor thread, so the parent is the
+        # request (or step) span that issued the command. Background work is not traced.
+        span = self.tracer.start_span(f"mongo.{event.command_name}", kind="client", attributes={
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+            "db.mongodb.collection": event.command.get(event.command_name) if isinstance(event.command.get(event.command_name), str) else None
+        }, new_trace=False)
+        if span is not None:
+            with self._lock:
+                self._spans[(event.request_id, event.operation_id)] = span
+
+    def _pop(self, event) -> Optional[Span]:
+        if not self._spans:
+            return None
+        with self._lock:
+            return self._spans.pop((event.request_id, event.operation_id), None)
+
+    def succeeded(self, event):
+        span = self._pop(event)
+        if span is not None:
+            span.end()
+
+    def failed(self, event):
+        span = self._pop(event)
+        if span is not None:
+            span.end(error=str(event.failure.get("errmsg", "")) if isinstance(event.failure, dict) else "failed")